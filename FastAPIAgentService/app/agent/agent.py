@@ -1,6 +1,6 @@
 import os
 import json
-import asyncio
+import time
 from typing import List, Optional, AsyncGenerator, Dict, Any
 
 from langchain_classic.agents import AgentExecutor, create_tool_calling_agent
@@ -12,10 +12,12 @@ from langchain_core.tools import BaseTool
 from app.agent.agent_middleware import get_middleware
 
 from app.core.logger_handler import logger
+from app.rag.retrieval_scope import RetrievalScope, set_retrieval_scope
 from app.services import session_manager as sm
 from app.tools.rag_tools import get_weather_tools, rag_summary_tools, what_time_is_now, get_user_info_tools, \
     reorder_documents_tools
 from app.utils.prompt_loader import load_prompt
+from app.utils.stream_handler import sse_event, coalesce_tokens
 
 
 class AgentFactory:
@@ -202,7 +204,8 @@ async def get_main_agent_stream_response(
         query: str,
         session_id: str,
         user_id: str,
-        jwt_token: Optional[str] = None
+        jwt_token: Optional[str] = None,
+        scope: Optional[RetrievalScope] = None
 ) -> AsyncGenerator[str, None]:
     """
     获取主Agent流式响应（协调多个子Agent）
@@ -210,9 +213,12 @@ async def get_main_agent_stream_response(
     :param session_id: 会话 ID
     :param user_id: 用户 ID
     :param jwt_token: JWT令牌
+    :param scope: 知识库检索范围，为空时只检索公共文档和该用户的个人文档
     :return: 流式响应生成器
     """
     try:
+        # 子Agent和工具中的知识库检索从上下文读取检索范围
+        set_retrieval_scope(scope or RetrievalScope(user_id=user_id))
         logger.info(f"【主Agent流式响应】开始处理请求，用户ID: {user_id}, 会话ID: {session_id}, 查询: {query}")
 
         # 获取会话历史
@@ -237,9 +243,17 @@ async def get_main_agent_stream_response(
         
         # 发送初始响应
         yield f"data: {json.dumps({'type': 'response', 'content': '', 'session_id': session_id}, ensure_ascii=False)}\n\n"
-        
-        # 使用流式方式处理请求，实时获取中间结果
-        async for step_result in main_agent.process_stream(input_data):
+
+        # 使用流式方式处理请求，实时获取中间结果；最终结果由 final 事件带回，整个请求只跑一遍流程
+        # 大模型 token 经过合并后按帧下发（约30ms或64个字符一帧），不再逐字拆分、人为 sleep
+        # 已发送给客户端的回答内容；写入会话历史的是这些内容，与用户看到的一致
+        # （子Agent流式输出后失败时，整合结果与已输出的内容不同）
+        delivered_parts = []
+        start_time = time.perf_counter()
+        first_token_time = None
+        frame_count = 0
+        async for step_result in coalesce_tokens(main_agent.process_stream(input_data)):
+            content = ""
             if step_result.get("type") == "thinking":
                 # 发送思考过程（可选，可用于调试）
                 logger.info(f"【主Agent流式响应】思考: {step_result.get('content')}")
@@ -247,42 +261,36 @@ async def get_main_agent_stream_response(
                 # 发送工具调用信息
                 tool_name = step_result.get("tool_name", "")
                 tool_input = step_result.get("tool_input", {})
-                yield f"data: {json.dumps({'type': 'thinking', 'content': f'正在调用{tool_name}工具...', 'session_id': session_id}, ensure_ascii=False)}\n\n"
+                yield sse_event({'type': 'thinking', 'content': f'正在调用{tool_name}工具...', 'session_id': session_id})
                 logger.info(f"【主Agent流式响应】调用工具: {tool_name}, 参数: {tool_input}")
-            elif step_result.get("type") == "tool_result":
-                # 发送工具执行结果
-                tool_name = step_result.get("tool_name", "")
-                result_content = step_result.get("content", "")
-                if result_content:
-                    # 逐字流式输出工具结果
-                    for char in result_content:
-                        yield f"data: {json.dumps({'type': 'response', 'content': char, 'session_id': session_id}, ensure_ascii=False)}\n\n"
-                        await asyncio.sleep(0.02)
+            elif step_result.get("type") in ("token", "tool_result"):
+                # 发送大模型生成的 token（已合并）或工具执行结果
+                content = step_result.get("content", "")
             elif step_result.get("type") == "final":
-                # 发送最终响应
-                final_response = step_result.get("content", "")
-                if final_response:
-                    # 逐字流式输出最终响应
-                    for char in final_response:
-                        yield f"data: {json.dumps({'type': 'response', 'content': char, 'session_id': session_id}, ensure_ascii=False)}\n\n"
-                        await asyncio.sleep(0.02)
-        
-        # 添加到会话历史（需要获取最终响应）
-        # 重新调用一次获取最终响应用于保存（或者在process_stream中保存）
-        result = await main_agent.process({
-            "query": query,
-            "session_id": session_id,
-            "user_id": user_id,
-            "chat_history": history,
-            "jwt_token": jwt_token
-        })
-        final_response = result.get("final_response", "")
+                # 发送最终响应（内容已经通过 token/tool_result 下发过的不再重复发送）
+                if not step_result.get("delivered"):
+                    content = step_result.get("content", "")
+
+            if content:
+                if first_token_time is None:
+                    first_token_time = time.perf_counter()
+                frame_count += 1
+                delivered_parts.append(content)
+                yield sse_event({'type': 'response', 'content': content, 'session_id': session_id})
+
+        total_ms = round((time.perf_counter() - start_time) * 1000, 1)
+        ttft_ms = round((first_token_time - start_time) * 1000, 1) if first_token_time else None
+        logger.info(f"【主Agent流式响应】首字延迟: {ttft_ms}ms, 总耗时: {total_ms}ms, 帧数: {frame_count}")
+
+        # 添加到会话历史（直接使用流式过程中发送的内容，不再重复执行主Agent）
+        final_response = "".join(delivered_parts)
         if final_response:
             await sm.session_manager.add_message(session_id, user_id, query, final_response)
             logger.info(f"【主Agent流式响应】添加到会话历史成功")
         
-        # 发送结束标记
-        yield f"data: {json.dumps({'type': 'done', 'session_id': session_id}, ensure_ascii=False)}\n\n"
+        # 发送结束标记，附带首字延迟与总耗时
+        metrics = {'ttft_ms': ttft_ms, 'total_ms': total_ms, 'frames': frame_count}
+        yield sse_event({'type': 'done', 'session_id': session_id, 'metrics': metrics})
         logger.info(f"【主Agent流式响应】处理完成，会话ID: {session_id}")
         
     except Exception as e:
@@ -296,7 +304,8 @@ async def get_main_agent_stream_response(
 async def get_main_agent_response(
         query: str,
         session_id: str,
-        user_id: str
+        user_id: str,
+        scope: Optional[RetrievalScope] = None
 ) -> Dict[str, Any]:
     """
     获取主Agent响应, 非流式响应
@@ -305,11 +314,14 @@ async def get_main_agent_response(
         query: 用户查询内容
         session_id: 会话ID
         user_id: 用户ID
+        scope: 知识库检索范围，为空时只检索公共文档和该用户的个人文档
     
     Returns:
         包含响应结果的字典
     """
     try:
+        # 子Agent和工具中的知识库检索从上下文读取检索范围
+        set_retrieval_scope(scope or RetrievalScope(user_id=user_id))
         logger.info(f"【主Agent非流式响应】开始处理请求，用户ID: {user_id}, 会话ID: {session_id}, 查询: {query}")
 
         # 获取会话历史
@@ -370,6 +382,7 @@ async def get_agent_stream_response(
         session_id: str,
         user_id: str,
         custom_tools: Optional[List[BaseTool]] = None,
+        scope: Optional[RetrievalScope] = None,
         **kwargs
 ) -> AsyncGenerator[str, None]:
     """
@@ -378,10 +391,13 @@ async def get_agent_stream_response(
     :param session_id: 会话 ID
     :param user_id: 用户 ID
     :param custom_tools: 自定义工具（可选）
+    :param scope: 知识库检索范围，为空时只检索公共文档和该用户的个人文档
     :param kwargs: 其他参数
     :return: 流式响应生成器
     """
     try:
+        # 工具中的知识库检索从上下文读取检索范围
+        set_retrieval_scope(scope or RetrievalScope(user_id=user_id))
         logger.info(f"【Agent流式响应】开始处理请求，用户ID: {user_id}, 会话ID: {session_id}, 查询: {query}")
 
         # 获取会话历史
@@ -418,7 +434,6 @@ async def get_agent_stream_response(
                 # 实时发送输出
                 yield f"data: {json.dumps({'type': 'response', 'content': chunk_content}, ensure_ascii=False)}\n\n"
                 logger.info(f"【debug】当前响应: {chunk_content}")
-                await asyncio.sleep(0.05)  # 减少延迟，提高响应速度
             elif "intermediate_steps" in chunk:
                 for action, observation in chunk["intermediate_steps"]:
                     # 记录日志
@@ -1,11 +1,20 @@
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional
 import os
+import threading
+import time
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import JsonOutputParser
 from pydantic import BaseModel, Field
 
 from app.agent.base import BaseAgent
+from app.agent.local_classifier import NearestNeighbourClassifier
 from app.core.logger_handler import logger
+from app.utils.config import agent_config
+
+# 路由方式（统计的键）
+ROUTE_STATIC = "static"
+ROUTE_CLASSIFIER = "classifier"
+ROUTE_LLM = "llm"
 
 
 class AgentRouteResult(BaseModel):
@@ -15,6 +24,91 @@ class AgentRouteResult(BaseModel):
     reason: str = Field(..., description="选择理由")
 
 
+# 可用的Agent及其能力
+AVAILABLE_AGENTS: Dict[str, Dict[str, Any]] = {
+    "tool_agent": {
+        "name": "工具执行Agent",
+        "description": "负责调用外部工具执行任务，如OA系统操作、API调用等",
+        "task_types": ["tool_execution", "oa_operation", "api_call", "attendance", "department", "user", "inform"]
+    },
+    "knowledge_agent": {
+        "name": "知识库Agent",
+        "description": "负责查询和检索知识库信息，处理RAG相关任务",
+        "task_types": ["knowledge_query", "rag_query", "information_retrieval"]
+    },
+    "memory_agent": {
+        "name": "记忆管理Agent",
+        "description": "负责管理会话记忆，处理历史记录相关任务",
+        "task_types": ["memory_management", "history_query", "session_management"]
+    },
+    "task_decomposer": {
+        "name": "任务拆解Agent",
+        "description": "负责将复杂任务分解为子任务",
+        "task_types": ["task_decomposition", "complex_task"]
+    }
+}
+
+
+class RoutingStats:
+    """Agent路由方式的统计，用于健康检查接口"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts: Dict[str, int] = {}
+        self._failures = 0
+        self._fast_path_us = 0.0
+
+    def observe(self, method: str, elapsed_us: float = 0.0):
+        with self._lock:
+            self._counts[method] = self._counts.get(method, 0) + 1
+            if method != ROUTE_LLM:
+                self._fast_path_us += elapsed_us
+
+    def observe_failure(self):
+        with self._lock:
+            self._failures += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        路由统计
+        :return: 总路由次数、各方式的次数、避免的大模型调用次数与占比、快速路由的平均耗时（微秒）
+        """
+        with self._lock:
+            total = sum(self._counts.values())
+            avoided = total - self._counts.get(ROUTE_LLM, 0)
+            return {
+                "routes": total,
+                "methods": dict(self._counts),
+                "llm_failures": self._failures,
+                "llm_calls_avoided": avoided,
+                "llm_calls_avoided_ratio": round(avoided / total, 4) if total else 0.0,
+                "fast_path_avg_us": round(self._fast_path_us / avoided, 2) if avoided else 0.0,
+            }
+
+
+routing_stats = RoutingStats()
+
+
+def create_route_classifier(examples: Dict[str, List[str]]) -> NearestNeighbourClassifier:
+    """
+    用Agent的描述和配置中的示例子任务建立最近邻分类器
+    :param examples: {Agent ID: 示例子任务描述列表}
+    :return: 分类器
+    """
+    texts, labels = [], []
+    for agent_id, info in AVAILABLE_AGENTS.items():
+        if agent_id == "task_decomposer":
+            continue
+        for text in [f"{info['name']} {info['description']}", *examples.get(agent_id, [])]:
+            texts.append(text)
+            labels.append(agent_id)
+    return NearestNeighbourClassifier().fit(texts, labels)
+
+
+# 快速路由的最近邻分类器，进程内只建立一次，所有请求的路由器共享（分类时只读）
+route_classifier = create_route_classifier(((agent_config or {}).get('routing') or {}).get('examples') or {})
+
+
 class AgentRouter(BaseAgent):
     """
     Agent路由器，负责根据任务类型和内容智能选择合适的Agent
@@ -24,32 +118,53 @@ class AgentRouter(BaseAgent):
         super().__init__("agent_router")
         
         # 定义可用的Agent及其能力
-        self.available_agents = {
-            "tool_agent": {
-                "name": "工具执行Agent",
-                "description": "负责调用外部工具执行任务，如OA系统操作、API调用等",
-                "task_types": ["tool_execution", "oa_operation", "api_call"]
-            },
-            "knowledge_agent": {
-                "name": "知识库Agent",
-                "description": "负责查询和检索知识库信息，处理RAG相关任务",
-                "task_types": ["knowledge_query", "rag_query", "information_retrieval"]
-            },
-            "memory_agent": {
-                "name": "记忆管理Agent",
-                "description": "负责管理会话记忆，处理历史记录相关任务",
-                "task_types": ["memory_management", "history_query", "session_management"]
-            },
-            "task_decomposer": {
-                "name": "任务拆解Agent",
-                "description": "负责将复杂任务分解为子任务",
-                "task_types": ["task_decomposition", "complex_task"]
-            }
-        }
+        self.available_agents = AVAILABLE_AGENTS
         
         self.llm = None
         self.prompt_template = self._create_prompt_template()
         self.parser = JsonOutputParser(pydantic_object=AgentRouteResult)
+
+        # 快速路由：任务类型查表，未知类型用本地最近邻分类，置信度不足时才调用大模型
+        routing_config = (agent_config or {}).get('routing') or {}
+        self.fast_path_enabled = routing_config.get('fast_path_enabled', True)
+        self.min_similarity = routing_config.get('min_similarity', 0.3)
+        self.min_margin = routing_config.get('min_margin', 0.1)
+        # 任务拆解Agent不执行子任务，不参与快速路由
+        self.type_table = {
+            task_type: agent_id
+            for agent_id, info in self.available_agents.items() if agent_id != "task_decomposer"
+            for task_type in info["task_types"]
+        }
+        self.classifier = route_classifier
+
+    def _fast_route(self, task_type: str, subtask_description: str) -> Optional[Dict[str, Any]]:
+        """
+        不调用大模型的路由：已知任务类型直接查表，其余按子任务描述做本地最近邻分类
+        :param task_type: 任务类型
+        :param subtask_description: 子任务描述
+        :return: 路由结果；分类置信度低于阈值时返回 None
+        """
+        agent_id = self.type_table.get(task_type)
+        if agent_id:
+            return {
+                "success": True,
+                "selected_agent": agent_id,
+                "confidence": 1.0,
+                "reason": f"任务类型 {task_type} 由 {agent_id} 处理",
+                "method": ROUTE_STATIC
+            }
+
+        agent_id, score, margin = self.classifier.predict(f"{task_type} {subtask_description}")
+        if agent_id and score >= self.min_similarity and margin >= self.min_margin:
+            return {
+                "success": True,
+                "selected_agent": agent_id,
+                "confidence": round(score, 4),
+                "reason": f"子任务描述与 {agent_id} 最相近（相似度 {score:.2f}，领先 {margin:.2f}）",
+                "method": ROUTE_CLASSIFIER
+            }
+        logger.info(f"【Agent路由】本地分类置信度不足（{agent_id} 相似度 {score:.2f}，领先 {margin:.2f}），调用大模型")
+        return None
     
     def _create_llm(self):
         """创建大模型实例"""
@@ -111,6 +226,17 @@ class AgentRouter(BaseAgent):
             subtask_description = input_data.get("subtask_description", "")
             required_params = input_data.get("required_params", [])
 
+            if self.fast_path_enabled:
+                start = time.perf_counter()
+                fast_result = self._fast_route(task_type, subtask_description)
+                if fast_result:
+                    routing_stats.observe(fast_result["method"], (time.perf_counter() - start) * 1_000_000)
+                    logger.info(
+                        f"【Agent路由】快速路由选择了: {fast_result['selected_agent']}, "
+                        f"方式: {fast_result['method']}, 置信度: {fast_result['confidence']}"
+                    )
+                    return fast_result
+
             if self.llm is None:
                 self.llm = self._create_llm()
             if self.llm is None:
@@ -123,6 +249,7 @@ class AgentRouter(BaseAgent):
             chain = self.prompt_template | self.llm | self.parser
             
             # 执行路由决策
+            routing_stats.observe(ROUTE_LLM)
             result = await chain.ainvoke({
                 "task_type": task_type,
                 "subtask_description": subtask_description,
@@ -140,7 +267,8 @@ class AgentRouter(BaseAgent):
                     "success": True,
                     "selected_agent": selected_agent,
                     "confidence": confidence,
-                    "reason": reason
+                    "reason": reason,
+                    "method": ROUTE_LLM
                 }
             else:
                 # 正常情况，result 是 AgentRouteResult 对象
@@ -150,10 +278,12 @@ class AgentRouter(BaseAgent):
                     "success": True,
                     "selected_agent": result.selected_agent,
                     "confidence": result.confidence,
-                    "reason": result.reason
+                    "reason": result.reason,
+                    "method": ROUTE_LLM
                 }
             
         except Exception as e:
+            routing_stats.observe_failure()
             logger.error(f"【Agent路由】失败: {str(e)}", exc_info=True)
             return {
                 "success": False,
@@ -74,6 +74,8 @@ class AgentState:
         self.task_status: str = "pending"
         self.tool_result: Optional[str] = None
         self.user_prompt: Optional[str] = None
+        # 因参数不完整而等待用户补充的子任务
+        self.blocked_task_id: Optional[str] = None
     
     def to_dict(self) -> Dict[str, Any]:
         """
@@ -103,7 +105,8 @@ class AgentState:
             "max_param_retries": self.max_param_retries,
             "task_status": self.task_status,
             "tool_result": self.tool_result,
-            "user_prompt": self.user_prompt
+            "user_prompt": self.user_prompt,
+            "blocked_task_id": self.blocked_task_id
         }
     
     @classmethod
@@ -137,4 +140,5 @@ class AgentState:
         state.task_status = data.get("task_status", "pending")
         state.tool_result = data.get("tool_result")
         state.user_prompt = data.get("user_prompt")
+        state.blocked_task_id = data.get("blocked_task_id")
         return state
\ No newline at end of file
@@ -0,0 +1,324 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import re
+import threading
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import Any, Dict, List, Optional
+
+from app.agent.local_classifier import NearestNeighbourClassifier
+from app.core.logger_handler import logger
+from app.utils.config import agent_config
+from app.utils.path_tool import get_abstract_path
+
+# 闲聊：只由关键词规则识别，不需要执行任何子任务，由整合结果直接回复
+CHITCHAT_INTENT = "chitchat"
+# 判断是否只有问候语时忽略的标点、空白和符号
+_NON_WORD = re.compile(r"[\W_]+")
+# 复合请求：作为反例参与最近邻分类，预测为该标签时交给大模型分解
+COMPOUND_INTENT = "compound"
+
+# 流量日志中脱敏的内容：邮箱、手机号/身份证号/卡号等 6 位以上的数字串
+_REDACTIONS = (
+    (re.compile(r"[\w.+-]+@[\w-]+(?:\.[\w-]+)+"), "<email>"),
+    (re.compile(r"\d{6,}[\dXx]?"), "<number>"),
+)
+
+
+def load_examples(path: str) -> List[Dict[str, str]]:
+    """
+    读取带标签的示例
+    :param path: JSONL 文件路径，每行 {"text": 用户输入, "intent": 意图}
+    :return: 示例列表；文件不存在时为空
+    """
+    if not os.path.exists(path):
+        return []
+    examples = []
+    with open(path, "r", encoding="utf-8") as file:
+        for line in file:
+            line = line.strip()
+            if line:
+                examples.append(json.loads(line))
+    return examples
+
+
+class IntentStats:
+    """意图分类的统计，用于健康检查接口"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts: Dict[str, int] = {}
+        self._fallback_reasons: Dict[str, int] = {}
+
+    def observe(self, intent: Optional[str], fallback_reason: Optional[str] = None):
+        with self._lock:
+            key = intent or "llm"
+            self._counts[key] = self._counts.get(key, 0) + 1
+            if fallback_reason:
+                self._fallback_reasons[fallback_reason] = self._fallback_reasons.get(fallback_reason, 0) + 1
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        意图分类统计
+        :return: 总请求数、跳过任务分解的次数与占比、各意图的次数、交给大模型分解的原因
+        """
+        with self._lock:
+            total = sum(self._counts.values())
+            bypassed = total - self._counts.get("llm", 0)
+            return {
+                "requests": total,
+                "decomposer_calls_avoided": bypassed,
+                "decomposer_calls_avoided_ratio": round(bypassed / total, 4) if total else 0.0,
+                "intents": dict(self._counts),
+                "fallback_reasons": dict(self._fallback_reasons),
+            }
+
+
+intent_stats = IntentStats()
+
+
+def redact(text: str) -> str:
+    """脱敏：替换输入中的邮箱和较长的数字串，意图分类只需要句式，不需要这些内容"""
+    for pattern, placeholder in _REDACTIONS:
+        text = pattern.sub(placeholder, text)
+    return text
+
+
+def traffic_log_files(path: str, backup_count: int) -> List[str]:
+    """
+    流量日志及其轮转出的旧文件，按从旧到新排列
+    :param path: 流量日志路径
+    :param backup_count: 保留的旧文件数
+    :return: 存在的文件路径列表
+    """
+    paths = [f"{path}.{index}" for index in range(backup_count, 0, -1)] + [path]
+    return [candidate for candidate in paths if os.path.exists(candidate)]
+
+
+class TrafficLog:
+    """
+    任务分解结果的流量日志
+    - 请求中只把记录放入队列，由后台线程写文件（QueueHandler + QueueListener），不阻塞事件循环
+    - 按大小轮转，只保留最近的 backup_count 个旧文件
+    """
+
+    def __init__(self, path: str, max_bytes: int, backup_count: int):
+        """
+        :param path: 日志路径（JSONL）
+        :param max_bytes: 单个文件的大小上限，超过后轮转
+        :param backup_count: 保留的旧文件数
+        """
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        records: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+        file_handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count,
+                                           encoding="utf-8", delay=True)
+        file_handler.setFormatter(logging.Formatter("%(message)s"))
+        self._listener = QueueListener(records, file_handler)
+        self._logger = logging.Logger(f"intent_traffic:{path}")
+        self._logger.propagate = False
+        self._logger.addHandler(QueueHandler(records))
+        self._listener.start()
+
+    def write(self, record: Dict[str, Any]):
+        self._logger.info(json.dumps(record, ensure_ascii=False))
+
+    def close(self):
+        """写完队列中剩余的记录后停止后台线程，之后再次获取同一路径的日志时重新创建"""
+        with _traffic_logs_lock:
+            if _traffic_logs.get(self.path) is not self:
+                return
+            del _traffic_logs[self.path]
+        self._listener.stop()
+
+
+_traffic_logs: Dict[str, TrafficLog] = {}
+_traffic_logs_lock = threading.Lock()
+
+
+def get_traffic_log(path: str, max_bytes: int, backup_count: int) -> TrafficLog:
+    """同一路径的流量日志在进程内共享（主Agent按请求创建，意图分类器随之创建多次）"""
+    with _traffic_logs_lock:
+        traffic_log = _traffic_logs.get(path)
+        if traffic_log is None:
+            traffic_log = TrafficLog(path, max_bytes, backup_count)
+            _traffic_logs[path] = traffic_log
+            atexit.register(traffic_log.close)
+        return traffic_log
+
+
+class IntentClassifier:
+    """
+    任务分解前的本地意图分类：关键词规则 + 带标签示例的最近邻分类（应用内使用模块级的 intent_classifier）
+    单一意图且置信度足够的请求直接生成只有一个子任务的计划，跳过任务分解的大模型调用；
+    复合请求（包含连接词、命中多个意图的关键词、过长或最近邻为复合示例）与置信度不足的请求交给大模型分解
+    """
+
+    def __init__(self, config: Optional[Dict[str, Any]] = None):
+        """
+        :param config: agent.yaml 中的 intent_classifier 配置，默认读取配置文件
+        """
+        config = config if config is not None else (agent_config or {}).get('intent_classifier') or {}
+        self.enabled = config.get('enabled', False)
+        self.min_similarity = config.get('min_similarity', 0.35)
+        self.min_margin = config.get('min_margin', 0.1)
+        self.max_chars = config.get('max_chars', 40)
+        self.compound_pattern = self._compile(config.get('compound_markers') or [])
+        self.intents: Dict[str, Dict[str, Any]] = config.get('intents') or {}
+        self.keyword_patterns = {
+            intent: self._compile(info.get('keywords') or []) for intent, info in self.intents.items()
+        }
+        # 问候语之外可以出现的语气词、称呼（如“谢谢你”“你真聪明”），其余内容都视为实际的问题
+        self.chitchat_filler_pattern = self._compile(
+            (self.intents.get(CHITCHAT_INTENT) or {}).get('fillers') or [])
+        self.examples_path = get_abstract_path(config.get('examples_path', 'app/config/intent_examples.jsonl'))
+        self.learned_examples_path = get_abstract_path(
+            config.get('learned_examples_path', 'data/intent_classifier/learned_examples.jsonl'))
+        self.traffic_log_path = get_abstract_path(config.get('traffic_log_path', 'data/intent_classifier/traffic.jsonl'))
+        # 流量中包含用户的原始输入，默认不记录；开启后会脱敏邮箱和较长的数字串，并按大小轮转
+        self.log_traffic_enabled = config.get('log_traffic', False)
+        self.traffic_log_max_bytes = config.get('traffic_log_max_bytes', 10 * 1024 * 1024)
+        self.traffic_log_backups = config.get('traffic_log_backups', 3)
+        self.classifier = NearestNeighbourClassifier(k=config.get('k', 3))
+        if self.enabled:
+            self.fit(load_examples(self.examples_path) + load_examples(self.learned_examples_path))
+
+    @staticmethod
+    def _compile(patterns: List[str]) -> Optional[re.Pattern]:
+        """把多个正则表达式合并为一个（忽略大小写），没有时返回 None"""
+        if not patterns:
+            return None
+        return re.compile("|".join(f"(?:{pattern})" for pattern in patterns), re.IGNORECASE)
+
+    def fit(self, examples: List[Dict[str, str]]) -> 'IntentClassifier':
+        """
+        用带标签的示例建立最近邻分类器（只保留已配置的意图和复合请求）
+        :param examples: [{"text": 用户输入, "intent": 意图}]
+        :return: 分类器本身
+        """
+        examples = [
+            example for example in examples
+            if example.get("intent") in self.intents or example.get("intent") == COMPOUND_INTENT
+        ]
+        self.classifier.fit([example["text"] for example in examples], [example["intent"] for example in examples])
+        logger.info(f"【意图分类】已加载示例 {len(examples)} 条")
+        return self
+
+    def _is_chitchat(self, text: str) -> bool:
+        """去掉问候语、语气词和标点后没有剩余内容时才是闲聊（“你好，年假有几天”不是闲聊）"""
+        pattern = self.keyword_patterns.get(CHITCHAT_INTENT)
+        if not pattern or not pattern.search(text):
+            return False
+        rest = pattern.sub("", text)
+        if self.chitchat_filler_pattern:
+            rest = self.chitchat_filler_pattern.sub("", rest)
+        return not _NON_WORD.sub("", rest)
+
+    def _keyword_intents(self, text: str) -> List[str]:
+        """命中关键词规则的意图；闲聊关键词只在输入只有问候语时生效，否则按问候语之后的问题分类"""
+        hits = [
+            intent for intent, pattern in self.keyword_patterns.items()
+            if pattern and intent != CHITCHAT_INTENT and pattern.search(text)
+        ]
+        if not hits and self._is_chitchat(text):
+            hits.append(CHITCHAT_INTENT)
+        return hits
+
+    def predict(self, text: str) -> Dict[str, Any]:
+        """
+        预测意图
+        :param text: 用户输入
+        :return: {"intent": 意图（需要交给大模型分解时为 None）, "confidence": 置信度, "reason": 判断依据}
+        """
+        text = text.strip()
+        if len(text) > self.max_chars:
+            return {"intent": None, "confidence": 0.0, "reason": "too_long"}
+        if self.compound_pattern and self.compound_pattern.search(text):
+            return {"intent": None, "confidence": 0.0, "reason": "compound_marker"}
+        keyword_intents = self._keyword_intents(text)
+        if len(keyword_intents) > 1:
+            return {"intent": None, "confidence": 0.0, "reason": "multiple_keywords"}
+
+        label, score, margin = self.classifier.predict(text)
+        confident = score >= self.min_similarity and margin >= self.min_margin
+        if keyword_intents:
+            keyword_intent = keyword_intents[0]
+            # 关键词与最近邻结果明确指向另一个意图时交给大模型（复合示例与单一意图的用词相近，不作为矛盾）
+            if confident and label not in (keyword_intent, COMPOUND_INTENT):
+                return {"intent": None, "confidence": score, "reason": "keyword_conflict"}
+            return {"intent": keyword_intent, "confidence": max(score, self.min_similarity), "reason": "keyword"}
+
+        if confident and label == COMPOUND_INTENT:
+            return {"intent": None, "confidence": score, "reason": "compound_example"}
+        # 闲聊只由关键词识别，避免把意图不明的短句当作闲聊直接回复
+        if confident and label != CHITCHAT_INTENT:
+            return {"intent": label, "confidence": score, "reason": "nearest_neighbour"}
+        return {"intent": None, "confidence": score, "reason": "low_confidence"}
+
+    def build_plan(self, intent: str, user_input: str) -> List[Dict[str, Any]]:
+        """
+        生成只有一个子任务的计划（格式与任务分解的结果相同）；闲聊不需要子任务
+        :param intent: 意图（即子任务的任务类型）
+        :param user_input: 用户输入，作为子任务描述
+        :return: 子任务列表
+        """
+        if intent == CHITCHAT_INTENT:
+            return []
+        info = self.intents.get(intent) or {}
+        return [{
+            "task_id": "task_1",
+            "task_name": info.get('task_name', intent),
+            "task_type": intent,
+            "priority": 1,
+            "dependencies": [],
+            "required_params": list(info.get('required_params') or []),
+            "description": user_input,
+        }]
+
+    def classify(self, user_input: str) -> Optional[Dict[str, Any]]:
+        """
+        对用户输入做意图分类
+        :param user_input: 用户输入
+        :return: 单一意图时返回 {"task_type": 意图, "subtasks": 子任务列表, "confidence": 置信度}，
+                 需要大模型分解时返回 None
+        """
+        if not self.enabled or not user_input:
+            return None
+        prediction = self.predict(user_input)
+        intent = prediction["intent"]
+        intent_stats.observe(intent, None if intent else prediction["reason"])
+        if not intent:
+            logger.info(f"【意图分类】交给大模型分解，原因: {prediction['reason']}，置信度: {prediction['confidence']:.2f}")
+            return None
+        logger.info(f"【意图分类】单一意图: {intent}，依据: {prediction['reason']}，置信度: {prediction['confidence']:.2f}")
+        return {
+            "task_type": intent,
+            "subtasks": self.build_plan(intent, user_input.strip()),
+            "confidence": prediction["confidence"],
+        }
+
+    def log_traffic(self, user_input: str, task_type: Optional[str], subtasks: List[Dict[str, Any]]):
+        """
+        记录大模型的任务分解结果（脱敏后异步写入），供 train_intent_classifier 学习新的示例
+        :param user_input: 用户输入
+        :param task_type: 主任务类型
+        :param subtasks: 子任务列表
+        """
+        if not self.log_traffic_enabled or not user_input:
+            return
+        record = {
+            "text": redact(user_input.strip()),
+            "task_type": task_type,
+            "subtask_types": [subtask.get("task_type") for subtask in subtasks],
+        }
+        try:
+            get_traffic_log(self.traffic_log_path, self.traffic_log_max_bytes, self.traffic_log_backups).write(record)
+        except OSError as e:
+            logger.warning(f"【意图分类】记录任务分解结果失败: {e}")
+
+
+# 全局意图分类器：示例在进程启动时加载并建立一次，所有请求共享（分类时只读）；
+# train_intent_classifier 学习的新示例在重启后生效
+intent_classifier = IntentClassifier()
@@ -1,7 +1,7 @@
-from typing import Dict, Any, List
+from typing import Dict, Any, List, AsyncGenerator
 from app.agent.base import BaseAgent
 from app.core.logger_handler import logger
-from app.rag.rag_service import RagService
+from app.rag.rag_service import get_rag_service
 
 
 class KnowledgeAgent(BaseAgent):
@@ -11,7 +11,7 @@ class KnowledgeAgent(BaseAgent):
     
     def __init__(self):
         super().__init__("knowledge_agent")
-        self.rag_service = RagService()
+        self.rag_service = get_rag_service()
     
     async def process(self, input_data: Dict[str, Any]) -> Dict[str, Any]:
         """处理输入数据，执行知识库查询"""
@@ -42,6 +42,34 @@ class KnowledgeAgent(BaseAgent):
                 "error": str(e)
             }
     
+    async def process_stream(self, input_data: Dict[str, Any]) -> AsyncGenerator[Dict[str, Any], None]:
+        """
+        流式执行知识库查询，逐个转发大模型生成的 token
+        :param input_data: 输入数据
+        :return: 异步生成器，产出 {"type": "token", "content": str}，最后产出 {"type": "result", "result": 与 process 相同的结果}
+        """
+        query = input_data.get("query", "")
+        if not query:
+            yield {"type": "result", "result": {"success": False, "error": "查询内容不能为空"}}
+            return
+
+        summary = ""
+        async for event in self.rag_service.stream_documents_and_summary(query):
+            if event.get("type") == "token":
+                yield event
+            elif event.get("type") == "result":
+                summary = event.get("summary", "")
+
+        logger.info(f"【知识库查询】流式查询完成，结果长度: {len(summary)}")
+        yield {
+            "type": "result",
+            "result": {
+                "success": True,
+                "knowledge_content": summary,
+                "query": query
+            }
+        }
+
     def can_handle(self, task_type: str) -> bool:
         """判断是否能够处理特定类型的任务"""
         knowledge_task_types = [
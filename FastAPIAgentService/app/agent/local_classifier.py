@@ -0,0 +1,74 @@
+import math
+from collections import Counter
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from app.rag.bm25_index import tokenize
+
+
+class NearestNeighbourClassifier:
+    """
+    本地最近邻文本分类器：文本按与 BM25 相同的分词（汉字单字 + 二元组）转为 TF-IDF 稀疏向量，
+    按余弦相似度取每个标签最相近的 k 个样本的平均相似度作为该标签的得分
+    不依赖模型服务，单次预测为微秒级，适合作为大模型调用前的快速判断
+    """
+
+    def __init__(self, k: int = 1):
+        """
+        :param k: 每个标签参与打分的最近样本数
+        """
+        self.k = k
+        self._idf: Dict[str, float] = {}
+        self._vectors: List[Dict[str, float]] = []
+        self._labels: List[str] = []
+
+    def _vectorize(self, text: str) -> Dict[str, float]:
+        """文本转为L2归一化的 TF-IDF 向量（只保留训练样本中出现过的词项）"""
+        counts = Counter(term for term in tokenize(text) if term in self._idf)
+        vector = {term: (1 + math.log(count)) * self._idf[term] for term, count in counts.items()}
+        norm = math.sqrt(sum(weight * weight for weight in vector.values()))
+        return {term: weight / norm for term, weight in vector.items()} if norm else {}
+
+    def fit(self, texts: Sequence[str], labels: Sequence[str]) -> 'NearestNeighbourClassifier':
+        """
+        用带标签的样本建立分类器（覆盖之前的样本）
+        :param texts: 样本文本
+        :param labels: 样本标签
+        :return: 分类器本身
+        """
+        document_frequency = Counter()
+        for text in texts:
+            document_frequency.update(set(tokenize(text)))
+        total = len(texts)
+        self._idf = {term: math.log((total + 1) / (df + 1)) + 1 for term, df in document_frequency.items()}
+        self._vectors = [self._vectorize(text) for text in texts]
+        self._labels = list(labels)
+        return self
+
+    def scores(self, text: str) -> Dict[str, float]:
+        """
+        各标签的得分
+        :param text: 待分类文本
+        :return: {标签: 最近 k 个样本的平均余弦相似度}
+        """
+        query = self._vectorize(text)
+        similarities: Dict[str, List[float]] = {}
+        for vector, label in zip(self._vectors, self._labels):
+            similarity = sum(weight * vector.get(term, 0.0) for term, weight in query.items())
+            similarities.setdefault(label, []).append(similarity)
+        return {
+            label: sum(sorted(values, reverse=True)[:self.k]) / min(self.k, len(values))
+            for label, values in similarities.items()
+        }
+
+    def predict(self, text: str) -> Tuple[Optional[str], float, float]:
+        """
+        预测标签
+        :param text: 待分类文本
+        :return: (得分最高的标签, 得分, 领先第二名的差值)；没有样本时标签为 None
+        """
+        ranked = sorted(self.scores(text).items(), key=lambda item: item[1], reverse=True)
+        if not ranked:
+            return None, 0.0, 0.0
+        label, score = ranked[0]
+        runner_up = ranked[1][1] if len(ranked) > 1 else 0.0
+        return label, score, score - runner_up
@@ -1,3 +1,4 @@
+import asyncio
 import json
 import os
 from typing import Dict, Any, List, Optional, AsyncGenerator
@@ -5,10 +6,12 @@ from typing import Dict, Any, List, Optional, AsyncGenerator
 from app.agent.base import BaseAgent, AgentState
 from app.agent.task_decomposer import TaskDecomposer
 from app.agent.agent_router import AgentRouter
+from app.agent.intent_classifier import CHITCHAT_INTENT, intent_classifier
 from app.agent.tool_agent import ToolAgent
 from app.agent.knowledge_agent import KnowledgeAgent
 from app.agent.memory_agent import MemoryAgent
 from app.agent.param_extraction_agent import ParamExtractionAgent
+from app.agent.plan_checkpoint import clear_plan_checkpoint, load_plan_checkpoint, save_plan_checkpoint
 from app.core.logger_handler import logger
 
 
@@ -25,6 +28,7 @@ class MainAgent(BaseAgent):
         self.knowledge_agent = KnowledgeAgent()
         self.memory_agent = MemoryAgent()
         self.param_extraction_agent = ParamExtractionAgent()
+        self.intent_classifier = intent_classifier
         
         # 创建Agent映射
         self.agent_map = {
@@ -59,11 +63,13 @@ class MainAgent(BaseAgent):
             # 步骤1: 获取会话历史
             state = await self._get_session_history(state)
             
-            # 步骤2: 任务分解
-            state = await self._decompose_task(state)
+            # 步骤2: 恢复等待用户补充参数的计划，没有时分解任务
+            resumed = await self._resume_pending_plan(state)
+            if not resumed:
+                state = await self._decompose_task(state)
             
-            # 如果任务分解失败，返回错误
-            if not state.task_subtasks:
+            # 如果任务分解失败，返回错误（闲聊没有子任务，直接整合回复）
+            if not state.task_subtasks and state.task_type != CHITCHAT_INTENT:
                 return {
                     "response": "抱歉，无法理解您的请求。请重新描述您的需求。",
                     "error": "任务分解失败"
@@ -71,6 +77,7 @@ class MainAgent(BaseAgent):
             
             # 步骤3: 执行子任务
             state = await self._execute_subtasks(state)
+            await self._checkpoint_plan(state, resumed)
             
             # 步骤4: 整合结果
             # 如果 final_response 已经被设置（例如，因为参数不完整而需要向用户询问），则跳过整合结果
@@ -110,7 +117,14 @@ class MainAgent(BaseAgent):
         return state
     
     async def _decompose_task(self, state: AgentState) -> AgentState:
-        """分解任务"""
+        """分解任务：单一意图的请求由本地意图分类直接生成计划，其余交给任务分解Agent"""
+        classification = self.intent_classifier.classify(state.user_input)
+        if classification:
+            state.task_type = classification["task_type"]
+            state.task_subtasks = classification["subtasks"]
+            logger.info(f"【主Agent】意图分类命中，跳过任务分解，任务类型: {state.task_type}")
+            return state
+
         decomposition_result = await self.task_decomposer.process({
             "user_input": state.user_input
         })
@@ -118,84 +132,285 @@ class MainAgent(BaseAgent):
         if decomposition_result.get("success"):
             state.task_type = decomposition_result.get("task_type")
             state.task_subtasks = decomposition_result.get("subtasks", [])
+            self.intent_classifier.log_traffic(state.user_input, state.task_type, state.task_subtasks)
             logger.info(f"【主Agent】任务分解成功，任务类型: {state.task_type}, 子任务数: {len(state.task_subtasks)}")
         else:
             logger.error(f"【主Agent】任务分解失败: {decomposition_result.get('error')}")
         
         return state
     
+    async def _resume_pending_plan(self, state: AgentState) -> bool:
+        """
+        恢复会话中等待用户补充参数的计划：本轮输入作为补充信息，从被阻塞子任务的参数提取继续执行，
+        已完成的子任务不再执行，也不再调用任务分解
+        本轮输入被识别为交给其他Agent的新请求，或补充参数的次数已达上限时丢弃检查点，按新请求处理
+        :param state: Agent状态
+        :return: 是否恢复了计划
+        """
+        checkpoint = await load_plan_checkpoint(state.session_id, state.user_id)
+        if not checkpoint:
+            return False
+
+        ordered_subtasks = self._sort_subtasks(checkpoint.task_subtasks or [])
+        blocked = next(
+            (subtask for index, subtask in enumerate(ordered_subtasks)
+             if self._subtask_key(subtask, index) == checkpoint.blocked_task_id),
+            None
+        )
+        discard_reason = None
+        if blocked is None:
+            discard_reason = "未找到等待补充参数的子任务"
+        elif checkpoint.param_retry_count >= checkpoint.max_param_retries:
+            discard_reason = f"补充参数已达 {checkpoint.max_param_retries} 次"
+        else:
+            intent = self.intent_classifier.predict(state.user_input)["intent"]
+            blocked_agent = self.agent_router.type_table.get(blocked.get("task_type"))
+            new_agent = self.agent_router.type_table.get(intent)
+            if intent == CHITCHAT_INTENT or (new_agent and blocked_agent and new_agent != blocked_agent):
+                discard_reason = f"本轮输入是新的请求（{intent}）"
+        if discard_reason:
+            logger.info(f"【主Agent】丢弃计划检查点，{discard_reason}，会话ID: {state.session_id}")
+            await clear_plan_checkpoint(state.session_id)
+            return False
+
+        state.task_type = checkpoint.task_type
+        state.task_subtasks = checkpoint.task_subtasks
+        state.agent_results = checkpoint.agent_results
+        state.param_retry_count = checkpoint.param_retry_count + 1
+        logger.info(
+            f"【主Agent】恢复计划检查点，从子任务 {checkpoint.blocked_task_id} 的参数提取继续，"
+            f"已完成子任务: {list(state.agent_results)}，第 {state.param_retry_count} 次补充参数"
+        )
+        return True
+
+    async def _checkpoint_plan(self, state: AgentState, resumed: bool) -> None:
+        """
+        子任务执行结束后更新计划检查点：有子任务等待用户补充参数时保存计划，恢复的计划已完成时删除检查点
+        :param state: Agent状态
+        :param resumed: 本轮是否从检查点恢复
+        """
+        if state.blocked_task_id:
+            await save_plan_checkpoint(state)
+        elif resumed:
+            await clear_plan_checkpoint(state.session_id)
+
     async def _execute_subtasks(self, state: AgentState) -> AgentState:
-        """执行子任务"""
+        """执行子任务（依赖已满足的子任务并发执行）"""
+        async for _ in self._iter_subtasks(state):
+            pass
+        return state
+
+    async def _iter_subtasks(self, state: AgentState, stream: bool = False) -> AsyncGenerator[Dict[str, Any], None]:
+        """
+        按依赖关系调度子任务：依赖已全部完成的子任务立即启动并发执行（单次请求内的并发数受
+        MAIN_AGENT_MAX_CONCURRENT_SUBTASKS 限制），执行结果写入 state.agent_results 并按计划顺序排列
+        - 某个子任务的结果已足够回答用户时不再启动新的子任务，已在执行的子任务照常完成
+        - 参数不完整需要询问用户（记录到 state.blocked_task_id，询问内容写入 state.final_response），
+          或子任务执行抛出异常时，取消其余子任务
+        - state.agent_results 中已有结果的子任务（从计划检查点恢复）视为已完成，不再执行
+        产出的事件按子任务的计划顺序输出，不会交错：当前子任务完成前，后续子任务的事件先缓存
+        :param state: Agent状态
+        :param stream: 是否使用子Agent的流式接口（产出 token 事件）
+        :return: 异步生成器，产出 tool_call / token / subtask_done 事件，需要询问用户时最后产出 aborted 事件
+        """
         ordered_subtasks = self._sort_subtasks(state.task_subtasks or [])
-        for idx, subtask in enumerate(ordered_subtasks):
-            # 检查参数是否完整（尝试从历史会话和用户输入中提取参数）
-            if not await self._check_params_complete(subtask, state):
-                # 如果参数不完整，已经在_check_params_complete中设置了final_response
-                return state
-            
-            # 路由到合适的Agent
-            route_result = await self.agent_router.process({
-                "task_type": subtask["task_type"],
-                "subtask_description": subtask["description"],
-                "required_params": subtask["required_params"]
-            })
-            
-            if route_result.get("success"):
-                selected_agent_id = route_result.get("selected_agent")
-                agent = self.agent_map.get(selected_agent_id)
-                
-                if agent:
-                    # 执行子任务
-                    task_input = {
-                        "task_description": subtask["description"],
-                        "params": subtask.get("params", {}),
-                        "session_id": state.session_id,
-                        "user_id": state.user_id,
-                        "jwt_token": state.jwt_token
-                    }
-                    
-                    # 根据不同的Agent添加特定参数
-                    if selected_agent_id == "knowledge_agent":
-                        task_input["query"] = subtask.get("query", subtask["description"])
-                    elif selected_agent_id == "memory_agent":
-                        task_input["action"] = subtask.get("action", "get_history")
-                    
-                    agent_result = await agent.process(task_input)
-                    
-                    # 保存Agent执行结果
-                    state.agent_results[subtask["task_id"]] = {
-                        "task": subtask,
-                        "agent": selected_agent_id,
-                        "result": agent_result
-                    }
-                    
-                    logger.info(f"【主Agent】子任务执行成功: {subtask['task_name']}")
-
-                    # 若当前结果已足以回答用户问题，则直接结束，避免继续无效调用（如多余RAG）
-                    if self._can_finalize_after_subtask(subtask, selected_agent_id, agent_result):
-                        state.final_response = self._extract_response_from_agent_result(selected_agent_id, agent_result)
-                        logger.info("【主Agent】任务已满足，提前结束后续子任务")
-                        return state
+        keys = [self._subtask_key(subtask, index) for index, subtask in enumerate(ordered_subtasks)]
+        dependencies = self._subtask_dependencies(ordered_subtasks)
+        max_concurrency = self._max_concurrent_subtasks()
+        semaphore = asyncio.Semaphore(max_concurrency)
+        queue: asyncio.Queue = asyncio.Queue()
+        running: Dict[int, asyncio.Task] = {}
+        completed: set[int] = set()
+        buffered: Dict[int, list] = {index: [] for index in range(len(ordered_subtasks))}
+        stop_launching = False
+        cursor = 0
+        # 之前的轮次中已完成的子任务（从计划检查点恢复）不再执行，结果按计划顺序重新输出
+        for index, key in enumerate(keys):
+            if key in state.agent_results:
+                completed.add(index)
+                restored = state.agent_results[key]
+                buffered[index].append({
+                    "type": "subtask_done",
+                    "key": key,
+                    "subtask": restored.get("task"),
+                    "agent": restored.get("agent"),
+                    "result": restored.get("result") or {}
+                })
+
+        async def run(index: int):
+            try:
+                async with semaphore:
+                    async for event in self._run_subtask(ordered_subtasks[index], keys[index], state, stream):
+                        queue.put_nowait((index, event))
+            except Exception as e:
+                queue.put_nowait((index, {"type": "error", "error": e}))
+            finally:
+                queue.put_nowait((index, None))
+
+        def launch_ready():
+            if stop_launching:
+                return
+            for index in range(len(ordered_subtasks)):
+                if index not in running and index not in completed and dependencies[index] <= completed:
+                    running[index] = asyncio.create_task(run(index))
+
+        logger.info(f"【主Agent】开始调度子任务，子任务数: {len(ordered_subtasks)}，最大并发: {max_concurrency}")
+        launch_ready()
+        try:
+            while True:
+                # 按计划顺序输出已缓存的事件
+                while cursor < len(ordered_subtasks):
+                    events, buffered[cursor] = buffered[cursor], []
+                    for buffered_event in events:
+                        yield buffered_event
+                    if cursor in completed or (stop_launching and cursor not in running):
+                        cursor += 1
+                    else:
+                        break
+                if not running.keys() - completed:
+                    break
+
+                index, event = await queue.get()
+                if event is None:
+                    completed.add(index)
+                    launch_ready()
+                elif event["type"] == "error":
+                    logger.error(f"【主Agent】子任务 {keys[index]} 执行异常，取消其余子任务")
+                    raise event["error"]
+                elif event["type"] == "aborted":
+                    logger.info(f"【主Agent】子任务 {keys[index]} 需要向用户询问参数，取消其余子任务")
+                    # 只按实际处理的 aborted 事件设置，被取消的并发子任务不会覆盖询问内容
+                    state.blocked_task_id = keys[index]
+                    state.final_response = event["content"]
+                    yield event
+                    return
                 else:
-                    logger.error(f"【主Agent】未找到路由到的Agent: {selected_agent_id}")
-                    state.agent_results[subtask.get("task_id", "unknown")] = {
-                        "task": subtask,
-                        "agent": selected_agent_id,
-                        "result": {"success": False, "error": f"未找到Agent: {selected_agent_id}"}
-                    }
-            else:
-                logger.error(f"【主Agent】子任务路由失败: {route_result.get('error')}")
-                state.agent_results[subtask.get("task_id", "unknown")] = {
-                    "task": subtask,
-                    "agent": None,
-                    "result": {"success": False, "error": route_result.get("error", "路由失败")}
-                }
+                    if event["type"] == "subtask_done":
+                        state.agent_results[event["key"]] = {
+                            "task": event["subtask"],
+                            "agent": event["agent"],
+                            "result": event["result"]
+                        }
+                        # 若当前结果已足以回答用户问题，则不再启动后续子任务，避免继续无效调用（如多余RAG）
+                        if event["agent"] and self._can_finalize_after_subtask(
+                                event["subtask"], event["agent"], event["result"]):
+                            stop_launching = True
+                            logger.info("【主Agent】任务已满足，不再启动后续子任务")
+                    buffered[index].append(event)
+        finally:
+            for task in running.values():
+                task.cancel()
+            await asyncio.gather(*running.values(), return_exceptions=True)
+            # 结果按计划顺序排列，整合结果的顺序与子任务完成的先后无关
+            state.agent_results = {key: state.agent_results[key] for key in keys if key in state.agent_results}
 
-            # 最后一个子任务执行后自然退出
-            if idx == len(ordered_subtasks) - 1:
-                continue
-        
-        return state
+    async def _run_subtask(
+            self,
+            subtask: Dict[str, Any],
+            key: str,
+            state: AgentState,
+            stream: bool = False,
+    ) -> AsyncGenerator[Dict[str, Any], None]:
+        """
+        执行单个子任务：参数检查 -> 路由 -> 调用子Agent
+        :param subtask: 子任务
+        :param key: 子任务在 agent_results 中的键
+        :param state: Agent状态
+        :param stream: 是否使用子Agent的流式接口
+        :return: 异步生成器，产出 tool_call / token 事件，最后产出 subtask_done 事件；
+                 参数不完整需要询问用户时只产出 aborted 事件（content 为询问内容）
+        """
+        # 检查参数是否完整（尝试从历史会话和用户输入中提取参数）
+        question = await self._missing_params_question(subtask, state)
+        if question:
+            yield {"type": "aborted", "key": key, "content": question}
+            return
+
+        # 路由到合适的Agent
+        route_result = await self.agent_router.process({
+            "task_type": subtask["task_type"],
+            "subtask_description": subtask["description"],
+            "required_params": subtask["required_params"]
+        })
+
+        if not route_result.get("success"):
+            logger.error(f"【主Agent】子任务路由失败: {route_result.get('error')}")
+            yield {
+                "type": "subtask_done",
+                "key": key,
+                "subtask": subtask,
+                "agent": None,
+                "result": {"success": False, "error": route_result.get("error", "路由失败")}
+            }
+            return
+
+        selected_agent_id = route_result.get("selected_agent")
+        agent = self.agent_map.get(selected_agent_id)
+        if not agent:
+            logger.error(f"【主Agent】未找到路由到的Agent: {selected_agent_id}")
+            yield {
+                "type": "subtask_done",
+                "key": key,
+                "subtask": subtask,
+                "agent": selected_agent_id,
+                "result": {"success": False, "error": f"未找到Agent: {selected_agent_id}"}
+            }
+            return
+
+        # 执行子任务
+        task_input = {
+            "task_description": subtask["description"],
+            "params": subtask.get("params", {}),
+            "session_id": state.session_id,
+            "user_id": state.user_id,
+            "jwt_token": state.jwt_token
+        }
+
+        # 根据不同的Agent添加特定参数
+        if selected_agent_id == "knowledge_agent":
+            task_input["query"] = subtask.get("query", subtask["description"])
+        elif selected_agent_id == "memory_agent":
+            task_input["action"] = subtask.get("action", "get_history")
+
+        agent_result = None
+        if stream:
+            # 发送工具调用信息
+            yield {"type": "tool_call", "key": key, "agent": selected_agent_id, "tool_input": subtask.get("params", {})}
+        if stream and hasattr(agent, "process_stream"):
+            # 支持流式的子Agent直接转发大模型 token
+            async for event in agent.process_stream(task_input):
+                if event.get("type") == "token":
+                    yield {"type": "token", "key": key, "agent": selected_agent_id, "content": event.get("content", "")}
+                elif event.get("type") == "result":
+                    agent_result = event.get("result")
+        else:
+            agent_result = await agent.process(task_input)
+        agent_result = agent_result or {"success": False, "error": "子Agent未返回结果"}
+
+        logger.info(f"【主Agent】子任务执行完成: {subtask.get('task_name')}")
+        yield {"type": "subtask_done", "key": key, "subtask": subtask, "agent": selected_agent_id, "result": agent_result}
+
+    @staticmethod
+    def _subtask_key(subtask: Dict[str, Any], index: int) -> str:
+        """子任务在 agent_results 中的键（index 为子任务在计划顺序中的位置）"""
+        return subtask.get("task_id") or f"subtask_{index}"
+
+    def _subtask_dependencies(self, ordered_subtasks: list[Dict[str, Any]]) -> list[set[int]]:
+        """
+        计算每个子任务依赖的子任务（在 ordered_subtasks 中的下标）
+        依赖缺失或存在循环依赖时（_sort_subtasks 已退化为按 priority 排序），退化为逐个顺序执行
+        """
+        position = {subtask.get("task_id"): index for index, subtask in enumerate(ordered_subtasks) if subtask.get("task_id")}
+        dependencies: list[set[int]] = []
+        for index, subtask in enumerate(ordered_subtasks):
+            indexes = set()
+            for dep in subtask.get("dependencies") or []:
+                dep_index = position.get(dep)
+                if dep_index is None or dep_index >= index:
+                    return [{i - 1} if i else set() for i in range(len(ordered_subtasks))]
+                indexes.add(dep_index)
+            dependencies.append(indexes)
+        return dependencies
 
     def _sort_subtasks(self, subtasks: list[Dict[str, Any]]) -> list[Dict[str, Any]]:
         """
@@ -266,8 +481,19 @@ class MainAgent(BaseAgent):
             "yes",
         )
 
-    async def _check_params_complete(self, subtask: Dict[str, Any], state: AgentState) -> bool:
-        """检查参数是否完整：由参数提取Agent独立完成提取；缺参时默认放行（可严格拦截）。"""
+    def _max_concurrent_subtasks(self) -> int:
+        """单次请求内同时执行的子任务数上限"""
+        try:
+            return max(1, int(os.getenv("MAIN_AGENT_MAX_CONCURRENT_SUBTASKS", "3")))
+        except ValueError:
+            return 3
+
+    async def _missing_params_question(self, subtask: Dict[str, Any], state: AgentState) -> Optional[str]:
+        """
+        检查参数是否完整：由参数提取Agent独立完成提取，提取到的参数写入 subtask["params"]；缺参时默认放行（可严格拦截）
+        并发执行的子任务各自检查，不修改 state.final_response，询问内容由调度器按实际处理的子任务设置
+        :return: 需要向用户询问缺少的参数时返回询问内容，否则返回 None
+        """
         task_type = subtask.get("task_type", "")
         # 这些类型由子 Agent / 对话本身处理，不在此用 required_params 卡死
         if task_type in (
@@ -277,11 +503,11 @@ class MainAgent(BaseAgent):
             "user_interaction",
             "memory_management",
         ):
-            return True
+            return None
 
         required_params = subtask.get("required_params") or []
         if not required_params:
-            return True
+            return None
 
         # 将 jwt_token 注入到 existing_params 中，避免参数提取 Agent 重复询问
         existing_params = subtask.get("params") or {}
@@ -304,21 +530,18 @@ class MainAgent(BaseAgent):
         missing_params = extraction_result.get("missing_params") or []
         if not missing_params:
             logger.info(f"【参数检查】所有参数已提取完成: {merged_params}")
-            return True
+            return None
 
         logger.info(f"【参数检查】仍缺参数: {missing_params}")
 
         if self._strict_params_enabled():
-            state.final_response = (
-                f"我需要更多信息来完成任务：{', '.join(missing_params)}"
-            )
-            return False
+            return f"我需要更多信息来完成任务：{', '.join(missing_params)}"
 
         # 默认：不阻断，交给 tool_agent 等用自然语言 + 部分 params 继续推理/调工具
         logger.warning(
             "【参数检查】缺参但未启用 STRICT，继续执行子任务；子 Agent 可结合完整描述补全"
         )
-        return True
+        return None
 
     def _extract_response_from_agent_result(self, agent_id: str, agent_result: Dict[str, Any]) -> str:
         if agent_id == "tool_agent":
@@ -353,6 +576,14 @@ class MainAgent(BaseAgent):
             return not any(s in output.lower() for s in bad_signals)
         return False
     
+    def _has_successful_output(self, state: AgentState) -> bool:
+        """是否存在执行成功且有输出的子任务（整合结果时会直接拼接这些输出）"""
+        return any(
+            task_data.get("result", {}).get("success")
+            and self._extract_response_from_agent_result(task_data.get("agent"), task_data.get("result", {}))
+            for task_data in state.agent_results.values()
+        )
+
     async def _integrate_results(self, state: AgentState) -> AgentState:
         """整合结果"""
         # 整合所有Agent的执行结果
@@ -461,7 +692,8 @@ class MainAgent(BaseAgent):
     async def process_stream(self, input_data: Dict[str, Any]) -> AsyncGenerator[Dict[str, Any], None]:
         """
         流式处理输入数据，实时返回中间结果
-        :param input_data: 输入数据
+        最后一个事件为 {"type": "final", "content": 最终响应}，调用方据此保存会话历史，无需再调用 process
+        :param input_data: 输入数据（可携带 chat_history，避免重复获取会话历史）
         :return: 异步生成器，产生中间结果
         """
         try:
@@ -483,89 +715,65 @@ class MainAgent(BaseAgent):
             
             logger.info(f"【主Agent流式】开始处理请求，用户ID: {user_id}, 会话ID: {session_id}, 输入: {user_input[:50]}...")
             
-            # 步骤1: 获取会话历史
+            # 步骤1: 获取会话历史（调用方已取过历史时直接复用，避免重复查询）
             yield {"type": "thinking", "content": "获取会话历史..."}
-            state = await self._get_session_history(state)
-            
-            # 步骤2: 任务分解
+            if input_data.get("chat_history") is not None:
+                state.chat_history = input_data.get("chat_history")
+            else:
+                state = await self._get_session_history(state)
+
+            # 步骤2: 恢复等待用户补充参数的计划，没有时分解任务
             yield {"type": "thinking", "content": "分析您的请求..."}
-            state = await self._decompose_task(state)
+            resumed = await self._resume_pending_plan(state)
+            if not resumed:
+                state = await self._decompose_task(state)
             
-            # 如果任务分解失败，返回错误
-            if not state.task_subtasks:
+            # 如果任务分解失败，返回错误（闲聊没有子任务，直接整合回复）
+            if not state.task_subtasks and state.task_type != CHITCHAT_INTENT:
                 yield {"type": "final", "content": "抱歉，无法理解您的请求。请重新描述您的需求。"}
                 return
             
-            # 步骤3: 执行子任务
-            ordered_subtasks = self._sort_subtasks(state.task_subtasks or [])
-            for idx, subtask in enumerate(ordered_subtasks):
-                # 检查参数是否完整
-                if not await self._check_params_complete(subtask, state):
-                    if state.final_response:
-                        yield {"type": "final", "content": state.final_response}
+            # 步骤3: 执行子任务（依赖已满足的子任务并发执行，事件按计划顺序输出）
+            emitted_output = False  # 是否已经向客户端输出过回答内容
+            streamed_keys = set()  # 已流式输出过 token 的子任务
+            async for event in self._iter_subtasks(state, stream=True):
+                if event["type"] == "aborted":
+                    # 参数不完整，保存计划后向用户询问
+                    await self._checkpoint_plan(state, resumed)
+                    yield {"type": "final", "content": event["content"]}
                     return
-                
-                # 路由到合适的Agent
-                route_result = await self.agent_router.process({
-                    "task_type": subtask["task_type"],
-                    "subtask_description": subtask["description"],
-                    "required_params": subtask["required_params"]
-                })
-                
-                if route_result.get("success"):
-                    selected_agent_id = route_result.get("selected_agent")
-                    agent = self.agent_map.get(selected_agent_id)
-                    
-                    if agent:
-                        # 发送工具调用信息
-                        yield {"type": "tool_call", "tool_name": selected_agent_id, "tool_input": subtask.get("params", {})}
-                        
-                        # 执行子任务
-                        task_input = {
-                            "task_description": subtask["description"],
-                            "params": subtask.get("params", {}),
-                            "session_id": state.session_id,
-                            "user_id": state.user_id,
-                            "jwt_token": state.jwt_token
-                        }
-                        
-                        if selected_agent_id == "knowledge_agent":
-                            task_input["query"] = subtask.get("query", subtask["description"])
-                        elif selected_agent_id == "memory_agent":
-                            task_input["action"] = subtask.get("action", "get_history")
-                        
-                        # 获取工具执行结果
-                        agent_result = await agent.process(task_input)
-                        
-                        # 保存Agent执行结果
-                        state.agent_results[subtask["task_id"]] = {
-                            "task": subtask,
-                            "agent": selected_agent_id,
-                            "result": agent_result
-                        }
-                        
-                        # 如果工具执行成功，发送结果
-                        if agent_result.get("success"):
-                            output = self._extract_response_from_agent_result(selected_agent_id, agent_result)
-                            if output:
-                                yield {"type": "tool_result", "tool_name": selected_agent_id, "content": output}
-                            
-                            # 检查是否可以提前结束
-                            if self._can_finalize_after_subtask(subtask, selected_agent_id, agent_result):
-                                state.final_response = output
-                                break
-            
+                if event["type"] == "tool_call":
+                    yield {"type": "tool_call", "tool_name": event["agent"], "tool_input": event["tool_input"]}
+                elif event["type"] == "token":
+                    if event["key"] not in streamed_keys and emitted_output:
+                        # 多个子任务的输出之间用空行分隔，与整合结果的格式保持一致
+                        yield {"type": "token", "tool_name": event["agent"], "content": "\n\n"}
+                    streamed_keys.add(event["key"])
+                    emitted_output = True
+                    yield {"type": "token", "tool_name": event["agent"], "content": event["content"]}
+                elif event["type"] == "subtask_done" and event["result"].get("success"):
+                    # 如果工具执行成功，发送结果（已流式输出的不再重复发送）
+                    output = self._extract_response_from_agent_result(event["agent"], event["result"])
+                    if output and event["key"] not in streamed_keys:
+                        separator = "\n\n" if emitted_output else ""
+                        emitted_output = True
+                        yield {"type": "tool_result", "tool_name": event["agent"], "content": separator + output}
+            
+            await self._checkpoint_plan(state, resumed)
+
             # 步骤4: 整合结果
             if not state.final_response:
                 state = await self._integrate_results(state)
             
-            # 发送最终响应
+            # 发送最终响应（由调用方负责写入会话历史，这里不再保存记忆，避免重复写入）
+            # delivered 表示最终响应的内容已经通过 token/tool_result 事件发送给客户端
             if state.final_response:
-                yield {"type": "final", "content": state.final_response}
-            
-            # 步骤5: 保存记忆（在后台异步执行，不阻塞流式输出）
-            await self._save_memory(state)
-            
+                yield {
+                    "type": "final",
+                    "content": state.final_response,
+                    "delivered": emitted_output and self._has_successful_output(state),
+                }
+
             logger.info(f"【主Agent流式】处理完成，会话ID: {session_id}")
             
         except Exception as e:
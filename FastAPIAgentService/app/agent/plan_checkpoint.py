@@ -0,0 +1,70 @@
+import json
+import os
+from typing import Any, Dict, Optional
+
+from app.agent.base import AgentState
+from app.core.logger_handler import logger
+from app.db.redis_config import delete_redis_cache, get_redis_cache_json, set_redis_cache
+
+CHECKPOINT_KEY_PREFIX = "agent:pending_plan:"
+# 不写入检查点的参数（身份令牌每次请求重新注入）
+_SECRET_PARAMS = ("jwt_token", "token")
+
+
+def _checkpoint_ttl() -> int:
+    """检查点的有效期（秒），超过后用户的回复按新请求处理"""
+    try:
+        return int(os.getenv("MAIN_AGENT_PENDING_PLAN_TTL", "1800"))
+    except ValueError:
+        return 1800
+
+
+def _strip_secrets(subtask: Dict[str, Any]) -> Dict[str, Any]:
+    params = {key: value for key, value in (subtask.get("params") or {}).items() if key not in _SECRET_PARAMS}
+    return {**subtask, "params": params}
+
+
+async def save_plan_checkpoint(state: AgentState) -> bool:
+    """
+    保存等待用户补充参数的计划：子任务（含已提取的参数）、已完成子任务的结果、被阻塞的子任务
+    身份令牌与工具调用明细（可能包含令牌）不写入检查点
+    :param state: Agent状态
+    :return: 是否保存成功
+    """
+    data = state.to_dict()
+    data["chat_history"] = None
+    data["task_subtasks"] = [_strip_secrets(subtask) for subtask in state.task_subtasks or []]
+    data["agent_results"] = {
+        key: {
+            "task": _strip_secrets(task_data.get("task") or {}),
+            "agent": task_data.get("agent"),
+            "result": {name: value for name, value in (task_data.get("result") or {}).items() if name != "steps"},
+        }
+        for key, task_data in state.agent_results.items()
+    }
+    saved = await set_redis_cache(
+        CHECKPOINT_KEY_PREFIX + state.session_id,
+        json.dumps(data, ensure_ascii=False, default=str),
+        expire=_checkpoint_ttl(),
+    )
+    if saved:
+        logger.info(f"【计划检查点】已保存，会话ID: {state.session_id}，等待补充参数的子任务: {state.blocked_task_id}")
+    return saved
+
+
+async def load_plan_checkpoint(session_id: str, user_id: str) -> Optional[AgentState]:
+    """
+    读取会话中等待用户补充参数的计划
+    :param session_id: 会话ID
+    :param user_id: 用户ID（与保存时不一致时忽略检查点）
+    :return: 恢复的Agent状态，没有检查点时返回 None
+    """
+    data = await get_redis_cache_json(CHECKPOINT_KEY_PREFIX + session_id)
+    if not data or str(data.get("user_id")) != str(user_id):
+        return None
+    return AgentState.from_dict(data)
+
+
+async def clear_plan_checkpoint(session_id: str) -> bool:
+    """删除会话的计划检查点"""
+    return await delete_redis_cache(CHECKPOINT_KEY_PREFIX + session_id)
@@ -1,10 +1,14 @@
 import re
-from typing import Dict, Any, List, Optional
+import threading
+import time
+from typing import Dict, Any, List, Optional, AsyncGenerator, Tuple
 import json
 from datetime import datetime, timedelta
 
 from langchain_classic.agents import create_tool_calling_agent, AgentExecutor, AgentOutputParser
+from langchain_core.callbacks import BaseCallbackHandler
 from langchain_core.messages import ToolCall
+from langchain_core.outputs import LLMResult
 from langchain_core.tools import BaseTool
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 
@@ -30,6 +34,112 @@ from app.tools.rag_tools import (
     get_user_info_tools,
     reorder_documents_tools
 )
+from app.tools.tool_context import bind_runtime_token, set_tool_token
+
+# 不写入模型输入的参数（身份令牌由运行时注入工具）
+_SECRET_PARAMS = ("jwt_token", "token", "auth_token")
+
+
+class ToolExecutorStats:
+    """工具执行器的构建开销与模型服务提示词缓存的统计，用于健康检查接口"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._builds = 0
+        self._build_ms = 0.0
+        self._build_ms_max = 0.0
+        self._cache_hits = 0
+        self._llm_calls = 0
+        self._llm_calls_with_usage = 0
+        self._llm_calls_with_cache_hit = 0
+        self._prompt_tokens = 0
+        self._cached_prompt_tokens = 0
+
+    def observe_build(self, elapsed_ms: float):
+        with self._lock:
+            self._builds += 1
+            self._build_ms += elapsed_ms
+            self._build_ms_max = max(self._build_ms_max, elapsed_ms)
+
+    def observe_cache_hit(self):
+        with self._lock:
+            self._cache_hits += 1
+
+    def observe_llm_usage(self, prompt_tokens: Optional[int], cached_tokens: int = 0):
+        with self._lock:
+            self._llm_calls += 1
+            if prompt_tokens is None:
+                return
+            self._llm_calls_with_usage += 1
+            self._prompt_tokens += prompt_tokens
+            self._cached_prompt_tokens += cached_tokens
+            if cached_tokens:
+                self._llm_calls_with_cache_hit += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        工具执行器统计
+        :return: 执行器的构建次数与耗时（毫秒）、复用次数及节省的构建耗时、
+                 模型调用次数、输入 token 数与其中命中提示词缓存的 token 数及占比
+        """
+        with self._lock:
+            requests = self._builds + self._cache_hits
+            build_ms_avg = self._build_ms / self._builds if self._builds else 0.0
+            return {
+                "executor_builds": self._builds,
+                "executor_cache_hits": self._cache_hits,
+                "executor_cache_hit_ratio": round(self._cache_hits / requests, 4) if requests else 0.0,
+                "build_ms_avg": round(build_ms_avg, 2),
+                "build_ms_max": round(self._build_ms_max, 2),
+                "build_ms_saved": round(build_ms_avg * self._cache_hits, 2),
+                "llm_calls": self._llm_calls,
+                "llm_calls_with_usage": self._llm_calls_with_usage,
+                "llm_calls_with_cache_hit": self._llm_calls_with_cache_hit,
+                "prompt_tokens": self._prompt_tokens,
+                "cached_prompt_tokens": self._cached_prompt_tokens,
+                "prompt_cache_hit_ratio": (
+                    round(self._cached_prompt_tokens / self._prompt_tokens, 4) if self._prompt_tokens else 0.0
+                ),
+            }
+
+
+tool_executor_stats = ToolExecutorStats()
+
+
+def _extract_prompt_usage(generation: Any) -> Tuple[Optional[int], int]:
+    """
+    从模型输出中读取输入 token 数和命中提示词缓存的 token 数
+    优先读取 LangChain 标准的 usage_metadata，其次读取通义千问返回的 token_usage
+    :return: (输入 token 数，模型服务未返回用量时为 None, 命中缓存的 token 数)
+    """
+    message = getattr(generation, "message", None)
+    usage_metadata = getattr(message, "usage_metadata", None)
+    if usage_metadata:
+        details = usage_metadata.get("input_token_details") or {}
+        return usage_metadata.get("input_tokens"), details.get("cache_read") or 0
+
+    token_usage = (getattr(message, "response_metadata", None) or {}).get("token_usage") \
+        or (getattr(generation, "generation_info", None) or {}).get("token_usage")
+    if not token_usage:
+        return None, 0
+    prompt_tokens = token_usage.get("input_tokens", token_usage.get("prompt_tokens"))
+    details = token_usage.get("prompt_tokens_details") or {}
+    return prompt_tokens, details.get("cached_tokens") or 0
+
+
+class PromptCacheUsageHandler(BaseCallbackHandler):
+    """统计每次模型调用的输入 token 与提示词缓存命中情况"""
+
+    def on_llm_end(self, response: LLMResult, **kwargs: Any) -> None:
+        for generations in response.generations:
+            for generation in generations:
+                tool_executor_stats.observe_llm_usage(*_extract_prompt_usage(generation))
+
+
+# 按工具集缓存的执行器：模型客户端、提示词模板、Agent 与 AgentExecutor 只构建一次，跨请求复用
+# 执行器本身不保存请求状态（输入与对话历史随调用传入，身份令牌通过上下文注入工具），可以被并发的请求共享
+_executor_cache: Dict[Tuple[str, ...], AgentExecutor] = {}
+_executor_cache_lock = threading.Lock()
 
 
 class ToolAgent(BaseAgent):
@@ -226,8 +336,24 @@ class ToolAgent(BaseAgent):
             "reason": str(reason)
         }
     
-    def _create_agent_executor(self, jwt_token: Optional[str] = None):
-        """创建Agent执行器"""
+    def _get_agent_executor(self) -> AgentExecutor:
+        """获取当前工具集的Agent执行器，首次使用时构建并缓存"""
+        key = tuple(tool.name for tool in self.tools)
+        with _executor_cache_lock:
+            agent_executor = _executor_cache.get(key)
+            if agent_executor is not None:
+                tool_executor_stats.observe_cache_hit()
+                return agent_executor
+            start = time.perf_counter()
+            agent_executor = self._create_agent_executor()
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            _executor_cache[key] = agent_executor
+        tool_executor_stats.observe_build(elapsed_ms)
+        logger.info(f"【工具执行】已构建Agent执行器，工具数: {len(key)}，耗时: {elapsed_ms:.1f}ms")
+        return agent_executor
+
+    def _create_agent_executor(self) -> AgentExecutor:
+        """创建Agent执行器（系统提示词与用户无关，身份令牌在调用工具时从上下文注入）"""
         from app.utils.prompt_loader import load_prompt
         
         # 创建聊天模型
@@ -249,15 +375,15 @@ class ToolAgent(BaseAgent):
             base_url=base_url, 
             temperature=0.3,
             # 开启自动工具选择；不强制 json_object，避免 Tongyi 对 messages 的 json 关键词校验报错
-            tool_choice="auto"
+            tool_choice="auto",
+            callbacks=[PromptCacheUsageHandler()]
         )
         
-        # 创建提示词模板，支持注入 jwt_token
+        # 创建提示词模板；系统提示词对所有用户相同，便于模型服务复用提示词缓存
         system_prompt = load_prompt('tool_agent_prompt')
         
-        # 如果提供了 jwt_token，将其注入到系统Prompt中
-        if jwt_token:
-            system_prompt += f"\n\n你拥有以下身份验证令牌，在调用需要身份验证的工具时使用：\nJWT_TOKEN: {jwt_token}"
+        # 需要 JWT 的工具改为运行时从上下文读取令牌，模型不再生成 token 参数
+        tools = [bind_runtime_token(tool) for tool in self.tools]
         
         prompt = ChatPromptTemplate.from_messages([
             ("system", system_prompt),
@@ -269,7 +395,7 @@ class ToolAgent(BaseAgent):
         # 创建Agent
         agent = create_tool_calling_agent(
             llm, 
-            self.tools, 
+            tools, 
             prompt
         )
 
@@ -307,124 +433,11 @@ class ToolAgent(BaseAgent):
         # 创建Executor
         return AgentExecutor(
             agent=agent,
-            tools=self.tools,
+            tools=tools,
             verbose=True,
             return_intermediate_steps=True,
             handle_parsing_errors=custom_error_handler)
 
-    async def process(self, input_data: Dict[str, Any]) -> Dict[str, Any]:
-        """处理输入数据，执行工具调用"""
-        try:
-            task_description = input_data.get("task_description", "")
-            params = input_data.get("params", {})
-
-            # 对“请假申请创建”场景走确定性调用，避免LLM工具参数JSON格式不稳定导致失败。
-            deterministic_leave_args = self._build_leave_tool_args(params)
-            if deterministic_leave_args:
-                logger.info(f"【工具执行】命中确定性请假流程，参数: {deterministic_leave_args}")
-                direct_result = await create_attendance_record.ainvoke(deterministic_leave_args)
-                return {
-                    "success": True,
-                    "output": direct_result,
-                    "steps": [{
-                        "tool": "create_attendance_record",
-                        "tool_input": deterministic_leave_args,
-                        "tool_output": direct_result,
-                        "thought": "使用确定性流程直接创建请假考勤记录，避免工具参数JSON格式错误。"
-                    }],
-                    "tool_used": ["create_attendance_record"]
-                }
-
-            # 对“创建通知”场景走确定性调用
-            if "create_inform" in task_description or "创建通知" in task_description:
-                token = params.get("jwt_token") or params.get("token")
-                inform_data = params.get("inform_data") or params.get("notification_data")
-                if token and inform_data:
-                    try:
-                        # 确保inform_data是字典格式
-                        if isinstance(inform_data, str):
-                            inform_data = json.loads(inform_data)
-                        
-                        # 验证必需字段
-                        if all(key in inform_data for key in ["title", "content"]):
-                            from app.schemas.oa_schemas import InformCreateRequest
-                            inform_request = InformCreateRequest(
-                                title=inform_data["title"],
-                                content=inform_data["content"],
-                                public=inform_data.get("public", False),
-                                department_ids=inform_data.get("department_ids", [])
-                            )
-                            logger.info(f"【工具执行】命中确定性创建通知流程，参数: {{'token': '***', 'title': '{inform_data['title']}'}}")
-                            direct_result = await create_inform.ainvoke({"token": token, "inform_data": inform_request})
-                            return {
-                                "success": True,
-                                "output": direct_result,
-                                "steps": [{
-                                    "tool": "create_inform",
-                                    "tool_input": {"token": token, "title": inform_data["title"]},
-                                    "tool_output": direct_result,
-                                    "thought": "使用确定性流程直接创建通知，避免工具参数JSON格式错误。"
-                                }],
-                                "tool_used": ["create_inform"]
-                            }
-                    except Exception as e:
-                        logger.warning(f"确定性创建通知流程失败: {str(e)}")
-                        # 失败后继续走通用流程
-
-            # 对“更新考勤记录”场景走确定性调用
-            if "update_attendance" in task_description or "更新考勤" in task_description:
-                token = params.get("jwt_token") or params.get("token")
-                record_id = params.get("record_id") or params.get("id")
-                update_data = params.get("update_data") or params.get("status")
-                if token and record_id:
-                    try:
-                        from app.schemas.oa_schemas import AttendanceUpdateRequest
-                        # 构建更新数据
-                        if isinstance(update_data, dict):
-                            attendance_update = AttendanceUpdateRequest(**update_data)
-                        elif isinstance(update_data, str):
-                            # 简单处理：如果只是状态字符串
-                            attendance_update = AttendanceUpdateRequest(status=update_data)
-                        else:
-                            attendance_update = AttendanceUpdateRequest(status="approved" if "通过" in task_description else "rejected")
-                        
-                        logger.info(f"【工具执行】命中确定性更新考勤流程，参数: {{'token': '***', 'record_id': {record_id}}}")
-                        direct_result = await update_attendance_record.ainvoke({"token": token, "record_id": record_id, "update_data": attendance_update})
-                        return {
-                            "success": True,
-                            "output": direct_result,
-                            "steps": [{
-                                "tool": "update_attendance_record",
-                                "tool_input": {"token": token, "record_id": record_id},
-                                "tool_output": direct_result,
-                                "thought": "使用确定性流程直接更新考勤记录，避免工具参数JSON格式错误。"
-                            }],
-                            "tool_used": ["update_attendance_record"]
-                        }
-                    except Exception as e:
-                        logger.warning(f"确定性更新考勤流程失败: {str(e)}")
-                        # 失败后继续走通用流程
-
-            
-            # 每次请求创建全新的 executor，避免跨会话状态污染
-            agent_executor = self._create_agent_executor()
-
-            # 构建工具调用输入：附带严格JSON参数块，减少模型生成非法arguments的概率
-            tool_input = task_description
-            if params:
-                strict_json_params = self._build_strict_json_block(params)
-                tool_input += (
-                    "\n参数（严格JSON，仅可使用该格式组装工具arguments）：\n"
-                    f"{strict_json_params}"
-                )
-            
-            logger.info(f"【工具执行】开始执行工具，输入: {tool_input}")
-            logger.info(f"【工具执行】参数: {params}")
-
-        except Exception as e:
-            logger.error(f"【工具执行】工具调用失败: {str(e)}")
-            return {"success": False, "message": f"工具调用失败: {str(e)}"}
-
     def _build_attendance_args(self, params: Dict[str, Any]) -> Dict[str, Any]:
         """构建考勤记录参数"""
         token = params.get("jwt_token") or params.get("token") or params.get("auth_token")
@@ -489,118 +502,171 @@ class ToolAgent(BaseAgent):
             logger.error(f"直接调用工具失败: {str(direct_error)}")
             return {}
 
-    async def process(self, input_data: Dict[str, Any]) -> Dict[str, Any]:
-        """处理输入数据，执行工具调用"""
-        try:
-            task_description = input_data.get("task_description", "")
-            params = input_data.get("params", {})
-            jwt_token = input_data.get("jwt_token")
-
-            # 如果 params 中没有 jwt_token，但 input_data 中有，则添加到 params
-            if jwt_token and "jwt_token" not in params:
-                params["jwt_token"] = jwt_token
-
-            # 对“请假申请创建”场景走确定性调用，避免LLM工具参数JSON格式不稳定导致失败。
-            deterministic_leave_args = self._build_leave_tool_args(params)
-            if deterministic_leave_args:
-                logger.info(f"【工具执行】命中确定性请假流程，参数: {deterministic_leave_args}")
-                direct_result = await create_attendance_record.ainvoke(deterministic_leave_args)
-                return {
-                    "success": True,
-                    "output": direct_result,
-                    "steps": [{
-                        "tool": "create_attendance_record",
-                        "tool_input": deterministic_leave_args,
-                        "tool_output": direct_result,
-                        "thought": "使用确定性流程直接创建请假考勤记录，避免工具参数JSON格式错误。"
-                    }],
-                    "tool_used": ["create_attendance_record"]
-                }
-
-            # 对“创建通知”场景走确定性调用
-            if "create_inform" in task_description or "创建通知" in task_description:
-                token = params.get("jwt_token") or params.get("token")
-                inform_data = params.get("inform_data") or params.get("notification_data")
-                if token and inform_data:
-                    try:
-                        # 确保inform_data是字典格式
-                        if isinstance(inform_data, str):
-                            inform_data = json.loads(inform_data)
-                        
-                        # 验证必需字段
-                        if all(key in inform_data for key in ["title", "content"]):
-                            from app.schemas.oa_schemas import InformCreateRequest
-                            inform_request = InformCreateRequest(
-                                title=inform_data["title"],
-                                content=inform_data["content"],
-                                public=inform_data.get("public", False),
-                                department_ids=inform_data.get("department_ids", [])
-                            )
-                            logger.info(f"【工具执行】命中确定性创建通知流程，参数: {{'token': '***', 'title': '{inform_data['title']}'}}")
-                            direct_result = await create_inform.ainvoke({"token": token, "inform_data": inform_request})
-                            return {
-                                "success": True,
-                                "output": direct_result,
-                                "steps": [{
-                                    "tool": "create_inform",
-                                    "tool_input": {"token": token, "title": inform_data["title"]},
-                                    "tool_output": direct_result,
-                                    "thought": "使用确定性流程直接创建通知，避免工具参数JSON格式错误。"
-                                }],
-                                "tool_used": ["create_inform"]
-                            }
-                    except Exception as e:
-                        logger.warning(f"确定性创建通知流程失败: {str(e)}")
-                        # 失败后继续走通用流程
-
-            # 对“更新考勤记录”场景走确定性调用
-            if "update_attendance" in task_description or "更新考勤" in task_description:
-                token = params.get("jwt_token") or params.get("token")
-                record_id = params.get("record_id") or params.get("id")
-                update_data = params.get("update_data") or params.get("status")
-                if token and record_id:
-                    try:
-                        from app.schemas.oa_schemas import AttendanceUpdateRequest
-                        # 构建更新数据
-                        if isinstance(update_data, dict):
-                            attendance_update = AttendanceUpdateRequest(**update_data)
-                        elif isinstance(update_data, str):
-                            # 简单处理：如果只是状态字符串
-                            attendance_update = AttendanceUpdateRequest(status=update_data)
-                        else:
-                            attendance_update = AttendanceUpdateRequest(status="approved" if "通过" in task_description else "rejected")
-                        
-                        logger.info(f"【工具执行】命中确定性更新考勤流程，参数: {{'token': '***', 'record_id': {record_id}}}")
-                        direct_result = await update_attendance_record.ainvoke({"token": token, "record_id": record_id, "update_data": attendance_update})
+    @staticmethod
+    def _parse_input(input_data: Dict[str, Any]) -> tuple[str, Dict[str, Any], Optional[str]]:
+        """解析输入数据，返回 (任务描述, 参数, jwt_token)"""
+        task_description = input_data.get("task_description", "")
+        params = input_data.get("params", {})
+        jwt_token = input_data.get("jwt_token")
+
+        # 如果 params 中没有 jwt_token，但 input_data 中有，则添加到 params
+        if jwt_token and "jwt_token" not in params:
+            params["jwt_token"] = jwt_token
+
+        return task_description, params, jwt_token
+
+    @staticmethod
+    def _resolve_token(params: Dict[str, Any], jwt_token: Optional[str]) -> Optional[str]:
+        """本次调用工具使用的 JWT"""
+        return jwt_token or params.get("jwt_token") or params.get("token") or params.get("auth_token")
+
+    async def _try_deterministic_flows(self, task_description: str, params: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        尝试命中确定性调用流程（请假、创建通知、更新考勤），避免LLM工具参数JSON格式不稳定导致失败
+        :return: 命中时返回执行结果，未命中返回 None，继续走通用Agent流程
+        """
+        # 对“请假申请创建”场景走确定性调用，避免LLM工具参数JSON格式不稳定导致失败。
+        deterministic_leave_args = self._build_leave_tool_args(params)
+        if deterministic_leave_args:
+            logger.info(f"【工具执行】命中确定性请假流程，参数: {deterministic_leave_args}")
+            direct_result = await create_attendance_record.ainvoke(deterministic_leave_args)
+            return {
+                "success": True,
+                "output": direct_result,
+                "steps": [{
+                    "tool": "create_attendance_record",
+                    "tool_input": deterministic_leave_args,
+                    "tool_output": direct_result,
+                    "thought": "使用确定性流程直接创建请假考勤记录，避免工具参数JSON格式错误。"
+                }],
+                "tool_used": ["create_attendance_record"]
+            }
+
+        # 对“创建通知”场景走确定性调用
+        if "create_inform" in task_description or "创建通知" in task_description:
+            token = params.get("jwt_token") or params.get("token")
+            inform_data = params.get("inform_data") or params.get("notification_data")
+            if token and inform_data:
+                try:
+                    # 确保inform_data是字典格式
+                    if isinstance(inform_data, str):
+                        inform_data = json.loads(inform_data)
+
+                    # 验证必需字段
+                    if all(key in inform_data for key in ["title", "content"]):
+                        from app.schemas.oa_schemas import InformCreateRequest
+                        inform_request = InformCreateRequest(
+                            title=inform_data["title"],
+                            content=inform_data["content"],
+                            public=inform_data.get("public", False),
+                            department_ids=inform_data.get("department_ids", [])
+                        )
+                        logger.info(f"【工具执行】命中确定性创建通知流程，参数: {{'token': '***', 'title': '{inform_data['title']}'}}")
+                        direct_result = await create_inform.ainvoke({"token": token, "inform_data": inform_request})
                         return {
                             "success": True,
                             "output": direct_result,
                             "steps": [{
-                                "tool": "update_attendance_record",
-                                "tool_input": {"token": token, "record_id": record_id},
+                                "tool": "create_inform",
+                                "tool_input": {"token": token, "title": inform_data["title"]},
                                 "tool_output": direct_result,
-                                "thought": "使用确定性流程直接更新考勤记录，避免工具参数JSON格式错误。"
+                                "thought": "使用确定性流程直接创建通知，避免工具参数JSON格式错误。"
                             }],
-                            "tool_used": ["update_attendance_record"]
+                            "tool_used": ["create_inform"]
                         }
-                    except Exception as e:
-                        logger.warning(f"确定性更新考勤流程失败: {str(e)}")
-                        # 失败后继续走通用流程
-
-            # 每次请求创建全新的 executor，避免跨会话状态污染
-            agent_executor = self._create_agent_executor(jwt_token)
-
-            # 构建工具调用输入：附带严格JSON参数块，减少模型生成非法arguments的概率
-            tool_input = task_description
-            if params:
-                strict_json_params = self._build_strict_json_block(params)
-                tool_input += (
-                    "\n参数（严格JSON，仅可使用该格式组装工具arguments）：\n"
-                    f"{strict_json_params}"
-                )
+                except Exception as e:
+                    logger.warning(f"确定性创建通知流程失败: {str(e)}")
+                    # 失败后继续走通用流程
+
+        # 对“更新考勤记录”场景走确定性调用
+        if "update_attendance" in task_description or "更新考勤" in task_description:
+            token = params.get("jwt_token") or params.get("token")
+            record_id = params.get("record_id") or params.get("id")
+            update_data = params.get("update_data") or params.get("status")
+            if token and record_id:
+                try:
+                    from app.schemas.oa_schemas import AttendanceUpdateRequest
+                    # 构建更新数据
+                    if isinstance(update_data, dict):
+                        attendance_update = AttendanceUpdateRequest(**update_data)
+                    elif isinstance(update_data, str):
+                        # 简单处理：如果只是状态字符串
+                        attendance_update = AttendanceUpdateRequest(status=update_data)
+                    else:
+                        attendance_update = AttendanceUpdateRequest(status="approved" if "通过" in task_description else "rejected")
+
+                    logger.info(f"【工具执行】命中确定性更新考勤流程，参数: {{'token': '***', 'record_id': {record_id}}}")
+                    direct_result = await update_attendance_record.ainvoke({"token": token, "record_id": record_id, "update_data": attendance_update})
+                    return {
+                        "success": True,
+                        "output": direct_result,
+                        "steps": [{
+                            "tool": "update_attendance_record",
+                            "tool_input": {"token": token, "record_id": record_id},
+                            "tool_output": direct_result,
+                            "thought": "使用确定性流程直接更新考勤记录，避免工具参数JSON格式错误。"
+                        }],
+                        "tool_used": ["update_attendance_record"]
+                    }
+                except Exception as e:
+                    logger.warning(f"确定性更新考勤流程失败: {str(e)}")
+                    # 失败后继续走通用流程
+
+        return None
+
+    def _build_tool_input(self, task_description: str, params: Dict[str, Any]) -> str:
+        """构建工具调用输入：附带严格JSON参数块，减少模型生成非法arguments的概率（身份令牌不写入输入）"""
+        tool_input = task_description
+        params = {key: value for key, value in params.items() if key not in _SECRET_PARAMS}
+        if params:
+            strict_json_params = self._build_strict_json_block(params)
+            tool_input += (
+                "\n参数（严格JSON，仅可使用该格式组装工具arguments）：\n"
+                f"{strict_json_params}"
+            )
+        return tool_input
+
+    @staticmethod
+    def _build_executor_result(result: Dict[str, Any]) -> Dict[str, Any]:
+        """将 AgentExecutor 的输出转换为统一的执行结果"""
+        output = result.get("output", "")
+        intermediate_steps = result.get("intermediate_steps", [])
+
+        # 记录工具调用步骤
+        steps = []
+        for action, observation in intermediate_steps:
+            steps.append({
+                "tool": action.tool,
+                "tool_input": action.tool_input,
+                "tool_output": observation,
+                "thought": action.log
+            })
+
+        logger.info(f"【工具执行】成功执行工具，输出: {output[:100]}...")
+
+        return {
+            "success": True,
+            "output": output,
+            "steps": steps,
+            "tool_used": [step["tool"] for step in steps]
+        }
+
+    async def process(self, input_data: Dict[str, Any]) -> Dict[str, Any]:
+        """处理输入数据，执行工具调用"""
+        try:
+            task_description, params, jwt_token = self._parse_input(input_data)
+
+            direct_result = await self._try_deterministic_flows(task_description, params)
+            if direct_result:
+                return direct_result
+
+            # 复用按工具集缓存的执行器；身份令牌只通过上下文传给工具，不进入提示词
+            set_tool_token(self._resolve_token(params, jwt_token))
+            agent_executor = self._get_agent_executor()
+
+            tool_input = self._build_tool_input(task_description, params)
             
             logger.info(f"【工具执行】开始执行工具，输入: {tool_input}")
-            logger.info(f"【工具执行】参数: {params}")
 
             # 执行工具调用
             max_retries = 2
@@ -640,19 +706,19 @@ class ToolAgent(BaseAgent):
                             + "2. 所有键名和字符串值必须使用双引号包围\n"
                             + "3. 不允许出现注释、单引号、尾逗号\n"
                             + "4. 仅从上面的'参数（严格JSON）'中选取字段构造arguments\n"
-                            + "5. 创建考勤记录仅需: token, type, start_time, end_time, reason\n"
-                            + "6. 示例格式：{\"token\": \"your_token\", \"type\": 1, \"start_time\": \"2026-04-26T00:00:00\", \"end_time\": \"2026-04-27T23:59:59\", \"reason\": \"请假原因\"}\n"
+                            + "5. 创建考勤记录仅需: type, start_time, end_time, reason（token 由系统自动注入）\n"
+                            + "6. 示例格式：{\"type\": 1, \"start_time\": \"2026-04-26T00:00:00\", \"end_time\": \"2026-04-27T23:59:59\", \"reason\": \"请假原因\"}\n"
                         )
                         tool_input = retry_input
                     elif "缺少必需参数" in error_str:
                         logger.warning(f"缺少必需参数，尝试重新执行 (尝试 {retry_count}/{max_retries})")
                         # 重新构建工具输入，强调必需参数
-                        retry_input = tool_input + "\n\n重要提示：\n创建考勤记录时，必须提供以下所有参数：\n- token: JWT token字符串\n- type: 考勤类型ID（整数）\n- start_time: 开始时间（格式：2026-04-26T00:00:00）\n- end_time: 结束时间（格式：2026-04-27T23:59:59）\n- reason: 请假原因（字符串）\n\n审批人由系统自动获取，无需传入responser参数。"
+                        retry_input = tool_input + "\n\n重要提示：\n创建考勤记录时，必须提供以下所有参数（token 由系统自动注入）：\n- type: 考勤类型ID（整数）\n- start_time: 开始时间（格式：2026-04-26T00:00:00）\n- end_time: 结束时间（格式：2026-04-27T23:59:59）\n- reason: 请假原因（字符串）\n\n审批人由系统自动获取，无需传入responser参数。"
                         tool_input = retry_input
                     elif "400" in error_str or "InvalidParameter" in error_str:
                         logger.warning(f"参数错误，尝试重新执行 (尝试 {retry_count}/{max_retries})")
                         # 重新构建工具输入，强调参数格式
-                        retry_input = tool_input + "\n\n重要提示：\n请确保所有参数格式正确：\n- token: 必须是有效的JWT字符串\n- type: 必须是整数类型的考勤类型ID\n- start_time和end_time: 必须是ISO格式的时间字符串\n- reason: 必须是非空字符串\n"
+                        retry_input = tool_input + "\n\n重要提示：\n请确保所有参数格式正确：\n- type: 必须是整数类型的考勤类型ID\n- start_time和end_time: 必须是ISO格式的时间字符串\n- reason: 必须是非空字符串\n"
                         tool_input = retry_input
                     else:
                         # 其他错误，直接抛出
@@ -669,27 +735,7 @@ class ToolAgent(BaseAgent):
                 logger.error(f"【工具执行】所有尝试都失败，执行失败: {str(last_error)}")
                 raise last_error
             
-            output = result.get("output", "")
-            intermediate_steps = result.get("intermediate_steps", [])
-            
-            # 记录工具调用步骤
-            steps = []
-            for action, observation in intermediate_steps:
-                steps.append({
-                    "tool": action.tool,
-                    "tool_input": action.tool_input,
-                    "tool_output": observation,
-                    "thought": action.log
-                })
-            
-            logger.info(f"【工具执行】成功执行工具，输出: {output[:100]}...")
-            
-            return {
-                "success": True,
-                "output": output,
-                "steps": steps,
-                "tool_used": [step["tool"] for step in steps]
-            }
+            return self._build_executor_result(result)
             
         except Exception as e:
             logger.error(f"【工具执行】失败: {str(e)}", exc_info=True)
@@ -697,6 +743,59 @@ class ToolAgent(BaseAgent):
                 "success": False,
                 "error": str(e)
             }
+
+    async def process_stream(self, input_data: Dict[str, Any]) -> AsyncGenerator[Dict[str, Any], None]:
+        """
+        流式执行工具调用，实时转发大模型回答的 token
+        确定性流程没有大模型输出，直接产出结果；流式执行失败且尚未输出任何 token 时，退回 process 的重试流程
+        :param input_data: 输入数据
+        :return: 异步生成器，产出 {"type": "token", "content": str}，最后产出 {"type": "result", "result": 与 process 相同的结果}
+        """
+        emitted = False
+        try:
+            task_description, params, jwt_token = self._parse_input(input_data)
+
+            direct_result = await self._try_deterministic_flows(task_description, params)
+            if direct_result:
+                yield {"type": "result", "result": direct_result}
+                return
+
+            set_tool_token(self._resolve_token(params, jwt_token))
+            agent_executor = self._get_agent_executor()
+            tool_input = self._build_tool_input(task_description, params)
+            logger.info(f"【工具执行】开始流式执行工具，输入: {tool_input}")
+
+            executor_output = None
+            async for event in agent_executor.astream_events(
+                    {"input": tool_input, "chat_history": []},
+                    version="v2",
+            ):
+                kind = event.get("event")
+                if kind == "on_chat_model_stream":
+                    chunk = event["data"].get("chunk")
+                    # 工具调用参数的增量不属于回答内容，不转发
+                    if chunk is None or getattr(chunk, "tool_call_chunks", None):
+                        continue
+                    content = chunk.content if isinstance(chunk.content, str) else ""
+                    if content:
+                        emitted = True
+                        yield {"type": "token", "content": content}
+                elif kind == "on_chain_end" and event.get("name") == "AgentExecutor":
+                    executor_output = event["data"].get("output")
+
+            if not isinstance(executor_output, dict):
+                raise RuntimeError("AgentExecutor 未返回执行结果")
+
+            yield {"type": "result", "result": self._build_executor_result(executor_output)}
+
+        except Exception as e:
+            if emitted:
+                logger.error(f"【工具执行】流式执行中断: {str(e)}", exc_info=True)
+                yield {"type": "result", "result": {"success": False, "error": str(e)}}
+                return
+            logger.warning(f"【工具执行】流式执行失败，退回非流式重试流程: {str(e)}")
+            yield {"type": "result", "result": await self.process(input_data)}
+
     
     def can_handle(self, task_type: str) -> bool:
         """判断是否能够处理特定类型的任务"""
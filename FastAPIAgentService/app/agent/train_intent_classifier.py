@@ -0,0 +1,85 @@
+"""
+从线上流量学习意图分类的示例
+
+读取 agent.yaml 中 intent_classifier.traffic_log_path 记录的大模型任务分解结果（含轮转出的旧文件）：
+只有一个子任务且任务类型是已配置意图的请求作为该意图的示例，有多个子任务的请求作为复合请求的示例；
+同一输入出现多次时按多数结果标注。与已有示例（内置 + 已学习）重复的输入不再加入。
+新示例追加到 learned_examples_path，重启服务后生效。
+
+用法：
+    python -m app.agent.train_intent_classifier
+    python -m app.agent.train_intent_classifier --dry-run --min-count 2
+"""
+import argparse
+import json
+import os
+from collections import Counter, defaultdict
+
+from app.agent.intent_classifier import COMPOUND_INTENT, IntentClassifier, load_examples, traffic_log_files
+
+
+def label_traffic(records: list, intents: dict, min_count: int) -> tuple[dict, Counter]:
+    """
+    为流量记录标注意图
+    :param records: 流量记录 [{"text", "task_type", "subtask_types"}]
+    :param intents: 已配置的意图
+    :param min_count: 同一输入的多数结果至少出现的次数
+    :return: ({输入: 意图}, 未配置意图的任务类型及次数)
+    """
+    votes = defaultdict(Counter)
+    unknown_types = Counter()
+    for record in records:
+        subtask_types = record.get("subtask_types") or []
+        if len(subtask_types) > 1:
+            votes[record["text"]][COMPOUND_INTENT] += 1
+        elif len(subtask_types) == 1 and subtask_types[0] in intents:
+            votes[record["text"]][subtask_types[0]] += 1
+        elif len(subtask_types) == 1:
+            unknown_types[subtask_types[0]] += 1
+
+    labels = {}
+    for text, counter in votes.items():
+        intent, count = counter.most_common(1)[0]
+        if count >= min_count:
+            labels[text] = intent
+    return labels, unknown_types
+
+
+def main():
+    parser = argparse.ArgumentParser(description="从大模型任务分解的记录中学习意图分类示例")
+    parser.add_argument("--min-count", type=int, default=1, help="同一输入的多数结果至少出现的次数")
+    parser.add_argument("--dry-run", action="store_true", help="只输出统计，不写入示例文件")
+    args = parser.parse_args()
+
+    classifier = IntentClassifier()
+    records = [
+        record
+        for path in traffic_log_files(classifier.traffic_log_path, classifier.traffic_log_backups)
+        for record in load_examples(path)
+    ]
+    labels, unknown_types = label_traffic(records, classifier.intents, args.min_count)
+
+    existing = {
+        example["text"]
+        for example in load_examples(classifier.examples_path) + load_examples(classifier.learned_examples_path)
+    }
+    new_examples = [{"text": text, "intent": intent} for text, intent in labels.items() if text not in existing]
+
+    print(f"流量记录: {len(records)} 条，可标注的输入: {len(labels)} 条，新示例: {len(new_examples)} 条")
+    for intent, count in Counter(example["intent"] for example in new_examples).most_common():
+        print(f"  {intent}: {count}")
+    if unknown_types:
+        unknown = "，".join(f"{task_type} {count} 次" for task_type, count in unknown_types.most_common())
+        print(f"未配置为意图的任务类型（可在 agent.yaml 的 intents 中添加）: {unknown}")
+    if args.dry_run or not new_examples:
+        return
+
+    os.makedirs(os.path.dirname(classifier.learned_examples_path), exist_ok=True)
+    with open(classifier.learned_examples_path, "a", encoding="utf-8") as file:
+        for example in new_examples:
+            file.write(json.dumps(example, ensure_ascii=False) + "\n")
+    print(f"已写入 {classifier.learned_examples_path}，重启服务后生效")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+import asyncio
+import hashlib
+import os
+import sqlite3
+import threading
+from typing import Dict, List
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from app.core.logger_handler import logger
+
+# SQLite 单条语句的参数数量有限制，分批查询
+_LOOKUP_BATCH_SIZE = 500
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    带持久化缓存的嵌入模型包装器
+
+    - 以 (模型名, sha256(文本)) 为键，向量以 float16 存入 SQLite，相同文本只向模型请求一次
+    - 对 embed_documents / embed_query 及其异步版本透明生效，可直接替换原嵌入模型
+    - 为保证命中与未命中时结果一致，新计算的向量同样按 float16 精度返回
+    """
+
+    def __init__(self, embeddings: Embeddings, model_name: str, db_path: str):
+        """
+        :param embeddings: 被包装的嵌入模型
+        :param model_name: 模型名称，作为缓存键的一部分，换模型后自动不再命中旧向量
+        :param db_path: SQLite 文件路径
+        """
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.db_path = db_path
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "model TEXT NOT NULL, text_hash BLOB NOT NULL, vector BLOB NOT NULL, "
+            "PRIMARY KEY (model, text_hash)) WITHOUT ROWID"
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def _hash(text: str) -> bytes:
+        return hashlib.sha256(text.encode("utf-8")).digest()
+
+    @staticmethod
+    def _to_blob(vector: List[float]) -> bytes:
+        return np.asarray(vector, dtype=np.float16).tobytes()
+
+    @staticmethod
+    def _from_blob(blob: bytes) -> List[float]:
+        return np.frombuffer(blob, dtype=np.float16).astype(np.float32).tolist()
+
+    def _lookup(self, hashes: List[bytes]) -> Dict[bytes, List[float]]:
+        """批量读取缓存的向量"""
+        found = {}
+        with self._lock:
+            for start in range(0, len(hashes), _LOOKUP_BATCH_SIZE):
+                batch = hashes[start:start + _LOOKUP_BATCH_SIZE]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND text_hash IN ({placeholders})",
+                    (self.model_name, *batch),
+                ).fetchall()
+                found.update((text_hash, self._from_blob(vector)) for text_hash, vector in rows)
+        return found
+
+    def _store(self, items: Dict[bytes, List[float]]) -> Dict[bytes, List[float]]:
+        """写入新计算的向量，返回 float16 精度的向量"""
+        blobs = {text_hash: self._to_blob(vector) for text_hash, vector in items.items()}
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, text_hash, vector) VALUES (?, ?, ?)",
+                [(self.model_name, text_hash, blob) for text_hash, blob in blobs.items()],
+            )
+            self._conn.commit()
+        return {text_hash: self._from_blob(blob) for text_hash, blob in blobs.items()}
+
+    def _plan(self, texts: List[str]):
+        """计算文本哈希并查缓存，返回 (哈希列表, 已缓存向量, 需要计算的去重文本)"""
+        hashes = [self._hash(text) for text in texts]
+        cached = self._lookup(list(set(hashes)))
+        missing: Dict[bytes, str] = {}
+        for text_hash, text in zip(hashes, texts):
+            if text_hash not in cached:
+                missing.setdefault(text_hash, text)
+        with self._lock:
+            self.hits += len(texts) - sum(1 for text_hash in hashes if text_hash in missing)
+            self.misses += len(missing)
+        return hashes, cached, missing
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        hashes, cached, missing = self._plan(texts)
+        if missing:
+            vectors = self.embeddings.embed_documents(list(missing.values()))
+            cached.update(self._store(dict(zip(missing.keys(), vectors))))
+        return [cached[text_hash] for text_hash in hashes]
+
+    def embed_query(self, text: str) -> List[float]:
+        hashes, cached, missing = self._plan([text])
+        if missing:
+            cached.update(self._store({hashes[0]: self.embeddings.embed_query(text)}))
+        return cached[hashes[0]]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        hashes, cached, missing = await asyncio.to_thread(self._plan, texts)
+        if missing:
+            vectors = await self.embeddings.aembed_documents(list(missing.values()))
+            cached.update(await asyncio.to_thread(self._store, dict(zip(missing.keys(), vectors))))
+        return [cached[text_hash] for text_hash in hashes]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        hashes, cached, missing = await asyncio.to_thread(self._plan, [text])
+        if missing:
+            vector = await self.embeddings.aembed_query(text)
+            cached.update(await asyncio.to_thread(self._store, {hashes[0]: vector}))
+        return cached[hashes[0]]
+
+    def stats(self) -> Dict[str, object]:
+        """缓存统计：命中/未命中次数与命中率"""
+        total = self.hits + self.misses
+        return {
+            "model": self.model_name,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+def wrap_with_embedding_cache(embeddings: Embeddings, model_name: str, db_path: str) -> Embeddings:
+    """
+    为嵌入模型加上持久化缓存，缓存库无法打开时返回原模型
+    :param embeddings: 嵌入模型
+    :param model_name: 模型名称
+    :param db_path: SQLite 文件路径
+    :return: 包装后的嵌入模型
+    """
+    try:
+        return CachedEmbeddings(embeddings, model_name, db_path)
+    except Exception as e:
+        logger.error(f"【嵌入缓存】初始化失败，不使用缓存: {e}")
+        return embeddings
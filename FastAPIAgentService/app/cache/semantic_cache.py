@@ -0,0 +1,161 @@
+import copy
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from app.core.logger_handler import logger
+
+
+class SemanticAnswerCache:
+    """
+    语义答案缓存（进程内）
+
+    - 以查询向量为键，最近邻相似度不低于阈值即命中，相近的问法共享同一份答案
+    - 每条缓存记录所属的向量库版本，版本变化（文档入库/删除）时整体失效
+    - 每条缓存记录所属的分区（检索范围），只在同一分区内查找，不同用户/部门可见的文档不同，答案不能共享
+    - 支持 TTL 过期与 LRU 淘汰，并统计命中率
+    """
+
+    def __init__(
+            self,
+            embed_model: Embeddings,
+            similarity_threshold: float = 0.92,
+            ttl_seconds: int = 3600,
+            max_entries: int = 1000,
+    ):
+        """
+        :param embed_model: 嵌入模型
+        :param similarity_threshold: 命中所需的最小余弦相似度
+        :param ttl_seconds: 缓存有效期（秒）
+        :param max_entries: 最大缓存条数，超过后按 LRU 淘汰
+        """
+        self.embed_model = embed_model
+        self.similarity_threshold = similarity_threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._version = None
+        # 向量矩阵按槽位存放，_entries 的顺序即 LRU 顺序（末尾为最近使用）
+        self._matrix: Optional[np.ndarray] = None
+        self._valid = np.zeros(max_entries, dtype=bool)
+        self._partitions = np.full(max_entries, "", dtype=object)
+        self._entries: "OrderedDict[int, Dict[str, Any]]" = OrderedDict()
+        self._free_slots: List[int] = list(range(max_entries - 1, -1, -1))
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.stale_puts = 0
+
+    async def embed(self, query: str) -> np.ndarray:
+        """
+        计算查询的归一化向量
+        :param query: 查询语句
+        :return: 单位向量
+        """
+        vector = np.asarray(await self.embed_model.aembed_query(query), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _check_version(self, version: int):
+        """向量库版本变化时清空缓存"""
+        if version != self._version:
+            if self._entries:
+                self.invalidations += 1
+                logger.info(f"【语义缓存】向量库版本变化 {self._version} -> {version}，清空 {len(self._entries)} 条缓存")
+            self.clear()
+            self._version = version
+
+    def _release(self, slot: int):
+        self._entries.pop(slot, None)
+        self._valid[slot] = False
+        self._free_slots.append(slot)
+
+    def get(self, embedding: np.ndarray, version: int, partition: str = "") -> Optional[Dict[str, Any]]:
+        """
+        查找语义最相近的缓存答案
+        :param embedding: 查询向量（embed 的返回值）
+        :param version: 当前向量库版本
+        :param partition: 缓存分区（检索范围），只在同一分区内查找
+        :return: 命中时返回缓存的结果副本，否则返回 None
+        """
+        self._check_version(version)
+        if not self._entries or self._matrix is None:
+            self.misses += 1
+            return None
+
+        similarities = self._matrix @ embedding
+        similarities[~self._valid | (self._partitions != partition)] = -np.inf
+        slot = int(np.argmax(similarities))
+        similarity = float(similarities[slot])
+        entry = self._entries.get(slot)
+        if entry is None or similarity < self.similarity_threshold:
+            self.misses += 1
+            return None
+        if entry["expires_at"] < time.monotonic():
+            self._release(slot)
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(slot)
+        self.hits += 1
+        logger.info(f"【语义缓存】命中，相似度: {similarity:.4f}，缓存问题: {entry['query']}")
+        return copy.deepcopy(entry["result"])
+
+    def put(self, embedding: np.ndarray, query: str, result: Dict[str, Any], version: int, partition: str = "",
+            current_version: Optional[int] = None):
+        """
+        写入缓存
+        :param embedding: 查询向量（embed 的返回值）
+        :param query: 查询语句
+        :param result: 要缓存的结果
+        :param version: 生成该结果时的向量库版本
+        :param partition: 缓存分区（检索范围）
+        :param current_version: 写入时的向量库版本（版本由多个进程共享时，可能已被其他进程更新）
+        """
+        if current_version is not None:
+            self._check_version(current_version)
+        if self._version is not None and version < self._version:
+            # 生成结果期间向量库已更新，结果可能已过期：直接丢弃，不回退版本、不清空新版本的缓存
+            self.stale_puts += 1
+            return
+        self._check_version(version)
+        if self._matrix is None:
+            self._matrix = np.zeros((self.max_entries, embedding.shape[0]), dtype=np.float32)
+        if not self._free_slots:
+            lru_slot = next(iter(self._entries))
+            self._release(lru_slot)
+            self.evictions += 1
+
+        slot = self._free_slots.pop()
+        self._matrix[slot] = embedding
+        self._valid[slot] = True
+        self._partitions[slot] = partition
+        self._entries[slot] = {
+            "query": query,
+            "result": copy.deepcopy(result),
+            "expires_at": time.monotonic() + self.ttl_seconds,
+        }
+
+    def clear(self):
+        """清空缓存"""
+        self._entries.clear()
+        self._valid[:] = False
+        self._free_slots = list(range(self.max_entries - 1, -1, -1))
+
+    def stats(self) -> Dict[str, Any]:
+        """缓存统计：条数、命中/未命中次数、命中率、淘汰与失效次数、丢弃的过期写入次数"""
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_entries": self.max_entries,
+            "version": self._version,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "stale_puts": self.stale_puts,
+        }
@@ -85,4 +85,15 @@ async def set_redis_cache(key: str, value: Any, expire: int = 3600) -> bool:
 
     except Exception as e:
         print(f"设置redis缓存失败: {e}")
-        return False
\ No newline at end of file
+        return False
+
+
+async def delete_redis_cache(key: str) -> bool:
+    """根据key删除redis缓存"""
+    try:
+        redis_client = await connect_redis()
+        await redis_client.delete(key)
+        return True
+    except Exception as e:
+        print(f"删除redis缓存失败: {e}")
+        return False
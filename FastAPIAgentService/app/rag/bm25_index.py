@@ -0,0 +1,800 @@
+import heapq
+import json
+import math
+import mmap
+import os
+import re
+import shutil
+import sys
+import threading
+import time
+import uuid
+from array import array
+from collections import Counter
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Tuple
+
+# 将根目录添加到系统路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from app.core.logger_handler import logger
+from app.utils.config import chroma_config
+from app.utils.path_tool import get_abstract_path
+
+try:
+    import fcntl
+except ImportError:  # Windows 下没有 fcntl，只在进程内加锁
+    fcntl = None
+
+# 中文按字切分（单字 + 相邻二元组），英文/数字按单词切分
+_CJK_RANGES = "\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff"
+_TOKEN_PATTERN = re.compile(f"[{_CJK_RANGES}]+|[a-z0-9]+(?:[._-][a-z0-9]+)*")
+_CJK_PATTERN = re.compile(f"[{_CJK_RANGES}]")
+
+# 未被 meta.json 引用的段目录超过该时间未修改才视为孤儿段清理（秒）
+ORPHAN_SEGMENT_GRACE_SECONDS = 3600
+# 重新加载时读到的段已被其他进程删除（元数据已更新）时的最大重试次数
+_RELOAD_ATTEMPTS = 5
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    中文友好的分词：连续汉字输出单字与二元组，英文与数字输出小写单词
+    :param text: 原始文本
+    :return: 词项列表
+    """
+    tokens = []
+    for match in _TOKEN_PATTERN.finditer(text.lower()):
+        word = match.group()
+        if _CJK_PATTERN.match(word):
+            tokens.extend(word)
+            tokens.extend(word[i:i + 2] for i in range(len(word) - 1))
+        else:
+            tokens.append(word)
+    return tokens
+
+
+def _write_array(path: str, values: array):
+    with open(path, "wb") as f:
+        values.tofile(f)
+
+
+def _write_json_atomic(path: str, data: Any):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+class _Segment:
+    """
+    只读的索引段，倒排表通过 mmap 映射，不整体加载进内存
+    目录结构：
+        lexicon.json       词项 -> [倒排表起始位置, 文档频率]
+        postings_doc.bin   段内文档序号（uint32）
+        postings_tf.bin    词频（uint16）
+        doc_len.bin        文档长度（uint32）
+        doc_offset.bin     docs.jsonl 中每个文档的起始字节（uint64）
+        docs.jsonl         文档内容与元数据
+    """
+
+    def __init__(self, path: str, base_id: int):
+        self.path = path
+        self.base_id = base_id
+        # 引用计数：索引的当前快照持有一个引用，每个进行中的查询各持有一个引用
+        self._refs = 1
+        self._refs_lock = threading.Lock()
+        self._remove_on_close = False
+        with open(os.path.join(path, "lexicon.json"), "r", encoding="utf-8") as f:
+            self.lexicon: Dict[str, List[int]] = json.load(f)
+        self._maps = []
+        self._views = []
+        self.postings_doc = self._map_array(os.path.join(path, "postings_doc.bin"), "I")
+        self.postings_tf = self._map_array(os.path.join(path, "postings_tf.bin"), "H")
+        self.doc_len = self._map_array(os.path.join(path, "doc_len.bin"), "I")
+        self.doc_offset = self._map_array(os.path.join(path, "doc_offset.bin"), "Q")
+        self._docs_file = open(os.path.join(path, "docs.jsonl"), "rb")
+        self._docs = mmap.mmap(self._docs_file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.doc_count = len(self.doc_len)
+
+    def _map_array(self, path: str, typecode: str):
+        """将二进制数组文件映射为只读 memoryview，空文件返回空数组"""
+        if os.path.getsize(path) == 0:
+            return array(typecode)
+        with open(path, "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(mapped).cast(typecode)
+        self._maps.append(mapped)
+        self._views.append(view)
+        return view
+
+    def postings(self, term: str):
+        """获取词项的倒排表（段内文档序号, 词频）"""
+        entry = self.lexicon.get(term)
+        if not entry:
+            return None
+        start, df = entry
+        return self.postings_doc[start:start + df], self.postings_tf[start:start + df]
+
+    def get_document(self, local_id: int) -> Dict[str, Any]:
+        """读取段内第 local_id 个文档"""
+        start = self.doc_offset[local_id]
+        end = self._docs.find(b"\n", start)
+        return json.loads(self._docs[start:end if end != -1 else len(self._docs)])
+
+    def iter_documents(self):
+        """顺序遍历段内所有文档，返回 (全局文档ID, 文档)"""
+        for local_id in range(self.doc_count):
+            yield self.base_id + local_id, self.get_document(local_id)
+
+    @staticmethod
+    def write(path: str, documents: List[Document]) -> int:
+        """
+        将文档写成一个新的索引段
+        :param path: 段目录
+        :param documents: 文档列表
+        :return: 段内所有文档的总长度（词项数）
+        """
+        os.makedirs(path, exist_ok=True)
+        inverted: Dict[str, List[tuple]] = {}
+        doc_len = array("I")
+        doc_offset = array("Q")
+        offset = 0
+        with open(os.path.join(path, "docs.jsonl"), "wb") as docs_file:
+            for local_id, doc in enumerate(documents):
+                term_freqs = Counter(tokenize(doc.page_content))
+                doc_len.append(sum(term_freqs.values()))
+                for term, tf in term_freqs.items():
+                    inverted.setdefault(term, []).append((local_id, min(tf, 0xFFFF)))
+
+                record = {"page_content": doc.page_content, "metadata": doc.metadata}
+                if doc.id:
+                    record["id"] = doc.id
+                line = json.dumps(record, ensure_ascii=False).encode("utf-8") + b"\n"
+                doc_offset.append(offset)
+                docs_file.write(line)
+                offset += len(line)
+
+        lexicon = {}
+        postings_doc = array("I")
+        postings_tf = array("H")
+        for term in sorted(inverted):
+            entries = inverted[term]
+            lexicon[term] = [len(postings_doc), len(entries)]
+            for local_id, tf in entries:
+                postings_doc.append(local_id)
+                postings_tf.append(tf)
+
+        _write_array(os.path.join(path, "postings_doc.bin"), postings_doc)
+        _write_array(os.path.join(path, "postings_tf.bin"), postings_tf)
+        _write_array(os.path.join(path, "doc_len.bin"), doc_len)
+        _write_array(os.path.join(path, "doc_offset.bin"), doc_offset)
+        _write_json_atomic(os.path.join(path, "lexicon.json"), lexicon)
+        return sum(doc_len)
+
+    def acquire(self):
+        """查询开始前增加引用，保证查询期间映射不被释放"""
+        with self._refs_lock:
+            self._refs += 1
+
+    def release(self):
+        """释放一个引用；最后一个引用释放后关闭映射，已退役的段同时删除目录"""
+        with self._refs_lock:
+            self._refs -= 1
+            last = self._refs == 0
+        if last:
+            self._close()
+            if self._remove_on_close:
+                shutil.rmtree(self.path, ignore_errors=True)
+
+    def retire(self, remove: bool):
+        """
+        段不再属于索引的当前快照：释放快照持有的引用，进行中的查询结束后才关闭
+        :param remove: 关闭后是否删除段目录（合并或重建替换掉的段）
+        """
+        self._remove_on_close = remove
+        self.release()
+
+    def _close(self):
+        """释放映射（仍有切片未释放时交给垃圾回收处理）"""
+        for view in self._views:
+            view.release()
+        for mapped in self._maps + [self._docs]:
+            try:
+                mapped.close()
+            except BufferError:
+                pass
+        self._docs_file.close()
+
+
+class BM25Index:
+    """
+    持久化、可增量更新的 BM25 稀疏索引
+    - 每次新增文档写成一个不可变的段，删除文档只记录墓碑，查询时跳过
+    - 段数量或墓碑比例超过阈值时合并为一个段
+    - 写操作生成新的快照后整体替换，查询始终读取一致的快照，无需等待写操作
+    - 查询期间持有所读快照中各段的引用，被替换的旧段在最后一个查询结束后才关闭和删除
+    - 查询只读取命中词项的倒排表，耗时与语料规模无关
+    - 多个进程（uvicorn worker）共用同一目录：写操作持有跨进程文件锁，加锁后先重新读取 meta.json 再分配段号和提交；
+      查询前检查 meta.json 是否变化，其他进程写入后自动切换到新快照
+    """
+
+    def __init__(self, index_dir: str, k1: float = 1.5, b: float = 0.75, max_segments: int = 8):
+        """
+        :param index_dir: 索引目录
+        :param k1: BM25 词频饱和参数
+        :param b: BM25 文档长度归一化参数
+        :param max_segments: 段数量上限，超过后自动合并
+        """
+        self.index_dir = index_dir
+        self.k1 = k1
+        self.b = b
+        self.max_segments = max_segments
+        self._lock = threading.RLock()
+        self._lock_depth = 0
+        # 保护快照切换与查询获取段引用，两者互斥，避免查询拿到即将关闭的段
+        self._snapshot_lock = threading.Lock()
+        self._loaded = False
+        # 已加载的 meta.json 版本 (inode, 修改时间, 大小)，查询前据此判断其他进程是否写入过；
+        # inode 会被复用、修改时间精度有限，写操作加锁后总是读取 meta.json 比较提交ID
+        self._meta_version = None
+        # 当前快照：(段列表, 已删除文档ID集合, 元数据)
+        self._snapshot: tuple = ((), frozenset(), self._empty_meta())
+
+    @property
+    def _meta_path(self) -> str:
+        return os.path.join(self.index_dir, "meta.json")
+
+    @property
+    def doc_count(self) -> int:
+        """有效文档数量"""
+        self.load()
+        _, deleted, meta = self._snapshot
+        return meta["doc_count"] - len(deleted)
+
+    @staticmethod
+    def _empty_meta() -> Dict[str, Any]:
+        # index_id 标识索引目录的这一次创建，分区被删除后重建时不会复用旧目录中同名的段
+        return {"index_id": uuid.uuid4().hex, "next_segment": 0, "segments": [], "doc_count": 0,
+                "total_len": 0, "deleted": [], "deleted_len": 0}
+
+    def _read_meta_version(self) -> Optional[tuple]:
+        try:
+            stat = os.stat(self._meta_path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def load(self):
+        """加载索引（幂等），之后每次调用都会同步其他进程的写入，倒排表以 mmap 方式映射"""
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    os.makedirs(self.index_dir, exist_ok=True)
+                    self._reload_if_changed()
+                    self._remove_orphan_segments(self._snapshot[2])
+                    self._loaded = True
+                    logger.info(f"【BM25索引】加载完成，段数: {len(self._snapshot[0])}, 文档数: {self.doc_count}")
+                    return
+        self._reload_if_changed()
+
+    def _reload_if_changed(self, force: bool = False):
+        """
+        meta.json 变化（首次加载、其他进程写入或删除了索引）时重新加载快照，未变化的段直接复用
+        :param force: 不论文件版本是否变化都读取 meta.json 比较提交ID（持有写锁时）
+        """
+        version = self._read_meta_version()
+        if version == self._meta_version and not force:
+            return
+        with self._lock:
+            for attempt in range(_RELOAD_ATTEMPTS):
+                version = self._read_meta_version()
+                if version == self._meta_version and not force:
+                    return
+                try:
+                    self._load_meta(version)
+                    return
+                except FileNotFoundError:
+                    # 未持有写锁时读到的元数据可能已被其他进程的合并替换、旧段已删除，重新读取最新的元数据
+                    if attempt == _RELOAD_ATTEMPTS - 1:
+                        raise
+
+    def _load_meta(self, version: Optional[tuple]):
+        """按 meta.json 切换快照（持有 _lock 时调用），段文件不存在时抛出 FileNotFoundError 且不改变当前快照"""
+        meta = self._empty_meta()
+        if version is not None:
+            with open(self._meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+        segments, _, current_meta = self._snapshot
+        if version is not None and meta.get("commit_id") and meta.get("commit_id") == current_meta.get("commit_id"):
+            self._meta_version = version
+            return
+        current = {}
+        if meta.get("index_id") == current_meta.get("index_id"):
+            current = {os.path.basename(seg.path): seg for seg in segments}
+        opened = []
+        try:
+            for name, base_id in meta["segments"]:
+                if name not in current:
+                    opened.append(_Segment(os.path.join(self.index_dir, name), base_id))
+        except FileNotFoundError:
+            for segment in opened:
+                segment.retire(remove=False)
+            raise
+        opened_by_name = {os.path.basename(seg.path): seg for seg in opened}
+        next_segments = tuple(current.get(name) or opened_by_name[name] for name, _ in meta["segments"])
+        retired = tuple(seg for seg in segments if seg not in next_segments)
+        # 段目录由删除它的进程负责清理，这里只关闭映射
+        self._swap_snapshot((next_segments, frozenset(meta["deleted"]), meta), retired, remove=False)
+        self._meta_version = version
+
+    def _remove_orphan_segments(self, meta: Dict[str, Any]):
+        """
+        清理未被 meta.json 引用的段目录（写入中断或合并后未能删除的旧段）
+        最近修改过的段可能是其他进程正在写入、尚未提交的段，超过宽限期后才清理
+        """
+        live = {name for name, _ in meta["segments"]}
+        expired_before = time.time() - ORPHAN_SEGMENT_GRACE_SECONDS
+        for name in os.listdir(self.index_dir):
+            path = os.path.join(self.index_dir, name)
+            if not (name.startswith("seg_") and name not in live and os.path.isdir(path)):
+                continue
+            try:
+                if os.path.getmtime(path) < expired_before:
+                    shutil.rmtree(path, ignore_errors=True)
+            except OSError:
+                continue
+
+    def _acquire_snapshot(self) -> tuple:
+        """同步其他进程的写入后获取当前快照，并持有其中各段的引用，用完后调用 _release_snapshot"""
+        self._reload_if_changed()
+        with self._snapshot_lock:
+            snapshot = self._snapshot
+            for segment in snapshot[0]:
+                segment.acquire()
+        return snapshot
+
+    @staticmethod
+    def _release_snapshot(snapshot: tuple):
+        for segment in snapshot[0]:
+            segment.release()
+
+    def _swap_snapshot(self, snapshot: tuple, retired: tuple = (), remove: bool = True):
+        """切换到新的快照，退役的段在进行中的查询结束后关闭"""
+        with self._snapshot_lock:
+            self._snapshot = snapshot
+            for segment in retired:
+                segment.retire(remove)
+
+    @contextmanager
+    def _write_lock(self):
+        """写操作加锁：进程内线程锁 + 跨进程文件锁，加锁后先同步其他进程的写入，再基于最新的元数据分配段号和提交"""
+        with self._lock:
+            if self._lock_depth:
+                # 同一线程内嵌套的写操作（如写入后触发合并）已持有文件锁
+                self._lock_depth += 1
+                try:
+                    yield
+                finally:
+                    self._lock_depth -= 1
+                return
+            os.makedirs(self.index_dir, exist_ok=True)
+            lock_file = open(os.path.join(self.index_dir, ".lock"), "a+")
+            self._lock_depth = 1
+            try:
+                if fcntl is not None:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+                self._reload_if_changed(force=True)
+                yield
+            finally:
+                self._lock_depth = 0
+                if fcntl is not None:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+                lock_file.close()
+
+    def _commit(self, segments: tuple, deleted: frozenset, meta: Dict[str, Any], retired: tuple = ()):
+        """持久化元数据并切换到新的快照，旧段在进行中的查询结束后释放并删除（持有写锁时调用）"""
+        meta["segments"] = [[os.path.basename(seg.path), seg.base_id] for seg in segments]
+        meta["deleted"] = sorted(deleted)
+        meta["commit_id"] = uuid.uuid4().hex
+        _write_json_atomic(self._meta_path, meta)
+        self._swap_snapshot((segments, deleted, meta), retired)
+        self._meta_version = self._read_meta_version()
+
+    def _new_segment(self, documents: List[Document], meta: Dict[str, Any]) -> _Segment:
+        """写入新段并更新（尚未提交的）元数据"""
+        name = f"seg_{meta['next_segment']:06d}"
+        meta["next_segment"] += 1
+        path = os.path.join(self.index_dir, name)
+        total_len = _Segment.write(path, documents)
+        base_id = meta["doc_count"]
+        meta["doc_count"] += len(documents)
+        meta["total_len"] += total_len
+        return _Segment(path, base_id)
+
+    def add_documents(self, documents: List[Document]):
+        """
+        增量添加文档（写入新段）
+        :param documents: 文档列表
+        """
+        if not documents:
+            return
+        self.load()
+        with self._write_lock():
+            segments, deleted, meta = self._snapshot
+            meta = dict(meta)
+            segment = self._new_segment(documents, meta)
+            self._commit(segments + (segment,), deleted, meta)
+            logger.info(f"【BM25索引】新增文档 {len(documents)} 个，当前段数: {len(segments) + 1}")
+            self._maybe_compact()
+
+    def delete(self, where: Dict[str, Any]) -> int:
+        """
+        删除元数据匹配的文档（记录墓碑）
+        :param where: 元数据过滤条件，如 {"user_id": "1"}
+        :return: 删除的文档数量
+        """
+        self.load()
+        with self._write_lock():
+            segments, deleted, meta = self._snapshot
+            removed_ids = set()
+            removed_len = 0
+            for segment in segments:
+                for doc_id, doc in segment.iter_documents():
+                    if doc_id in deleted:
+                        continue
+                    metadata = doc.get("metadata") or {}
+                    if all(metadata.get(key) == value for key, value in where.items()):
+                        removed_ids.add(doc_id)
+                        removed_len += segment.doc_len[doc_id - segment.base_id]
+            if removed_ids:
+                meta = dict(meta, deleted_len=meta["deleted_len"] + removed_len)
+                self._commit(segments, deleted | removed_ids, meta)
+                logger.info(f"【BM25索引】删除文档 {len(removed_ids)} 个，条件: {where}")
+                self._maybe_compact()
+            return len(removed_ids)
+
+    def _maybe_compact(self):
+        """段过多或墓碑比例超过 20% 时合并所有段"""
+        segments, deleted, meta = self._snapshot
+        if len(segments) > self.max_segments or len(deleted) > 0.2 * meta["doc_count"]:
+            self.compact()
+
+    def compact(self):
+        """合并所有段并清除已删除的文档"""
+        self.load()
+        with self._write_lock():
+            segments, deleted, _ = self._snapshot
+            documents = [
+                Document(id=doc.get("id"), page_content=doc["page_content"], metadata=doc.get("metadata") or {})
+                for segment in segments
+                for doc_id, doc in segment.iter_documents()
+                if doc_id not in deleted
+            ]
+            self._replace_all(documents)
+            logger.info(f"【BM25索引】合并完成，文档数: {len(documents)}")
+
+    def rebuild(self, documents: List[Document]):
+        """
+        丢弃现有索引并用给定文档重建
+        :param documents: 文档列表
+        """
+        self.load()
+        with self._write_lock():
+            self._replace_all(documents)
+            logger.info(f"【BM25索引】重建完成，文档数: {len(documents)}")
+
+    def _replace_all(self, documents: List[Document]):
+        """用给定文档生成唯一的新段，替换全部旧段"""
+        retired, _, meta = self._snapshot
+        meta = dict(meta, doc_count=0, total_len=0, deleted_len=0)
+        segments = (self._new_segment(documents, meta),) if documents else ()
+        self._commit(segments, frozenset(), meta, retired)
+
+    def search(self, query: str, k: int = 3, where: Optional[Dict[str, Any]] = None) -> List[Document]:
+        """
+        BM25 检索
+        :param query: 查询文本
+        :param k: 返回文档数量
+        :param where: 可选的元数据过滤条件
+        :return: 按相关度降序排列的文档列表
+        """
+        return [doc for doc, _ in self.search_with_scores(query, k=k, where=where)]
+
+    def search_with_scores(
+            self,
+            query: str,
+            k: int = 3,
+            where: Optional[Dict[str, Any]] = None,
+    ) -> List[Tuple[Document, float]]:
+        """
+        BM25 检索，同时返回相关度分数
+        :param query: 查询文本
+        :param k: 返回文档数量
+        :param where: 可选的元数据过滤条件
+        :return: 按相关度降序排列的 (文档, 分数) 列表
+        """
+        self.load()
+        snapshot = self._acquire_snapshot()
+        try:
+            return self._search_snapshot(snapshot, query, k, where)
+        finally:
+            self._release_snapshot(snapshot)
+
+    def _search_snapshot(
+            self,
+            snapshot: tuple,
+            query: str,
+            k: int,
+            where: Optional[Dict[str, Any]],
+    ) -> List[Tuple[Document, float]]:
+        """在给定快照上检索（调用方持有快照中各段的引用）"""
+        segments, deleted, meta = snapshot
+        live_count = meta["doc_count"] - len(deleted)
+        if live_count <= 0:
+            return []
+        avg_len = max((meta["total_len"] - meta["deleted_len"]) / live_count, 1.0)
+        query_terms = Counter(tokenize(query))
+
+        scores: Dict[int, float] = {}
+        for term, query_tf in query_terms.items():
+            hits = [(segment, segment.postings(term)) for segment in segments]
+            hits = [(segment, posting) for segment, posting in hits if posting]
+            # 文档频率包含尚未合并掉的已删除文档，合并后恢复精确值
+            df = sum(len(posting[0]) for _, posting in hits)
+            if not df:
+                continue
+            idf = math.log((live_count - df + 0.5) / (df + 0.5) + 1)
+            for segment, (local_ids, tfs) in hits:
+                doc_len = segment.doc_len
+                base_id = segment.base_id
+                for local_id, tf in zip(local_ids, tfs):
+                    doc_id = base_id + local_id
+                    if doc_id in deleted:
+                        continue
+                    norm = self.k1 * (1 - self.b + self.b * doc_len[local_id] / avg_len)
+                    scores[doc_id] = scores.get(doc_id, 0.0) + query_tf * idf * tf * (self.k1 + 1) / (tf + norm)
+
+        results = []
+        ranked = heapq.nlargest(len(scores) if where else k, scores.items(), key=lambda item: item[1])
+        for doc_id, score in ranked:
+            segment = self._find_segment(segments, doc_id)
+            doc = segment.get_document(doc_id - segment.base_id)
+            metadata = doc.get("metadata") or {}
+            if where and not all(metadata.get(key) == value for key, value in where.items()):
+                continue
+            results.append((Document(id=doc.get("id"), page_content=doc["page_content"], metadata=metadata), score))
+            if len(results) >= k:
+                break
+        return results
+
+    def close(self):
+        """释放所有段的映射（进行中的查询结束后才关闭），之后再次使用时重新加载"""
+        with self._lock:
+            segments, _, _ = self._snapshot
+            self._swap_snapshot(((), frozenset(), self._empty_meta()), segments, remove=False)
+            self._loaded = False
+            self._meta_version = None
+
+    @staticmethod
+    def _find_segment(segments: tuple, doc_id: int) -> _Segment:
+        for segment in reversed(segments):
+            if doc_id >= segment.base_id:
+                return segment
+        raise KeyError(doc_id)
+
+
+class BM25IndexRetriever(BaseRetriever):
+    """基于持久化 BM25 索引的检索器，可直接放入 EnsembleRetriever"""
+    index: Any
+    k: int = 3
+    where: Optional[Dict[str, Any]] = None
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        return self.index.search(query, k=self.k, where=self.where)
+
+
+PUBLIC_PARTITION = "public"
+USER_PARTITION_PREFIX = "user_"
+DEPARTMENT_PARTITION_PREFIX = "dept_"
+_PARTITION_NAME_PATTERN = re.compile(r"[^0-9A-Za-z_-]")
+
+
+def user_partition(user_id: Any) -> str:
+    """用户个人文档的分区名"""
+    return USER_PARTITION_PREFIX + _PARTITION_NAME_PATTERN.sub("_", str(user_id))
+
+
+def department_partition(department_id: Any) -> str:
+    """部门共享文档的分区名"""
+    return DEPARTMENT_PARTITION_PREFIX + _PARTITION_NAME_PATTERN.sub("_", str(department_id))
+
+
+def partition_of(metadata: Dict[str, Any]) -> str:
+    """
+    文档所属的分区：部门共享的文档按部门分区，用户上传的文档按用户分区，其余（系统知识库）为公共分区
+    :param metadata: 文档元数据
+    :return: 分区名
+    """
+    if metadata.get("visibility") == "department" and metadata.get("department_id"):
+        return department_partition(metadata["department_id"])
+    if metadata.get("user_id"):
+        return user_partition(metadata["user_id"])
+    return PUBLIC_PARTITION
+
+
+class PartitionedBM25Index:
+    """
+    按检索范围分区的 BM25 索引
+    - 公共文档、每个用户、每个部门各自一个 BM25Index（目录 public、user_<id>、dept_<id>）
+    - 查询只读取当前用户可见的几个分区，耗时只与这些分区的规模有关，不随其他用户的文档增长
+    - 分区在首次使用时加载；删除用户时直接删除整个分区目录
+    """
+
+    def __init__(self, root_dir: str, **index_kwargs):
+        """
+        :param root_dir: 索引根目录
+        :param index_kwargs: 传给每个分区 BM25Index 的参数
+        """
+        self.root_dir = root_dir
+        self.index_kwargs = index_kwargs
+        self._lock = threading.Lock()
+        self._indexes: Dict[str, BM25Index] = {}
+
+    def _partition_exists(self, name: str) -> bool:
+        return os.path.isfile(os.path.join(self.root_dir, name, "meta.json"))
+
+    def partition(self, name: str) -> BM25Index:
+        """获取分区索引，不存在时创建"""
+        with self._lock:
+            index = self._indexes.get(name)
+            if index is None:
+                index = BM25Index(os.path.join(self.root_dir, name), **self.index_kwargs)
+                self._indexes[name] = index
+            return index
+
+    def partitions(self) -> List[str]:
+        """磁盘上已有的分区名称"""
+        if not os.path.isdir(self.root_dir):
+            return []
+        return sorted(name for name in os.listdir(self.root_dir) if self._partition_exists(name))
+
+    @property
+    def doc_count(self) -> int:
+        """全部分区的有效文档数量"""
+        return sum(self.partition(name).doc_count for name in self.partitions())
+
+    @staticmethod
+    def _group(documents: List[Document]) -> Dict[str, List[Document]]:
+        groups: Dict[str, List[Document]] = {}
+        for doc in documents:
+            groups.setdefault(partition_of(doc.metadata or {}), []).append(doc)
+        return groups
+
+    def add_documents(self, documents: List[Document]):
+        """
+        按元数据把文档增量写入各自的分区
+        :param documents: 文档列表
+        """
+        for name, group in self._group(documents).items():
+            self.partition(name).add_documents(group)
+
+    def delete(self, where: Dict[str, Any], partitions: Optional[List[str]] = None) -> int:
+        """
+        删除元数据匹配的文档（记录墓碑）
+        :param where: 元数据过滤条件，如 {"file_hash": "..."}
+        :param partitions: 要处理的分区，None 表示全部分区
+        :return: 删除的文档数量
+        """
+        names = self.partitions() if partitions is None else [
+            name for name in partitions if self._partition_exists(name)
+        ]
+        return sum(self.partition(name).delete(where) for name in names)
+
+    def drop(self, name: str) -> bool:
+        """
+        删除整个分区
+        :param name: 分区名
+        :return: 分区是否存在
+        """
+        # 持有分区锁删除目录，查询不会在删除过程中加载该分区；同时持有分区的写锁，不与其他进程的写入交错；
+        # 已取得快照的查询继续使用各自映射的段（文件删除后映射仍然有效），结束时释放
+        with self._lock:
+            index = self._indexes.pop(name, None)
+            path = os.path.join(self.root_dir, name)
+            if not os.path.isdir(path):
+                if index is not None:
+                    index.close()
+                return False
+            index = index or BM25Index(path, **self.index_kwargs)
+            with index._write_lock():
+                shutil.rmtree(path, ignore_errors=True)
+            index.close()
+        logger.info(f"【BM25索引】已删除分区 {name}")
+        return True
+
+    def rebuild(self, documents: List[Document]):
+        """
+        丢弃现有的全部分区，按元数据分区后重建
+        :param documents: 文档列表
+        """
+        groups = self._group(documents)
+        for name in self.partitions():
+            if name not in groups:
+                self.drop(name)
+        for name, group in groups.items():
+            self.partition(name).rebuild(group)
+        self.remove_legacy_files()
+        logger.info(f"【BM25索引】分区重建完成，分区数: {len(groups)}, 文档数: {len(documents)}")
+
+    def remove_legacy_files(self):
+        """清理旧版未分区索引留在根目录下的 meta.json 和段目录"""
+        if not os.path.isdir(self.root_dir):
+            return
+        meta_path = os.path.join(self.root_dir, "meta.json")
+        if os.path.exists(meta_path):
+            os.remove(meta_path)
+        for name in os.listdir(self.root_dir):
+            if name.startswith("seg_"):
+                shutil.rmtree(os.path.join(self.root_dir, name), ignore_errors=True)
+
+    def search(self, query: str, k: int = 3, partitions: Optional[List[str]] = None) -> List[Document]:
+        """
+        在指定分区中检索，按分数合并
+        各分区的 IDF 分别计算，合并后的排序与单一索引略有差异，在混合检索中只用到排名，影响很小
+        :param query: 查询文本
+        :param k: 返回文档数量
+        :param partitions: 要检索的分区，None 表示全部分区
+        :return: 按相关度降序排列的文档列表
+        """
+        names = self.partitions() if partitions is None else partitions
+        scored = []
+        for name in names:
+            acquired = self._acquire_partition(name)
+            if acquired is None:
+                continue
+            index, snapshot = acquired
+            try:
+                scored.extend(index._search_snapshot(snapshot, query, k, None))
+            finally:
+                index._release_snapshot(snapshot)
+        return [doc for doc, _ in heapq.nlargest(k, scored, key=lambda item: item[1])]
+
+    def _acquire_partition(self, name: str) -> Optional[Tuple[BM25Index, tuple]]:
+        """
+        加载分区并持有其当前快照，与 drop 互斥
+        :param name: 分区名
+        :return: (分区索引, 快照)，分区不存在时返回 None
+        """
+        with self._lock:
+            if not self._partition_exists(name):
+                return None
+            index = self._indexes.get(name)
+            if index is None:
+                index = BM25Index(os.path.join(self.root_dir, name), **self.index_kwargs)
+                self._indexes[name] = index
+            index.load()
+            return index, index._acquire_snapshot()
+
+
+class PartitionedBM25Retriever(BaseRetriever):
+    """只检索指定分区的 BM25 检索器，可直接放入 EnsembleRetriever"""
+    index: Any
+    partitions: List[str]
+    k: int = 3
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        return self.index.search(query, k=self.k, partitions=self.partitions)
+
+
+bm25_index = PartitionedBM25Index(get_abstract_path(chroma_config.get('bm25_index_directory', 'data/bm25_index')))
+
+
+if __name__ == '__main__':
+    print(f"分区: {bm25_index.partitions()}，文档数量: {bm25_index.doc_count}")
+    for result in bm25_index.search('扫地机器人', k=3, partitions=[PUBLIC_PARTITION]):
+        print(result)
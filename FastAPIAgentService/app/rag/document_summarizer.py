@@ -0,0 +1,118 @@
+import asyncio
+import uuid
+from typing import Any, Dict, List, Optional
+
+from langchain_core.documents import Document
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.prompts import PromptTemplate
+
+from app.core.logger_handler import logger
+from app.utils.prompt_loader import load_prompt
+
+# 预生成摘要的元数据：doc_type 区分摘要与普通片段，summary_level 为 document（整个文档）或 section（章节）
+SUMMARY_DOC_TYPE = "summary"
+SUMMARY_LEVEL_DOCUMENT = "document"
+SUMMARY_LEVEL_SECTION = "section"
+# 片段所属章节序号的元数据键
+SECTION_KEY = "section"
+# 摘要继承自片段的元数据（来源文件与可见范围）
+_INHERITED_KEYS = ("source", "file_hash", "visibility", "user_id", "department_id")
+
+
+def is_summary(doc: Document) -> bool:
+    """是否为预生成的摘要"""
+    return (doc.metadata or {}).get("doc_type") == SUMMARY_DOC_TYPE
+
+
+class DocumentSummarizer:
+    """
+    入库时为每个源文档生成摘要：每个章节（按顺序累计不超过 section_max_chars 字的连续片段）一份，
+    多于一个章节时再由章节摘要生成整个文档的摘要；摘要作为普通文档写入向量库和BM25索引
+    章节很多时按 reduce_group_size 个一组逐层合并（每组生成一份中间摘要），单次调用的输入长度不随章节数增长
+    """
+
+    def __init__(self, chat_model, section_max_chars: int = 2000, max_concurrency: int = 2,
+                 timeout: float = 60.0, reduce_group_size: int = 8):
+        """
+        :param chat_model: 生成摘要的大模型
+        :param section_max_chars: 每个章节的最大字数
+        :param max_concurrency: 同时进行的大模型调用数
+        :param timeout: 单次大模型调用的超时时间（秒）
+        :param reduce_group_size: 生成文档摘要时每次合并的摘要数（至少为2）
+        """
+        self.chain = PromptTemplate.from_template(load_prompt("document_summary_prompt")) | chat_model | StrOutputParser()
+        self.section_max_chars = section_max_chars
+        self.max_concurrency = max_concurrency
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.timeout = timeout
+        self.reduce_group_size = max(reduce_group_size, 2)
+
+    def assign_sections(self, chunks: List[Document], state: Dict[str, int]):
+        """
+        按顺序为片段标记所属章节（写入元数据 section），同一文件的多批片段共用 state 连续编号
+        :param chunks: 一批片段
+        :param state: 文件的章节状态 {"section": 当前章节序号, "chars": 当前章节已累计的字数}
+        """
+        for chunk in chunks:
+            length = len(chunk.page_content)
+            if state["chars"] and state["chars"] + length > self.section_max_chars:
+                state["section"] += 1
+                state["chars"] = 0
+            state["chars"] += length
+            chunk.metadata[SECTION_KEY] = state["section"]
+
+    async def _summarize(self, level: str, content: str) -> str:
+        async with self.semaphore:
+            return await asyncio.wait_for(self.chain.ainvoke({"level": level, "content": content}), timeout=self.timeout)
+
+    @staticmethod
+    def _join_parts(texts: List[str]) -> str:
+        return "\n".join(f"第{i}部分：{text}" for i, text in enumerate(texts, 1))
+
+    async def _reduce(self, texts: List[str]) -> str:
+        """按 reduce_group_size 个一组逐层合并摘要，直到剩下一组时生成文档摘要"""
+        while len(texts) > self.reduce_group_size:
+            groups = [texts[start:start + self.reduce_group_size]
+                      for start in range(0, len(texts), self.reduce_group_size)]
+            merged = await asyncio.gather(
+                *(self._summarize("文档片段", self._join_parts(group)) for group in groups if len(group) > 1)
+            )
+            # 只有最后一组可能只剩一份摘要，直接留到下一层
+            texts = list(merged) + (groups[-1] if len(groups[-1]) == 1 else [])
+        return await self._summarize("文档", self._join_parts(texts))
+
+    @staticmethod
+    def _summary_document(text: str, level: str, metadata: Dict[str, Any], section: Optional[int]) -> Document:
+        summary_metadata = {key: metadata[key] for key in _INHERITED_KEYS if metadata.get(key) is not None}
+        summary_metadata.update(doc_type=SUMMARY_DOC_TYPE, summary_level=level)
+        if section is not None:
+            summary_metadata[SECTION_KEY] = section
+        return Document(id=str(uuid.uuid4()), page_content=text, metadata=summary_metadata)
+
+    async def summarize(self, chunks: List[Document]) -> List[Document]:
+        """
+        为一个文件的全部片段生成章节摘要和文档摘要
+        :param chunks: 已标记章节的片段（按原文顺序）
+        :return: 摘要文档列表（带ID），只有一个章节时只返回文档摘要
+        """
+        if not chunks:
+            return []
+        sections: Dict[int, List[str]] = {}
+        for chunk in chunks:
+            sections.setdefault(chunk.metadata.get(SECTION_KEY, 0), []).append(chunk.page_content)
+        sections = dict(sorted(sections.items()))
+        metadata = chunks[0].metadata
+        section_texts = await asyncio.gather(
+            *(self._summarize("章节", "\n".join(texts)) for texts in sections.values())
+        )
+        if len(section_texts) == 1:
+            return [self._summary_document(section_texts[0], SUMMARY_LEVEL_DOCUMENT, metadata, None)]
+
+        document_text = await self._reduce(list(section_texts))
+        summaries = [
+            self._summary_document(text, SUMMARY_LEVEL_SECTION, metadata, section)
+            for section, text in zip(sections, section_texts)
+        ]
+        summaries.append(self._summary_document(document_text, SUMMARY_LEVEL_DOCUMENT, metadata, None))
+        logger.info(f"【入库摘要】文件 {metadata.get('source', '')} 生成 {len(section_texts)} 个章节摘要和 1 个文档摘要")
+        return summaries
@@ -0,0 +1,881 @@
+import asyncio
+import json
+import mmap
+import os
+import shutil
+import threading
+import uuid
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+from app.core.logger_handler import logger
+
+try:
+    import fcntl
+except ImportError:  # Windows 下没有 fcntl，只在进程内加锁
+    fcntl = None
+
+
+def _import_faiss():
+    """faiss 为可选依赖（pip install faiss-cpu），只在使用 HNSW 后端时导入"""
+    import faiss
+    return faiss
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    """按行归一化，内积即余弦相似度"""
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+# 向量存储格式 -> faiss 标量量化类型（float32 不量化）
+VECTOR_DTYPES = ("float32", "float16", "int8")
+# 从其他向量库导入完成后写入的标记文件
+IMPORT_MARKER = "import_complete.json"
+# 重新加载时读到的段已被其他进程删除（元数据已更新）时的最大重试次数
+_RELOAD_ATTEMPTS = 5
+
+
+def _index_vectors(vectors: np.ndarray, dim: int) -> np.ndarray:
+    """取前 dim 维并重新归一化（Matryoshka 截断），维度不变时原样返回"""
+    if dim >= vectors.shape[-1]:
+        return vectors
+    return _normalize(np.ascontiguousarray(vectors[..., :dim]).reshape(-1, dim))
+
+
+def _write_json_atomic(path: str, data: Any):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+class _HNSWSegment:
+    """
+    只读的向量段
+    目录结构：
+        index.faiss      HNSW 索引（含向量），以 mmap 方式加载
+        ids.json         段内文档ID
+        docs.jsonl       文档内容与元数据
+        doc_offset.npy   docs.jsonl 中每个文档的起始字节
+        format.json      向量存储格式（压缩存储时写入；没有该文件表示 float32 全维度）
+        vectors.npy      全精度向量（压缩存储时写入），以 mmap 方式加载，只读取需要重新打分的候选
+    元数据中的标量字段在加载时建立 字段 -> 取值 -> 段内序号 的过滤索引，过滤条件在 HNSW 搜索时直接生效
+    """
+
+    def __init__(self, path: str, base_id: int):
+        self.path = path
+        self.base_id = base_id
+        # 引用计数：向量库的当前快照持有一个引用，每个进行中的查询各持有一个引用
+        self._refs = 1
+        self._refs_lock = threading.Lock()
+        self._remove_on_close = False
+        self.index = self._read_index(os.path.join(path, "index.faiss"))
+        with open(os.path.join(path, "ids.json"), "r", encoding="utf-8") as f:
+            self.ids: List[str] = json.load(f)
+        self.count = len(self.ids)
+        format_path = os.path.join(path, "format.json")
+        if os.path.exists(format_path):
+            with open(format_path, "r", encoding="utf-8") as f:
+                self.format: Dict[str, Any] = json.load(f)
+            self.full_vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r")
+            # 重新打分只随机读取少量候选，关闭预读，避免把整个文件读入页缓存
+            if hasattr(mmap, "MADV_RANDOM") and getattr(self.full_vectors, "_mmap", None) is not None:
+                self.full_vectors._mmap.madvise(mmap.MADV_RANDOM)
+        else:
+            self.format = {"vector_dtype": "float32", "dim": self.index.d, "index_dim": self.index.d}
+            self.full_vectors = None
+        self.doc_offset = np.load(os.path.join(path, "doc_offset.npy"), mmap_mode="r")
+        self._docs_file = open(os.path.join(path, "docs.jsonl"), "rb")
+        self._docs = mmap.mmap(self._docs_file.fileno(), 0, access=mmap.ACCESS_READ) if self.count else b""
+        self.filter_index = self._build_filter_index()
+
+    @staticmethod
+    def _read_index(path: str):
+        """只读映射索引文件，多个进程共享系统页缓存；平台不支持时回退为读入内存"""
+        faiss = _import_faiss()
+        try:
+            return faiss.read_index(path, faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY)
+        except Exception as e:
+            logger.warning(f"【HNSW向量库】无法以 mmap 方式加载 {path}，读入内存: {e}")
+            return faiss.read_index(path)
+
+    def _build_filter_index(self) -> Dict[str, Dict[Any, np.ndarray]]:
+        values: Dict[str, Dict[Any, List[int]]] = {}
+        for local_id in range(self.count):
+            for key, value in (self.get_document(local_id).get("metadata") or {}).items():
+                if isinstance(value, (str, int, float, bool)):
+                    values.setdefault(key, {}).setdefault(value, []).append(local_id)
+        return {
+            key: {value: np.asarray(local_ids, dtype=np.int64) for value, local_ids in by_value.items()}
+            for key, by_value in values.items()
+        }
+
+    def get_document(self, local_id: int) -> Dict[str, Any]:
+        """读取段内第 local_id 个文档"""
+        start = int(self.doc_offset[local_id])
+        end = self._docs.find(b"\n", start)
+        return json.loads(self._docs[start:end if end != -1 else len(self._docs)])
+
+    def vectors(self, local_ids: np.ndarray) -> np.ndarray:
+        """读取段内指定文档的全精度向量（已归一化）"""
+        local_ids = np.asarray(local_ids, dtype=np.int64)
+        if self.full_vectors is not None:
+            return np.asarray(self.full_vectors[local_ids], dtype=np.float32)
+        return self.index.reconstruct_batch(local_ids)
+
+    @property
+    def index_bytes(self) -> int:
+        """HNSW 索引文件大小（查询时常驻内存的部分）"""
+        return os.path.getsize(os.path.join(self.path, "index.faiss"))
+
+    def _field_mask(self, key: str, condition: Any) -> np.ndarray:
+        by_value = self.filter_index.get(key, {})
+        if not isinstance(condition, dict):
+            condition = {"$eq": condition}
+        mask = np.ones(self.count, dtype=bool)
+        for operator, operand in condition.items():
+            if operator == "$eq":
+                selected = [operand]
+            elif operator == "$ne":
+                selected = [value for value in by_value if value != operand]
+            elif operator == "$in":
+                selected = list(operand)
+            elif operator == "$nin":
+                selected = [value for value in by_value if value not in operand]
+            elif operator in ("$gt", "$gte", "$lt", "$lte"):
+                compare = {
+                    "$gt": lambda v: v > operand, "$gte": lambda v: v >= operand,
+                    "$lt": lambda v: v < operand, "$lte": lambda v: v <= operand,
+                }[operator]
+                selected = [
+                    value for value in by_value
+                    if isinstance(value, (int, float)) and not isinstance(value, bool) and compare(value)
+                ]
+            else:
+                raise ValueError(f"不支持的过滤运算符: {operator}")
+            field_mask = np.zeros(self.count, dtype=bool)
+            for value in selected:
+                local_ids = by_value.get(value)
+                if local_ids is not None:
+                    field_mask[local_ids] = True
+            mask &= field_mask
+        return mask
+
+    def match(self, where: Optional[Dict[str, Any]]) -> np.ndarray:
+        """
+        计算元数据过滤条件命中的文档（Chroma where 语法：等值、$eq/$ne/$in/$nin/$gt/$gte/$lt/$lte、$and/$or）
+        :param where: 过滤条件，None 表示全部
+        :return: 长度为段内文档数的布尔数组
+        """
+        mask = np.ones(self.count, dtype=bool)
+        for key, condition in (where or {}).items():
+            if key == "$and":
+                for sub_where in condition:
+                    mask &= self.match(sub_where)
+            elif key == "$or":
+                any_mask = np.zeros(self.count, dtype=bool)
+                for sub_where in condition:
+                    any_mask |= self.match(sub_where)
+                mask &= any_mask
+            else:
+                mask &= self._field_mask(key, condition)
+        return mask
+
+    def search(self, query: np.ndarray, k: int, allowed: np.ndarray, ef_search: int,
+               exact_threshold: int, rescore_factor: int = 4) -> List[Tuple[float, int]]:
+        """
+        在段内检索
+        :param query: 归一化的查询向量（全维度）
+        :param k: 返回数量
+        :param allowed: 允许返回的文档（布尔数组，已排除墓碑和不满足过滤条件的文档）
+        :param ef_search: HNSW 搜索宽度
+        :param exact_threshold: 允许的文档数不超过该值时改为精确计算，避免过滤条件很严格时 HNSW 找不满 k 个
+        :param rescore_factor: 压缩存储时先取 k * rescore_factor 个候选，再用全精度向量重新打分；<= 0 表示不重新打分
+        :return: [(相似度, 段内序号)]
+        """
+        allowed_count = int(allowed.sum())
+        if allowed_count == 0:
+            return []
+        if allowed_count <= exact_threshold:
+            local_ids = np.flatnonzero(allowed)
+            scores = self.vectors(local_ids) @ query
+            top = np.argsort(-scores)[:k]
+            return [(float(scores[i]), int(local_ids[i])) for i in top]
+
+        faiss = _import_faiss()
+        params = faiss.SearchParametersHNSW()
+        # 过滤掉的节点仍参与图遍历但不计入结果，允许的比例越低，搜索宽度相应放大
+        params.efSearch = max(ef_search, k) * min(self.count // allowed_count, 16)
+        if allowed_count < self.count:
+            bitmap = np.packbits(allowed, bitorder="little")
+            params.sel = faiss.IDSelectorBitmap(self.count, faiss.swig_ptr(bitmap))
+        rescore = self.full_vectors is not None and rescore_factor > 0
+        n_candidates = min(k * rescore_factor if rescore else k, allowed_count)
+        index_query = _index_vectors(query.reshape(1, -1), self.format["index_dim"])
+        scores, local_ids = self.index.search(index_query, n_candidates, params=params)
+        found = local_ids[0][local_ids[0] >= 0]
+        if not rescore:
+            return [(float(score), int(local_id)) for score, local_id in zip(scores[0], local_ids[0]) if local_id >= 0]
+        # 按段内序号顺序读取全精度向量，访问 mmap 时尽量连续
+        found = np.sort(found)
+        full_scores = self.vectors(found) @ query
+        top = np.argsort(-full_scores)[:k]
+        return [(float(full_scores[i]), int(found[i])) for i in top]
+
+    @staticmethod
+    def write(path: str, ids: List[str], documents: List[Document], vectors: np.ndarray,
+              m: int, ef_construction: int, vector_dtype: str = "float32", truncate_dim: Optional[int] = None):
+        """
+        将文档与向量写成一个新的段
+        :param path: 段目录
+        :param ids: 文档ID
+        :param documents: 文档
+        :param vectors: 归一化后的向量
+        :param m: HNSW 每个节点的邻居数
+        :param ef_construction: HNSW 构建时的搜索宽度
+        :param vector_dtype: 索引中向量的存储格式：float32 / float16 / int8（标量量化）
+        :param truncate_dim: 索引只使用前 truncate_dim 维，None 表示全部维度
+        """
+        faiss = _import_faiss()
+        os.makedirs(path, exist_ok=True)
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        dim = vectors.shape[1]
+        index_dim = min(truncate_dim or dim, dim)
+        index_vectors = _index_vectors(vectors, index_dim)
+        if vector_dtype == "float32":
+            index = faiss.IndexHNSWFlat(index_dim, m, faiss.METRIC_INNER_PRODUCT)
+        else:
+            qtype = {"float16": faiss.ScalarQuantizer.QT_fp16, "int8": faiss.ScalarQuantizer.QT_8bit}[vector_dtype]
+            index = faiss.IndexHNSWSQ(index_dim, qtype, m, faiss.METRIC_INNER_PRODUCT)
+            index.train(index_vectors)
+        index.hnsw.efConstruction = ef_construction
+        index.add(index_vectors)
+        faiss.write_index(index, os.path.join(path, "index.faiss"))
+        if vector_dtype != "float32" or index_dim < dim:
+            # 压缩存储时另存全精度向量，用于重新打分、合并段和迁移格式
+            np.save(os.path.join(path, "vectors.npy"), vectors)
+            _write_json_atomic(os.path.join(path, "format.json"),
+                               {"vector_dtype": vector_dtype, "dim": dim, "index_dim": index_dim})
+
+        offsets = np.zeros(len(documents), dtype=np.int64)
+        offset = 0
+        with open(os.path.join(path, "docs.jsonl"), "wb") as docs_file:
+            for i, doc in enumerate(documents):
+                line = json.dumps(
+                    {"page_content": doc.page_content, "metadata": doc.metadata or {}},
+                    ensure_ascii=False
+                ).encode("utf-8") + b"\n"
+                offsets[i] = offset
+                docs_file.write(line)
+                offset += len(line)
+        np.save(os.path.join(path, "doc_offset.npy"), offsets)
+        _write_json_atomic(os.path.join(path, "ids.json"), ids)
+
+    def acquire(self):
+        """查询开始前增加引用，保证查询期间索引和映射不被释放"""
+        with self._refs_lock:
+            self._refs += 1
+
+    def release(self):
+        """释放一个引用；最后一个引用释放后关闭映射，已退役的段同时删除目录"""
+        with self._refs_lock:
+            self._refs -= 1
+            last = self._refs == 0
+        if last:
+            self._close()
+            if self._remove_on_close:
+                shutil.rmtree(self.path, ignore_errors=True)
+
+    def retire(self, remove: bool):
+        """
+        段不再属于向量库的当前快照：释放快照持有的引用，进行中的查询结束后才关闭
+        :param remove: 关闭后是否删除段目录（合并替换掉的段）；其他进程提交的变更由该进程删除目录
+        """
+        self._remove_on_close = remove
+        self.release()
+
+    def _close(self):
+        """释放映射（仍有切片未释放时交给垃圾回收处理）"""
+        if isinstance(self._docs, mmap.mmap):
+            try:
+                self._docs.close()
+            except BufferError:
+                pass
+        self._docs_file.close()
+        self.index = None
+        self.full_vectors = None
+
+
+class HNSWVectorStore(VectorStore):
+    """
+    本地 HNSW 向量库（faiss-cpu），可替代 Chroma 作为 VectorStoreService 的后端
+    - 与 BM25Index 相同的段式结构：每次写入生成一个不可变的段，删除只记录墓碑，查询时跳过；
+      段数量超过上限时合并较小的段，墓碑比例超过 20% 时全部合并
+    - 段文件以 mmap 只读映射，多个 uvicorn worker 通过系统页缓存共享同一份向量和图，不各自持有一份
+    - 写操作持有文件锁并写入新的元数据；每次查询检查元数据是否变化，其他 worker 写入的数据随之可见
+    - 查询期间持有所读快照中各段的引用，被替换的旧段在最后一个查询结束后才关闭和删除
+    - 接口与 Chroma 保持一致：get / delete(ids, where) / as_retriever(search_kwargs={"k", "filter"})
+    - 索引中的向量可以按 float16 / int8 压缩存储并截断到前 N 维，检索时用全精度向量对候选重新打分；
+      格式按段记录，修改配置后新写入的段使用新格式，执行 migrate_format 后旧段全部改写
+    """
+
+    def __init__(
+            self,
+            index_dir: str,
+            embedding_function: Embeddings,
+            m: int = 32,
+            ef_construction: int = 200,
+            ef_search: int = 64,
+            max_segments: int = 8,
+            exact_search_threshold: int = 2000,
+            vector_dtype: str = "float32",
+            truncate_dim: Optional[int] = None,
+            rescore_factor: int = 4,
+    ):
+        """
+        :param index_dir: 索引目录
+        :param embedding_function: 嵌入模型
+        :param m: HNSW 每个节点的邻居数
+        :param ef_construction: HNSW 构建时的搜索宽度
+        :param ef_search: HNSW 查询时的搜索宽度
+        :param max_segments: 段数量上限，超过后合并
+        :param exact_search_threshold: 过滤后的候选数不超过该值时精确计算相似度
+        :param vector_dtype: 索引中向量的存储格式：float32 / float16 / int8
+        :param truncate_dim: 索引只使用向量的前 N 维（Matryoshka 截断），None 表示全部维度
+        :param rescore_factor: 压缩存储时每个段取 k * rescore_factor 个候选用全精度向量重新打分
+        """
+        if vector_dtype not in VECTOR_DTYPES:
+            raise ValueError(f"不支持的向量存储格式: {vector_dtype}，可选: {', '.join(VECTOR_DTYPES)}")
+        _import_faiss()
+        self.index_dir = index_dir
+        self.embedding_function = embedding_function
+        self.m = m
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+        self.max_segments = max_segments
+        self.exact_search_threshold = exact_search_threshold
+        self.vector_dtype = vector_dtype
+        self.truncate_dim = truncate_dim
+        self.rescore_factor = rescore_factor
+        self._lock = threading.RLock()
+        self._lock_depth = 0
+        # 保护快照切换与查询获取段引用，两者互斥，避免查询拿到即将关闭的段
+        self._snapshot_lock = threading.Lock()
+        self._meta_mtime = None
+        # 当前快照：(段列表, 已删除文档全局序号集合, 元数据, 文档ID -> 全局序号, 各段有效文档的布尔数组)
+        self._snapshot: tuple = ((), frozenset(), {"next_segment": 0, "segments": [], "doc_count": 0,
+                                                   "deleted": []}, {}, ())
+        os.makedirs(index_dir, exist_ok=True)
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self.embedding_function
+
+    @property
+    def _meta_path(self) -> str:
+        return os.path.join(self.index_dir, "meta.json")
+
+    # ---------- 快照与持久化 ----------
+
+    def _reload_if_changed(self):
+        """元数据文件变化（首次加载或其他进程写入）时重新加载快照，未变化的段直接复用"""
+        try:
+            mtime = os.stat(self._meta_path).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime == self._meta_mtime:
+            return
+        with self._lock:
+            for attempt in range(_RELOAD_ATTEMPTS):
+                try:
+                    mtime = os.stat(self._meta_path).st_mtime_ns
+                except FileNotFoundError:
+                    return
+                if mtime == self._meta_mtime:
+                    return
+                with open(self._meta_path, "r", encoding="utf-8") as f:
+                    meta = json.load(f)
+                try:
+                    self._load_meta(meta, mtime)
+                    return
+                except (OSError, RuntimeError):
+                    # 未持有写锁时读到的元数据可能已被其他进程的合并替换、旧段已删除，重新读取最新的元数据
+                    missing = any(not os.path.isdir(os.path.join(self.index_dir, name)) for name, _ in meta["segments"])
+                    if not missing or attempt == _RELOAD_ATTEMPTS - 1:
+                        raise
+
+    def _load_meta(self, meta: Dict[str, Any], mtime: int):
+        """按元数据切换快照（持有 _lock 时调用），段文件无法打开时抛出异常且不改变当前快照"""
+        current = {os.path.basename(seg.path): seg for seg in self._snapshot[0]}
+        opened = {}
+        try:
+            for name, base_id in meta["segments"]:
+                if name not in current:
+                    opened[name] = _HNSWSegment(os.path.join(self.index_dir, name), base_id)
+        except Exception:
+            for segment in opened.values():
+                segment.retire(remove=False)
+            raise
+        segments = tuple(current.get(name) or opened[name] for name, _ in meta["segments"])
+        live = {name for name, _ in meta["segments"]}
+        retired = tuple(segment for name, segment in current.items() if name not in live)
+        self._swap_snapshot(self._make_snapshot(segments, frozenset(meta["deleted"]), meta), retired,
+                            remove=False)
+        self._meta_mtime = mtime
+        logger.info(f"【HNSW向量库】加载完成，段数: {len(segments)}, 文档数: {self.count()}")
+
+    @staticmethod
+    def _make_snapshot(segments: tuple, deleted: frozenset, meta: Dict[str, Any]) -> tuple:
+        """生成快照：预先计算文档ID映射和各段的有效文档，查询时不再逐个检查墓碑"""
+        id_map = {}
+        live_masks = []
+        for segment in segments:
+            live = np.ones(segment.count, dtype=bool)
+            for local_id, doc_id in enumerate(segment.ids):
+                global_id = segment.base_id + local_id
+                if global_id in deleted:
+                    live[local_id] = False
+                else:
+                    id_map[doc_id] = global_id
+            live_masks.append(live)
+        return segments, deleted, meta, id_map, tuple(live_masks)
+
+    def load(self):
+        """加载索引（幂等），应用启动时调用一次"""
+        self._reload_if_changed()
+
+    def _acquire_snapshot(self) -> tuple:
+        """同步其他进程的写入后获取当前快照，并持有其中各段的引用，用完后调用 _release_snapshot"""
+        self._reload_if_changed()
+        with self._snapshot_lock:
+            snapshot = self._snapshot
+            for segment in snapshot[0]:
+                segment.acquire()
+        return snapshot
+
+    @staticmethod
+    def _release_snapshot(snapshot: tuple):
+        for segment in snapshot[0]:
+            segment.release()
+
+    def _swap_snapshot(self, snapshot: tuple, retired: tuple = (), remove: bool = True):
+        """切换到新的快照，退役的段在进行中的查询结束后关闭"""
+        with self._snapshot_lock:
+            self._snapshot = snapshot
+            for segment in retired:
+                segment.retire(remove)
+
+    @contextmanager
+    def _write_lock(self):
+        """写操作加锁：进程内线程锁 + 跨进程文件锁，加锁后先同步其他进程的写入"""
+        with self._lock:
+            if self._lock_depth:
+                # 同一线程内嵌套的写操作（如写入后触发合并）已持有文件锁
+                self._lock_depth += 1
+                try:
+                    yield
+                finally:
+                    self._lock_depth -= 1
+                return
+            lock_file = open(os.path.join(self.index_dir, ".lock"), "a+")
+            self._lock_depth = 1
+            try:
+                if fcntl is not None:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+                self._reload_if_changed()
+                yield
+            finally:
+                self._lock_depth = 0
+                if fcntl is not None:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+                lock_file.close()
+
+    def _commit(self, segments: tuple, deleted: frozenset, meta: Dict[str, Any], retired: tuple = ()):
+        """持久化元数据并切换到新的快照，旧段在进行中的查询结束后释放并删除"""
+        meta["segments"] = [[os.path.basename(seg.path), seg.base_id] for seg in segments]
+        meta["deleted"] = sorted(deleted)
+        _write_json_atomic(self._meta_path, meta)
+        self._swap_snapshot(self._make_snapshot(segments, deleted, meta), retired)
+        self._meta_mtime = os.stat(self._meta_path).st_mtime_ns
+        self._remove_orphan_segments(meta, {os.path.basename(seg.path) for seg in retired})
+
+    def _remove_orphan_segments(self, meta: Dict[str, Any], retired: Iterable[str] = ()):
+        """
+        清理未被 meta.json 引用的段目录（写入中断或未能删除的旧段），持有写锁时调用
+        :param retired: 刚退役的段，由最后一个查询结束时删除，这里跳过
+        """
+        keep = {name for name, _ in meta["segments"]} | set(retired)
+        for name in os.listdir(self.index_dir):
+            path = os.path.join(self.index_dir, name)
+            if name.startswith("seg_") and name not in keep and os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+
+    def _new_segment(self, ids: List[str], documents: List[Document], vectors: np.ndarray,
+                     meta: Dict[str, Any]) -> _HNSWSegment:
+        """写入新段并更新（尚未提交的）元数据"""
+        name = f"seg_{meta['next_segment']:06d}"
+        meta["next_segment"] += 1
+        path = os.path.join(self.index_dir, name)
+        _HNSWSegment.write(path, ids, documents, vectors, self.m, self.ef_construction,
+                           self.vector_dtype, self.truncate_dim)
+        base_id = meta["doc_count"]
+        meta["doc_count"] += len(ids)
+        return _HNSWSegment(path, base_id)
+
+    @staticmethod
+    def _find_segment(segments: tuple, global_id: int) -> _HNSWSegment:
+        for segment in reversed(segments):
+            if global_id >= segment.base_id:
+                return segment
+        raise KeyError(global_id)
+
+    def count(self) -> int:
+        """有效文档数量"""
+        self._reload_if_changed()
+        return len(self._snapshot[3])
+
+    # ---------- 写入与删除 ----------
+
+    def upsert(self, ids: List[str], embeddings: List[List[float]], documents: List[str],
+               metadatas: Optional[List[Optional[Dict[str, Any]]]] = None):
+        """
+        写入已计算好向量的文档，ID 已存在时覆盖（参数与 Chroma collection 的 upsert 一致）
+        :param ids: 文档ID
+        :param embeddings: 向量
+        :param documents: 文档内容
+        :param metadatas: 元数据
+        """
+        if not ids:
+            return
+        metadatas = metadatas or [None] * len(ids)
+        docs = [Document(page_content=text, metadata=metadata or {}) for text, metadata in zip(documents, metadatas)]
+        vectors = _normalize(np.asarray(embeddings, dtype=np.float32))
+        with self._write_lock():
+            segments, deleted, meta, id_map, _ = self._snapshot
+            meta = dict(meta)
+            replaced = {id_map[doc_id] for doc_id in ids if doc_id in id_map}
+            segment = self._new_segment(list(ids), docs, vectors, meta)
+            self._commit(segments + (segment,), deleted | replaced, meta)
+            self._maybe_compact()
+
+    def import_documents(self, batches: Iterable[Dict[str, Any]], source: str) -> int:
+        """
+        一次性导入其他向量库（如 Chroma）中的文档和向量，全部写成一个段
+        持有写锁执行，完成后写入导入标记；已有标记时直接返回，多个 worker 同时启动也只导入一次
+        :param batches: 分批读取的 {"ids", "embeddings", "documents", "metadatas"}，获得写锁后才开始读取
+        :param source: 数据来源，记录在导入标记中
+        :return: 导入的文档数，已导入过时返回 0
+        """
+        marker_path = os.path.join(self.index_dir, IMPORT_MARKER)
+        with self._write_lock():
+            if os.path.exists(marker_path):
+                return 0
+            # 导入前已直接写入本库的文档以本库为准
+            existing = self._snapshot[3]
+            ids, vectors, documents, metadatas = [], [], [], []
+            for batch in batches:
+                keep = [i for i, doc_id in enumerate(batch["ids"]) if doc_id not in existing]
+                if not keep:
+                    continue
+                ids.extend(batch["ids"][i] for i in keep)
+                vectors.append(np.asarray(batch["embeddings"], dtype=np.float32)[keep])
+                documents.extend(batch["documents"][i] for i in keep)
+                metadatas.extend(batch["metadatas"][i] for i in keep)
+            if ids:
+                self.upsert(ids, np.vstack(vectors), documents, metadatas)
+            _write_json_atomic(marker_path, {"source": source, "count": len(ids)})
+            return len(ids)
+
+    def update(self, ids: List[str], metadatas: List[Dict[str, Any]]):
+        """
+        整体替换指定文档的元数据，向量和内容不变（参数与 Chroma collection 的 update 一致）
+        :param ids: 文档ID
+        :param metadatas: 新的元数据
+        """
+        with self._write_lock():
+            segments, _, _, id_map, _ = self._snapshot
+            pairs = [(doc_id, metadata) for doc_id, metadata in zip(ids, metadatas) if doc_id in id_map]
+            if not pairs:
+                return
+            documents, vectors = [], []
+            for doc_id, metadata in pairs:
+                segment = self._find_segment(segments, id_map[doc_id])
+                local_id = id_map[doc_id] - segment.base_id
+                documents.append(segment.get_document(local_id)["page_content"])
+                vectors.append(segment.vectors(np.array([local_id]))[0])
+            self.upsert([doc_id for doc_id, _ in pairs], vectors, documents, [metadata for _, metadata in pairs])
+
+    def delete(self, ids: Optional[List[str]] = None, where: Optional[Dict[str, Any]] = None,
+               **kwargs: Any) -> Optional[bool]:
+        """
+        按ID或元数据删除文档（记录墓碑）
+        :param ids: 文档ID列表
+        :param where: 元数据过滤条件，如 {"user_id": "1"}
+        :return: 是否删除了文档
+        """
+        if not ids and not where:
+            return False
+        with self._write_lock():
+            segments, deleted, meta, id_map, live_masks = self._snapshot
+            removed = set()
+            if ids:
+                removed.update(id_map[doc_id] for doc_id in ids if doc_id in id_map)
+            if where:
+                for segment, live in zip(segments, live_masks):
+                    removed.update(
+                        segment.base_id + int(local_id)
+                        for local_id in np.flatnonzero(segment.match(where) & live)
+                    )
+            if not removed:
+                return False
+            self._commit(segments, deleted | removed, dict(meta))
+            logger.info(f"【HNSW向量库】删除文档 {len(removed)} 个")
+            self._maybe_compact()
+            return True
+
+    def _maybe_compact(self):
+        """墓碑比例超过 20% 时全部合并；段数量超过上限时合并除最大段以外的段"""
+        segments, deleted, meta, _, _ = self._snapshot
+        if meta["doc_count"] and len(deleted) > 0.2 * meta["doc_count"]:
+            self.compact()
+        elif len(segments) > self.max_segments:
+            largest = max(segments, key=lambda seg: seg.count)
+            self.compact([seg for seg in segments if seg is not largest])
+
+    def compact(self, segments_to_merge: Optional[List[_HNSWSegment]] = None):
+        """
+        合并段并清除已删除的文档
+        :param segments_to_merge: 要合并的段，None 表示全部
+        """
+        with self._write_lock():
+            segments, deleted, meta, _, live_masks = self._snapshot
+            merging = tuple(segments if segments_to_merge is None else
+                            [seg for seg in segments if seg in segments_to_merge])
+            ids, documents, vectors = [], [], []
+            for segment, live in zip(segments, live_masks):
+                if segment not in merging or not live.any():
+                    continue
+                live_ids = np.flatnonzero(live)
+                vectors.append(segment.vectors(live_ids))
+                for local_id in live_ids:
+                    doc = segment.get_document(local_id)
+                    ids.append(segment.ids[local_id])
+                    documents.append(Document(page_content=doc["page_content"], metadata=doc.get("metadata") or {}))
+            meta = dict(meta)
+            merged_ids = {seg.base_id + local_id for seg in merging for local_id in range(seg.count)}
+            kept = tuple(seg for seg in segments if seg not in merging)
+            new_segments = kept + ((self._new_segment(ids, documents, np.vstack(vectors), meta),) if ids else ())
+            self._commit(new_segments, deleted - merged_ids, meta, merging)
+            logger.info(f"【HNSW向量库】合并 {len(merging)} 个段，文档数: {len(ids)}，当前段数: {len(new_segments)}")
+
+    # ---------- 存储格式 ----------
+
+    def _matches_format(self, segment: _HNSWSegment) -> bool:
+        """段的存储格式是否与当前配置一致"""
+        dim = segment.format["dim"]
+        return (segment.format["vector_dtype"] == self.vector_dtype
+                and segment.format["index_dim"] == min(self.truncate_dim or dim, dim))
+
+    def pending_migration(self) -> int:
+        """存储格式与当前配置不一致、需要迁移的段数"""
+        self._reload_if_changed()
+        return sum(1 for segment in self._snapshot[0] if not self._matches_format(segment))
+
+    def migrate_format(self) -> int:
+        """
+        按当前配置的存储格式改写格式不一致的段（合并为一个新段，全精度向量从原段读取）
+        :return: 改写的段数
+        """
+        with self._write_lock():
+            outdated = [segment for segment in self._snapshot[0] if not self._matches_format(segment)]
+            if outdated:
+                self.compact(outdated)
+            return len(outdated)
+
+    def storage_report(self, sample_size: int = 200, k: int = 10, seed: int = 0) -> Dict[str, Any]:
+        """
+        统计向量占用的内存，并以抽样文档的向量为查询，评估压缩存储相对全精度精确检索的召回率
+        :param sample_size: 抽样查询数
+        :param k: 召回率的 k
+        :param seed: 随机种子
+        :return: 各格式（存储格式/索引维度）的文档数、文档总数、索引大小、向量部分的大小（当前 / 全精度）、
+                 不重新打分与重新打分的 recall@k
+        """
+        snapshot = self._acquire_snapshot()
+        try:
+            return self._storage_report(snapshot, sample_size, k, seed)
+        finally:
+            self._release_snapshot(snapshot)
+
+    def _storage_report(self, snapshot: tuple, sample_size: int, k: int, seed: int) -> Dict[str, Any]:
+        segments, _, _, id_map, live_masks = snapshot
+        bytes_per_value = {"float32": 4, "float16": 2, "int8": 1}
+        formats: Dict[str, int] = {}
+        for segment, live in zip(segments, live_masks):
+            name = f"{segment.format['vector_dtype']}/{segment.format['index_dim']}"
+            formats[name] = formats.get(name, 0) + int(live.sum())
+        report: Dict[str, Any] = {
+            "formats": formats,
+            "documents": len(id_map),
+            "index_bytes": sum(segment.index_bytes for segment in segments),
+            "vector_bytes": sum(int(live.sum()) * segment.format["index_dim"]
+                                * bytes_per_value[segment.format["vector_dtype"]]
+                                for segment, live in zip(segments, live_masks)),
+            "full_precision_vector_bytes": sum(int(live.sum()) * segment.format["dim"] * 4
+                                               for segment, live in zip(segments, live_masks)),
+        }
+        if not report["documents"]:
+            return report
+
+        # 抽样文档的全精度向量作为查询，逐段分块计算精确的 top-k 作为基准
+        rng = np.random.default_rng(seed)
+        positions = [(segment, int(local_id)) for segment, live in zip(segments, live_masks)
+                     for local_id in np.flatnonzero(live)]
+        picks = rng.choice(len(positions), size=min(sample_size, len(positions)), replace=False)
+        queries = np.vstack([positions[i][0].vectors(np.array([positions[i][1]])) for i in picks])
+        best_scores = np.full((len(queries), 0), -np.inf, dtype=np.float32)
+        best_ids = np.empty((len(queries), 0), dtype=np.int64)
+        for segment, live in zip(segments, live_masks):
+            live_ids = np.flatnonzero(live)
+            for start in range(0, len(live_ids), 10000):
+                block = live_ids[start:start + 10000]
+                scores = queries @ segment.vectors(block).T
+                best_scores = np.hstack([best_scores, scores])
+                best_ids = np.hstack([best_ids, np.broadcast_to(segment.base_id + block, scores.shape)])
+                order = np.argsort(-best_scores, axis=1)[:, :k]
+                best_scores = np.take_along_axis(best_scores, order, axis=1)
+                best_ids = np.take_along_axis(best_ids, order, axis=1)
+
+        for name, rescore_factor in (("recall_without_rescore", 0), ("recall", self.rescore_factor)):
+            hits = 0
+            for query, truth in zip(queries, best_ids):
+                found = {segment.base_id + local_id
+                         for _, segment, local_id in self._search(snapshot, query, k, None, rescore_factor)}
+                hits += len(found & set(truth.tolist()))
+            report[name] = hits / (len(queries) * k)
+        return report
+
+    # ---------- 查询 ----------
+
+    def get(self, ids: Optional[List[str]] = None, where: Optional[Dict[str, Any]] = None,
+            include: Iterable[str] = ("documents", "metadatas"), **kwargs: Any) -> Dict[str, Any]:
+        """
+        按ID或元数据读取文档，返回格式与 Chroma 的 get 相同
+        :param ids: 文档ID列表，None 表示不按ID筛选
+        :param where: 元数据过滤条件
+        :param include: 返回的字段：documents / metadatas / embeddings
+        :return: {"ids": [...], "documents": [...], "metadatas": [...], "embeddings": [...]}
+        """
+        snapshot = self._acquire_snapshot()
+        try:
+            return self._get(snapshot, ids, where, include)
+        finally:
+            self._release_snapshot(snapshot)
+
+    def _get(self, snapshot: tuple, ids: Optional[List[str]], where: Optional[Dict[str, Any]],
+             include: Iterable[str]) -> Dict[str, Any]:
+        segments, _, _, id_map, live_masks = snapshot
+        if ids is not None:
+            positions = [id_map[doc_id] for doc_id in ids if doc_id in id_map]
+            if where:
+                matched = {
+                    segment.base_id + int(local_id)
+                    for segment in segments for local_id in np.flatnonzero(segment.match(where))
+                }
+                positions = [global_id for global_id in positions if global_id in matched]
+        else:
+            positions = [
+                segment.base_id + int(local_id)
+                for segment, live in zip(segments, live_masks)
+                for local_id in np.flatnonzero(segment.match(where) & live if where else live)
+            ]
+
+        result: Dict[str, Any] = {"ids": [], "documents": [], "metadatas": [], "embeddings": []}
+        for global_id in positions:
+            segment = self._find_segment(segments, global_id)
+            local_id = global_id - segment.base_id
+            result["ids"].append(segment.ids[local_id])
+            if "documents" in include or "metadatas" in include:
+                doc = segment.get_document(local_id)
+                result["documents"].append(doc["page_content"])
+                result["metadatas"].append(doc.get("metadata") or None)
+            if "embeddings" in include:
+                result["embeddings"].append(segment.vectors(np.array([local_id]))[0].tolist())
+        return result
+
+    def similarity_search_by_vector_with_score(self, embedding: List[float], k: int = 4,
+                                               filter: Optional[Dict[str, Any]] = None) -> List[Tuple[Document, float]]:
+        """
+        按向量检索，过滤条件在 HNSW 搜索时生效（不是先检索再过滤）
+        :param embedding: 查询向量
+        :param k: 返回数量
+        :param filter: 元数据过滤条件
+        :return: 按余弦相似度降序排列的 (文档, 相似度)
+        """
+        query = _normalize(np.asarray([embedding], dtype=np.float32))[0]
+        snapshot = self._acquire_snapshot()
+        try:
+            results = []
+            for score, segment, local_id in self._search(snapshot, query, k, filter, self.rescore_factor):
+                doc = segment.get_document(local_id)
+                results.append((Document(id=segment.ids[local_id], page_content=doc["page_content"],
+                                         metadata=doc.get("metadata") or {}), score))
+            return results
+        finally:
+            self._release_snapshot(snapshot)
+
+    def _search(self, snapshot: tuple, query: np.ndarray, k: int, filter: Optional[Dict[str, Any]],
+                rescore_factor: int) -> List[Tuple[float, _HNSWSegment, int]]:
+        """在快照的各段中检索并合并结果，返回相似度最高的 k 个 (相似度, 段, 段内序号)"""
+        segments, _, _, _, live_masks = snapshot
+        candidates = []
+        for segment, live in zip(segments, live_masks):
+            allowed = segment.match(filter) & live if filter else live
+            for score, local_id in segment.search(query, k, allowed, self.ef_search, self.exact_search_threshold,
+                                                  rescore_factor):
+                candidates.append((score, segment, local_id))
+        candidates.sort(key=lambda item: item[0], reverse=True)
+        return candidates[:k]
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4,
+                                    filter: Optional[Dict[str, Any]] = None, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_by_vector_with_score(embedding, k, filter)]
+
+    def similarity_search_with_score(self, query: str, k: int = 4, filter: Optional[Dict[str, Any]] = None,
+                                     **kwargs: Any) -> List[Tuple[Document, float]]:
+        return self.similarity_search_by_vector_with_score(self.embedding_function.embed_query(query), k, filter)
+
+    def similarity_search(self, query: str, k: int = 4, filter: Optional[Dict[str, Any]] = None,
+                          **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, filter)]
+
+    async def asimilarity_search(self, query: str, k: int = 4, filter: Optional[Dict[str, Any]] = None,
+                                 **kwargs: Any) -> List[Document]:
+        """异步检索：查询向量用异步接口计算，检索在线程中执行"""
+        embedding = await self.embedding_function.aembed_query(query)
+        return await asyncio.to_thread(self.similarity_search_by_vector, embedding, k, filter)
+
+    def _select_relevance_score_fn(self):
+        return lambda score: score
+
+    def add_texts(self, texts: Iterable[str], metadatas: Optional[List[dict]] = None,
+                  ids: Optional[List[str]] = None, **kwargs: Any) -> List[str]:
+        texts = list(texts)
+        ids = list(ids) if ids else [str(uuid.uuid4()) for _ in texts]
+        self.upsert(ids, self.embedding_function.embed_documents(texts), texts, metadatas)
+        return ids
+
+    @classmethod
+    def from_texts(cls, texts: List[str], embedding: Embeddings, metadatas: Optional[List[dict]] = None,
+                   ids: Optional[List[str]] = None, index_dir: str = "data/hnsw_index",
+                   **kwargs: Any) -> "HNSWVectorStore":
+        store = cls(index_dir, embedding, **kwargs)
+        store.add_texts(texts, metadatas=metadatas, ids=ids)
+        return store
@@ -0,0 +1,182 @@
+import asyncio
+import hashlib
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, List, Optional, Sequence
+
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from app.core.logger_handler import logger
+
+# 各检索路的名称（延迟统计的键）
+DENSE_LEG = "dense"
+SPARSE_LEG = "sparse"
+TOTAL = "total"
+
+
+def document_key(doc: Document) -> str:
+    """
+    文档片段的去重键：优先使用片段ID；没有ID（旧版BM25索引）时使用 来源文件MD5 + 内容摘要
+    :param doc: 文档
+    :return: 去重键
+    """
+    if doc.id:
+        return doc.id
+    digest = hashlib.sha1(doc.page_content.encode("utf-8")).hexdigest()
+    return f"{doc.metadata.get('file_hash', '')}:{digest}"
+
+
+def reciprocal_rank_fusion(
+        result_lists: Sequence[List[Document]],
+        weights: Optional[Sequence[float]] = None,
+        rrf_k: int = 60,
+        limit: Optional[int] = None,
+) -> List[Document]:
+    """
+    倒数排名融合（RRF）：score(d) = Σ weight_i / (rrf_k + rank_i(d))，同一片段在各路结果中按去重键合并
+    :param result_lists: 各路检索结果（按相关度降序）
+    :param weights: 各路权重，默认相等
+    :param rrf_k: 平滑常数，越大排名靠后的文档权重衰减越慢
+    :param limit: 返回数量上限，None 表示全部
+    :return: 按融合分数降序排列、已去重的文档
+    """
+    weights = weights or [1.0] * len(result_lists)
+    scores: Dict[str, float] = {}
+    documents: Dict[str, Document] = {}
+    for results, weight in zip(result_lists, weights):
+        for rank, doc in enumerate(results, start=1):
+            key = document_key(doc)
+            scores[key] = scores.get(key, 0.0) + weight / (rrf_k + rank)
+            # 同一片段优先保留带ID的版本（向量库返回的文档）
+            if key not in documents or (doc.id and not documents[key].id):
+                documents[key] = doc
+    ranked = sorted(scores, key=scores.get, reverse=True)
+    return [documents[key] for key in ranked[:limit]]
+
+
+class RetrievalLatency:
+    """各检索路最近若干次的耗时统计（毫秒），用于健康检查接口"""
+
+    def __init__(self, window: int = 1000):
+        self._lock = threading.Lock()
+        self._samples: Dict[str, deque] = {}
+        self._counts: Dict[str, int] = {}
+        self._failures: Dict[str, int] = {}
+        self.window = window
+
+    def observe(self, leg: str, elapsed_ms: float, failed: bool = False):
+        with self._lock:
+            self._samples.setdefault(leg, deque(maxlen=self.window)).append(elapsed_ms)
+            self._counts[leg] = self._counts.get(leg, 0) + 1
+            if failed:
+                self._failures[leg] = self._failures.get(leg, 0) + 1
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        检索耗时统计
+        :return: 每路（dense / sparse / fusion / total）的调用次数、失败次数、最近窗口内的 p50 / p95 / 最大值
+        """
+        with self._lock:
+            result = {}
+            for leg, samples in self._samples.items():
+                ordered = sorted(samples)
+                result[leg] = {
+                    "count": self._counts[leg],
+                    "failures": self._failures.get(leg, 0),
+                    "p50_ms": round(ordered[len(ordered) // 2], 2),
+                    "p95_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 2),
+                    "max_ms": round(ordered[-1], 2),
+                }
+            return result
+
+
+retrieval_latency = RetrievalLatency()
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    并行混合检索器：向量检索与 BM25 检索用 asyncio.gather 同时执行（同步的查询放到线程中），
+    按倒数排名融合并按片段ID去重，只把融合后排名靠前的候选交给重排序模型
+    某一路失败时只使用另一路的结果
+    """
+    vector_store: Any
+    bm25_index: Any
+    partitions: List[str]
+    filter: Optional[Dict[str, Any]] = None
+    fetch_k: int = 5
+    max_candidates: int = 5
+    rrf_k: int = 60
+    weights: List[float] = [0.5, 0.5]
+
+    def _dense_search(self, query: str) -> List[Document]:
+        return self.vector_store.similarity_search(query, k=self.fetch_k, filter=self.filter)
+
+    def _sparse_search(self, query: str) -> List[Document]:
+        return self.bm25_index.search(query, k=self.fetch_k, partitions=self.partitions)
+
+    def _run_leg(self, leg: str, func, query: str, timings: Dict[str, float], failed: set) -> List[Document]:
+        """执行一路检索并记录耗时，失败时返回空结果"""
+        start = time.perf_counter()
+        try:
+            return func(query)
+        except Exception as e:
+            failed.add(leg)
+            logger.error(f"【混合检索】{leg} 检索失败，只使用另一路的结果: {e}")
+            return []
+        finally:
+            timings[leg] = (time.perf_counter() - start) * 1000
+
+    def _fuse(self, query: str, dense: List[Document], sparse: List[Document],
+              timings: Dict[str, float], failed: set) -> List[Document]:
+        """融合两路结果，记录各路耗时"""
+        start = time.perf_counter()
+        fused = reciprocal_rank_fusion([dense, sparse], self.weights, self.rrf_k, self.max_candidates)
+        timings["fusion"] = (time.perf_counter() - start) * 1000
+        for leg, elapsed_ms in timings.items():
+            retrieval_latency.observe(leg, elapsed_ms, failed=leg in failed)
+        logger.info(
+            f"【混合检索】查询: {query}，向量 {len(dense)} 条 / BM25 {len(sparse)} 条 -> 融合去重后 {len(fused)} 条，"
+            + "，".join(f"{leg} {elapsed_ms:.1f}ms" for leg, elapsed_ms in timings.items())
+        )
+        return fused
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        timings, failed = {}, set()
+        start = time.perf_counter()
+        dense = self._run_leg(DENSE_LEG, self._dense_search, query, timings, failed)
+        sparse = self._run_leg(SPARSE_LEG, self._sparse_search, query, timings, failed)
+        timings[TOTAL] = (time.perf_counter() - start) * 1000
+        return self._fuse(query, dense, sparse, timings, failed)
+
+    async def _adense_search(self, query: str) -> List[Document]:
+        """查询向量用异步接口计算，同步的向量库查询在线程中执行"""
+        embedding = await self.vector_store.embeddings.aembed_query(query)
+        return await asyncio.to_thread(
+            self.vector_store.similarity_search_by_vector, embedding, k=self.fetch_k, filter=self.filter
+        )
+
+    async def _arun_leg(self, leg: str, search, timings: Dict[str, float], failed: set) -> List[Document]:
+        start = time.perf_counter()
+        try:
+            return await search
+        except Exception as e:
+            failed.add(leg)
+            logger.error(f"【混合检索】{leg} 检索失败，只使用另一路的结果: {e}")
+            return []
+        finally:
+            timings[leg] = (time.perf_counter() - start) * 1000
+
+    async def _aget_relevant_documents(
+            self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        timings, failed = {}, set()
+        start = time.perf_counter()
+        dense, sparse = await asyncio.gather(
+            self._arun_leg(DENSE_LEG, self._adense_search(query), timings, failed),
+            self._arun_leg(SPARSE_LEG, asyncio.to_thread(self._sparse_search, query), timings, failed),
+        )
+        timings[TOTAL] = (time.perf_counter() - start) * 1000
+        return self._fuse(query, dense, sparse, timings, failed)
@@ -0,0 +1,270 @@
+import asyncio
+import hashlib
+import json
+import os
+import shutil
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+import aiofiles
+from fastapi import UploadFile
+
+from app.core.logger_handler import logger
+from app.db.redis_config import connect_redis
+from app.rag.ingestion_pipeline import FileTask
+from app.rag.rag_service import get_rag_service
+from app.utils.config import chroma_config
+from app.utils.path_tool import get_abstract_path
+
+# Redis 键：任务详情（JSON字符串）、待处理队列、每个服务实例的处理中队列、实例心跳（带过期时间）
+JOB_KEY_PREFIX = "ingestion:job:"
+QUEUE_KEY = "ingestion:queue"
+PROCESSING_KEY_PREFIX = "ingestion:processing:"
+HEARTBEAT_KEY_PREFIX = "ingestion:heartbeat:"
+# 旧版本所有实例共用的处理中队列，启动时一并恢复
+LEGACY_PROCESSING_KEY = "ingestion:processing"
+
+# 上传文件落盘时每次读取的大小
+_SPOOL_CHUNK_SIZE = 1024 * 1024
+
+
+class IngestionJobManager:
+    """
+    后台文档入库任务
+
+    - 上传接口只负责把文件暂存到磁盘并登记任务，立即返回任务ID
+    - 任务详情和队列都保存在 Redis 中，服务内的工作协程从队列取任务执行入库流水线，并逐个文件更新进度
+    - 每个服务实例有自己的处理中队列和心跳键，任务执行时先移入本实例的处理中队列；
+      心跳过期（实例退出或卡死）后，其他实例或重启后的服务才把它处理中的任务放回队列重新执行（已入库的文件按MD5跳过，
+      入库到一半的文件由同一任务接管清单中的占用、清理已写入的片段后重新入库），
+      其他实例正在执行的任务不会被重复执行
+    """
+
+    def __init__(self, config: Optional[Dict[str, Any]] = None):
+        """
+        :param config: 任务配置，见 chroma.yaml 中的 ingestion_jobs
+        """
+        config = config or {}
+        self.workers = config.get('workers', 1)
+        self.spool_directory = get_abstract_path(config.get('spool_directory', 'data/ingestion_spool'))
+        self.job_ttl_seconds = config.get('job_ttl_seconds', 7 * 24 * 3600)
+        self.heartbeat_interval = config.get('heartbeat_interval', 10)
+        self.heartbeat_ttl_seconds = config.get('heartbeat_ttl_seconds', 60)
+        self.instance_id = uuid.uuid4().hex
+        self.processing_key = PROCESSING_KEY_PREFIX + self.instance_id
+        self.heartbeat_key = HEARTBEAT_KEY_PREFIX + self.instance_id
+        self._tasks: List[asyncio.Task] = []
+
+    async def submit(self, files: List[UploadFile], user_id: str, department_id: Optional[str] = None) -> str:
+        """
+        暂存上传的文件并登记入库任务
+        :param files: 上传的文件列表
+        :param user_id: 用户ID
+        :param department_id: 部门ID，有值时文档在该部门内共享，否则仅上传者本人可见
+        :return: 任务ID
+        """
+        job_id = uuid.uuid4().hex
+        job_dir = os.path.join(self.spool_directory, job_id)
+        await asyncio.to_thread(os.makedirs, job_dir, exist_ok=True)
+
+        job_files = []
+        try:
+            for index, file in enumerate(files):
+                # 加序号避免同名文件互相覆盖，保留扩展名用于选择加载器
+                path = os.path.join(job_dir, f"{index:04d}_{os.path.basename(file.filename)}")
+                # 分块写入并同时计算md5，入库时不必再读一遍文件
+                md5_object = hashlib.md5()
+                await file.seek(0)
+                async with aiofiles.open(path, "wb") as f:
+                    while chunk := await file.read(_SPOOL_CHUNK_SIZE):
+                        md5_object.update(chunk)
+                        await f.write(chunk)
+                job_files.append({
+                    "name": file.filename,
+                    "path": path,
+                    "file_hash": md5_object.hexdigest(),
+                    "status": "pending",
+                    "chunks": 0,
+                    "error": "",
+                })
+        except Exception:
+            await asyncio.to_thread(shutil.rmtree, job_dir, True)
+            raise
+
+        now = time.time()
+        job = {
+            "job_id": job_id,
+            "user_id": user_id,
+            "department_id": department_id,
+            "status": "queued",
+            "created_at": now,
+            "updated_at": now,
+            "files": job_files,
+            "stats": {},
+            "error": "",
+        }
+        await self._save(job)
+        redis_client = await connect_redis()
+        await redis_client.lpush(QUEUE_KEY, job_id)
+        logger.info(f"【入库任务】任务 {job_id} 已登记，用户: {user_id}，文件数: {len(job_files)}")
+        return job_id
+
+    async def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """
+        查询任务详情
+        :param job_id: 任务ID
+        :return: 任务详情（含进度），不存在时返回 None
+        """
+        redis_client = await connect_redis()
+        data = await redis_client.get(JOB_KEY_PREFIX + job_id)
+        if not data:
+            return None
+        job = json.loads(data)
+        finished = sum(1 for file in job["files"] if file["status"] != "pending")
+        job["progress"] = {"finished": finished, "total": len(job["files"])}
+        for file in job["files"]:
+            file.pop("path", None)
+        return job
+
+    async def _save(self, job: Dict[str, Any]):
+        """写回任务详情，序列化在写入时进行，保证后写入的总是最新状态"""
+        job["updated_at"] = time.time()
+        redis_client = await connect_redis()
+        await redis_client.set(JOB_KEY_PREFIX + job["job_id"], json.dumps(job, ensure_ascii=False),
+                               ex=self.job_ttl_seconds)
+
+    async def start(self):
+        """写入本实例的心跳后启动工作协程，并把心跳已过期的实例未执行完的任务放回队列"""
+        redis_client = await connect_redis()
+        # 先写心跳再取任务，其他实例恢复时不会误判本实例的处理中队列
+        await redis_client.set(self.heartbeat_key, time.time(), ex=self.heartbeat_ttl_seconds)
+        await self.recover_expired()
+        self._tasks = [asyncio.create_task(self._heartbeat())]
+        self._tasks += [asyncio.create_task(self._worker(index)) for index in range(self.workers)]
+        logger.info(f"【入库任务】实例 {self.instance_id} 已启动 {self.workers} 个工作协程")
+
+    async def stop(self):
+        """停止工作协程并删除心跳，执行中的任务留在处理中队列，由其他实例或下次启动时重新执行"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        try:
+            redis_client = await connect_redis()
+            await redis_client.delete(self.heartbeat_key)
+        except Exception as e:
+            logger.warning(f"【入库任务】删除实例 {self.instance_id} 的心跳失败: {e}")
+
+    async def recover_expired(self) -> int:
+        """
+        把心跳已过期的实例处理中队列里的任务放回待处理队列
+        :return: 恢复的任务数
+        """
+        redis_client = await connect_redis()
+        expired = [LEGACY_PROCESSING_KEY]
+        async for key in redis_client.scan_iter(match=PROCESSING_KEY_PREFIX + "*"):
+            instance_id = key[len(PROCESSING_KEY_PREFIX):]
+            if not await redis_client.exists(HEARTBEAT_KEY_PREFIX + instance_id):
+                expired.append(key)
+        recovered = 0
+        for key in expired:
+            # LMOVE 是原子操作，多个实例同时恢复时每个任务只会被放回一次
+            while await redis_client.lmove(key, QUEUE_KEY, "LEFT", "RIGHT"):
+                recovered += 1
+        if recovered:
+            logger.info(f"【入库任务】恢复 {recovered} 个未完成的任务")
+        return recovered
+
+    async def _heartbeat(self):
+        """定期续期本实例的心跳，并恢复其他已退出实例的任务"""
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            try:
+                redis_client = await connect_redis()
+                await redis_client.set(self.heartbeat_key, time.time(), ex=self.heartbeat_ttl_seconds)
+                await self.recover_expired()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"【入库任务】实例 {self.instance_id} 续期心跳出错: {e}")
+
+    async def _worker(self, index: int):
+        """从队列中取任务执行"""
+        while True:
+            try:
+                redis_client = await connect_redis()
+                job_id = await redis_client.blmove(QUEUE_KEY, self.processing_key, 5, "RIGHT", "LEFT")
+                if not job_id:
+                    continue
+                await self._run_job(job_id)
+                await redis_client.lrem(self.processing_key, 0, job_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"【入库任务】工作协程 {index} 出错: {e}")
+                await asyncio.sleep(1)
+
+    async def _run_job(self, job_id: str):
+        """执行单个入库任务"""
+        redis_client = await connect_redis()
+        data = await redis_client.get(JOB_KEY_PREFIX + job_id)
+        if not data:
+            logger.warning(f"【入库任务】任务 {job_id} 不存在或已过期，跳过")
+            return
+        job = json.loads(data)
+        # 重启后恢复的任务只处理尚未完成的文件
+        files_by_path = {file["path"]: file for file in job["files"]}
+        pending = [
+            # 以任务ID作为入库清单中的占用者，实例退出后任务被重新执行时可以接管上次的占用
+            FileTask(path=file["path"], md5_hex=file.get("file_hash", ""), claim_owner=job_id)
+            for file in job["files"] if file["status"] == "pending"
+        ]
+        job["status"] = "running"
+        await self._save(job)
+        logger.info(f"【入库任务】开始执行任务 {job_id}，待处理文件: {len(pending)}")
+        # 逐个文件写回进度的协程，保留引用避免被回收，任务结束前全部等待完成
+        saves = set()
+
+        def on_file_done(task, status):
+            file = files_by_path.get(task.path)
+            if file is None:
+                return
+            file["status"] = status
+            file["chunks"] = len(task.chunk_ids) if status == "ingested" else 0
+            file["error"] = task.error
+            save = asyncio.get_running_loop().create_task(self._save(job))
+            saves.add(save)
+            save.add_done_callback(saves.discard)
+
+        try:
+            job["stats"] = await get_rag_service().add_documents(
+                file_paths=pending, user_id=job["user_id"], on_file_done=on_file_done,
+                department_id=job.get("department_id"),
+            )
+            job["status"] = "completed"
+        except Exception as e:
+            logger.error(f"【入库任务】任务 {job_id} 执行失败: {e}")
+            job["status"] = "failed"
+            job["error"] = str(e)
+
+        for result in await asyncio.gather(*saves, return_exceptions=True):
+            if isinstance(result, Exception):
+                logger.warning(f"【入库任务】任务 {job_id} 写回进度失败: {result}")
+        await self._save(job)
+        await asyncio.to_thread(shutil.rmtree, os.path.join(self.spool_directory, job_id), True)
+        logger.info(f"【入库任务】任务 {job_id} 结束，状态: {job['status']}")
+
+
+# 全局入库任务管理器
+ingestion_job_manager = IngestionJobManager(chroma_config.get('ingestion_jobs'))
+
+
+async def init_ingestion_jobs():
+    """启动后台入库任务的工作协程（应用启动时调用）"""
+    await ingestion_job_manager.start()
+
+
+async def close_ingestion_jobs():
+    """停止后台入库任务的工作协程（应用关闭时调用）"""
+    await ingestion_job_manager.stop()
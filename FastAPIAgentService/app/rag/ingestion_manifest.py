@@ -0,0 +1,287 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from app.core.logger_handler import logger
+from app.rag.bm25_index import PUBLIC_PARTITION, USER_PARTITION_PREFIX
+from app.utils.config import chroma_config
+from app.utils.path_tool import get_abstract_path
+
+# 入库记录的状态：pending 为入库中（已在哈希阶段占用），done 为已入库
+STATUS_PENDING = "pending"
+STATUS_DONE = "done"
+# 入库中的记录超过该时长（秒）未完成时视为进程已退出，允许重新入库
+PENDING_CLAIM_TIMEOUT = 2 * 3600
+# claim 的结果：新占用；接管了同一任务（如服务重启后重新执行的后台任务）或已超时的占用，上次可能写入了部分片段
+CLAIM_NEW = "new"
+CLAIM_RESUMED = "resumed"
+
+
+class IngestionManifest:
+    """
+    入库清单（SQLite）
+
+    - 每个文件在每个可见范围内一行：(文件MD5, 可见范围) 为主键，另记录所属用户、文档片段ID、嵌入模型、入库时间；
+      可见范围即文档所在的检索分区（public、user_<用户ID>、dept_<部门ID>），查重只在同一范围内进行，
+      其他用户上传同一文件、或把文件共享到另一个范围时照常入库
+    - WAL 模式 + busy_timeout，多个进程/线程同时写入时由 SQLite 串行化，不会互相覆盖
+    - 哈希阶段用 INSERT ... ON CONFLICT DO NOTHING 原子地占用 (文件MD5, 可见范围)，写入 pending 状态的记录，
+      同一文件被同时上传时只有一个任务继续入库；入库完成后改为 done，失败时删除占用；
+      占用记录保存占用者（后台任务ID），任务在实例退出后被重新执行时可以接管自己的占用
+    - 记录了片段ID，可以只删除或重建某一个文件的向量
+    - settings 表保存一次性数据迁移等的完成标记，以及各进程共享的计数（如检索器版本）
+    """
+
+    def __init__(self, db_path: str, legacy_md5_store: Optional[str] = None):
+        """
+        :param db_path: SQLite 文件路径
+        :param legacy_md5_store: 旧版 md5_hex_store.txt 路径，清单为空时导入其中的MD5作为查重记录
+        """
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(files)")}
+        if columns and "scope" not in columns:
+            self._migrate_scope()
+        elif columns:
+            if "status" not in columns:
+                self._conn.execute(f"ALTER TABLE files ADD COLUMN status TEXT NOT NULL DEFAULT '{STATUS_DONE}'")
+            if "owner" not in columns:
+                self._conn.execute("ALTER TABLE files ADD COLUMN owner TEXT")
+        self._conn.execute(self._CREATE_FILES_TABLE.format(table="files"))
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_files_user_id ON files (user_id)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self._conn.commit()
+        if legacy_md5_store:
+            self._import_legacy(legacy_md5_store)
+
+    _CREATE_FILES_TABLE = (
+        "CREATE TABLE IF NOT EXISTS {table} ("
+        "file_hash TEXT NOT NULL, scope TEXT NOT NULL, user_id TEXT, chunk_ids TEXT NOT NULL, "
+        "embedding_model TEXT, ingested_at REAL NOT NULL, "
+        f"status TEXT NOT NULL DEFAULT '{STATUS_DONE}', owner TEXT, PRIMARY KEY (file_hash, scope))"
+    )
+
+    def _migrate_scope(self):
+        """
+        旧版清单按文件MD5唯一，迁移为按 (文件MD5, 可见范围) 唯一：
+        有用户ID的记录视为该用户的个人文档，其余为公共文档
+        """
+        with self._lock:
+            self._conn.execute("DROP TABLE IF EXISTS files_migrating")
+            self._conn.execute(self._CREATE_FILES_TABLE.format(table="files_migrating"))
+            self._conn.execute(
+                "INSERT INTO files_migrating (file_hash, scope, user_id, chunk_ids, embedding_model, ingested_at) "
+                "SELECT file_hash, CASE WHEN user_id IS NULL OR user_id = '' THEN ? ELSE ? || user_id END, "
+                "user_id, chunk_ids, embedding_model, ingested_at FROM files",
+                (PUBLIC_PARTITION, USER_PARTITION_PREFIX),
+            )
+            self._conn.execute("DROP TABLE files")
+            self._conn.execute("ALTER TABLE files_migrating RENAME TO files")
+            self._conn.commit()
+        logger.info("【入库清单】已将入库记录迁移为按文件和可见范围查重")
+
+    def _import_legacy(self, path: str):
+        """导入旧版MD5记录（没有片段ID，只用于查重）"""
+        if not os.path.exists(path) or self._conn.execute("SELECT 1 FROM files LIMIT 1").fetchone():
+            return
+        with open(path, 'r', encoding="utf-8") as f:
+            hashes = {line.strip() for line in f if line.strip()}
+        if not hashes:
+            return
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO files (file_hash, scope, user_id, chunk_ids, embedding_model, ingested_at) "
+                "VALUES (?, ?, NULL, '[]', NULL, ?)",
+                [(file_hash, PUBLIC_PARTITION, time.time()) for file_hash in hashes],
+            )
+            self._conn.commit()
+        logger.info(f"【入库清单】已从 {path} 导入 {len(hashes)} 条MD5记录")
+
+    _ENTRY_COLUMNS = "file_hash, scope, user_id, chunk_ids, embedding_model, ingested_at"
+
+    @staticmethod
+    def _to_entry(row) -> Dict[str, Any]:
+        file_hash, scope, user_id, chunk_ids, embedding_model, ingested_at = row
+        return {
+            "file_hash": file_hash,
+            "scope": scope,
+            "user_id": user_id,
+            "chunk_ids": json.loads(chunk_ids),
+            "embedding_model": embedding_model,
+            "ingested_at": ingested_at,
+        }
+
+    def contains(self, file_hash: str, scope: str) -> bool:
+        """
+        文件是否已在该可见范围内完成入库
+        :param file_hash: 文件MD5
+        :param scope: 可见范围（检索分区名）
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM files WHERE file_hash = ? AND scope = ? AND status = ?", (file_hash, scope, STATUS_DONE)
+            ).fetchone()
+        return row is not None
+
+    def get(self, file_hash: str, scope: str) -> Optional[Dict[str, Any]]:
+        """
+        查询单个文件在某个可见范围内的入库记录
+        :param file_hash: 文件MD5
+        :param scope: 可见范围（检索分区名）
+        :return: 入库记录，不存在时返回 None
+        """
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT {self._ENTRY_COLUMNS} FROM files WHERE file_hash = ? AND scope = ? AND status = ?",
+                (file_hash, scope, STATUS_DONE),
+            ).fetchone()
+        return self._to_entry(row) if row else None
+
+    def list_by_file(self, file_hash: str) -> List[Dict[str, Any]]:
+        """
+        查询文件在各个可见范围内的入库记录（不同用户、不同范围各自一条）
+        :param file_hash: 文件MD5
+        :return: 入库记录列表
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT {self._ENTRY_COLUMNS} FROM files WHERE file_hash = ? AND status = ?", (file_hash, STATUS_DONE)
+            ).fetchall()
+        return [self._to_entry(row) for row in rows]
+
+    def list_by_user(self, user_id: str) -> List[Dict[str, Any]]:
+        """
+        查询用户的全部入库记录
+        :param user_id: 用户ID
+        :return: 入库记录列表，按入库时间倒序
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT {self._ENTRY_COLUMNS} FROM files WHERE user_id = ? AND status = ? ORDER BY ingested_at DESC",
+                (user_id, STATUS_DONE),
+            ).fetchall()
+        return [self._to_entry(row) for row in rows]
+
+    def claim(self, file_hash: str, scope: str, user_id: Optional[str], owner: Optional[str] = None) -> Optional[str]:
+        """
+        原子地占用 (文件MD5, 可见范围)，写入 pending 状态的记录；入库完成后调用 record，失败时调用 release
+        已入库、或其他任务正在入库（占用者不同且未超过 PENDING_CLAIM_TIMEOUT）时占用失败
+        :param file_hash: 文件MD5
+        :param scope: 可见范围（检索分区名）
+        :param user_id: 上传者的用户ID
+        :param owner: 占用者（后台任务ID），同一占用者可以接管自己未完成的占用
+        :return: 占用失败时返回 None；新占用返回 CLAIM_NEW；接管已有占用返回 CLAIM_RESUMED，调用方需先清理上次写入的片段
+        """
+        now = time.time()
+        with self._lock:
+            # IMMEDIATE 事务内先查再写，其他进程的 claim 等待本事务结束，接管与新占用的判断不会交错
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                existed = self._conn.execute(
+                    "SELECT 1 FROM files WHERE file_hash = ? AND scope = ?", (file_hash, scope)
+                ).fetchone() is not None
+                cursor = self._conn.execute(
+                    f"INSERT INTO files ({self._ENTRY_COLUMNS}, status, owner) VALUES (?, ?, ?, '[]', NULL, ?, ?, ?) "
+                    "ON CONFLICT (file_hash, scope) DO UPDATE SET user_id = excluded.user_id, "
+                    "ingested_at = excluded.ingested_at, owner = excluded.owner "
+                    "WHERE files.status = ? AND (files.ingested_at < ? OR files.owner = excluded.owner)",
+                    (file_hash, scope, user_id, now, STATUS_PENDING, owner,
+                     STATUS_PENDING, now - PENDING_CLAIM_TIMEOUT),
+                )
+                self._conn.commit()
+            except Exception:
+                self._conn.rollback()
+                raise
+        if cursor.rowcount <= 0:
+            return None
+        return CLAIM_RESUMED if existed else CLAIM_NEW
+
+    def release(self, file_hash: str, scope: str):
+        """入库失败或跳过时删除 claim 写入的占用记录，之后可以重新上传"""
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM files WHERE file_hash = ? AND scope = ? AND status = ?",
+                (file_hash, scope, STATUS_PENDING),
+            )
+            self._conn.commit()
+
+    def record(self, file_hash: str, scope: str, user_id: Optional[str], chunk_ids: List[str], embedding_model: str):
+        """
+        写入（或覆盖）文件在某个可见范围内的入库记录，状态为已入库
+        :param file_hash: 文件MD5
+        :param scope: 可见范围（检索分区名）
+        :param user_id: 上传者的用户ID，系统知识库文件为 None
+        :param chunk_ids: 文档片段ID
+        :param embedding_model: 嵌入模型名称
+        """
+        with self._lock:
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO files ({self._ENTRY_COLUMNS}, status) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (file_hash, scope, user_id, json.dumps(chunk_ids), embedding_model, time.time(), STATUS_DONE),
+            )
+            self._conn.commit()
+
+    def remove(self, file_hash: str, scope: str) -> bool:
+        """删除单个文件在某个可见范围内的入库记录"""
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM files WHERE file_hash = ? AND scope = ?", (file_hash, scope))
+            self._conn.commit()
+        return cursor.rowcount > 0
+
+    def remove_user(self, user_id: str) -> int:
+        """删除用户的全部入库记录，返回删除条数"""
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM files WHERE user_id = ?", (user_id,))
+            self._conn.commit()
+        return cursor.rowcount
+
+    def get_setting(self, key: str) -> Optional[str]:
+        """读取设置项，不存在时返回 None"""
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM settings WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_setting(self, key: str, value: str):
+        """写入设置项"""
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)", (key, value))
+            self._conn.commit()
+
+    def increment_setting(self, key: str) -> int:
+        """
+        原子地把整数设置项加一（不存在时从 0 开始），多个进程同时递增时不会丢失
+        :param key: 设置项
+        :return: 递增后的值
+        """
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(
+                    "INSERT INTO settings (key, value) VALUES (?, '1') "
+                    "ON CONFLICT (key) DO UPDATE SET value = CAST(settings.value AS INTEGER) + 1",
+                    (key,),
+                )
+                value = self._conn.execute("SELECT value FROM settings WHERE key = ?", (key,)).fetchone()[0]
+                self._conn.commit()
+            except Exception:
+                self._conn.rollback()
+                raise
+        return int(value)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+# 全局入库清单，首次创建时导入旧版 md5_hex_store.txt
+ingestion_manifest = IngestionManifest(
+    get_abstract_path(chroma_config.get('ingestion_manifest', 'data/ingestion_manifest/manifest.sqlite3')),
+    legacy_md5_store=get_abstract_path(chroma_config['md5_hex_store']),
+)
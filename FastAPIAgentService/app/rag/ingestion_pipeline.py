@@ -0,0 +1,351 @@
+import asyncio
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Union
+
+from langchain_core.documents import Document
+
+from app.core.logger_handler import logger
+from app.rag.bm25_index import bm25_index, partition_of
+from app.rag.document_summarizer import DocumentSummarizer
+from app.rag.ingestion_manifest import CLAIM_RESUMED
+from app.rag.retrieval_scope import VISIBILITY_DEPARTMENT, VISIBILITY_PRIVATE, VISIBILITY_PUBLIC
+from app.utils.file_handler import get_file_md5_hex
+
+# 队列结束标记
+_STOP = object()
+
+
+@dataclass
+class FileTask:
+    """单个文件在流水线中的状态"""
+    # 文件路径
+    path: str
+    # 已计算好的md5值（如上传落盘时边写边算）可直接传入，跳过哈希阶段的读取
+    md5_hex: str = ""
+    # 已切分的文档片段及其ID（文件完成后整体写入BM25索引）
+    chunks: List[Document] = field(default_factory=list)
+    chunk_ids: List[str] = field(default_factory=list)
+    # 启用入库摘要时按顺序为片段划分章节，同一文件的多批片段连续编号
+    sections: Dict[str, int] = field(default_factory=lambda: {"section": 0, "chars": 0})
+    # 解析阶段按批交给切分阶段，记录尚未切分的批数；解析完成且全部切分后发出结束标记
+    parts_pending: int = 0
+    # 解析阶段为每批编号；切分阶段并发时各批完成的顺序不确定，按编号依次记录片段、划分章节
+    parts_parsed: int = 0
+    next_part: int = 0
+    part_turn: asyncio.Condition = field(default_factory=asyncio.Condition)
+    parse_done: bool = False
+    split_done: bool = False
+    total_batches: int = 0
+    done_batches: int = 0
+    failed: bool = False
+    error: str = ""
+    # 入库清单中占用记录的占用者（后台任务ID），任务重新执行时可以接管自己的占用
+    claim_owner: Optional[str] = None
+    # 哈希阶段已在入库清单中占用该文件，未成功入库时需要释放
+    claimed: bool = False
+
+
+class IngestionPipeline:
+    """
+    分阶段、流水线式的文档入库
+    哈希去重 -> 解析 -> 切分 -> 按固定批次嵌入 -> 写入向量库 -> 完成（可选生成入库摘要，更新BM25索引和入库清单）
+    PDF按页码范围分批解析，解析出的页按顺序逐批交给切分阶段，大文件不必等全部页解析完才开始嵌入；
+    各阶段之间用有界队列连接（上游过快时自动等待，内存占用不随上传总量增长），每个阶段的并发数可配置；
+    写入阶段只有一个协程，同一文件的所有批次写完后才交给完成阶段；
+    生成摘要需要调用大模型，放在独立的完成阶段中并发执行，不阻塞其他文件的写入
+    """
+
+    def __init__(self, store, embeddings, config: Optional[Dict[str, Any]] = None,
+                 summarizer: Optional[DocumentSummarizer] = None):
+        """
+        :param store: VectorStoreService 实例
+        :param embeddings: 嵌入模型
+        :param config: 流水线配置，见 chroma.yaml 中的 ingestion
+        :param summarizer: 入库摘要生成器，为空时不生成摘要
+        """
+        config = config or {}
+        self.store = store
+        self.embeddings = embeddings
+        self.hash_concurrency = config.get('hash_concurrency', 4)
+        self.parse_concurrency = config.get('parse_concurrency', 2)
+        self.split_concurrency = config.get('split_concurrency', 2)
+        self.embed_concurrency = config.get('embed_concurrency', 2)
+        self.embed_batch_size = config.get('embed_batch_size', 32)
+        self.queue_size = config.get('queue_size', 8)
+        self.summarizer = summarizer
+        # 完成阶段的并发数：生成摘要时与摘要的大模型并发上限一致
+        self.complete_concurrency = summarizer.max_concurrency if summarizer else 1
+        self.stats: Dict[str, Any] = {}
+
+    async def run(
+            self,
+            files: List[Union[str, FileTask]],
+            user_id: Optional[str] = None,
+            on_file_done: Optional[Callable[[FileTask, str], None]] = None,
+            department_id: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        """
+        执行入库流水线
+        :param files: 待入库的文件路径，或预先构造的文件任务（携带文件流或md5值）
+        :param user_id: 用户ID，写入每个文档片段的元数据
+        :param on_file_done: 文件处理结束（成功/跳过/失败）时的回调，参数为 (文件任务, 状态)
+        :param department_id: 部门ID，有值时文档在该部门内共享，否则仅上传者本人可见（无用户ID时为公共文档）
+        :return: 入库统计，包含 chunks_per_sec
+        """
+        self.user_id = user_id
+        self.department_id = department_id
+        if department_id:
+            self.visibility = VISIBILITY_DEPARTMENT
+        else:
+            self.visibility = VISIBILITY_PRIVATE if user_id else VISIBILITY_PUBLIC
+        # 查重与入库记录按可见范围区分，即文档所在的检索分区
+        self.scope = partition_of({"visibility": self.visibility, "user_id": user_id, "department_id": department_id})
+        self.on_file_done = on_file_done
+        self.stats = {"files": len(files), "ingested": 0, "skipped": 0, "failed": 0, "chunks": 0, "summaries": 0}
+        start_time = time.perf_counter()
+
+        hash_queue = asyncio.Queue()
+        parse_queue = asyncio.Queue(maxsize=self.queue_size)
+        split_queue = asyncio.Queue(maxsize=self.queue_size)
+        embed_queue = asyncio.Queue(maxsize=self.queue_size)
+        write_queue = asyncio.Queue(maxsize=self.queue_size)
+        complete_queue = asyncio.Queue()
+        for file in files:
+            hash_queue.put_nowait(file if isinstance(file, FileTask) else FileTask(path=file))
+        for _ in range(self.hash_concurrency):
+            hash_queue.put_nowait(_STOP)
+
+        await asyncio.gather(
+            self._stage(hash_queue, parse_queue, self._hash, self.hash_concurrency, self.parse_concurrency),
+            self._stage(parse_queue, split_queue, self._parse, self.parse_concurrency, self.split_concurrency),
+            self._stage(split_queue, embed_queue, self._split, self.split_concurrency, self.embed_concurrency),
+            self._stage(embed_queue, write_queue, self._embed, self.embed_concurrency, 1),
+            self._stage(write_queue, complete_queue, self._write, 1, self.complete_concurrency),
+            self._stage(complete_queue, None, self._complete, self.complete_concurrency, 0),
+        )
+
+        elapsed = time.perf_counter() - start_time
+        self.stats["seconds"] = round(elapsed, 3)
+        self.stats["chunks_per_sec"] = round(self.stats["chunks"] / elapsed, 2) if elapsed > 0 else 0.0
+        logger.info(
+            f"【向量数据库】入库完成，文件: {self.stats['files']}，成功: {self.stats['ingested']}，"
+            f"跳过: {self.stats['skipped']}，失败: {self.stats['failed']}，片段: {self.stats['chunks']}，"
+            f"摘要: {self.stats['summaries']}，"
+            f"耗时: {self.stats['seconds']}秒，吞吐: {self.stats['chunks_per_sec']} chunks/sec"
+        )
+        return self.stats
+
+    @staticmethod
+    async def _stage(inbox: asyncio.Queue, outbox: Optional[asyncio.Queue], handler, concurrency: int,
+                     next_concurrency: int):
+        """运行一个阶段：concurrency 个协程消费 inbox，处理结果放入 outbox，全部结束后通知下游"""
+        async def worker():
+            while (item := await inbox.get()) is not _STOP:
+                if outbox is None:
+                    await handler(item)
+                    continue
+                async for output in handler(item):
+                    await outbox.put(output)
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        if outbox is not None:
+            for _ in range(next_concurrency):
+                await outbox.put(_STOP)
+
+    def _finish(self, task: FileTask, status: str):
+        """文件处理结束：更新统计并回调"""
+        self.stats[status] += 1
+        if status == "failed":
+            logger.error(f"【向量数据库】文件 {task.path} 处理时出错: {task.error}")
+        if self.on_file_done:
+            self.on_file_done(task, status)
+
+    async def _release(self, task: FileTask):
+        """文件未能入库时释放哈希阶段的占用，之后可以重新上传"""
+        if not task.claimed:
+            return
+        try:
+            await self.store.release_file(task.md5_hex, self.scope)
+            task.claimed = False
+        except Exception as e:
+            logger.error(f"【向量数据库】释放文件 {task.path} 的入库占用失败: {e}")
+
+    async def _hash(self, task: FileTask):
+        """计算MD5，在同一可见范围内原子地占用入库记录去重，同一文件同时上传时只有一个任务继续入库"""
+        try:
+            if not task.md5_hex:
+                task.md5_hex = await get_file_md5_hex(task.path)
+            claim = await self.store.claim_file(task.md5_hex, self.scope, self.user_id, task.claim_owner)
+            if not claim:
+                logger.info(f"【向量数据库】文件 {task.path} 的md5值 {task.md5_hex} 已在 {self.scope} 中入库或正在入库，跳过")
+                self._finish(task, "skipped")
+                return
+            task.claimed = True
+            if claim == CLAIM_RESUMED:
+                # 上次入库在中途中断，先清理已写入的片段再重新入库
+                await self.store.discard_partial_file(task.md5_hex, self.scope)
+        except Exception as e:
+            task.error = str(e)
+            await self._release(task)
+            self._finish(task, "failed")
+            return
+        yield task
+
+    async def _iter_parts(self, task: FileTask):
+        """逐批加载文件内容"""
+        async for documents in self.store.iter_file_document(task.path):
+            yield documents
+
+    async def _parse(self, task: FileTask):
+        """加载文件内容，按批交给切分阶段；最后一批在标记解析完成后发出"""
+        previous = None
+        try:
+            async for documents in self._iter_parts(task):
+                if not documents:
+                    continue
+                if previous is not None:
+                    task.parts_pending += 1
+                    task.parts_parsed += 1
+                    yield task, task.parts_parsed - 1, previous
+                previous = documents
+        except Exception as e:
+            task.failed, task.error = True, str(e)
+
+        if previous is None:
+            # 没有任何内容交给下游，直接结束
+            if not task.failed:
+                logger.error(f"【向量数据库】文件 {task.path} 加载内容为空，跳过")
+            await self._release(task)
+            self._finish(task, "failed" if task.failed else "skipped")
+            return
+        task.parse_done = True
+        task.parts_pending += 1
+        task.parts_parsed += 1
+        yield task, task.parts_parsed - 1, previous
+
+    async def _split(self, item):
+        """切分一批文档并按固定大小分批；文件的最后一批切分完成后额外发出结束标记"""
+        task, part, documents = item
+        chunks = []
+        if not task.failed:
+            try:
+                chunks = await self.store.spliter.split_documents(documents)
+            except Exception as e:
+                task.failed, task.error = True, str(e)
+        task.parts_pending -= 1
+        is_last = task.parse_done and task.parts_pending == 0
+
+        for chunk in chunks:
+            # 记录来源文件的MD5，便于按文件删除
+            chunk.metadata['file_hash'] = task.md5_hex
+            # 可见范围，检索时按范围过滤
+            chunk.metadata['visibility'] = self.visibility
+            if self.user_id:
+                chunk.metadata['user_id'] = self.user_id
+            if self.department_id:
+                chunk.metadata['department_id'] = self.department_id
+        chunk_ids = [str(uuid.uuid4()) for _ in chunks]
+        # BM25索引中保存同一个片段ID，混合检索时两路结果按ID去重
+        for chunk, chunk_id in zip(chunks, chunk_ids):
+            chunk.id = chunk_id
+        # 前面的批都处理完后再划分章节、记录片段，保证章节和片段顺序与原文一致；
+        # 队列先进先出，前面的批一定已被其他切分协程取走，不会互相等待
+        async with task.part_turn:
+            await task.part_turn.wait_for(lambda: task.next_part == part)
+            if self.summarizer:
+                self.summarizer.assign_sections(chunks, task.sections)
+            task.chunks.extend(chunks)
+            task.chunk_ids.extend(chunk_ids)
+            task.next_part += 1
+            task.part_turn.notify_all()
+
+        batches = [
+            (chunks[start:start + self.embed_batch_size], chunk_ids[start:start + self.embed_batch_size])
+            for start in range(0, len(chunks), self.embed_batch_size)
+        ]
+        # 结束标记也计入批数，写入阶段收齐所有批次（含标记）时该文件完成
+        task.total_batches += len(batches) + (1 if is_last else 0)
+        if is_last:
+            task.split_done = True
+        for batch_chunks, batch_ids in batches:
+            yield task, batch_chunks, batch_ids
+        if is_last:
+            yield task, None, None
+
+    async def _embed(self, item):
+        """按批计算嵌入向量，失败或结束标记时向写入阶段传递 None"""
+        task, chunks, chunk_ids = item
+        if chunks is None or task.failed:
+            yield task, chunks, chunk_ids, None
+            return
+        try:
+            vectors = await self.embeddings.aembed_documents([chunk.page_content for chunk in chunks])
+        except Exception as e:
+            task.failed, task.error = True, str(e)
+            vectors = None
+        yield task, chunks, chunk_ids, vectors
+
+    async def _write(self, item):
+        """写入向量库；一个文件的所有批次完成后交给完成阶段"""
+        task, chunks, chunk_ids, vectors = item
+        if vectors is not None and not task.failed:
+            try:
+                await asyncio.to_thread(self.store.add_embeddings, chunks, vectors, chunk_ids)
+            except Exception as e:
+                task.failed, task.error = True, str(e)
+
+        task.done_batches += 1
+        if task.split_done and task.done_batches == task.total_batches:
+            yield task
+
+    async def _add_summaries(self, task: FileTask):
+        """生成文件的入库摘要并写入向量库，摘要与片段一起计入BM25索引和入库清单；生成失败时只入库片段"""
+        try:
+            summaries = await self.summarizer.summarize(task.chunks)
+        except Exception as e:
+            logger.warning(f"【入库摘要】文件 {task.path} 生成摘要失败，只入库文档片段: {e}")
+            return
+        if not summaries:
+            return
+        summary_ids = [summary.id for summary in summaries]
+        # 先记录ID，写入失败时与片段一起清理
+        task.chunk_ids.extend(summary_ids)
+        vectors = await self.embeddings.aembed_documents([summary.page_content for summary in summaries])
+        await asyncio.to_thread(self.store.add_embeddings, summaries, vectors, summary_ids)
+        task.chunks.extend(summaries)
+        self.stats["summaries"] += len(summaries)
+
+    async def _complete(self, task: FileTask):
+        """文件的所有批次写入后：生成入库摘要（可选），更新BM25索引和入库清单；失败时清理已写入的内容"""
+        if not task.failed and not task.chunks:
+            logger.error(f"【向量数据库】文件 {task.path} 切分内容为空，跳过")
+            await self._release(task)
+            self._finish(task, "skipped")
+            return
+
+        if not task.failed:
+            try:
+                chunk_count = len(task.chunks)
+                if self.summarizer:
+                    await self._add_summaries(task)
+                await asyncio.to_thread(bm25_index.add_documents, task.chunks)
+                await self.store.record_file(task.md5_hex, self.scope, self.user_id, task.chunk_ids)
+                task.claimed = False
+                logger.info(f"【向量数据库】文件 {task.path} 的md5值 {task.md5_hex} 已记录到入库清单")
+                self.stats["chunks"] += chunk_count
+                self._finish(task, "ingested")
+            except Exception as e:
+                task.failed, task.error = True, str(e)
+
+        if task.failed:
+            # 删除该文件已写入的部分（向量库与BM25分区），保证下次重新上传时可以完整入库
+            try:
+                await asyncio.to_thread(self.store.delete_by_ids, task.chunk_ids)
+                await asyncio.to_thread(bm25_index.delete, {"file_hash": task.md5_hex}, [self.scope])
+            except Exception as e:
+                logger.error(f"【向量数据库】清理文件 {task.path} 已写入的片段失败: {e}")
+            await self._release(task)
+            self._finish(task, "failed")
+        task.chunks = []
@@ -0,0 +1,59 @@
+"""
+向量存储格式迁移
+
+按 chroma.yaml 中当前集合的 hnsw 配置（vector_dtype / truncate_dim）改写已有的段，迁移前后各输出一份报告：
+向量占用的内存（当前格式 / 全精度）和抽样查询的 recall@k（不重新打分 / 用全精度向量重新打分）。
+hnsw 索引为空时先从 Chroma 导入已有数据（与应用启动时相同）。
+
+用法：
+    python -m app.rag.migrate_vectors
+    python -m app.rag.migrate_vectors --report-only --sample 500 --k 10
+"""
+import argparse
+import asyncio
+import sys
+
+from app.rag.vector_store import VectorStoreService
+
+
+def format_report(report: dict) -> str:
+    """格式化存储报告"""
+    vector_mb = report["vector_bytes"] / 1024 / 1024
+    full_mb = report["full_precision_vector_bytes"] / 1024 / 1024
+    saved = 1 - vector_mb / full_mb if full_mb else 0.0
+    formats = "，".join(f"{name} {count} 个" for name, count in report["formats"].items()) or "无"
+    line = (
+        f"格式（存储格式/索引维度）: {formats} 文档数: {report['documents']} "
+        f"索引文件: {report['index_bytes'] / 1024 / 1024:.1f}MB 向量: {vector_mb:.1f}MB（全精度 {full_mb:.1f}MB，"
+        f"节省 {saved:.0%}）"
+    )
+    if "recall" in report:
+        line += f" recall@k: {report['recall']:.3f}（不重新打分 {report['recall_without_rescore']:.3f}）"
+    return line
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="按当前配置迁移 hnsw 向量库的存储格式")
+    parser.add_argument("--report-only", action="store_true", help="只输出报告，不迁移")
+    parser.add_argument("--sample", type=int, default=200, help="评估召回率的抽样查询数")
+    parser.add_argument("--k", type=int, default=10)
+    args = parser.parse_args()
+
+    service = VectorStoreService()
+    if service.backend != "hnsw":
+        print("压缩存储只适用于 hnsw 后端，请在 chroma.yaml 中设置 vector_backend: hnsw")
+        sys.exit(1)
+    await service.sync_vector_backend()
+    store = service.vectors_store
+
+    before = await asyncio.to_thread(store.storage_report, args.sample, args.k)
+    print(f"[当前] {format_report(before)}，待迁移段数: {store.pending_migration()}")
+    if args.report_only or not store.pending_migration():
+        return
+    migrated = await asyncio.to_thread(store.migrate_format)
+    after = await asyncio.to_thread(store.storage_report, args.sample, args.k)
+    print(f"[迁移后] {format_report(after)}，已改写段数: {migrated}")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -1,33 +1,199 @@
 import asyncio
-from concurrent.futures import ThreadPoolExecutor
+import re
+import time
+from typing import AsyncGenerator, Dict, Optional
 
+from langchain_core.documents import Document
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.prompts import PromptTemplate
 
+from app.cache.semantic_cache import SemanticAnswerCache
+from app.rag.document_summarizer import SECTION_KEY, SUMMARY_LEVEL_DOCUMENT, is_summary
+from app.rag.ingestion_manifest import ingestion_manifest
 from app.rag.vector_store import VectorStoreService
+from app.rag.retrieval_scope import RetrievalScope, get_retrieval_scope
 from app.rag.reorder_service import reorder_service
-from app.utils.factory import chat_model
+from app.utils.config import rag_config
+from app.utils.factory import chat_model, embed_model
 from app.utils.prompt_loader import load_prompt
 from app.core.logger_handler import logger
 
+# 生成答案上下文的方式：预生成摘要 + 片段 / 直接拼接片段 / 逐个片段总结后合并
+CONTEXT_MODE_PRECOMPUTED = "precomputed_summary"
+CONTEXT_MODE_STUFF = "stuff"
+CONTEXT_MODE_MAP_REDUCE = "map_reduce"
+
+_CJK_CHAR_PATTERN = re.compile(r"[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]")
+# 入库清单 settings 表中的检索器版本：每次入库/删除/重建后递增，所有进程共享
+RETRIEVER_VERSION_KEY = "retriever_version"
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    估算文本的 token 数：汉字约1个token，其余字符约4个字符1个token
+    :param text: 文本
+    :return: 估算的 token 数
+    """
+    cjk_count = len(_CJK_CHAR_PATTERN.findall(text))
+    return cjk_count + (len(text) - cjk_count + 3) // 4
+
 
 class RagService:
-    def __init__(self):
-        self.vector_store = VectorStoreService()
-        self.retriever = None  # 延迟初始化
+    """
+    RAG服务，进程内只创建一个实例（见 init_rag_service / get_rag_service），
+    共享同一个 Chroma 客户端、提示词链和摘要并发限制
+    """
+    def __init__(self, vector_store: Optional[VectorStoreService] = None):
+        self.vector_store = vector_store or VectorStoreService()
         self.prompt_text = load_prompt(prompt_type="rag_summary_prompt")
         self.prompt_template = PromptTemplate.from_template(self.prompt_text)
         self.chat_model = chat_model
         self.chain = self._init_chain()
-        self.executor = ThreadPoolExecutor(max_workers=5)
+        # 上下文不超过该 token 数时直接一次调用（stuff），否则先逐个文档摘要再合并（map-reduce）
+        self.stuff_max_tokens = rag_config.get('summary_stuff_max_tokens', 2000)
+        # 所有请求共享的 map 阶段大模型并发上限
+        self.summary_semaphore = asyncio.Semaphore(rag_config.get('summary_max_concurrency', 4))
+        # 语义答案缓存，以检索器版本作为向量库版本，任一进程入库/删除后自动失效；不同检索范围的缓存互不命中
+        self.answer_cache = self._init_answer_cache()
+        # 入库摘要：启用时优先用预生成的摘要 + 片段组成上下文，只调用一次大模型
+        summary_config = rag_config.get('ingestion_summaries') or {}
+        self.use_ingestion_summaries = summary_config.get('enabled', False)
+        self.summary_context_max_tokens = summary_config.get('context_max_tokens', 3000)
+        # 每种上下文方式的查询数与大模型调用次数（不含命中答案缓存的查询）
+        self._llm_call_counts: Dict[str, Dict[str, int]] = {}
+
+    @staticmethod
+    def _init_answer_cache() -> Optional[SemanticAnswerCache]:
+        """根据配置创建语义答案缓存，未启用时返回None"""
+        cache_config = rag_config.get('answer_cache') or {}
+        if not cache_config.get('enabled', False):
+            return None
+        return SemanticAnswerCache(
+            embed_model,
+            similarity_threshold=cache_config.get('similarity_threshold', 0.92),
+            ttl_seconds=cache_config.get('ttl_seconds', 3600),
+            max_entries=cache_config.get('max_entries', 1000),
+        )
+
+    async def _lookup_answer_cache(self, query: str, scope: RetrievalScope):
+        """
+        查询语义答案缓存
+        :param query: 查询语句
+        :param scope: 检索范围
+        :return: (缓存结果或None, 查询向量或None, 查询时的检索器版本或None)
+        """
+        if self.answer_cache is None:
+            return None, None, None
+        try:
+            version = await self.get_retriever_version()
+            embedding = await self.answer_cache.embed(query)
+            return self.answer_cache.get(embedding, version, scope.key), embedding, version
+        except Exception as e:
+            logger.warning(f"【RAG】查询语义缓存失败: {e}")
+            return None, None, None
+
+    async def _store_answer_cache(self, query: str, embedding, result: dict, version: Optional[int],
+                                  scope: RetrievalScope):
+        """写入语义答案缓存（仅缓存检索到文档的正常结果）；生成结果期间其他进程更新了检索数据时丢弃"""
+        if self.answer_cache is None or embedding is None or version is None or not result.get("documents"):
+            return
+        try:
+            current_version = await self.get_retriever_version()
+        except Exception as e:
+            logger.warning(f"【RAG】读取检索器版本失败，不写入语义缓存: {e}")
+            return
+        self.answer_cache.put(embedding, query, result, version, scope.key, current_version)
+
+    def _record_llm_calls(self, mode: str, llm_calls: int):
+        counts = self._llm_call_counts.setdefault(mode, {"queries": 0, "llm_calls": 0})
+        counts["queries"] += 1
+        counts["llm_calls"] += llm_calls
+
+    def reset_llm_call_stats(self):
+        """清空大模型调用统计"""
+        self._llm_call_counts = {}
+
+    def llm_call_stats(self) -> dict:
+        """
+        每次查询的大模型调用次数统计
+        :return: 总体及每种上下文方式（precomputed_summary / stuff / map_reduce）的查询数、调用次数和平均每次查询的调用次数
+        """
+        queries = sum(counts["queries"] for counts in self._llm_call_counts.values())
+        llm_calls = sum(counts["llm_calls"] for counts in self._llm_call_counts.values())
+        return {
+            "queries": queries,
+            "llm_calls": llm_calls,
+            "llm_calls_per_query": round(llm_calls / queries, 2) if queries else 0,
+            "modes": {
+                mode: {**counts, "llm_calls_per_query": round(counts["llm_calls"] / counts["queries"], 2)}
+                for mode, counts in self._llm_call_counts.items()
+            },
+        }
+
+    @staticmethod
+    async def get_retriever_version() -> int:
+        """
+        读取所有进程共享的检索器版本（入库清单 settings 表）
+        :return: 检索器版本，从未更新过时为 0
+        """
+        value = await asyncio.to_thread(ingestion_manifest.get_setting, RETRIEVER_VERSION_KEY)
+        return int(value) if value else 0
+
+    async def refresh_retriever(self):
+        """
+        文档入库、删除或重建后调用：递增共享的检索器版本，使所有进程的语义答案缓存失效
+        检索器本身按检索范围在每次查询时创建，BM25分区和向量库的变更对之后的查询立即可见
+        """
+        version = await asyncio.to_thread(ingestion_manifest.increment_setting, RETRIEVER_VERSION_KEY)
+        logger.info(f"【RAG】检索数据已更新，版本: {version}")
+
+    async def add_documents(self, user_id: str = None, file_paths: list = None,
+                            on_file_done=None, department_id: str = None) -> dict:
+        """
+        文档入库，完成后更新检索器
+        :param user_id: 用户ID
+        :param file_paths: 已落盘的文件路径或文件任务列表（上传的文件由后台入库任务暂存），为None时从数据文件夹读取
+        :param on_file_done: 单个文件处理结束时的回调，参数为 (文件任务, 状态)
+        :param department_id: 部门ID，有值时文档在该部门内共享，否则仅上传者本人可见
+        :return: 入库统计
+        """
+        stats = await self.vector_store.get_document(
+            user_id=user_id, file_paths=file_paths, on_file_done=on_file_done, department_id=department_id,
+        )
+        await self.refresh_retriever()
+        return stats
 
-    async def initialize_retriever(self):
+    async def delete_user_documents(self, user_id: str):
         """
-        初始化检索器
+        删除指定用户的所有文档，完成后更新检索器
+        :param user_id: 用户ID
         """
-        if self.retriever is None:
-            self.retriever = await self.vector_store.get_retriever()
+        await self.vector_store.delete_user_documents(user_id)
+        await self.refresh_retriever()
 
+    async def delete_file(self, file_hash: str, scope: str) -> bool:
+        """
+        删除单个文件在某个可见范围内的文档，完成后更新检索器
+        :param file_hash: 文件MD5
+        :param scope: 可见范围（检索分区名）
+        :return: 文件是否存在
+        """
+        deleted = await self.vector_store.delete_file(file_hash, scope)
+        if deleted:
+            await self.refresh_retriever()
+        return deleted
+
+    async def reindex_file(self, file_hash: str, scope: str) -> int:
+        """
+        重建单个文件在某个可见范围内的向量，完成后更新检索器
+        :param file_hash: 文件MD5
+        :param scope: 可见范围（检索分区名）
+        :return: 重建的片段数，无法重建时返回 -1
+        """
+        count = await self.vector_store.reindex_file(file_hash, scope)
+        if count >= 0:
+            await self.refresh_retriever()
+        return count
 
     def _init_chain(self):
         """初始化链"""
@@ -38,16 +204,20 @@ class RagService:
         )
         return chain
 
-    async def retrieve_document(self, query: str) -> list:
-        """从向量数据库里检索文档"""
+    async def retrieve_document(self, query: str, scope: Optional[RetrievalScope] = None) -> list:
+        """
+        在检索范围内从向量数据库里检索文档
+        :param query: 查询语句
+        :param scope: 检索范围，为空时使用当前请求的检索范围
+        :return: 文档列表
+        """
         try:
-            # 确保检索器已初始化
-            if self.retriever is None:
-                await self.initialize_retriever()
-            
+            scope = scope or get_retrieval_scope()
+            retriever = await self.vector_store.get_retriever(scope)
+
             # 使用原始查询进行检索
-            logger.info(f"【RAG】开始处理查询: {query}")
-            documents = await self.retriever.ainvoke(query)
+            logger.info(f"【RAG】开始处理查询: {query}，检索范围: {scope.key}")
+            documents = await retriever.ainvoke(query)
             logger.info(f"【RAG】检索到 {len(documents)} 个相关文档")
             
             return documents
@@ -72,20 +242,120 @@ class RagService:
             logger.warning(f"【RAG】重排序失败: {result['error']}")
             return documents
 
-    async def get_documents_and_summary(self, query: str) -> dict:
+    async def _retrieve_and_reorder(self, query: str, scope: RetrievalScope) -> list[Document]:
+        """检索文档并重排序，返回重排序后的文档"""
+        documents = await self.retrieve_document(query, scope)
+
+        # 对文档内容进行重排序，再按内容映射回文档以保留元数据
+        reordered_contents = await self.reorder_documents(query, [doc.page_content for doc in documents])
+        by_content = {}
+        for doc in documents:
+            by_content.setdefault(doc.page_content, doc)
+        return [by_content.get(content) or Document(page_content=content) for content in reordered_contents]
+
+    async def _precomputed_summary_context(self, top_documents: list[Document]) -> Optional[str]:
+        """
+        用入库时预生成的摘要和排名靠前的片段组成上下文：
+        检索结果中的摘要、片段所属文件的文档摘要和所属章节的章节摘要在前，片段原文在后（不超过 token 上限）
+        :param top_documents: 排名靠前的文档
+        :return: 上下文，相关文件都没有预生成摘要（如旧版数据）时返回 None
+        """
+        chunks = [doc for doc in top_documents if not is_summary(doc)]
+        sections = {(doc.metadata.get('file_hash'), doc.metadata.get(SECTION_KEY)) for doc in chunks}
+        file_hashes = sorted({file_hash for file_hash, _ in sections if file_hash})
+        stored = await asyncio.to_thread(self.vector_store.get_summaries, file_hashes)
+
+        summaries = {doc.page_content: doc for doc in top_documents if is_summary(doc)}
+        for doc in stored:
+            section = (doc.metadata.get('file_hash'), doc.metadata.get(SECTION_KEY))
+            if doc.metadata.get('summary_level') == SUMMARY_LEVEL_DOCUMENT or section in sections:
+                summaries.setdefault(doc.page_content, doc)
+        if not summaries:
+            return None
+
+        context = "以下是相关文档的摘要和原文片段，请综合这些信息生成回答：\n\n"
+        context += "".join(f"【文档摘要{i}】:{text}\n" for i, text in enumerate(summaries, 1))
+        for i, chunk in enumerate(chunks, 1):
+            part = f"【参考资料{i}】:{chunk.page_content}\n"
+            if i > 1 and estimate_tokens(context + part) > self.summary_context_max_tokens:
+                break
+            context += part
+        logger.info(f"【RAG】使用 {len(summaries)} 个预生成摘要和 {len(chunks)} 个片段，约 {estimate_tokens(context)} tokens")
+        return context
+
+    async def _prepare_summary_context(self, query: str, reordered_documents: list[Document]) -> tuple[str, str, int]:
+        """
+        生成最终回答所用的上下文
+        - 预生成摘要：启用入库摘要且相关文件有摘要时，摘要与片段直接组成上下文，只需最终一次大模型调用
+        - stuff：参考资料的估算 token 数不超过 stuff_max_tokens 时，直接拼接作为上下文，只需最终一次大模型调用
+        - map-reduce：否则在共享的并发限制下用 asyncio.gather 并发逐个总结，再把摘要合并为上下文
+        :param query: 查询语句
+        :param reordered_documents: 重排序后的文档列表
+        :return: (最终一次大模型调用的 context, 上下文方式, 生成上下文时的大模型调用次数)
+        """
+        max_documents = 3  # 使用前3个最相关的文档
+        top_documents = reordered_documents[:max_documents]
+        if self.use_ingestion_summaries:
+            try:
+                context = await self._precomputed_summary_context(top_documents)
+                if context is not None:
+                    return context, CONTEXT_MODE_PRECOMPUTED, 0
+            except Exception as e:
+                logger.warning(f"【RAG】读取预生成摘要失败，按原方式生成上下文: {e}")
+
+        top_contents = [doc.page_content for doc in top_documents]
+        stuff_context = "".join(
+            f"【参考资料{i}】:{doc}\n" for i, doc in enumerate(top_contents, 1)
+        )
+        context_tokens = estimate_tokens(stuff_context)
+        if len(top_contents) == 1 or context_tokens <= self.stuff_max_tokens:
+            logger.info(f"【RAG】参考资料约 {context_tokens} tokens，使用 stuff 模式")
+            return stuff_context, CONTEXT_MODE_STUFF, 0
+
+        logger.info(f"【RAG】参考资料约 {context_tokens} tokens，使用 map-reduce 模式")
+
+        async def summarize_document(doc_index: int, doc_content: str) -> str:
+            """单个文档总结任务，失败或超时时使用原文"""
+            single_context = f"【参考资料{doc_index}】:{doc_content}\n"
+            async with self.summary_semaphore:
+                start_time = time.perf_counter()
+                try:
+                    single_summary = await asyncio.wait_for(
+                        self.chain.ainvoke({"input": query, "context": single_context}),
+                        timeout=30.0
+                    )
+                except Exception as e:
+                    logger.warning(f"【RAG】第{doc_index}个文档总结失败，使用原文: {e}")
+                    return doc_content
+                logger.info(f"【RAG】第{doc_index}个文档总结耗时: {time.perf_counter() - start_time:.2f}秒")
+                return single_summary
+
+        individual_summaries = await asyncio.gather(
+            *(summarize_document(i, doc) for i, doc in enumerate(top_contents, 1))
+        )
+
+        # 合并多个文档的摘要
+        combined_context = "以下是多个文档的摘要，请综合这些信息生成最终的回答：\n\n"
+        for i, summary in enumerate(individual_summaries, 1):
+            combined_context += f"【文档{i}摘要】:{summary}\n\n"
+
+        logger.info(f"【RAG】合并摘要完成，开始生成最终总结")
+        return combined_context, CONTEXT_MODE_MAP_REDUCE, len(top_contents)
+
+    async def get_documents_and_summary(self, query: str, scope: Optional[RetrievalScope] = None) -> dict:
         """
         获取文档列表和摘要
         :param query: 查询语句
+        :param scope: 检索范围，为空时使用当前请求的检索范围
         :return: 包含文档列表和摘要的字典
         """
+        scope = scope or get_retrieval_scope()
         try:
-            documents = await self.retrieve_document(query)
-
-            # 提取文档内容列表
-            document_contents = [doc.page_content for doc in documents]
+            cached, embedding, version = await self._lookup_answer_cache(query, scope)
+            if cached is not None:
+                return cached
 
-            # 对文档进行重排序
-            reordered_documents = await self.reorder_documents(query, document_contents)
+            reordered_documents = await self._retrieve_and_reorder(query, scope)
 
             # 如果没有检索到文档
             if not reordered_documents:
@@ -94,74 +364,28 @@ class RagService:
                     "summary": "抱歉，我没有找到相关的信息。"
                 }
 
-            # 使用分批总结策略，在线程池中并行处理
+            document_contents = [doc.page_content for doc in reordered_documents]
             try:
-                # 对每个文档单独总结
-                individual_summaries = []
-                max_documents = 3  # 使用前3个最相关的文档
-                
-                async def summarize_document(doc_index: int, doc_content: str):
-                    """单个文档总结任务"""
-                    logger.info(f"【RAG】正在总结第{doc_index}个文档")
-                    single_context = f"【参考资料{doc_index}】:{doc_content}\n"
-                    import time
-                    start_time = time.time()
-                    single_summary = await asyncio.wait_for(
-                        self.chain.ainvoke({"input": query, "context": single_context}),
-                        timeout=30.0
-                    )
-                    end_time = time.time()
-                    logger.info(f"【RAG】第{doc_index}个文档总结耗时: {end_time - start_time:.2f}秒")
-                    return single_summary
-                
-                # 使用线程池并行执行文档总结
-                loop = asyncio.get_event_loop()
-                tasks = []
-                
-                for i, doc in enumerate(reordered_documents[:max_documents], 1):
-                    # 将每个文档总结任务提交到线程池
-                    task = loop.run_in_executor(
-                        self.executor,
-                        lambda idx=i, content=doc: asyncio.run(summarize_document(idx, content))
-                    )
-                    tasks.append(task)
-                
-                # 等待所有任务完成
-                individual_summaries = await asyncio.gather(*tasks)
-                
-                for i in range(len(individual_summaries)):
-                    logger.info(f"【RAG】第{i+1}个文档总结完成")
-
-                # 如果只有一个文档，直接返回其摘要
-                if len(individual_summaries) == 1:
-                    logger.info(f"【RAG】生成摘要成功")
-                    return {
-                        "documents": reordered_documents,
-                        "summary": individual_summaries[0]
-                    }
-
-                # 合并多个文档的摘要，生成最终总结
-                combined_context = "以下是多个文档的摘要，请综合这些信息生成最终的回答：\n\n"
-                for i, summary in enumerate(individual_summaries, 1):
-                    combined_context += f"【文档{i}摘要】:{summary}\n\n"
-
-                logger.info(f"【RAG】合并摘要完成，开始生成最终总结")
-                
+                context, mode, llm_calls = await self._prepare_summary_context(query, reordered_documents)
+                self._record_llm_calls(mode, llm_calls + 1)
+
                 # 生成最终总结
                 final_summary = await asyncio.wait_for(
-                    self.chain.ainvoke({"input": query, "context": combined_context}),
+                    self.chain.ainvoke({"input": query, "context": context}),
                     timeout=30.0  # 最终总结超时时间
                 )
-                
+
                 logger.info(f"【RAG】生成摘要成功")
-                return {
-                    "documents": reordered_documents,
+                result = {
+                    "documents": document_contents,
                     "summary": final_summary
                 }
+                await self._store_answer_cache(query, embedding, result, version, scope)
+                return result
             except asyncio.TimeoutError:
                 logger.error(f"【RAG】生成摘要超时")
                 return {
-                    "documents": reordered_documents,
+                    "documents": document_contents,
                     "summary": "抱歉，生成摘要超时，请稍后再试。"
                 }
         except Exception as e:
@@ -171,17 +395,108 @@ class RagService:
                 "summary": "抱歉，处理您的请求时出现了错误。"
             }
 
-    async def rag_summary(self, query: str) -> str:
-        """RAG 摘要"""
-        result = await self.get_documents_and_summary(query)
+    async def stream_documents_and_summary(
+            self,
+            query: str,
+            scope: Optional[RetrievalScope] = None,
+    ) -> AsyncGenerator[dict, None]:
+        """
+        流式获取文档列表和摘要：最终一次大模型调用的 token 边生成边产出
+        :param query: 查询语句
+        :param scope: 检索范围，为空时使用当前请求的检索范围
+        :return: 异步生成器，依次产出 {"type": "token", "content": str}，
+                 最后产出 {"type": "result", "documents": list, "summary": str}
+        """
+        scope = scope or get_retrieval_scope()
+        reordered_documents = []
+        summary_parts = []
+        try:
+            cached, embedding, version = await self._lookup_answer_cache(query, scope)
+            if cached is not None:
+                yield {"type": "token", "content": cached["summary"]}
+                yield {"type": "result", **cached}
+                return
+
+            reordered_documents = await self._retrieve_and_reorder(query, scope)
+
+            if not reordered_documents:
+                summary = "抱歉，我没有找到相关的信息。"
+                yield {"type": "token", "content": summary}
+                yield {"type": "result", "documents": [], "summary": summary}
+                return
+
+            context, mode, llm_calls = await self._prepare_summary_context(query, reordered_documents)
+            self._record_llm_calls(mode, llm_calls + 1)
+
+            async for token in self.chain.astream({"input": query, "context": context}):
+                if token:
+                    summary_parts.append(token)
+                    yield {"type": "token", "content": token}
+
+            logger.info(f"【RAG】流式生成摘要成功")
+            result = {"documents": [doc.page_content for doc in reordered_documents], "summary": "".join(summary_parts)}
+            await self._store_answer_cache(query, embedding, result, version, scope)
+            yield {"type": "result", **result}
+        except Exception as e:
+            logger.error(f"【RAG】流式生成摘要失败: {e}", exc_info=True)
+            if summary_parts:
+                # 已经输出了部分内容，保留已生成的部分
+                yield {
+                    "type": "result",
+                    "documents": [doc.page_content for doc in reordered_documents],
+                    "summary": "".join(summary_parts),
+                }
+            else:
+                summary = "抱歉，处理您的请求时出现了错误。"
+                yield {"type": "token", "content": summary}
+                yield {"type": "result", "documents": [], "summary": summary}
+
+    async def rag_summary(self, query: str, scope: Optional[RetrievalScope] = None) -> str:
+        """RAG 摘要，scope 为空时使用当前请求的检索范围"""
+        result = await self.get_documents_and_summary(query, scope)
         return result.get("summary", "抱歉，处理您的请求时出现了错误。")
 
+
+# 全局RAG服务实例
+rag_service: Optional[RagService] = None
+
+
+async def init_rag_service() -> RagService:
+    """
+    应用启动时初始化RAG服务：首次启用 hnsw 后端时导入 Chroma 中的向量，
+    再对齐BM25分区索引与向量库（旧版数据在此完成一次性迁移）
+    :return: 初始化完成的 RagService 实例
+    """
+    global rag_service
+    service = RagService()
+    await service.vector_store.sync_vector_backend()
+    await service.vector_store.sync_bm25_index()
+    rag_service = service
+    return rag_service
+
+
+def get_rag_service() -> RagService:
+    """
+    获取RAG服务实例（用于依赖注入），未经启动初始化时（如单独运行脚本）按需创建
+    :return: RagService 实例
+    """
+    global rag_service
+    if rag_service is None:
+        rag_service = RagService()
+    return rag_service
+
+
+async def close_rag_service():
+    """应用关闭时释放RAG服务实例"""
+    global rag_service
+    rag_service = None
+
+
 if __name__ == '__main__':
     import asyncio
     
     async def main():
-        service = RagService()
-        await service.initialize_retriever()
+        service = await init_rag_service()
         result = await service.rag_summary("小户型适合什么扫地机器人")
         print(result)
     
@@ -1,9 +1,12 @@
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Tuple
+import threading
 import torch
 import os
 from dotenv import load_dotenv
 from sentence_transformers import CrossEncoder
 from app.core.logger_handler import logger
+from app.rag.rerank_batcher import RerankBatcher
+from app.rag.reranker_backends import RerankerBackend, create_reranker_backend
 
 # 加载环境变量
 load_dotenv()
@@ -50,26 +53,41 @@ class ReorderService:
         self.HF_MODEL_NAME = "Qwen/Qwen3-Reranker-0.6B"
         # 自动选择设备（优先使用GPU）
         self.device = "cuda" if torch.cuda.is_available() else "cpu"
-        # 模型实例（懒加载）
-        self._model = None
+        # 推理后端：torch / onnx / onnx-int8，ONNX 不可用时回退到 torch
+        self.backend_name = os.getenv("RERANKER_BACKEND", "torch")
+        self.num_threads = int(os.getenv("RERANKER_NUM_THREADS", "0")) or None
+        self.max_length = int(os.getenv("RERANKER_MAX_LENGTH", "512"))
+        self.quantization_config = os.getenv("RERANKER_QUANTIZATION", "avx2")
+        # 推理后端实例（懒加载）
+        self._backend = None
+        self._backend_lock = threading.Lock()
+        # 微批处理器：推理在后台线程执行，并发请求合并成批
+        self.batcher = RerankBatcher(
+            predict_fn=self._predict,
+            max_batch_pairs=int(os.getenv("RERANKER_MAX_BATCH_PAIRS", "32")),
+            max_wait_ms=float(os.getenv("RERANKER_MAX_WAIT_MS", "10")),
+        )
     
-    async def _get_model(self):
-        """懒加载模型实例"""
-        if self._model is None:
-            logger.info(f"✅ 加载重排序模型：{self.LOCAL_MODEL_PATH}")
-            self._model = CrossEncoder(
-                self.LOCAL_MODEL_PATH,
-                max_length=512,
-                device=self.device,
-                local_files_only=True
-            )
-            logger.info(f"✅ 模型加载成功，使用设备：{self.device}")
-        return self._model
-    
-    @property
-    async def model(self):
-        """获取模型实例（懒加载）"""
-        return await self._get_model()
+    def _load_backend(self) -> RerankerBackend:
+        """懒加载推理后端（在批处理线程中调用，不阻塞事件循环）"""
+        if self._backend is None:
+            with self._backend_lock:
+                if self._backend is None:
+                    logger.info(f"✅ 加载重排序模型：{self.LOCAL_MODEL_PATH}，推理后端：{self.backend_name}")
+                    self._backend = create_reranker_backend(
+                        self.backend_name,
+                        self.LOCAL_MODEL_PATH,
+                        device=self.device,
+                        max_length=self.max_length,
+                        num_threads=self.num_threads,
+                        quantization_config=self.quantization_config,
+                    )
+                    logger.info(f"✅ 模型加载成功，使用设备：{self.device}，推理后端：{self._backend.name}")
+        return self._backend
+
+    def _predict(self, pairs: List[Tuple[str, str]], batch_size: int) -> List[float]:
+        """批量推理，由批处理线程调用"""
+        return self._load_backend().predict(pairs, batch_size)
     
     async def reorder_documents(self, query: str, documents: List[str]) -> Dict[str, Any]:
         """
@@ -90,9 +108,8 @@ class ReorderService:
             # 构造查询+文档对
             pairs = [(query, doc) for doc in documents]
             
-            # 使用模型进行批量预测（batch_size=1避免padding令牌报错）
-            model = await self.model
-            scores = model.predict(pairs, batch_size=1)
+            # 提交给批处理线程，与其他并发请求合并推理
+            scores = await self.batcher.submit(pairs)
             
             # 构建结果列表
             scored_documents = []
@@ -121,6 +138,10 @@ class ReorderService:
                 "error": error_msg
             }
 
+    def stats(self) -> Dict[str, Any]:
+        """重排序批处理统计（队列深度、批大小直方图）"""
+        return self.batcher.stats()
+
     @staticmethod
     async def format_reorder_result(sorted_docs: List[Dict]) -> str:
         """
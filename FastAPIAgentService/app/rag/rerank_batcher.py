@@ -0,0 +1,192 @@
+import asyncio
+import queue
+import threading
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, List, Sequence, Tuple
+
+from app.core.logger_handler import logger
+
+# 直方图桶上界（批大小、队列深度都以 (query, doc) 对为单位）
+HISTOGRAM_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+
+
+class _Histogram:
+    """简单的累计直方图，桶上界见 HISTOGRAM_BUCKETS，超出的计入 +Inf"""
+
+    def __init__(self):
+        self.counts = [0] * (len(HISTOGRAM_BUCKETS) + 1)
+        self.total = 0
+        self.sum = 0
+
+    def observe(self, value: int):
+        self.counts[bisect_left(HISTOGRAM_BUCKETS, value)] += 1
+        self.total += 1
+        self.sum += value
+
+    def to_dict(self) -> Dict[str, object]:
+        buckets = {str(bound): count for bound, count in zip(HISTOGRAM_BUCKETS, self.counts)}
+        buckets["+Inf"] = self.counts[-1]
+        return {
+            "buckets": buckets,
+            "count": self.total,
+            "avg": round(self.sum / self.total, 2) if self.total else 0,
+        }
+
+
+class _Request:
+    """一次重排序请求：多个 (query, doc) 对共享一个 future"""
+    __slots__ = ("pairs", "future", "loop", "enqueued_at")
+
+    def __init__(self, pairs: List[Tuple[str, str]], future: asyncio.Future, loop: asyncio.AbstractEventLoop):
+        self.pairs = pairs
+        self.future = future
+        self.loop = loop
+        self.enqueued_at = time.perf_counter()
+
+
+class RerankBatcher:
+    """
+    重排序微批处理器
+    - 模型推理在独立的后台线程中执行，不阻塞事件循环
+    - 并发请求的 (query, doc) 对被合并成动态大小的批次：凑满 max_batch_pairs 或
+      最早的请求等待超过 max_wait_ms 即执行
+    - 每个请求拿到一个 future，推理完成后按请求拆分分数回填
+    """
+
+    def __init__(
+            self,
+            predict_fn: Callable[[List[Tuple[str, str]], int], Sequence[float]],
+            max_batch_pairs: int = 32,
+            max_wait_ms: float = 10.0,
+    ):
+        """
+        :param predict_fn: 推理函数，参数为 (pairs, batch_size)，返回与 pairs 等长的分数
+        :param max_batch_pairs: 单批最大 (query, doc) 对数量
+        :param max_wait_ms: 批次最长等待时间（毫秒）
+        """
+        self.predict_fn = predict_fn
+        self.max_batch_pairs = max_batch_pairs
+        self.max_wait = max_wait_ms / 1000
+        self._queue: "queue.Queue[_Request]" = queue.Queue()
+        self._carry: List[_Request] = []
+        self._pending_pairs = 0
+        self._stats_lock = threading.Lock()
+        self._batch_size_histogram = _Histogram()
+        self._queue_depth_histogram = _Histogram()
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="rerank-batcher", daemon=True)
+                self._thread.start()
+                logger.info(f"【重排序服务】批处理线程已启动，最大批大小: {self.max_batch_pairs}, "
+                            f"最长等待: {self.max_wait * 1000:.0f}ms")
+
+    async def submit(self, pairs: List[Tuple[str, str]]) -> List[float]:
+        """
+        提交一组 (query, doc) 对，等待批处理线程返回分数
+        :param pairs: (query, doc) 对列表
+        :return: 与 pairs 顺序一致的分数列表
+        """
+        if not pairs:
+            return []
+        self._ensure_started()
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        with self._stats_lock:
+            self._pending_pairs += len(pairs)
+        self._queue.put(_Request(list(pairs), future, loop))
+        return await future
+
+    def _next_request(self, timeout: float = None):
+        if self._carry:
+            return self._carry.pop(0)
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def _collect_batch(self) -> List[_Request]:
+        """阻塞等待第一个请求，然后在截止时间前尽量凑满一个批次"""
+        first = self._next_request()
+        batch = [first]
+        batch_pairs = len(first.pairs)
+        deadline = first.enqueued_at + self.max_wait
+        while batch_pairs < self.max_batch_pairs:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0 and self._queue.empty() and not self._carry:
+                break
+            request = self._next_request(timeout=max(remaining, 0))
+            if request is None:
+                break
+            if batch_pairs + len(request.pairs) > self.max_batch_pairs:
+                # 放不下的请求留给下一批，保持先来先服务
+                self._carry.insert(0, request)
+                break
+            batch.append(request)
+            batch_pairs += len(request.pairs)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            error: Exception = RuntimeError("重排序批处理中断")
+            delivered = 0
+            try:
+                pairs = [pair for request in batch for pair in request.pairs]
+                with self._stats_lock:
+                    self._queue_depth_histogram.observe(self._pending_pairs)
+                    self._batch_size_histogram.observe(len(pairs))
+                    self._pending_pairs -= len(pairs)
+
+                scores = list(self.predict_fn(pairs, self.max_batch_pairs))
+                offset = 0
+                for request in batch:
+                    request_scores = [float(score) for score in scores[offset:offset + len(request.pairs)]]
+                    offset += len(request.pairs)
+                    self._deliver(request, self._set_result, request_scores)
+                    delivered += 1
+            except Exception as e:
+                logger.error(f"【重排序服务】批量推理失败: {e}")
+                error = e
+            finally:
+                # 中途出错时，尚未送达结果的请求收到异常，不会一直等待
+                for request in batch[delivered:]:
+                    self._deliver(request, self._set_exception, error)
+
+    @staticmethod
+    def _deliver(request: _Request, callback: Callable, value):
+        """把结果交给请求所在的事件循环执行；事件循环已关闭（请求方已退出）时丢弃，批处理线程继续运行"""
+        try:
+            request.loop.call_soon_threadsafe(callback, request.future, value)
+        except RuntimeError:
+            logger.warning("【重排序服务】请求所在的事件循环已关闭，丢弃结果")
+
+    @staticmethod
+    def _set_result(future: asyncio.Future, result):
+        if not future.done():
+            future.set_result(result)
+
+    @staticmethod
+    def _set_exception(future: asyncio.Future, error: Exception):
+        if not future.done():
+            future.set_exception(error)
+
+    def stats(self) -> Dict[str, object]:
+        """
+        批处理统计信息
+        :return: 当前排队的 (query, doc) 对数量、批大小直方图、批次形成时的队列深度直方图
+        """
+        with self._stats_lock:
+            return {
+                "queue_depth": self._pending_pairs,
+                "max_batch_pairs": self.max_batch_pairs,
+                "max_wait_ms": self.max_wait * 1000,
+                "batch_size_histogram": self._batch_size_histogram.to_dict(),
+                "queue_depth_histogram": self._queue_depth_histogram.to_dict(),
+            }
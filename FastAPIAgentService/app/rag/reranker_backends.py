@@ -0,0 +1,165 @@
+import os
+from typing import List, Optional, Tuple
+
+import torch
+from sentence_transformers import CrossEncoder
+
+from app.core.logger_handler import logger
+
+# 支持的后端：torch（原有 fp32 路径，兜底）、onnx（ONNX Runtime fp32）、onnx-int8（ONNX Runtime 动态 int8 量化）
+SUPPORTED_BACKENDS = ("torch", "onnx", "onnx-int8")
+
+
+def _enable_padding(model: CrossEncoder):
+    """
+    Qwen3-Reranker 的分词器没有 pad token，batch_size>1 时无法补齐。
+    使用 eos 作为 pad，并改为左侧补齐，保证序列分类取到的最后一个 token 始终是真实 token
+    """
+    tokenizer = model.tokenizer
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+    tokenizer.padding_side = "left"
+    config = getattr(model.model, "config", None)
+    if config is not None and getattr(config, "pad_token_id", None) is None:
+        config.pad_token_id = tokenizer.pad_token_id
+
+
+class RerankerBackend:
+    """
+    重排序推理后端
+    推理前按文本长度排序，使同一批次内的序列长度接近：每批只补齐到本批最长序列，
+    短文档组成的批次自动使用更短的有效长度（上限为 max_length）
+    """
+    name = "torch"
+
+    def __init__(self, model: CrossEncoder):
+        self.model = model
+        _enable_padding(model)
+
+    def predict(self, pairs: List[Tuple[str, str]], batch_size: int) -> List[float]:
+        """
+        批量推理
+        :param pairs: (query, doc) 对列表
+        :param batch_size: 批大小
+        :return: 与 pairs 顺序一致的分数列表
+        """
+        order = sorted(range(len(pairs)), key=lambda i: len(pairs[i][0]) + len(pairs[i][1]))
+        sorted_scores = self.model.predict(
+            [pairs[i] for i in order],
+            batch_size=batch_size,
+            show_progress_bar=False,
+        )
+        scores = [0.0] * len(pairs)
+        for position, index in enumerate(order):
+            scores[index] = float(sorted_scores[position])
+        return scores
+
+
+class TorchRerankerBackend(RerankerBackend):
+    """PyTorch 后端（原有实现）"""
+    name = "torch"
+
+    def __init__(self, model_path: str, device: str, max_length: int, num_threads: Optional[int] = None):
+        if num_threads:
+            torch.set_num_threads(num_threads)
+        super().__init__(CrossEncoder(
+            model_path,
+            max_length=max_length,
+            device=device,
+            local_files_only=True
+        ))
+
+
+class OnnxRerankerBackend(RerankerBackend):
+    """
+    ONNX Runtime 后端（仅CPU），需要安装 optimum[onnxruntime]
+    首次使用时导出 ONNX 模型到 <模型目录>/onnx/，int8 模式再做一次动态量化，之后直接加载导出结果
+    """
+
+    def __init__(self, model_path: str, max_length: int, num_threads: Optional[int] = None,
+                 quantize: bool = False, quantization_config: str = "avx2"):
+        import onnxruntime
+
+        session_options = onnxruntime.SessionOptions()
+        if num_threads:
+            session_options.intra_op_num_threads = num_threads
+            session_options.inter_op_num_threads = 1
+        self.name = "onnx-int8" if quantize else "onnx"
+
+        file_name = "onnx/model.onnx"
+        if not os.path.exists(os.path.join(model_path, file_name)):
+            self._export(model_path, max_length)
+        if quantize:
+            file_name = f"onnx/model_qint8_{quantization_config}.onnx"
+            if not os.path.exists(os.path.join(model_path, file_name)):
+                self._export_quantized(model_path, max_length, quantization_config)
+
+        super().__init__(CrossEncoder(
+            model_path,
+            max_length=max_length,
+            device="cpu",
+            backend="onnx",
+            local_files_only=True,
+            model_kwargs={
+                "file_name": file_name,
+                "provider": "CPUExecutionProvider",
+                "session_options": session_options,
+            },
+        ))
+
+    @staticmethod
+    def _export(model_path: str, max_length: int):
+        """将 torch 模型导出为 fp32 ONNX 模型，保存在模型目录下"""
+        logger.info(f"【重排序服务】开始导出 ONNX 模型: {model_path}")
+        model = CrossEncoder(model_path, max_length=max_length, device="cpu", backend="onnx", local_files_only=True)
+        model.save_pretrained(model_path)
+
+    @staticmethod
+    def _export_quantized(model_path: str, max_length: int, quantization_config: str):
+        """基于 fp32 ONNX 模型生成动态 int8 量化版本，保存在模型目录下"""
+        from sentence_transformers import export_dynamic_quantized_onnx_model
+
+        logger.info(f"【重排序服务】开始导出 int8 量化模型，量化配置: {quantization_config}")
+        model = CrossEncoder(model_path, max_length=max_length, device="cpu", backend="onnx", local_files_only=True)
+        export_dynamic_quantized_onnx_model(model, quantization_config, model_path)
+        logger.info(f"【重排序服务】int8 量化模型导出完成: {model_path}")
+
+
+def create_reranker_backend(
+        backend: str,
+        model_path: str,
+        device: str,
+        max_length: int = 512,
+        num_threads: Optional[int] = None,
+        quantization_config: str = "avx2",
+) -> RerankerBackend:
+    """
+    创建重排序推理后端，ONNX 后端不可用（未安装依赖、导出失败、GPU 环境）时回退到 torch
+    :param backend: 后端名称，见 SUPPORTED_BACKENDS
+    :param model_path: 本地模型目录
+    :param device: 推理设备
+    :param max_length: 最大序列长度
+    :param num_threads: 推理线程数，None 表示使用默认值
+    :param quantization_config: int8 量化配置（avx2 / avx512 / avx512_vnni / arm64）
+    :return: 推理后端
+    """
+    if backend not in SUPPORTED_BACKENDS:
+        logger.warning(f"【重排序服务】未知的推理后端 {backend}，使用 torch")
+        backend = "torch"
+
+    if backend != "torch":
+        if device != "cpu":
+            logger.warning(f"【重排序服务】ONNX 后端仅用于CPU，当前设备为 {device}，使用 torch")
+        else:
+            try:
+                return OnnxRerankerBackend(
+                    model_path,
+                    max_length=max_length,
+                    num_threads=num_threads,
+                    quantize=backend == "onnx-int8",
+                    quantization_config=quantization_config,
+                )
+            except Exception as e:
+                logger.warning(f"【重排序服务】加载 {backend} 后端失败，回退到 torch: {e}")
+
+    return TorchRerankerBackend(model_path, device=device, max_length=max_length, num_threads=num_threads)
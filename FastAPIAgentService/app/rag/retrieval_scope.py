@@ -0,0 +1,105 @@
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+from fastapi import Depends
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+
+from app.core.logger_handler import logger
+from app.rag.bm25_index import PUBLIC_PARTITION, department_partition, user_partition
+from app.utils.auth_utils import get_current_user_id, get_user_info_from_redis, security
+
+# 文档可见范围（写入每个文档片段的 visibility 元数据）
+VISIBILITY_PUBLIC = "public"
+VISIBILITY_PRIVATE = "private"
+VISIBILITY_DEPARTMENT = "department"
+
+
+@dataclass(frozen=True)
+class RetrievalScope:
+    """
+    检索范围：公共文档 + 当前用户上传的文档 + 所在部门共享的文档
+    未登录（user_id 为空）时只能检索公共文档
+    """
+    user_id: Optional[str] = None
+    department_id: Optional[str] = None
+
+    @property
+    def key(self) -> str:
+        """范围标识，用于区分不同范围的缓存"""
+        return f"{self.user_id or ''}|{self.department_id or ''}"
+
+    def chroma_filter(self) -> Dict[str, Any]:
+        """下推到 Chroma 查询的元数据过滤条件"""
+        conditions: List[Dict[str, Any]] = [{"visibility": VISIBILITY_PUBLIC}]
+        if self.user_id:
+            conditions.append({"user_id": self.user_id})
+        if self.department_id:
+            conditions.append({"department_id": self.department_id})
+        return conditions[0] if len(conditions) == 1 else {"$or": conditions}
+
+    def bm25_partitions(self) -> List[str]:
+        """需要检索的 BM25 分区"""
+        partitions = [PUBLIC_PARTITION]
+        if self.user_id:
+            partitions.append(user_partition(self.user_id))
+        if self.department_id:
+            partitions.append(department_partition(self.department_id))
+        return partitions
+
+
+PUBLIC_SCOPE = RetrievalScope()
+
+# 当前请求的检索范围，由请求入口设置；Agent 工具等拿不到用户信息的调用方从这里读取
+_current_scope: ContextVar[RetrievalScope] = ContextVar("retrieval_scope", default=PUBLIC_SCOPE)
+
+
+def set_retrieval_scope(scope: RetrievalScope):
+    """设置当前请求（上下文）的检索范围"""
+    _current_scope.set(scope)
+
+
+def get_retrieval_scope() -> RetrievalScope:
+    """获取当前请求（上下文）的检索范围，未设置时只检索公共文档"""
+    return _current_scope.get()
+
+
+async def get_user_department_id(user_id: str, credentials: Optional[HTTPAuthorizationCredentials]) -> Optional[str]:
+    """
+    获取用户所在部门ID（优先读取 Redis 中缓存的用户信息）
+    :param user_id: 用户ID
+    :param credentials: HTTP认证凭据，缓存未命中时用于调用 Django 接口
+    :return: 部门ID，获取失败或未分配部门时返回 None
+    """
+    if credentials is None:
+        return None
+    try:
+        user_info = await get_user_info_from_redis(user_id, credentials)
+    except Exception as e:
+        logger.warning(f"【检索范围】获取用户 {user_id} 的部门失败，只检索公共和个人文档: {e}")
+        return None
+    if not isinstance(user_info, dict):
+        return None
+    department_id = (user_info.get("user") or user_info).get("department")
+    return str(department_id) if department_id else None
+
+
+async def get_request_scope(
+        user_id: str = Depends(get_current_user_id),
+        credentials: HTTPAuthorizationCredentials = Depends(security),
+) -> RetrievalScope:
+    """依赖注入：已登录请求的检索范围"""
+    return RetrievalScope(user_id=user_id, department_id=await get_user_department_id(user_id, credentials))
+
+
+optional_security = HTTPBearer(auto_error=False)
+
+
+async def get_optional_request_scope(
+        credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_security),
+) -> RetrievalScope:
+    """依赖注入：允许匿名访问的请求的检索范围，未携带令牌时只检索公共文档"""
+    if credentials is None:
+        return PUBLIC_SCOPE
+    user_id = await get_current_user_id(credentials)
+    return RetrievalScope(user_id=user_id, department_id=await get_user_department_id(user_id, credentials))
@@ -1,9 +1,12 @@
-import math
 import asyncio
 from typing import List, Optional, Any
+
+import numpy as np
 from langchain.embeddings.base import Embeddings
+from langchain_core.documents import Document
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 
+from app.core.logger_handler import logger
 from app.utils.config import chroma_config
 
 
@@ -15,14 +18,18 @@ class AsyncTextSplitter:
     - 将文本分割成多个片段
     - 保留标题、段落、列表层级等结构
     - 保证片段语义完整，避免把一个观点拆成多段
-    - 使用嵌入模型结合余弦相似度判断语义完整性
+    - 使用嵌入模型结合余弦相似度判断语义完整性：一次批量计算全部片段的向量，
+      相邻片段相似度不低于阈值且合并后不超过长度上限时合并
     """
     
     def __init__(self, 
                  chunk_size: int = 1000, 
                  chunk_overlap: int = 200, 
                  separators: Optional[List[str]] = None, 
-                 embedding_model: Optional[Embeddings] = None):
+                 embedding_model: Optional[Embeddings] = None,
+                 similarity_threshold: float = 0.7,
+                 max_chunk_size: Optional[int] = None,
+                 min_overlap: Optional[int] = None):
         """
         初始化文本分割器
         
@@ -30,7 +37,11 @@ class AsyncTextSplitter:
             chunk_size: 每个文本片段的最大长度
             chunk_overlap: 片段之间的重叠长度
             separators: 分割符列表，用于分割文本
-            embedding_model: 嵌入模型，用于计算语义相似度
+            embedding_model: 嵌入模型，用于计算语义相似度；为None时不做语义合并
+            similarity_threshold: 相邻片段合并所需的最小余弦相似度
+            max_chunk_size: 合并后片段的最大长度，默认为 chunk_size 的3倍
+            min_overlap: 合并时去掉重叠部分所需的最小重叠长度，默认为 chunk_overlap；
+                         更短的首尾相同（如都是一个句号）视为巧合，不去掉
         """
         # 默认分割符，按优先级排序
         default_separators = chroma_config['separators']
@@ -39,6 +50,9 @@ class AsyncTextSplitter:
         self.chunk_overlap = chunk_overlap
         self.separators = separators or default_separators
         self.embedding_model = embedding_model
+        self.similarity_threshold = similarity_threshold
+        self.max_chunk_size = max_chunk_size or chunk_size * 3
+        self.min_overlap = max(min_overlap if min_overlap is not None else chunk_overlap, 1)
         
         # 初始化递归字符分割器
         self.splitter = RecursiveCharacterTextSplitter(
@@ -68,7 +82,7 @@ class AsyncTextSplitter:
     
     async def split_documents(self, documents: List[Any]) -> List[Any]:
         """
-        分割文档列表
+        分割文档列表，提供了嵌入模型时对每个文档内的相邻片段做语义合并
         
         Args:
             documents: 文档对象列表
@@ -76,9 +90,21 @@ class AsyncTextSplitter:
         Returns:
             List[Any]: 分割后的文档对象列表
         """
-        # 使用递归字符分割器分割文档（同步操作，用to_thread包装）
-        split_docs = await asyncio.to_thread(self.splitter.split_documents, documents)
-        return split_docs
+        if not self.embedding_model:
+            # 使用递归字符分割器分割文档（同步操作，用to_thread包装）
+            split_docs = await asyncio.to_thread(self.splitter.split_documents, documents)
+            return split_docs
+
+        # 按文档分别切分，合并只在同一文档（如PDF的同一页）内进行，元数据保持不变
+        chunks_per_document = await asyncio.to_thread(
+            lambda: [self.splitter.split_text(document.page_content) for document in documents]
+        )
+        merged_per_document = await self._merge_chunk_groups(chunks_per_document)
+        return [
+            Document(page_content=text, metadata=dict(document.metadata))
+            for document, texts in zip(documents, merged_per_document)
+            for text in texts
+        ]
     
     async def _optimize_chunks(self, chunks: List[str]) -> List[str]:
         """
@@ -90,65 +116,90 @@ class AsyncTextSplitter:
         Returns:
             List[str]: 优化后的文本片段列表
         """
-        optimized_chunks = []
-        current_chunk = chunks[0]
+        merged = await self._merge_chunk_groups([chunks])
+        return merged[0]
+    
+    async def _merge_chunk_groups(self, groups: List[List[str]]) -> List[List[str]]:
+        """
+        对多组片段做语义合并，所有片段只调用一次批量嵌入
         
-        for i in range(1, len(chunks)):
-            # 计算当前片段与下一个片段的语义相似度
-            similarity = await self._calculate_similarity(current_chunk, chunks[i])
+        Args:
+            groups: 片段分组，合并只在组内相邻片段之间进行
             
-            # 如果相似度高于阈值，合并两个片段
-            if similarity > 0.7:  # 相似度阈值
-                current_chunk += " " + chunks[i]
-            else:
-                optimized_chunks.append(current_chunk)
-                current_chunk = chunks[i]
-        
-        # 添加最后一个片段
-        optimized_chunks.append(current_chunk)
-        
-        return optimized_chunks
+        Returns:
+            List[List[str]]: 合并后的片段分组
+        """
+        texts = [text for group in groups for text in group]
+        if len(texts) < 2:
+            return groups
+        try:
+            vectors = np.asarray(await self.embedding_model.aembed_documents(texts), dtype=np.float32)
+        except Exception as e:
+            logger.warning(f"【文本分割】计算片段向量失败，跳过语义合并: {e}")
+            return groups
+        similarities = self._adjacent_similarities(vectors)
+
+        merged_groups = []
+        offset = 0
+        for group in groups:
+            merged_groups.append(self._merge_group(group, similarities[offset:offset + len(group) - 1]))
+            offset += len(group)
+        return merged_groups
     
-    async def _calculate_similarity(self, text1: str, text2: str) -> float:
+    @staticmethod
+    def _adjacent_similarities(vectors: np.ndarray) -> np.ndarray:
         """
-        计算两个文本片段的语义相似度
+        计算相邻向量的余弦相似度
         
         Args:
-            text1: 第一个文本片段
-            text2: 第二个文本片段
+            vectors: 向量矩阵，每行一个片段
             
         Returns:
-            float: 两个文本片段的相似度，范围0-1
+            np.ndarray: 长度为 n-1 的数组，第 i 个元素为第 i 与第 i+1 个片段的相似度
         """
-        if not self.embedding_model:
-            return 0.0
-        
-        embedding1 = self.embedding_model.embed_query(text1)
-        embedding2 = self.embedding_model.embed_query(text2)
-        
-        # 计算余弦相似度
-        similarity = self._cosine_similarity(embedding1, embedding2)
-        
-        return similarity
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        normalized = np.divide(vectors, norms, out=np.zeros_like(vectors), where=norms > 0)
+        return np.einsum("ij,ij->i", normalized[:-1], normalized[1:])
     
-    def _cosine_similarity(self, vec1: List[float], vec2: List[float]) -> float:
+    def _merge_group(self, chunks: List[str], similarities: np.ndarray) -> List[str]:
         """
-        计算两个向量的余弦相似度
+        按相邻相似度合并一组片段
         
         Args:
-            vec1: 第一个向量
-            vec2: 第二个向量
+            chunks: 组内片段
+            similarities: 组内相邻片段的相似度
             
         Returns:
-            float: 两个向量的余弦相似度，范围0-1
+            List[str]: 合并后的片段
         """
-        import math
-        
-        dot_product = sum(a * b for a, b in zip(vec1, vec2))
-        magnitude1 = math.sqrt(sum(a * a for a in vec1))
-        magnitude2 = math.sqrt(sum(a * a for a in vec2))
-        
-        if magnitude1 == 0 or magnitude2 == 0:
-            return 0.0
+        if not chunks:
+            return []
+        merged = []
+        current_chunk = chunks[0]
+        for next_chunk, similarity in zip(chunks[1:], similarities):
+            addition = self._strip_overlap(current_chunk, next_chunk)
+            # 相似度达到阈值且合并后不超过长度上限时合并
+            if similarity >= self.similarity_threshold and len(current_chunk) + len(addition) + 1 <= self.max_chunk_size:
+                current_chunk += " " + addition
+            else:
+                merged.append(current_chunk)
+                current_chunk = next_chunk
+        merged.append(current_chunk)
+        return merged
+    
+    def _strip_overlap(self, current_chunk: str, next_chunk: str) -> str:
+        """
+        去掉下一片段开头与当前片段结尾重叠的部分（递归分割器切分时保留的 chunk_overlap），
+        重叠长度不足 min_overlap 时原样保留，避免误删巧合相同的字符
         
-        return dot_product / (magnitude1 * magnitude2)
\ No newline at end of file
+        Args:
+            current_chunk: 当前片段
+            next_chunk: 下一片段
+            
+        Returns:
+            str: 去掉重叠部分后的下一片段
+        """
+        for size in range(min(self.chunk_overlap, len(current_chunk), len(next_chunk)), self.min_overlap - 1, -1):
+            if current_chunk.endswith(next_chunk[:size]):
+                return next_chunk[size:].lstrip()
+        return next_chunk
@@ -1,137 +1,320 @@
 import asyncio
 import sys
 import os
-import tempfile
-
-from langchain_classic.retrievers import EnsembleRetriever
 
 # 将根目录添加到系统路径
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
 
-import aiofiles
-from aiofiles import os as aio_os
-
 from langchain_chroma import Chroma
 from langchain_core.documents import Document
 from app.rag.text_spliter import AsyncTextSplitter
-from langchain_community.retrievers import BM25Retriever
+from app.rag.hnsw_store import HNSWVectorStore
+from app.rag.hybrid_retriever import HybridRetriever
+from app.rag.bm25_index import (
+    bm25_index, PartitionedBM25Retriever, DEPARTMENT_PARTITION_PREFIX, partition_of, user_partition
+)
+from app.rag.retrieval_scope import RetrievalScope, PUBLIC_SCOPE, VISIBILITY_PRIVATE, VISIBILITY_PUBLIC
+from app.rag.ingestion_pipeline import IngestionPipeline
+from app.rag.document_summarizer import DocumentSummarizer, SUMMARY_DOC_TYPE
+from app.rag.ingestion_manifest import ingestion_manifest
 
-from app.utils.config import chroma_config
-from app.utils.factory import embed_model
-from app.utils.file_handler import pdf_loader, txt_loader, listdir_allowed_type, get_file_md5_hex
+from app.utils.config import chroma_config, rag_config
+from app.utils.factory import chat_model, embed_model
+from app.utils.file_handler import pdf_loader, txt_loader, iter_file_documents, listdir_allowed_type
 from app.core.logger_handler import logger
 from app.utils.path_tool import get_abstract_path
 
+# 入库清单中记录"旧版数据已补写可见范围、BM25索引已按范围分区"的设置项
+SCOPE_MIGRATION_KEY = "retrieval_scope_migrated"
+# Chroma 单次批量更新的条数
+_UPDATE_BATCH_SIZE = 1000
+# 从 Chroma 导入 HNSW 后端时每批读取的条数
+_IMPORT_BATCH_SIZE = 10000
+
+
+def get_hnsw_config(collection_name: str) -> dict:
+    """
+    获取集合的 hnsw 后端配置：hnsw 下的公共配置，再用 hnsw.collections.<集合名> 中的配置覆盖
+    :param collection_name: 集合名
+    :return: 合并后的配置
+    """
+    hnsw_config = dict(chroma_config.get('hnsw') or {})
+    overrides = (hnsw_config.pop('collections', None) or {}).get(collection_name) or {}
+    hnsw_config.update(overrides)
+    return hnsw_config
+
+
 class VectorStoreService:
     """向量数据库服务"""
     def __init__(self):
-        persist_dir = get_abstract_path(chroma_config['persist_directory'])
-        # 使用同步 Chroma, 在调用时用 to_thread 包裹
-        self.vectors_store = Chroma(
-            collection_name=chroma_config['collection_name'],
-            embedding_function=embed_model,
-            persist_directory=persist_dir,
-        )
+        # 使用同步的向量库, 在调用时用 to_thread 包裹
+        self.backend = chroma_config.get('vector_backend', 'chroma')
+        self.vectors_store = self._create_vector_store()
+        semantic_merge = chroma_config.get('semantic_merge') or {}
         self.spliter = AsyncTextSplitter(
             chunk_size=chroma_config['chunk_size'],
             chunk_overlap=chroma_config['chunk_overlap'],
             separators=chroma_config['separators'],
-            embedding_model=embed_model
+            embedding_model=embed_model if semantic_merge.get('enabled', False) else None,
+            similarity_threshold=semantic_merge.get('similarity_threshold', 0.7),
+            max_chunk_size=semantic_merge.get('max_chunk_size'),
+            min_overlap=semantic_merge.get('min_overlap'),
         )
+        self.summarizer = self._create_summarizer()
+
+    @staticmethod
+    def _create_summarizer():
+        """根据 rag.yaml 中的 ingestion_summaries 创建入库摘要生成器，未启用时返回None"""
+        summary_config = rag_config.get('ingestion_summaries') or {}
+        if not summary_config.get('enabled', False):
+            return None
+        return DocumentSummarizer(
+            chat_model,
+            section_max_chars=summary_config.get('section_max_chars', 2000),
+            max_concurrency=summary_config.get('max_concurrency', 2),
+            timeout=summary_config.get('timeout_seconds', 60),
+            reduce_group_size=summary_config.get('reduce_group_size', 8),
+        )
+
+    @staticmethod
+    def _create_chroma() -> Chroma:
+        return Chroma(
+            collection_name=chroma_config['collection_name'],
+            embedding_function=embed_model,
+            persist_directory=get_abstract_path(chroma_config['persist_directory']),
+        )
+
+    def _create_vector_store(self):
+        """根据配置创建向量库后端，hnsw 后端不可用（未安装 faiss-cpu）时回退到 Chroma"""
+        if self.backend == 'hnsw':
+            collection_name = chroma_config['collection_name']
+            hnsw_config = get_hnsw_config(collection_name)
+            try:
+                return HNSWVectorStore(
+                    os.path.join(get_abstract_path(hnsw_config.get('index_directory', 'data/hnsw_index')),
+                                 collection_name),
+                    embed_model,
+                    m=hnsw_config.get('m', 32),
+                    ef_construction=hnsw_config.get('ef_construction', 200),
+                    ef_search=hnsw_config.get('ef_search', 64),
+                    max_segments=hnsw_config.get('max_segments', 8),
+                    exact_search_threshold=hnsw_config.get('exact_search_threshold', 2000),
+                    vector_dtype=hnsw_config.get('vector_dtype', 'float32'),
+                    truncate_dim=hnsw_config.get('truncate_dim'),
+                    rescore_factor=hnsw_config.get('rescore_factor', 4),
+                )
+            except ImportError as e:
+                logger.warning(f"【向量数据库】hnsw 后端不可用（需要安装 faiss-cpu），使用 Chroma: {e}")
+        elif self.backend != 'chroma':
+            logger.warning(f"【向量数据库】未知的向量库后端 {self.backend}，使用 Chroma")
+        self.backend = 'chroma'
+        return self._create_chroma()
 
-    async def get_bm25_retriever(self):
+    @property
+    def _collection(self):
+        """底层写入接口：Chroma 的 collection，或 HNSW 向量库本身（upsert/update 的参数与 collection 一致）"""
+        return self.vectors_store if self.backend == 'hnsw' else self.vectors_store._collection
+
+    async def sync_vector_backend(self):
         """
-        获取BM25检索器
-        :return: BM25Retriever实例
+        启用 hnsw 后端后首次启动时，把 Chroma 中已有的文档连同向量一起导入，不需要重新计算嵌入
+        导入完成后 hnsw 索引目录中留有导入标记，之后不再导入；中途失败不写标记，下次启动重新导入
         """
-        # 从文件直接加载文档，不依赖向量数据库
-        allowed_file_path: tuple[str] = await listdir_allowed_type(
-            chroma_config['data_path'],
-            tuple(chroma_config['allow_knowledge_file_types'])
+        if self.backend != 'hnsw':
+            return
+        if not os.path.isdir(get_abstract_path(chroma_config['persist_directory'])):
+            return
+        imported = await asyncio.to_thread(
+            self.vectors_store.import_documents, self._iter_chroma_batches(), 'chroma'
         )
-        file_paths = list(allowed_file_path)
-        
-        all_docs = []
-        for file_path in file_paths:
-            documents = await self.get_file_document(file_path)
-            if documents:
-                split_docs = await self.spliter.split_documents(documents)
-                all_docs.extend(split_docs)
-        
-        # 创建BM25检索器
-        if all_docs:
-            bm25_retriever = BM25Retriever.from_documents(
-                documents=all_docs,
-                k=chroma_config['k']
+        if imported:
+            logger.info(f"【向量数据库】已从 Chroma 导入 {imported} 个文档片段到 hnsw 后端")
+
+    def _iter_chroma_batches(self):
+        """分批读取 Chroma 中的文档和向量（同步生成器，在导入线程中消费）"""
+        collection = self._create_chroma()._collection
+        offset = 0
+        while True:
+            batch = collection.get(
+                limit=_IMPORT_BATCH_SIZE, offset=offset, include=['embeddings', 'documents', 'metadatas']
             )
-            return bm25_retriever
-        else:
-            return None
+            if not batch['ids']:
+                return
+            yield batch
+            offset += len(batch['ids'])
+
+    def get_bm25_retriever(self, scope: RetrievalScope) -> PartitionedBM25Retriever:
+        """
+        获取检索范围内的BM25检索器
+        基于按范围分区的持久化倒排索引，只读取范围内的公共、个人、部门分区，不随其他用户的文档增长
+        :param scope: 检索范围
+        :return: PartitionedBM25Retriever实例
+        """
+        return PartitionedBM25Retriever(index=bm25_index, partitions=scope.bm25_partitions(), k=chroma_config['k'])
+
+    async def sync_bm25_index(self):
+        """
+        启动时对齐BM25索引与向量库：
+        - 旧版数据只执行一次：为没有可见范围的文档片段补写 visibility（有用户ID为个人文档，否则为公共文档），
+          再用向量库中的文档按范围分区重建BM25索引
+        - 索引为空而向量库中已有文档时（如索引目录被删除），用向量库中的文档重建
+        """
+        migrated = await asyncio.to_thread(ingestion_manifest.get_setting, SCOPE_MIGRATION_KEY)
+        if migrated and bm25_index.partitions():
+            return
+        stored = await asyncio.to_thread(self.vectors_store.get, include=['documents', 'metadatas'])
+        metadatas = [metadata or {} for metadata in stored['metadatas']]
+        if not migrated:
+            updated = await asyncio.to_thread(self._backfill_visibility, stored['ids'], metadatas)
+            if updated:
+                logger.info(f"【向量数据库】已为 {updated} 个旧版文档片段补写可见范围")
+        documents = [
+            Document(id=doc_id, page_content=text, metadata=metadata)
+            for doc_id, text, metadata in zip(stored['ids'], stored['documents'], metadatas)
+        ]
+        if documents or not migrated:
+            await asyncio.to_thread(bm25_index.rebuild, documents)
+            logger.info(f"【向量数据库】已根据向量库按范围分区构建BM25索引，文档数: {len(documents)}")
+        await asyncio.to_thread(ingestion_manifest.set_setting, SCOPE_MIGRATION_KEY, "1")
 
-    async def _get_all_documents(self) -> list[Document]:
+    def _backfill_visibility(self, ids: list[str], metadatas: list[dict]) -> int:
+        """
+        为缺少可见范围的文档片段补写 visibility（同步方法，调用时用 to_thread 包裹）
+        :param ids: 文档ID列表
+        :param metadatas: 与ID对应的元数据，原地补写
+        :return: 补写的片段数
         """
-        获取向量库中的所有文档
-        :return: 文档列表
+        pending = []
+        for doc_id, metadata in zip(ids, metadatas):
+            if metadata.get('visibility'):
+                continue
+            metadata['visibility'] = VISIBILITY_PRIVATE if metadata.get('user_id') else VISIBILITY_PUBLIC
+            pending.append((doc_id, metadata))
+        for start in range(0, len(pending), _UPDATE_BATCH_SIZE):
+            batch = pending[start:start + _UPDATE_BATCH_SIZE]
+            self._collection.update(
+                ids=[doc_id for doc_id, _ in batch],
+                metadatas=[metadata for _, metadata in batch],
+            )
+        return len(pending)
+
+    async def get_retriever(self, scope: RetrievalScope = PUBLIC_SCOPE):
         """
-        # 使用同步操作获取所有文档
-        all_docs = await asyncio.to_thread(
-            self.vectors_store.get,
-            include=['documents', 'metadatas']
+        获取检索范围内的混合检索器（BM25 + 向量检索，两路并行执行后按倒数排名融合）
+        范围条件作为元数据过滤下推到 Chroma 查询中，BM25 只检索范围内的分区；
+        检索器只是轻量的查询参数对象，每次查询按范围创建
+        :param scope: 检索范围，默认只检索公共文档
+        :return: HybridRetriever实例
+        """
+        hybrid_config = chroma_config.get('hybrid_retrieval') or {}
+        return HybridRetriever(
+            vector_store=self.vectors_store,
+            bm25_index=bm25_index,
+            partitions=scope.bm25_partitions(),
+            filter=scope.chroma_filter(),
+            fetch_k=hybrid_config.get('fetch_k', chroma_config['k']),
+            max_candidates=hybrid_config.get('max_candidates', 2 * chroma_config['k']),
+            rrf_k=hybrid_config.get('rrf_k', 60),
+            weights=hybrid_config.get('weights', [0.5, 0.5]),
         )
-        # 构建Document对象列表
-        documents = []
-        for i, doc in enumerate(all_docs['documents']):
-            metadata = all_docs['metadatas'][i] if i < len(all_docs['metadatas']) else {}
-            documents.append(Document(page_content=doc, metadata=metadata))
-        return documents
-
-    async def get_retriever(self):
-        """
-        获取混合检索器（BM25 + 向量检索）
-        :return: EnsembleRetriever实例或单独的向量检索器
-        """
-        # 创建向量检索器
-        vector_retriever = self.vectors_store.as_retriever(
-            search_type='similarity',
-            search_kwargs={'k': chroma_config['k']},
+
+    async def claim_file(self, md5_hex: str, scope: str, user_id: str | None, owner: str | None = None) -> str | None:
+        """
+        异步占用文件在该可见范围内的入库记录；已入库或其他任务正在入库时返回 None
+        :param md5_hex: 文件MD5
+        :param scope: 可见范围（检索分区名）
+        :param user_id: 上传者的用户ID
+        :param owner: 占用者（后台任务ID），任务被重新执行时可以接管自己的占用
+        :return: CLAIM_NEW / CLAIM_RESUMED，见 IngestionManifest.claim
+        """
+        return await asyncio.to_thread(ingestion_manifest.claim, md5_hex, scope, user_id, owner)
+
+    async def discard_partial_file(self, md5_hex: str, scope: str):
+        """
+        清理上次未完成的入库（如实例在入库中途退出）在该可见范围内写入的片段，接管占用后、重新入库前调用
+        :param md5_hex: 文件MD5
+        :param scope: 可见范围（检索分区名）
+        """
+        chunk_ids = await asyncio.to_thread(self._scope_chunk_ids, md5_hex, scope)
+        await asyncio.to_thread(self.delete_by_ids, chunk_ids)
+        await asyncio.to_thread(bm25_index.delete, {"file_hash": md5_hex}, [scope])
+        if chunk_ids:
+            logger.info(f"【向量数据库】已清理文件 {md5_hex} 在 {scope} 中未完成入库的 {len(chunk_ids)} 个文档片段")
+
+    def _scope_chunk_ids(self, file_hash: str, scope: str) -> list[str]:
+        """按元数据找出文件在某个可见范围内的片段ID（同步方法，调用时用 to_thread 包裹）"""
+        stored = self.vectors_store.get(where={"file_hash": file_hash}, include=["metadatas"])
+        return [
+            doc_id for doc_id, metadata in zip(stored["ids"], stored["metadatas"])
+            if partition_of(metadata or {}) == scope
+        ]
+
+    async def release_file(self, md5_hex: str, scope: str):
+        """
+        释放 claim_file 的占用（入库失败或跳过时），之后可以重新上传
+        :param md5_hex: 文件MD5
+        :param scope: 可见范围（检索分区名）
+        """
+        await asyncio.to_thread(ingestion_manifest.release, md5_hex, scope)
+
+    async def record_file(self, md5_hex: str, scope: str, user_id: str | None, chunk_ids: list[str]):
+        """
+        记录已入库的文件
+        :param md5_hex: 文件MD5
+        :param scope: 可见范围（检索分区名）
+        :param user_id: 上传者的用户ID
+        :param chunk_ids: 文档片段ID
+        """
+        await asyncio.to_thread(
+            ingestion_manifest.record, md5_hex, scope, user_id, chunk_ids, rag_config['text_embedding_model_name']
         )
-        # 创建BM25检索器
-        bm25_retriever = await self.get_bm25_retriever()
-        
-        # 根据是否有BM25检索器决定返回哪种检索器
-        if bm25_retriever:
-            # 创建混合检索器
-            ensemble_retriever = EnsembleRetriever(
-                retrievers=[vector_retriever, bm25_retriever],
-                weights=[0.5, 0.5]  # 权重可以根据实际情况调整
-            )
-            return ensemble_retriever
-        else:
-            # 如果没有BM25检索器，只返回向量检索器
-            return vector_retriever
-
-    async def check_md5_hex(self, md5_for_check: str) -> bool:
-        """异步检查md5"""
-        md5_path = get_abstract_path(chroma_config['md5_hex_store'])
-        # 确保目录存在
-        md5_dir = os.path.dirname(md5_path)
-        if not await aio_os.path.exists(md5_dir):
-            await aio_os.makedirs(md5_dir, exist_ok=True)
-        if not await aio_os.path.exists(md5_path):
-            async with aiofiles.open(md5_path, 'w', encoding="utf-8"):
-                pass
-            return False
 
-        async with aiofiles.open(md5_path, 'r', encoding="utf-8") as f:
-            async for line in f:
-                if line.strip() == md5_for_check:
-                    return True
+    async def delete_file(self, file_hash: str, scope: str) -> bool:
+        """
+        删除单个文件在某个可见范围内的全部文档片段及其入库记录，其他范围内的同一文件不受影响
+        :param file_hash: 文件MD5
+        :param scope: 可见范围（检索分区名）
+        :return: 文件是否存在
+        """
+        entry = await asyncio.to_thread(ingestion_manifest.get, file_hash, scope)
+        if entry is None:
             return False
+        chunk_ids = entry["chunk_ids"]
+        if not chunk_ids:
+            # 旧版MD5记录没有片段ID，按元数据找出该范围内的片段
+            chunk_ids = await asyncio.to_thread(self._scope_chunk_ids, file_hash, scope)
+        await asyncio.to_thread(self.delete_by_ids, chunk_ids)
+        # 可见范围即文件所在的BM25分区
+        await asyncio.to_thread(bm25_index.delete, {"file_hash": file_hash}, [scope])
+        await asyncio.to_thread(ingestion_manifest.remove, file_hash, scope)
+        logger.info(f"【向量数据库】已删除文件 {file_hash} 在 {scope} 中的 {len(chunk_ids)} 个文档片段")
+        return True
 
-    async def save_md5_hex(self, md5_hex: str):
-        """异步保存md5"""
-        async with aiofiles.open(get_abstract_path(chroma_config['md5_hex_store']), 'a', encoding="utf-8") as f:
-            await f.write(md5_hex + '\n')
+    async def reindex_file(self, file_hash: str, scope: str) -> int:
+        """
+        用当前嵌入模型重新计算单个文件在某个可见范围内的向量（片段ID与文本不变）
+        :param file_hash: 文件MD5
+        :param scope: 可见范围（检索分区名）
+        :return: 重建的片段数，文件不存在或没有片段ID时返回 -1
+        """
+        entry = await asyncio.to_thread(ingestion_manifest.get, file_hash, scope)
+        if entry is None or not entry["chunk_ids"]:
+            return -1
+        stored = await asyncio.to_thread(
+            self.vectors_store.get, ids=entry["chunk_ids"], include=["documents", "metadatas"]
+        )
+        documents = [
+            Document(page_content=text, metadata=metadata or {})
+            for text, metadata in zip(stored["documents"], stored["metadatas"])
+        ]
+        batch_size = chroma_config.get('ingestion', {}).get('embed_batch_size', 32)
+        for start in range(0, len(documents), batch_size):
+            batch = documents[start:start + batch_size]
+            vectors = await embed_model.aembed_documents([doc.page_content for doc in batch])
+            await asyncio.to_thread(self.add_embeddings, batch, vectors, stored["ids"][start:start + batch_size])
+        await self.record_file(file_hash, scope, entry["user_id"], stored["ids"])
+        logger.info(f"【向量数据库】已重建文件 {file_hash} 的 {len(documents)} 个文档片段")
+        return len(documents)
 
     async def delete_user_documents(self, user_id: str):
         """
@@ -144,6 +327,15 @@ class VectorStoreService:
                 self.vectors_store.delete, 
                 where={"user_id": user_id}
             )
+            # 同步删除BM25索引中的文档：个人分区整体删除，共享到部门的文档从部门分区中删除
+            await asyncio.to_thread(bm25_index.drop, user_partition(user_id))
+            department_partitions = [
+                name for name in bm25_index.partitions() if name.startswith(DEPARTMENT_PARTITION_PREFIX)
+            ]
+            if department_partitions:
+                await asyncio.to_thread(bm25_index.delete, {"user_id": user_id}, department_partitions)
+            # 删除入库记录，之后重新上传同一文件可以正常入库
+            await asyncio.to_thread(ingestion_manifest.remove_user, user_id)
             logger.info(f"【向量数据库】已删除用户 {user_id} 的所有文档")
         except Exception as e:
             logger.error(f"【向量数据库】删除用户 {user_id} 的文档时出错: {e}")
@@ -158,101 +350,79 @@ class VectorStoreService:
         else:
             return []
 
-    async def get_document(self, files: list = None, user_id: str = None):
+    async def iter_file_document(self, read_path: str):
+        """异步逐批加载文件，PDF按页码范围分批返回"""
+        async for documents in iter_file_documents(read_path):
+            yield documents
+
+    def add_embeddings(self, documents: list[Document], embeddings: list[list[float]], ids: list[str]):
+        """
+        写入已计算好向量的文档（同步方法，调用时用 to_thread 包裹）
+        :param documents: 文档列表
+        :param embeddings: 与文档一一对应的向量
+        :param ids: 文档ID
+        """
+        # langchain_chroma 没有提供直接写入已有向量的公开方法，这里直接使用底层 collection（HNSW 后端接口相同）
+        self._collection.upsert(
+            ids=ids,
+            embeddings=embeddings,
+            documents=[doc.page_content for doc in documents],
+            metadatas=[doc.metadata or None for doc in documents],
+        )
+
+    def get_summaries(self, file_hashes: list[str]) -> list[Document]:
+        """
+        读取指定文件的入库摘要（同步方法，调用时用 to_thread 包裹）
+        :param file_hashes: 文件MD5列表
+        :return: 摘要文档列表
+        """
+        if not file_hashes:
+            return []
+        stored = self.vectors_store.get(
+            where={"$and": [{"doc_type": SUMMARY_DOC_TYPE}, {"file_hash": {"$in": list(file_hashes)}}]},
+            include=["documents", "metadatas"],
+        )
+        return [
+            Document(id=doc_id, page_content=text, metadata=metadata or {})
+            for doc_id, text, metadata in zip(stored["ids"], stored["documents"], stored["metadatas"])
+        ]
+
+    def delete_by_ids(self, ids: list[str]):
+        """
+        按ID删除文档（同步方法，调用时用 to_thread 包裹）
+        :param ids: 文档ID列表
+        """
+        if ids:
+            self.vectors_store.delete(ids=ids)
+
+    async def get_document(
+            self,
+            user_id: str = None,
+            file_paths: list = None,
+            on_file_done=None,
+            department_id: str = None,
+    ) -> dict:
         """
         处理文档并将其转为向量存入向量数据库
-        :param files: 上传的文件列表，如果为None则从数据文件夹读取
         :param user_id: 用户ID，用于标记文档的所有者
+        :param file_paths: 已落盘的文件路径或文件任务列表（如后台入库任务暂存的上传文件），为None时从数据文件夹读取
+        :param on_file_done: 单个文件处理结束时的回调，参数为 (文件任务, 状态)
+        :param department_id: 部门ID，有值时文档在该部门内共享
+        :return: 入库统计（文件数、片段数、chunks_per_sec等）
         """
         # 确定要处理的文件列表
-        file_paths = []
-        if files:
-            # 处理上传的文件
-            for file in files:
-                # 创建临时文件，使用asyncio.to_thread 包裹
-                temp_file_path = await asyncio.to_thread(
-                    tempfile.NamedTemporaryFile,
-                    delete=False,
-                    suffix=os.path.splitext(file.filename)[1]
-                )
-                content = await file.read()
-                await asyncio.to_thread(temp_file_path.write, content)
-                file_paths.append(temp_file_path.name)
+        if file_paths:
+            sources = list(file_paths)
         else:
             # 从数据文件夹读取文件
             allowed_file_path: tuple[str] = await listdir_allowed_type(
                 chroma_config['data_path'],
                 tuple(chroma_config['allow_knowledge_file_types'])
             )
-            file_paths = list(allowed_file_path)
-
-        for file_path in file_paths:
-            # 2. 计算MD5
-            md5_hex = await get_file_md5_hex(file_path)
-            if await self.check_md5_hex(md5_hex):
-                logger.info(f"【向量数据库】文件 {file_path} 的md5值 {md5_hex} 已存在，跳过")
-                # 如果是临时文件，删除
-                if files:
-                    try:
-                        os.unlink(file_path)
-                    except:
-                        pass
-                continue
-
-            try:
-                # 3. 加载文档
-                document: list[Document] = await self.get_file_document(file_path)
-                if not document:
-                    logger.error(f"【向量数据库】文件 {file_path} 加载内容为空，跳过")
-                    # 如果是临时文件，删除
-                    if files:
-                        try:
-                            os.unlink(file_path)
-                        except Exception as e:
-                            pass
-                    continue
-
-                # 4. 切分文档
-                document: list[Document] = await self.spliter.split_documents(document)
-                if not document:
-                    logger.error(f"【向量数据库】文件 {file_path} 切分内容为空，跳过")
-                    # 如果是临时文件，删除
-                    if files:
-                        try:
-                            os.unlink(file_path)
-                        except:
-                            pass
-                    continue
-
-                # 5. 添加用户ID作为元数据
-                if user_id:
-                    for doc in document:
-                        doc.metadata['user_id'] = user_id
-
-                # 6. 异步写入向量库
-                await asyncio.to_thread(self.vectors_store.add_documents, document)
-
-                # 6. 保存MD5
-                await self.save_md5_hex(md5_hex)
-                logger.info(f"【向量数据库】文件 {file_path} 的md5值 {md5_hex} 已保存")
-
-                # 如果是临时文件，删除
-                if files:
-                    try:
-                        os.unlink(file_path)
-                    except:
-                        pass
-
-            except Exception as e:
-                logger.error(f"【向量数据库】文件 {file_path} 处理时出错: {e}")
-                # 如果是临时文件，删除
-                if files:
-                    try:
-                        os.unlink(file_path)
-                    except:
-                        pass
-                continue
+            sources = list(allowed_file_path)
 
+        pipeline = IngestionPipeline(self, embed_model, chroma_config.get('ingestion'), self.summarizer)
+        return await pipeline.run(sources, user_id=user_id, on_file_done=on_file_done, department_id=department_id)
 
 if __name__ == '__main__':
     async def main():
@@ -261,7 +431,7 @@ if __name__ == '__main__':
 
         # 等待get_retriever方法完成
         retriever = await store.get_retriever()
-        # 直接使用ainvoke方法，因为EnsembleRetriever的invoke可能返回协程
+        # 使用ainvoke方法，向量检索与BM25检索并行执行
         results = await retriever.ainvoke('扫地')
         print(f"检索结果数量: {len(results)}")
         for result in results:
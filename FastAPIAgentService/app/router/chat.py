@@ -1,8 +1,8 @@
-from typing import List
+from typing import List, Optional
 import uuid
 
 from fastapi.routing import APIRouter
-from fastapi import UploadFile, File, Depends, Header
+from fastapi import UploadFile, File, Form, Depends, Header
 from fastapi.responses import StreamingResponse
 
 from app.agent.agent import get_agent_stream_response, get_main_agent_stream_response, get_main_agent_response
@@ -10,6 +10,7 @@ from app.router.chat_service import ChatService, get_router_service
 
 from app.schemas.rag_schemas import QueryRequest, RAGResponse, RAGRequest, SessionResponse, ReorderResponse, ReorderRequest, ParamExtractionRequest, ParamExtractionResponse
 from app.agent.main_agent import MainAgent
+from app.rag.retrieval_scope import RetrievalScope, get_request_scope, get_optional_request_scope
 from app.utils.auth_utils import get_current_user_id
 from app.core.success_response import success_response
 from app.core.rate_limit import rate_limit
@@ -21,6 +22,7 @@ chat_router = APIRouter(prefix="/api", tags=["api"])
 async def query_stream(
         request: QueryRequest,
         user_id: str = Depends(get_current_user_id),
+        scope: RetrievalScope = Depends(get_request_scope),
         _: None = Depends(rate_limit(limit=10, window=60))
 ):
     """查询Agent流式响应"""
@@ -29,7 +31,7 @@ async def query_stream(
     
     # 直接调用get_agent_stream_response函数
     return StreamingResponse(
-        get_agent_stream_response(request.query, session_id, user_id),
+        get_agent_stream_response(request.query, session_id, user_id, scope=scope),
         media_type="text/event-stream",
         headers={
             "Cache-Control": "no-cache",
@@ -42,6 +44,7 @@ async def query_stream(
 async def main_agent_query_stream(
         request: QueryRequest,
         user_id: str = Depends(get_current_user_id),
+        scope: RetrievalScope = Depends(get_request_scope),
         _: None = Depends(rate_limit(limit=10, window=60))
 ):
     """查询主Agent流式响应（协调多个子Agent）"""
@@ -50,7 +53,7 @@ async def main_agent_query_stream(
     
     # 调用主Agent流式响应函数，传递 jwt_token
     return StreamingResponse(
-        get_main_agent_stream_response(request.query, session_id, user_id, request.jwt_token),
+        get_main_agent_stream_response(request.query, session_id, user_id, request.jwt_token, scope),
         media_type="text/event-stream",
         headers={
             "Cache-Control": "no-cache",
@@ -59,19 +62,20 @@ async def main_agent_query_stream(
     )
 
 @chat_router.post("/main-agent/query")
-async def main_agent_query(request: QueryRequest, user_id: str = Depends(get_current_user_id), router_service: ChatService = Depends(get_router_service)):
+async def main_agent_query(request: QueryRequest, user_id: str = Depends(get_current_user_id), scope: RetrievalScope = Depends(get_request_scope), router_service: ChatService = Depends(get_router_service)):
     """查询主Agent, 非流式响应"""
-    response = await get_main_agent_response(request.query, request.session_id, user_id)
+    response = await get_main_agent_response(request.query, request.session_id, user_id, scope)
     return success_response(data=response)
 
 @chat_router.post("/rag/query")
 async def query_rag(
         request: RAGRequest,
+        scope: RetrievalScope = Depends(get_optional_request_scope),
         router_service: ChatService = Depends(get_router_service),
         _: None = Depends(rate_limit(limit=15, window=60))
 ):
-    """RAG检索"""
-    response = await router_service.handle_rag_query(request.query)
+    """RAG检索，携带令牌时检索公共、个人和所在部门的文档，否则只检索公共文档"""
+    response = await router_service.handle_rag_query(request.query, scope)
     return success_response(data=RAGResponse(response=response))
 
 
@@ -107,26 +111,82 @@ async def get_user_sessions(user_id: str, current_user_id: str = Depends(get_cur
 @chat_router.post("/vector/add/single")
 async def add_vector_single(
         file: UploadFile = File(...),
+        visibility: str = Form("private", description="可见范围：private 仅本人可见，department 所在部门共享"),
         user_id: str = Depends(get_current_user_id),
+        scope: RetrievalScope = Depends(get_request_scope),
         router_service: ChatService = Depends(get_router_service),
         _: None = Depends(rate_limit(limit=5, window=60))
 ):
-    """上传文件，将文件保存到向量数据库，仅支持TXT和PDF"""
-    filename = await router_service.handle_add_vector_single(file, user_id)
-    return success_response(message=f"文件 {filename} 已成功上传并存储到向量数据库")
+    """上传文件，登记后台入库任务并返回任务ID，仅支持TXT和PDF"""
+    job_id = await router_service.handle_add_vector_single(file, user_id, visibility, scope)
+    return success_response(
+        message=f"文件 {file.filename} 已上传，正在后台入库",
+        data={"job_id": job_id, "status_url": f"/api/vector/jobs/{job_id}"}
+    )
 
 
 
 @chat_router.post("/vector/add/multiple")
 async def add_vector_multiple(
         files: List[UploadFile] = File(..., description="要上传的文件列表，仅支持PDF和TXT格式"),
+        visibility: str = Form("private", description="可见范围：private 仅本人可见，department 所在部门共享"),
         user_id: str = Depends(get_current_user_id),
+        scope: RetrievalScope = Depends(get_request_scope),
         router_service: ChatService = Depends(get_router_service),
         _: None = Depends(rate_limit(limit=3, window=60))
 ):
-    """上传多个文件，将文件保存到向量数据库，仅支持TXT和PDF"""
-    filenames = await router_service.handle_add_vector_multiple(files, user_id)
-    return success_response(message=f"文件 {filenames} 已成功上传并存储到向量数据库")
+    """上传多个文件，登记后台入库任务并返回任务ID，仅支持TXT和PDF"""
+    job_id = await router_service.handle_add_vector_multiple(files, user_id, visibility, scope)
+    return success_response(
+        message=f"文件 {[file.filename for file in files]} 已上传，正在后台入库",
+        data={"job_id": job_id, "status_url": f"/api/vector/jobs/{job_id}"}
+    )
+
+
+@chat_router.get("/vector/jobs/{job_id}")
+async def get_vector_job(
+        job_id: str,
+        user_id: str = Depends(get_current_user_id),
+        router_service: ChatService = Depends(get_router_service),
+):
+    """查询入库任务状态及每个文件的处理进度"""
+    job = await router_service.handle_get_ingestion_job(job_id, user_id)
+    return success_response(data=job)
+
+
+@chat_router.get("/vector/files")
+async def list_vector_files(
+        user_id: str = Depends(get_current_user_id),
+        router_service: ChatService = Depends(get_router_service),
+):
+    """查询用户已入库的文件"""
+    files = await router_service.handle_list_user_files(user_id)
+    return success_response(data=files)
+
+
+@chat_router.delete("/vector/files/{file_hash}")
+async def delete_vector_file(
+        file_hash: str,
+        scope: Optional[str] = None,
+        user_id: str = Depends(get_current_user_id),
+        router_service: ChatService = Depends(get_router_service),
+):
+    """删除单个文件的全部向量；scope 为可见范围（见文件列表），不传时删除本人在各个范围内上传的该文件"""
+    await router_service.handle_delete_file(file_hash, user_id, scope)
+    return success_response(message=f"已删除文件 {file_hash} 的向量")
+
+
+@chat_router.post("/vector/files/{file_hash}/reindex")
+async def reindex_vector_file(
+        file_hash: str,
+        scope: Optional[str] = None,
+        user_id: str = Depends(get_current_user_id),
+        router_service: ChatService = Depends(get_router_service),
+        _: None = Depends(rate_limit(limit=5, window=60))
+):
+    """用当前嵌入模型重建单个文件的向量；scope 为可见范围，不传时重建本人在各个范围内上传的该文件"""
+    count = await router_service.handle_reindex_file(file_hash, user_id, scope)
+    return success_response(message=f"已重建文件 {file_hash} 的 {count} 个文档片段")
 
 
 @chat_router.delete("/vector/clean")
@@ -174,7 +234,7 @@ async def test_param_extraction(
         state.user_id = user_id
         
         # 执行参数提取
-        await main_agent._check_params_complete(subtask, state)
+        await main_agent._missing_params_question(subtask, state)
         
         # 获取提取的参数和缺失的参数
         extracted_params = subtask.get("params", {})
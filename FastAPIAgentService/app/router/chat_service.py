@@ -1,12 +1,15 @@
+import asyncio
 from typing import List, Optional, Tuple, Dict, Any
 import uuid
-import magic
 
-from fastapi import HTTPException, UploadFile
+from fastapi import HTTPException, UploadFile, Depends
 
 from app.core.logger_handler import logger
-from app.rag.vector_store import VectorStoreService
-from app.rag.rag_service import RagService
+from app.utils.file_handler import MIME_SNIFF_SIZE, sniff_mime_type
+from app.rag.rag_service import RagService, get_rag_service
+from app.rag.ingestion_jobs import ingestion_job_manager
+from app.rag.ingestion_manifest import ingestion_manifest
+from app.rag.retrieval_scope import RetrievalScope, VISIBILITY_DEPARTMENT, VISIBILITY_PRIVATE
 from app.rag.reorder_service import reorder_service
 from app.agent.agent import get_agent_response
 from app.services import session_manager as sm
@@ -14,6 +17,9 @@ from app.services import session_manager as sm
 class ChatService:
     """路由服务层，处理业务逻辑"""
 
+    def __init__(self, rag_service: RagService):
+        self.rag_service = rag_service
+
     async def handle_agent_query(self, query: str, session_id: Optional[str], user_id: str) -> Tuple[str, dict, str]:
         """处理智能代理查询逻辑"""
         # 如果未提供 session_id，则生成一个
@@ -32,10 +38,9 @@ class ChatService:
 
         return session_id, response, steps
 
-    async def handle_rag_query(self, query: str) -> str:
-        """处理 RAG 查询逻辑"""
-        rag_service = RagService()
-        response = await rag_service.rag_summary(query)
+    async def handle_rag_query(self, query: str, scope: RetrievalScope) -> str:
+        """处理 RAG 查询逻辑，只检索范围内的文档"""
+        response = await self.rag_service.rag_summary(query, scope)
         return response
 
     async def handle_get_session(self, session_id: str, user_id: str) -> List[Tuple[str, str]]:
@@ -62,51 +67,61 @@ class ChatService:
         sessions = await sm.session_manager.get_user_sessions(user_id)
         return sessions
 
-    async def handle_add_vector_single(self, file: UploadFile, user_id: str) -> str:
-        """处理添加单个向量逻辑"""
-        # 创建向量数据库服务实例
-        store = VectorStoreService()
+    @staticmethod
+    def _resolve_upload_department(visibility: str, scope: RetrievalScope) -> Optional[str]:
+        """根据上传时选择的可见范围确定共享的部门，仅本人可见时返回 None"""
+        if visibility == VISIBILITY_PRIVATE:
+            return None
+        if visibility != VISIBILITY_DEPARTMENT:
+            raise HTTPException(status_code=400, detail=f"可见范围仅支持 {VISIBILITY_PRIVATE} 和 {VISIBILITY_DEPARTMENT}")
+        if not scope.department_id:
+            raise HTTPException(status_code=400, detail="当前用户未分配部门，无法共享到部门")
+        return scope.department_id
+
+    async def handle_add_vector_single(self, file: UploadFile, user_id: str, visibility: str,
+                                       scope: RetrievalScope) -> str:
+        """处理添加单个向量逻辑，返回入库任务ID"""
+        department_id = self._resolve_upload_department(visibility, scope)
 
         # 检查文件大小，如果超过20MB则抛出异常
         max_file_size = 20 * 1024 * 1024  # 20MB
         if file.size > max_file_size:
             raise HTTPException(status_code=400, detail="文件大小不能超过20MB")
 
-        # 使用python-magic检查文件类型
-        content = await file.read()
+        # 使用python-magic检查文件类型，只读取文件头
+        head = await file.read(MIME_SNIFF_SIZE)
         # 重置文件指针
         await file.seek(0)
 
         # 检测文件类型
-        mime = magic.Magic(mime=True)
-        file_type = mime.from_buffer(content)
+        file_type = sniff_mime_type(head)
 
         # 检查文件类型是否允许
         allowed_mime_types = {'application/pdf', 'text/plain'}
         if file_type not in allowed_mime_types:
             raise HTTPException(status_code=400, detail=f"文件类型不支持，仅支持PDF和TXT文件。检测到的文件类型: {file_type}")
 
-        # 处理文件并存储到向量数据库
-        await store.get_document(files=[file], user_id=user_id)
+        # 暂存文件并登记后台入库任务
+        return await ingestion_job_manager.submit([file], user_id, department_id)
 
-        return file.filename
+    async def handle_add_vector_multiple(self, files: List[UploadFile], user_id: str, visibility: str,
+                                         scope: RetrievalScope) -> str:
+        """处理添加多个向量逻辑，返回入库任务ID"""
+        department_id = self._resolve_upload_department(visibility, scope)
 
-    async def handle_add_vector_multiple(self, files: List[UploadFile], user_id: str) -> List[str]:
-        """处理添加多个向量逻辑"""
-        store = VectorStoreService()
         max_file_folder_size = 200 * 1024 * 1024  # 最大文件大小200MB
 
         # 检查文件类型和大小
         total_size = 0
         allowed_mime_types = {'application/pdf', 'text/plain'}
-        mime = magic.Magic(mime=True)
 
         for file in files:
-            content = await file.read()
-            total_size += len(content)
+            # 文件大小取自上传时的统计，类型检测只读取文件头
+            total_size += file.size or 0
+            head = await file.read(MIME_SNIFF_SIZE)
 
             # 检测文件类型
-            file_type = mime.from_buffer(content)
+            file_type = sniff_mime_type(head)
             if file_type not in allowed_mime_types:
                 raise HTTPException(status_code=400, detail=f"文件 {file.filename} 类型不支持，仅支持PDF和TXT文件。检测到的文件类型: {file_type}")
 
@@ -116,16 +131,66 @@ class ChatService:
         if total_size > max_file_folder_size:
             raise HTTPException(status_code=400, detail="文件总大小不能超过200MB")
 
-        await store.get_document(files=files, user_id=user_id)
+        # 暂存文件并登记后台入库任务
+        return await ingestion_job_manager.submit(files, user_id, department_id)
 
-        return [file.filename for file in files]
+    async def handle_get_ingestion_job(self, job_id: str, user_id: str) -> Dict[str, Any]:
+        """处理查询入库任务逻辑，只能查询自己提交的任务"""
+        job = await ingestion_job_manager.get_job(job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail="入库任务不存在或已过期")
+        if job["user_id"] != user_id:
+            raise HTTPException(status_code=403, detail="Forbidden")
+        return job
+
+    async def handle_list_user_files(self, user_id: str) -> List[Dict[str, Any]]:
+        """处理查询用户已入库文件逻辑"""
+        entries = await asyncio.to_thread(ingestion_manifest.list_by_user, user_id)
+        return [
+            {
+                "file_hash": entry["file_hash"],
+                "scope": entry["scope"],
+                "chunk_count": len(entry["chunk_ids"]),
+                "embedding_model": entry["embedding_model"],
+                "ingested_at": entry["ingested_at"],
+            }
+            for entry in entries
+        ]
+
+    async def _owned_entries(self, file_hash: str, user_id: str, scope: Optional[str]) -> List[Dict[str, Any]]:
+        """
+        当前用户上传的该文件的入库记录（同一文件可以由不同用户、在不同可见范围内各自入库）
+        :param scope: 可见范围，为空时返回全部范围
+        """
+        entries = await asyncio.to_thread(ingestion_manifest.list_by_file, file_hash)
+        if scope:
+            entries = [entry for entry in entries if entry["scope"] == scope]
+        if not entries:
+            raise HTTPException(status_code=404, detail="文件不存在")
+        owned = [entry for entry in entries if entry["user_id"] == user_id]
+        if not owned:
+            raise HTTPException(status_code=403, detail="Forbidden")
+        return owned
+
+    async def handle_delete_file(self, file_hash: str, user_id: str, scope: Optional[str] = None) -> None:
+        """处理删除单个文件逻辑"""
+        for entry in await self._owned_entries(file_hash, user_id, scope):
+            await self.rag_service.delete_file(file_hash, entry["scope"])
+
+    async def handle_reindex_file(self, file_hash: str, user_id: str, scope: Optional[str] = None) -> int:
+        """处理重建单个文件向量逻辑，返回重建的片段数"""
+        counts = [
+            await self.rag_service.reindex_file(file_hash, entry["scope"])
+            for entry in await self._owned_entries(file_hash, user_id, scope)
+        ]
+        if all(count < 0 for count in counts):
+            raise HTTPException(status_code=400, detail="该文件没有记录文档片段，无法重建")
+        return sum(count for count in counts if count > 0)
 
     async def clean_user_upload(self, user_id: str) -> None:
         """处理删除用户上传的所有向量逻辑"""
-        # 创建向量数据库服务实例
-        store = VectorStoreService()
         # 删除用户的所有文档
-        await store.delete_user_documents(user_id)
+        await self.rag_service.delete_user_documents(user_id)
 
     async def handle_reorder(self, query: str, documents: List[str]) -> List[Dict[str, Any]]:
         """
@@ -154,6 +219,6 @@ class ChatService:
             raise HTTPException(status_code=500, detail=f"重排序过程中出错: {str(e)}")
 
 
-def get_router_service() -> ChatService:
+def get_router_service(rag_service: RagService = Depends(get_rag_service)) -> ChatService:
     """获取路由服务实例（用于依赖注入）"""
-    return ChatService()
\ No newline at end of file
+    return ChatService(rag_service)
\ No newline at end of file
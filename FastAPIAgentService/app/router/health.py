@@ -1,9 +1,16 @@
 from fastapi import HTTPException
 from fastapi.routing import APIRouter
 
+from app.agent.agent_router import routing_stats
+from app.agent.intent_classifier import intent_stats
+from app.agent.tool_agent import tool_executor_stats
 from app.core.success_response import success_response
 from app.db.db_config import check_mysql_connection
 from app.db.redis_config import check_redis_connection
+from app.rag.hybrid_retriever import retrieval_latency
+from app.rag.reorder_service import reorder_service
+from app.rag.rag_service import get_rag_service
+from app.utils.factory import embed_model
 
 health_router = APIRouter(prefix="/health")
 
@@ -34,3 +41,75 @@ async def get_health_readiness():
     else:
         raise HTTPException(status_code=503, detail="MySQL或Redis连接失败")
 
+
+@health_router.get("/rerank", tags=["健康检查"], summary="重排序批处理统计")
+async def get_rerank_stats():
+    """重排序批处理统计：当前队列深度、批大小与队列深度直方图"""
+    return success_response(
+        message="rerank batcher stats",
+        data=reorder_service.stats()
+    )
+
+
+@health_router.get("/retrieval", tags=["健康检查"], summary="混合检索耗时统计")
+async def get_retrieval_stats():
+    """混合检索耗时统计：向量检索、BM25检索、融合及总耗时的 p50 / p95"""
+    return success_response(
+        message="retrieval latency stats",
+        data=retrieval_latency.stats()
+    )
+
+
+@health_router.get("/answer-cache", tags=["健康检查"], summary="语义答案缓存统计")
+async def get_answer_cache_stats():
+    """语义答案缓存统计：条数、命中率、淘汰与失效次数"""
+    answer_cache = get_rag_service().answer_cache
+    return success_response(
+        message="answer cache stats",
+        data=answer_cache.stats() if answer_cache else {"enabled": False}
+    )
+
+
+@health_router.get("/rag-llm-calls", tags=["健康检查"], summary="RAG大模型调用统计")
+async def get_rag_llm_call_stats():
+    """RAG每次查询的大模型调用次数：总体及按上下文方式（预生成摘要 / stuff / map-reduce）统计"""
+    return success_response(
+        message="rag llm call stats",
+        data=get_rag_service().llm_call_stats()
+    )
+
+
+@health_router.get("/agent-routing", tags=["健康检查"], summary="Agent路由统计")
+async def get_agent_routing_stats():
+    """Agent路由统计：查表 / 本地分类 / 大模型各方式的次数，以及避免的大模型调用次数"""
+    return success_response(
+        message="agent routing stats",
+        data=routing_stats.stats()
+    )
+
+
+@health_router.get("/intent-classifier", tags=["健康检查"], summary="意图分类统计")
+async def get_intent_classifier_stats():
+    """意图分类统计：跳过任务分解的次数与占比、各意图的次数、交给大模型分解的原因"""
+    return success_response(
+        message="intent classifier stats",
+        data=intent_stats.stats()
+    )
+
+
+@health_router.get("/tool-agent", tags=["健康检查"], summary="工具执行器统计")
+async def get_tool_agent_stats():
+    """工具执行器统计：执行器的构建次数与耗时、复用次数，以及模型服务提示词缓存的命中情况"""
+    return success_response(
+        message="tool agent stats",
+        data=tool_executor_stats.stats()
+    )
+
+
+@health_router.get("/embedding-cache", tags=["健康检查"], summary="嵌入缓存统计")
+async def get_embedding_cache_stats():
+    """嵌入缓存统计：命中/未命中次数与命中率"""
+    return success_response(
+        message="embedding cache stats",
+        data=embed_model.stats() if hasattr(embed_model, "stats") else {"enabled": False}
+    )
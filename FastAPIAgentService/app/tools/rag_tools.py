@@ -3,7 +3,7 @@ from typing import List
 from langchain_core.tools import tool
 
 from app.core.logger_handler import logger
-from app.rag.rag_service import RagService
+from app.rag.rag_service import get_rag_service
 from app.rag.reorder_service import reorder_service
 from app.utils.auth_utils import decode_django_jwt
 
@@ -12,7 +12,7 @@ import datetime
 @tool(description="用于从向量数据库里检索文档并生成摘要，返回包含文档列表和摘要的结果。返回格式为：'摘要: [摘要内容]\n\n检索到的文档列表:\n1. [文档1内容]\n2. [文档2内容]\n...'。注意：文档已经过自动重排序，无需再调用重排序工具")
 async def rag_summary_tools(query: str) -> str:
     """RAG 摘要工具"""
-    result = await RagService().get_documents_and_summary(query)
+    result = await get_rag_service().get_documents_and_summary(query)
     documents = result.get("documents", [])
     summary = result.get("summary", "")
 
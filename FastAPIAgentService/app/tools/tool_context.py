@@ -0,0 +1,52 @@
+from contextvars import ContextVar
+from typing import Any, Optional
+
+from langchain_core.tools import BaseTool, StructuredTool
+from pydantic import BaseModel, create_model
+
+# 需要身份验证的工具中表示 JWT 的参数名
+TOKEN_ARG = "token"
+MISSING_TOKEN_MESSAGE = "当前会话未登录，无法调用需要身份验证的工具，请提示用户先登录"
+
+# 当前请求（上下文）的 JWT，由 ToolAgent 在执行前设置；工具调用时从这里读取，不经过提示词和模型生成的参数
+_current_token: ContextVar[Optional[str]] = ContextVar("tool_jwt_token", default=None)
+
+
+def set_tool_token(token: Optional[str]):
+    """设置当前请求（上下文）调用工具使用的 JWT"""
+    _current_token.set(token)
+
+
+def get_tool_token() -> Optional[str]:
+    """获取当前请求（上下文）调用工具使用的 JWT，未设置时返回 None"""
+    return _current_token.get()
+
+
+def bind_runtime_token(tool: BaseTool) -> BaseTool:
+    """
+    把需要 JWT 的工具包装为由运行时注入令牌的工具：参数 schema 去掉 token，调用时从当前上下文读取
+    模型看不到也无需生成令牌，系统提示词因此与用户无关，可以被模型服务的提示词缓存复用
+    :param tool: 原工具
+    :return: 包装后的工具；不需要 JWT 的工具原样返回
+    """
+    schema = tool.args_schema
+    if not (isinstance(schema, type) and issubclass(schema, BaseModel)) or TOKEN_ARG not in schema.model_fields:
+        return tool
+
+    fields = {
+        name: (field.annotation, field) for name, field in schema.model_fields.items() if name != TOKEN_ARG
+    }
+
+    async def call_with_token(**kwargs: Any) -> Any:
+        token = get_tool_token()
+        if not token:
+            return MISSING_TOKEN_MESSAGE
+        return await tool.ainvoke({**kwargs, TOKEN_ARG: token})
+
+    return StructuredTool.from_function(
+        coroutine=call_with_token,
+        name=tool.name,
+        description=f"{tool.description}（其中 JWT token 由系统在调用时自动注入，不要在参数中传入）",
+        args_schema=create_model(f"{tool.name}_runtime_token", **fields),
+        infer_schema=False,
+    )
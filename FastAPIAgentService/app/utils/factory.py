@@ -8,7 +8,9 @@ from langchain_core.embeddings import Embeddings
 from langchain_core.language_models import BaseChatModel
 from langchain_ollama import OllamaEmbeddings
 
+from app.cache.embedding_cache import wrap_with_embedding_cache
 from app.utils.config import rag_config
+from app.utils.path_tool import get_abstract_path
 
 # 加载环境变量
 load_dotenv()
@@ -38,11 +40,19 @@ class ChatModelFactory(BaseModelFactory):
 class EmbedModelFactory(BaseModelFactory):
     """嵌入模型工厂"""
     def generator(self) -> Optional[Embeddings | BaseChatModel]:
-        """生成模型"""
-        return OllamaEmbeddings(
+        """生成模型（按配置加上持久化嵌入缓存）"""
+        embeddings = OllamaEmbeddings(
             model=rag_config['text_embedding_model_name'],
             base_url="http://localhost:11434"
         )
+        cache_config = rag_config.get('embedding_cache') or {}
+        if not cache_config.get('enabled', False):
+            return embeddings
+        return wrap_with_embedding_cache(
+            embeddings,
+            model_name=rag_config['text_embedding_model_name'],
+            db_path=get_abstract_path(cache_config.get('path', 'data/embedding_cache/embeddings.sqlite3')),
+        )
 
 
 class RerankerModelFactory(BaseModelFactory):
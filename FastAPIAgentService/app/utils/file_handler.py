@@ -1,9 +1,17 @@
 import os, hashlib, aiofiles, asyncio
+import codecs
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import AsyncIterator, BinaryIO, Optional
+
+import magic
 from langchain_core.documents import Document
 
 from app.core.logger_handler import logger
+from app.utils.config import chroma_config
 from app.utils.path_tool import get_abstract_path
-from langchain_community.document_loaders import PyPDFLoader, TextLoader
+from app.utils.pdf_parser import count_pdf_pages, extract_pdf_pages
+from langchain_community.document_loaders import TextLoader
 
 
 async def get_file_md5_hex(file_path: str) -> str:
@@ -59,17 +67,90 @@ async def listdir_allowed_type(path: str, allowed_types: tuple[str]) -> tuple:
 
 
 
-async def pdf_loader(file_path: str, password: str = None) -> list[Document]:
+# PDF 解析进程池配置：进程数（0或1表示不使用进程池）、每个任务解析的页数
+pdf_parsing_config = chroma_config.get('pdf_parsing') or {}
+PDF_PARSE_WORKERS = pdf_parsing_config.get('workers', 4)
+PDF_PAGES_PER_TASK = pdf_parsing_config.get('pages_per_task', 20)
+
+# PDF 解析进程池，首次使用时创建
+_pdf_executor: ProcessPoolExecutor | None = None
+
+
+def _get_pdf_executor(max_workers: int) -> ProcessPoolExecutor:
+    """获取PDF解析进程池（spawn 方式启动，子进程不继承主进程中的模型和线程）"""
+    global _pdf_executor
+    if _pdf_executor is None:
+        _pdf_executor = ProcessPoolExecutor(
+            max_workers=max_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _pdf_executor
+
+
+def close_pdf_executor():
+    """关闭PDF解析进程池（应用关闭时调用）"""
+    global _pdf_executor
+    if _pdf_executor is not None:
+        _pdf_executor.shutdown(cancel_futures=True)
+        _pdf_executor = None
+
+
+async def iter_pdf_pages(
+        file_path: str,
+        password: str = None,
+        workers: int = None,
+        pages_per_task: int = None,
+) -> AsyncIterator[list[Document]]:
     """
-    加载PDF文件内容
+    按页码范围并行解析PDF，按页序逐批返回
     :param file_path: PDF文件路径
     :param password: PDF密码（如果有）
-    :return: PDF文件内容
+    :param workers: 进程数，默认取配置，0或1时在线程中顺序解析
+    :param pages_per_task: 每批的页数，默认取配置
+    :return: 异步迭代器，每次返回一批按页序排列的文档
     """
     # 处理路径，确保使用绝对路径
     abs_file_path = get_abstract_path(file_path) if not os.path.isabs(file_path) else file_path
-    loader = PyPDFLoader(abs_file_path, password=password)
-    return await asyncio.to_thread(loader.load)
+    workers = PDF_PARSE_WORKERS if workers is None else workers
+    pages_per_task = pages_per_task or PDF_PAGES_PER_TASK
+    loop = asyncio.get_running_loop()
+    executor = _get_pdf_executor(workers) if workers > 1 else None
+
+    total_pages = await loop.run_in_executor(executor, count_pdf_pages, abs_file_path, password)
+    ranges = [(start, min(start + pages_per_task, total_pages)) for start in range(0, total_pages, pages_per_task)]
+
+    def to_documents(pages) -> list[Document]:
+        return [
+            Document(
+                page_content=text,
+                metadata={"source": abs_file_path, "page": index, "page_label": label, "total_pages": total_pages},
+            )
+            for index, label, text in pages
+        ]
+
+    # 最多同时提交 2 倍进程数的任务，按页序等待结果，解析好的批次不会无限堆积
+    window = max(workers, 1) * 2
+    pending = []
+    try:
+        for start, end in ranges:
+            pending.append(loop.run_in_executor(executor, extract_pdf_pages, abs_file_path, start, end, password))
+            if len(pending) >= window:
+                yield to_documents(await pending.pop(0))
+        while pending:
+            yield to_documents(await pending.pop(0))
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+async def pdf_loader(file_path: str, password: str = None) -> list[Document]:
+    """
+    加载PDF文件内容（按页码范围在进程池中并行解析）
+    :param file_path: PDF文件路径
+    :param password: PDF密码（如果有）
+    :return: PDF文件内容
+    """
+    return [document async for pages in iter_pdf_pages(file_path, password) for document in pages]
 
 
 async def txt_loader(file_path: str) -> list[Document]:
@@ -91,4 +172,87 @@ async def txt_loader(file_path: str) -> list[Document]:
             logger.error(f"【文本文件加载】使用编码 {encoding} 加载文件 {abs_file_path} 时出错: {e}")
             continue
     # 所有编码都失败，返回空列表
-    return []
\ No newline at end of file
+    return []
+
+
+async def iter_file_documents(file_path: str) -> AsyncIterator[list[Document]]:
+    """
+    逐批加载文件内容：PDF按页码范围分批返回，TXT按固定大小分块读取、逐批返回
+    :param file_path: 文件路径
+    :return: 异步迭代器，每次返回一批文档
+    """
+    if file_path.endswith('.pdf'):
+        async for pages in iter_pdf_pages(file_path):
+            yield pages
+    elif file_path.endswith('.txt'):
+        abs_file_path = get_abstract_path(file_path) if not os.path.isabs(file_path) else file_path
+        stream = await asyncio.to_thread(open, abs_file_path, "rb")
+        try:
+            async for documents in iter_txt_stream(stream, abs_file_path):
+                yield documents
+        finally:
+            await asyncio.to_thread(stream.close)
+
+
+# MIME 类型检测只需要文件头
+MIME_SNIFF_SIZE = 2048
+# 分块读取文本时每次读取的大小
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+
+def sniff_mime_type(head: bytes) -> str:
+    """
+    根据文件头检测MIME类型
+    :param head: 文件开头的若干字节（MIME_SNIFF_SIZE 即可）
+    :return: MIME类型
+    """
+    return magic.Magic(mime=True).from_buffer(head)
+
+
+def _detect_txt_encoding(stream: BinaryIO, source: str) -> Optional[str]:
+    """分块校验文件流能否完整解码，依次尝试 utf-8、gbk 编码，都失败时返回 None"""
+    for encoding in ['utf-8', 'gbk']:
+        stream.seek(0)
+        decoder = codecs.getincrementaldecoder(encoding)()
+        try:
+            while chunk := stream.read(STREAM_CHUNK_SIZE):
+                decoder.decode(chunk)
+            decoder.decode(b"", final=True)
+            return encoding
+        except UnicodeDecodeError as e:
+            logger.error(f"【文本文件加载】使用编码 {encoding} 解码文件 {source} 时出错: {e}")
+    return None
+
+
+def _read_txt_block(stream: BinaryIO, decoder: codecs.IncrementalDecoder) -> tuple[str, bool]:
+    """读取并解码一块文本，返回 (文本, 是否已读完)"""
+    chunk = stream.read(STREAM_CHUNK_SIZE)
+    return decoder.decode(chunk, final=not chunk), not chunk
+
+
+async def iter_txt_stream(stream: BinaryIO, source: str) -> AsyncIterator[list[Document]]:
+    """
+    按固定大小分块读取文本文件流，逐批返回，内存占用不随文件大小增长
+    先分块校验编码（依次尝试 utf-8、gbk），再分块解码；每批在最后一个换行处断开，避免把一行切到两批中
+    :param stream: 二进制文件流
+    :param source: 文档来源
+    :return: 异步迭代器，每次返回一批文档
+    """
+    encoding = await asyncio.to_thread(_detect_txt_encoding, stream, source)
+    if encoding is None:
+        return
+    stream.seek(0)
+    decoder = codecs.getincrementaldecoder(encoding)()
+    pending = ""
+    while True:
+        block, finished = await asyncio.to_thread(_read_txt_block, stream, decoder)
+        text = pending + block
+        if finished:
+            if text:
+                yield [Document(page_content=text, metadata={"source": source})]
+            return
+        # 没有换行的超长行按块切开
+        cut = text.rfind("\n") + 1 or len(text)
+        pending = text[cut:]
+        if cut:
+            yield [Document(page_content=text[:cut], metadata={"source": source})]
@@ -0,0 +1,56 @@
+"""
+PDF 分页解析（在进程池的子进程中执行）
+
+子进程只导入本模块和 pypdf，不加载应用的其他依赖；返回值为普通的元组，减少进程间传输的开销
+"""
+import os
+import threading
+from typing import List, Optional, Tuple
+
+from pypdf import PdfReader
+
+# 每个进程（线程）缓存最近打开的一个PDF：同一文件的多个页码范围复用同一个 reader，页树只需解析一次
+_reader_cache = threading.local()
+
+
+def _open_reader(file_path: str, password: Optional[str]) -> PdfReader:
+    """打开PDF，文件未变化时复用缓存的 reader"""
+    stat = os.stat(file_path)
+    key = (file_path, stat.st_mtime_ns, stat.st_size, password)
+    if getattr(_reader_cache, "key", None) != key:
+        _reader_cache.reader = PdfReader(file_path, password=password)
+        _reader_cache.key = key
+    return _reader_cache.reader
+
+
+def count_pdf_pages(file_path: str, password: Optional[str] = None) -> int:
+    """
+    获取PDF页数
+    :param file_path: PDF文件路径
+    :param password: PDF密码（如果有）
+    :return: 页数
+    """
+    return len(_open_reader(file_path, password).pages)
+
+
+def extract_pdf_pages(
+        file_path: str,
+        start: int,
+        end: int,
+        password: Optional[str] = None,
+) -> List[Tuple[int, str, str]]:
+    """
+    提取 [start, end) 范围内各页的文本
+    :param file_path: PDF文件路径
+    :param start: 起始页（从0开始）
+    :param end: 结束页（不包含）
+    :param password: PDF密码（如果有）
+    :return: (页码, 页标签, 文本) 列表
+    """
+    reader = _open_reader(file_path, password)
+    # 计算页标签需要遍历全部页，只有文档定义了页标签时才计算，否则与页码一致
+    page_labels = reader.page_labels if "/PageLabels" in reader.trailer["/Root"] else None
+    return [
+        (index, page_labels[index] if page_labels else str(index + 1), reader.pages[index].extract_text() or "")
+        for index in range(start, min(end, len(reader.pages)))
+    ]
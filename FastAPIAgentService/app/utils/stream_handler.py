@@ -0,0 +1,83 @@
+import asyncio
+import json
+from typing import Any, AsyncIterator, Dict
+
+
+def sse_event(payload: Dict[str, Any]) -> str:
+    """
+    将事件字典序列化为一帧SSE数据
+    :param payload: 事件内容
+    :return: SSE帧字符串
+    """
+    return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+
+async def coalesce_tokens(
+        events: AsyncIterator[Dict[str, Any]],
+        max_chars: int = 64,
+        max_delay: float = 0.03,
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    合并连续的 token 事件，按时间/长度预算批量输出，减少SSE帧数与json序列化次数
+    - 缓冲区累计达到 max_chars 个字符时立即输出
+    - 缓冲区中最早的 token 等待超过 max_delay 秒时输出（即使上游暂时没有新 token）
+    - 遇到非 token 事件时先输出缓冲区，再原样透传该事件
+    :param events: 上游事件流，token 事件格式为 {"type": "token", "content": str, ...}
+    :param max_chars: 单帧最大字符数
+    :param max_delay: 单帧最大等待时间（秒）
+    :return: 合并后的事件流
+    """
+    loop = asyncio.get_running_loop()
+    iterator = events.__aiter__()
+    buffer: list[str] = []
+    buffered_chars = 0
+    buffered_event: Dict[str, Any] = {}
+    deadline = None
+    pending = None
+
+    def flush() -> Dict[str, Any]:
+        nonlocal buffer, buffered_chars, deadline
+        merged = {**buffered_event, "content": "".join(buffer)}
+        buffer, buffered_chars, deadline = [], 0, None
+        return merged
+
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(iterator.__anext__())
+
+            timeout = None if deadline is None else max(deadline - loop.time(), 0)
+            done, _ = await asyncio.wait({pending}, timeout=timeout)
+            if not done:
+                # 等待超时，先把已缓冲的内容发出去，继续等待同一个 pending
+                yield flush()
+                continue
+
+            task, pending = pending, None
+            try:
+                event = task.result()
+            except StopAsyncIteration:
+                break
+
+            if event.get("type") == "token":
+                content = event.get("content") or ""
+                if not content:
+                    continue
+                if not buffer:
+                    buffered_event = {k: v for k, v in event.items() if k != "content"}
+                    deadline = loop.time() + max_delay
+                buffer.append(content)
+                buffered_chars += len(content)
+                if buffered_chars >= max_chars:
+                    yield flush()
+                continue
+
+            if buffer:
+                yield flush()
+            yield event
+
+        if buffer:
+            yield flush()
+    finally:
+        if pending is not None and not pending.done():
+            pending.cancel()
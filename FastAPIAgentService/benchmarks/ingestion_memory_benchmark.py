@@ -0,0 +1,140 @@
+"""
+上传文件入库前处理的峰值内存（RSS）测试
+
+对同一个上传文件分别执行改造前后的处理路径，只测文件读取/检测/哈希/解析部分（不含嵌入和写库）：
+- before: 整个文件读入内存做MIME检测 -> 再读一遍复制到 NamedTemporaryFile -> 加载器从临时文件读回
+- after:  只读文件头做MIME检测 -> 分块写入入库任务的暂存目录并同时计算md5 -> 从暂存文件逐批解析（TXT按固定大小分块）
+
+峰值RSS只增不减，因此每种路径在独立子进程中运行，结果为处理前后的峰值RSS增量。
+不指定 --file 时生成一个指定大小的 TXT 文件。
+
+用法：
+    python benchmarks/ingestion_memory_benchmark.py --size-mb 100
+    python benchmarks/ingestion_memory_benchmark.py --file data/example.pdf
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from starlette.datastructures import UploadFile
+
+from app.utils.file_handler import (
+    MIME_SNIFF_SIZE, STREAM_CHUNK_SIZE, get_file_md5_hex, iter_file_documents, pdf_loader, sniff_mime_type, txt_loader
+)
+
+# Starlette 解析 multipart 时 SpooledTemporaryFile 的内存上限
+SPOOL_MAX_SIZE = 1024 * 1024
+
+
+def peak_rss_mb() -> float:
+    """当前进程的峰值RSS（MB），Linux 下 ru_maxrss 单位为KB"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+
+def make_upload(path: str) -> UploadFile:
+    """模拟框架收到的上传文件：内容按块写入 SpooledTemporaryFile"""
+    spooled = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+    with open(path, "rb") as f:
+        while chunk := f.read(SPOOL_MAX_SIZE):
+            spooled.write(chunk)
+    spooled.seek(0)
+    return UploadFile(file=spooled, filename=os.path.basename(path), size=os.path.getsize(path))
+
+
+async def run_before(upload: UploadFile) -> int:
+    content = await upload.read()
+    sniff_mime_type(content)
+    await upload.seek(0)
+
+    suffix = os.path.splitext(upload.filename)[1]
+    temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=suffix)
+    try:
+        temp_file.write(await upload.read())
+        temp_file.close()
+        await get_file_md5_hex(temp_file.name)
+        loader = pdf_loader if suffix == ".pdf" else txt_loader
+        documents = await loader(temp_file.name)
+    finally:
+        os.unlink(temp_file.name)
+    return len(documents)
+
+
+async def run_after(upload: UploadFile) -> int:
+    sniff_mime_type(await upload.read(MIME_SNIFF_SIZE))
+    await upload.seek(0)
+
+    # 与 IngestionJobManager.submit 一样分块暂存并同时计算md5
+    suffix = os.path.splitext(upload.filename)[1]
+    spool_file = tempfile.NamedTemporaryFile(delete=False, suffix=suffix)
+    try:
+        md5_object = hashlib.md5()
+        while chunk := await upload.read(STREAM_CHUNK_SIZE):
+            md5_object.update(chunk)
+            spool_file.write(chunk)
+        spool_file.close()
+        # 与入库流水线一样逐批处理，不保留已处理的批次
+        count = 0
+        async for documents in iter_file_documents(spool_file.name):
+            count += len(documents)
+    finally:
+        os.unlink(spool_file.name)
+    return count
+
+
+def worker(mode: str, path: str):
+    """子进程：执行一种处理路径并输出峰值RSS增量"""
+    upload = make_upload(path)
+    baseline = peak_rss_mb()
+    documents = asyncio.run(run_before(upload) if mode == "before" else run_after(upload))
+    print(json.dumps({"mode": mode, "documents": documents, "peak_rss_delta_mb": round(peak_rss_mb() - baseline, 1)}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="上传文件入库前处理的峰值内存测试")
+    parser.add_argument("--file", help="测试文件（PDF或TXT），不指定时生成TXT文件")
+    parser.add_argument("--size-mb", type=int, default=100, help="生成的TXT文件大小（MB）")
+    parser.add_argument("--worker", choices=["before", "after"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        worker(args.worker, args.file)
+        return
+
+    path = args.file
+    generated = None
+    if path is None:
+        line = "扫地机器人的滤网建议每周清洗一次，每三个月更换一次，以保持吸力。\n".encode("utf-8")
+        generated = tempfile.NamedTemporaryFile(delete=False, suffix=".txt")
+        for _ in range(args.size_mb * 1024 * 1024 // len(line)):
+            generated.write(line)
+        generated.close()
+        path = generated.name
+
+    try:
+        size_mb = os.path.getsize(path) / 1024 / 1024
+        for mode in ["before", "after"]:
+            output = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--worker", mode, "--file", path],
+                capture_output=True, text=True, check=True,
+            ).stdout.strip().splitlines()[-1]
+            result = json.loads(output)
+            print(
+                f"[{mode}] file={os.path.basename(path)} size={size_mb:.1f}MB documents={result['documents']} "
+                f"peak_rss_delta={result['peak_rss_delta_mb']}MB"
+            )
+    finally:
+        if generated is not None:
+            os.unlink(generated.name)
+
+
+if __name__ == '__main__':
+    main()
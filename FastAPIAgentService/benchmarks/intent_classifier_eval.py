@@ -0,0 +1,99 @@
+"""
+意图分类离线评估：准确率与延迟
+
+对带标签的示例做留一法（或 k 折）交叉验证：用其余示例建立分类器，预测被留出的示例，统计
+- bypass:    跳过任务分解（直接生成计划）的比例
+- precision: 跳过任务分解的请求中意图正确的比例
+- compound leak: 复合请求被误判为单一意图（本应交给大模型分解）的比例
+- 各意图的跳过率与误判明细
+延迟为用全部示例建立分类器后，单次 predict 的 p50 / p95 / 最大值（微秒）。
+
+用法：
+    python benchmarks/intent_classifier_eval.py
+    python benchmarks/intent_classifier_eval.py --data data/intent_classifier/learned_examples.jsonl --folds 5
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+from collections import Counter
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.agent.intent_classifier import COMPOUND_INTENT, IntentClassifier, load_examples
+
+
+def cross_validate(classifier: IntentClassifier, examples: list, folds: int) -> list:
+    """
+    交叉验证
+    :param folds: 折数，0 表示留一法
+    :return: [(示例, 预测结果)]
+    """
+    folds = folds or len(examples)
+    results = []
+    for fold in range(folds):
+        held_out = [example for index, example in enumerate(examples) if index % folds == fold]
+        classifier.fit([example for index, example in enumerate(examples) if index % folds != fold])
+        results.extend((example, classifier.predict(example["text"])) for example in held_out)
+    return results
+
+
+def measure_latency(classifier: IntentClassifier, examples: list, rounds: int) -> list:
+    classifier.fit(examples)
+    samples = []
+    for _ in range(rounds):
+        for example in examples:
+            start = time.perf_counter()
+            classifier.predict(example["text"])
+            samples.append((time.perf_counter() - start) * 1_000_000)
+    return sorted(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="意图分类离线评估（准确率与延迟）")
+    parser.add_argument("--data", nargs="+", help="带标签的示例文件（JSONL），默认使用内置示例和已学习的示例")
+    parser.add_argument("--folds", type=int, default=0, help="交叉验证折数，0 表示留一法")
+    parser.add_argument("--rounds", type=int, default=20, help="延迟测试的轮数")
+    args = parser.parse_args()
+
+    classifier = IntentClassifier()
+    paths = args.data or [classifier.examples_path, classifier.learned_examples_path]
+    examples = [
+        example for path in paths for example in load_examples(path)
+        if example.get("intent") in classifier.intents or example.get("intent") == COMPOUND_INTENT
+    ]
+    if not examples:
+        print("没有可用的示例")
+        sys.exit(1)
+
+    results = cross_validate(classifier, examples, args.folds)
+    bypassed = [(example, prediction) for example, prediction in results if prediction["intent"]]
+    correct = [(example, prediction) for example, prediction in bypassed if prediction["intent"] == example["intent"]]
+    compounds = [(example, prediction) for example, prediction in results if example["intent"] == COMPOUND_INTENT]
+    leaked = [(example, prediction) for example, prediction in compounds if prediction["intent"]]
+    print(
+        f"[accuracy] examples={len(results)} bypass={len(bypassed) / len(results):.1%} "
+        f"precision={len(correct) / len(bypassed) if bypassed else 0.0:.1%} "
+        f"compound_leak={len(leaked) / len(compounds) if compounds else 0.0:.1%}"
+    )
+
+    totals = Counter(example["intent"] for example, _ in results)
+    bypass_counts = Counter(example["intent"] for example, _ in bypassed)
+    reasons = Counter(prediction["reason"] for _, prediction in results)
+    for intent, total in totals.most_common():
+        print(f"  {intent}: {bypass_counts[intent]}/{total} 跳过任务分解")
+    print("  判断依据: " + " ".join(f"{reason}={count}" for reason, count in reasons.most_common()))
+    for example, prediction in bypassed:
+        if prediction["intent"] != example["intent"]:
+            print(f"  误判: {example['text']} 标注={example['intent']} 预测={prediction['intent']}（{prediction['reason']}）")
+
+    samples = measure_latency(classifier, examples, args.rounds)
+    print(
+        f"[latency] p50={statistics.median(samples):.1f}us "
+        f"p95={samples[min(len(samples) - 1, int(len(samples) * 0.95))]:.1f}us max={samples[-1]:.1f}us"
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""
+RAG 每次查询的大模型调用次数基准测试：入库摘要启用前后对比
+
+对同一组查询分别执行两轮（关闭语义答案缓存）：
+- before: 不使用预生成摘要，参考资料超过 summary_stuff_max_tokens 时逐个片段总结再合并（map-reduce）
+- after:  使用入库时预生成的文档/章节摘要 + 排名靠前的片段，只调用一次大模型
+输出每轮的平均大模型调用次数、各上下文方式的占比和端到端延迟。
+
+需要知识库已在 rag.yaml 中 ingestion_summaries.enabled: true 时入库（之前入库的文件没有预生成摘要，
+after 轮会对这些文件回退到原方式）。
+
+用法：
+    python benchmarks/rag_llm_calls_benchmark.py
+    python benchmarks/rag_llm_calls_benchmark.py --queries "差旅报销流程" "年假天数怎么计算"
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.rag.rag_service import init_rag_service, close_rag_service
+
+QUERIES = [
+    "小户型适合什么扫地机器人",
+    "扫地机器人的滤网多久清洗一次",
+    "扫地机器人电池续航多长时间",
+    "扫地机器人在地毯上清扫效果不好怎么办",
+    "扫地机器人的保修政策是什么",
+]
+
+
+async def run_round(service, queries: list, use_summaries: bool) -> dict:
+    """执行一轮查询，返回大模型调用统计和延迟"""
+    service.use_ingestion_summaries = use_summaries
+    service.reset_llm_call_stats()
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        await service.get_documents_and_summary(query)
+        latencies.append(time.perf_counter() - start)
+    stats = service.llm_call_stats()
+    stats["p50_s"] = statistics.median(latencies)
+    stats["max_s"] = max(latencies)
+    return stats
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="RAG 每次查询的大模型调用次数（入库摘要启用前后）")
+    parser.add_argument("--queries", nargs="+", default=QUERIES)
+    args = parser.parse_args()
+
+    service = await init_rag_service()
+    # 关闭语义答案缓存，保证每次查询都实际生成答案
+    service.answer_cache = None
+    try:
+        for name, use_summaries in (("before", False), ("after", True)):
+            stats = await run_round(service, args.queries, use_summaries)
+            modes = " ".join(
+                f"{mode}={counts['queries']}次/{counts['llm_calls_per_query']}调用"
+                for mode, counts in stats["modes"].items()
+            )
+            print(
+                f"[{name}] queries={stats['queries']} llm_calls={stats['llm_calls']} "
+                f"llm_calls/query={stats['llm_calls_per_query']} {modes} "
+                f"p50={stats['p50_s']:.2f}s max={stats['max_s']:.2f}s"
+            )
+    finally:
+        await close_rag_service()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,92 @@
+"""
+/api/rag/query 延迟基准测试
+
+接口本身有限流（每IP每分钟15次），因此这里在进程内直接调用路由背后的处理函数：
+- before: 每次请求新建 RagService（新的 Chroma 客户端、提示词链，检索器冷启动），与改造前一致
+- after:  使用启动时初始化的全局 RagService（ChatService 通过依赖注入拿到同一个实例）
+
+用法：
+    python benchmarks/rag_query_benchmark.py --requests 50 --concurrency 4
+    python benchmarks/rag_query_benchmark.py --stage retrieve   # 只测检索+重排序，排除大模型生成耗时
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.rag.rag_service import RagService, init_rag_service, close_rag_service
+from app.router.chat_service import ChatService
+
+QUERIES = [
+    "小户型适合什么扫地机器人",
+    "扫地机器人多久清洗一次滤网",
+    "扫地机器人电池续航多久",
+    "扫地机器人遇到地毯怎么办",
+]
+
+
+def percentile(samples: list, q: float) -> float:
+    """
+    计算分位数（线性插值）
+    :param samples: 样本
+    :param q: 分位点，0~100
+    :return: 分位数
+    """
+    ordered = sorted(samples)
+    if len(ordered) == 1:
+        return ordered[0]
+    position = (len(ordered) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+async def run(mode: str, stage: str, total: int, concurrency: int) -> list:
+    """
+    执行基准测试
+    :return: 每次请求的耗时（毫秒）
+    """
+    shared_service = await init_rag_service() if mode == "after" else None
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one_request(index: int):
+        query = QUERIES[index % len(QUERIES)]
+        async with semaphore:
+            start = time.perf_counter()
+            service = shared_service or RagService()
+            if stage == "retrieve":
+                await service._retrieve_and_reorder(query)
+            else:
+                await ChatService(service).handle_rag_query(query)
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    await asyncio.gather(*(one_request(i) for i in range(total)))
+    await close_rag_service()
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description="/api/rag/query 延迟基准测试")
+    parser.add_argument("--mode", choices=["before", "after", "both"], default="both")
+    parser.add_argument("--stage", choices=["full", "retrieve"], default="full")
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=4)
+    args = parser.parse_args()
+
+    modes = ["before", "after"] if args.mode == "both" else [args.mode]
+    for mode in modes:
+        latencies = asyncio.run(run(mode, args.stage, args.requests, args.concurrency))
+        print(
+            f"[{mode}] stage={args.stage} requests={len(latencies)} concurrency={args.concurrency} "
+            f"p50={percentile(latencies, 50):.1f}ms p99={percentile(latencies, 99):.1f}ms "
+            f"mean={statistics.mean(latencies):.1f}ms"
+        )
+
+
+if __name__ == '__main__':
+    main()
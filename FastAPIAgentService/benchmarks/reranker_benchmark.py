@@ -0,0 +1,108 @@
+"""
+重排序推理后端基准测试
+
+在固定语料上比较各推理后端的吞吐（pairs/sec），以及与 fp32 torch 模型排序结果的一致性：
+- spearman: 每个查询下文档分数的 Spearman 秩相关系数（取平均）
+- top1:     最相关文档与 fp32 一致的查询占比
+- top3:     前3个文档与 fp32 的平均重合率
+
+用法：
+    python benchmarks/reranker_benchmark.py --backends torch onnx onnx-int8 --threads 4 --rounds 3
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dotenv import load_dotenv
+
+from app.rag.reranker_backends import SUPPORTED_BACKENDS, create_reranker_backend
+
+load_dotenv()
+
+QUERIES = [
+    "小户型适合什么扫地机器人",
+    "扫地机器人多久清洗一次滤网",
+    "扫地机器人电池续航多久",
+    "请假流程需要哪些审批",
+    "考勤异常如何申请补卡",
+    "公司年假有多少天",
+]
+
+DOCUMENTS = [
+    "小户型建议选择机身较薄、体积小巧的扫地机器人，方便进入床底和沙发底清扫。",
+    "扫地机器人的滤网建议每周清洗一次，每三个月更换一次，以保持吸力。",
+    "该款扫地机器人满电状态下续航约120分钟，可清扫约150平方米。",
+    "遇到长毛地毯时，扫地机器人会自动提高吸力，必要时可设置禁区避开地毯。",
+    "员工请假需在OA系统提交申请，三天以内由部门经理审批，三天以上还需人事审批。",
+    "考勤异常需在异常发生后三个工作日内提交补卡申请，并由直属上级审批。",
+    "员工入职满一年可享受5天年假，满十年享受10天年假，满二十年享受15天年假。",
+    "公司食堂每天中午十一点半开放，提供自助餐和面食两种选择。",
+    "会议室需提前一天在OA系统预约，超过两小时的会议需要行政部确认。",
+    "扫地机器人的边刷容易缠绕头发，建议每两周清理一次。",
+    "报销单据需在费用发生后三十天内提交，逾期将不予报销。",
+    "拖地模式下请确保水箱已加水，并安装好拖布支架。",
+]
+
+
+def rank(scores: list) -> list:
+    """返回按分数降序排列的下标"""
+    return sorted(range(len(scores)), key=lambda i: scores[i], reverse=True)
+
+
+def spearman(a: list, b: list) -> float:
+    """Spearman 秩相关系数（分数无并列时）"""
+    n = len(a)
+    rank_a = {index: position for position, index in enumerate(rank(a))}
+    rank_b = {index: position for position, index in enumerate(rank(b))}
+    d2 = sum((rank_a[i] - rank_b[i]) ** 2 for i in range(n))
+    return 1 - 6 * d2 / (n * (n * n - 1))
+
+
+def score_corpus(backend, batch_size: int) -> list:
+    """对每个查询的全部文档打分，返回每个查询的分数列表"""
+    pairs = [(query, doc) for query in QUERIES for doc in DOCUMENTS]
+    scores = backend.predict(pairs, batch_size)
+    return [scores[i * len(DOCUMENTS):(i + 1) * len(DOCUMENTS)] for i in range(len(QUERIES))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="重排序推理后端基准测试")
+    parser.add_argument("--backends", nargs="+", choices=SUPPORTED_BACKENDS, default=list(SUPPORTED_BACKENDS))
+    parser.add_argument("--model-path", default=os.getenv("RERANKER_MODEL_PATH"))
+    parser.add_argument("--threads", type=int, default=int(os.getenv("RERANKER_NUM_THREADS", "0")) or None)
+    parser.add_argument("--max-length", type=int, default=int(os.getenv("RERANKER_MAX_LENGTH", "512")))
+    parser.add_argument("--quantization", default=os.getenv("RERANKER_QUANTIZATION", "avx2"))
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    # fp32 torch 结果作为一致性基准
+    reference_backend = create_reranker_backend("torch", args.model_path, "cpu", args.max_length, args.threads)
+    reference = score_corpus(reference_backend, args.batch_size)
+
+    total_pairs = len(QUERIES) * len(DOCUMENTS)
+    for backend_name in args.backends:
+        backend = reference_backend if backend_name == "torch" else create_reranker_backend(
+            backend_name, args.model_path, "cpu", args.max_length, args.threads, args.quantization
+        )
+        score_corpus(backend, args.batch_size)  # 预热
+
+        start = time.perf_counter()
+        for _ in range(args.rounds):
+            results = score_corpus(backend, args.batch_size)
+        elapsed = time.perf_counter() - start
+
+        spearman_avg = sum(spearman(r, s) for r, s in zip(reference, results)) / len(QUERIES)
+        top1 = sum(rank(r)[0] == rank(s)[0] for r, s in zip(reference, results)) / len(QUERIES)
+        top3 = sum(len(set(rank(r)[:3]) & set(rank(s)[:3])) / 3 for r, s in zip(reference, results)) / len(QUERIES)
+        print(
+            f"[{backend_name} -> {backend.name}] pairs/sec={total_pairs * args.rounds / elapsed:.1f} "
+            f"spearman={spearman_avg:.4f} top1={top1:.2%} top3={top3:.2%}"
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+"""
+按检索范围分区的 BM25 检索延迟基准测试
+
+生成 N 个用户（每个用户若干文档，分属若干部门，部分文档共享到部门）和一批公共文档，比较：
+- global:      所有文档在同一个 BM25 索引中，检索全部文档后按范围过滤（与改造前在整个库上检索相同）
+- partitioned: 按 public / user_<id> / dept_<id> 分区，只检索当前用户可见的分区
+
+用户数逐级增加时，global 的延迟随总文档数增长，partitioned 只与范围内的文档数有关，基本保持不变。
+指定 --chroma 时额外测试 Chroma 在带范围过滤条件（$or 下推）时的向量检索延迟（需要 chromadb）。
+
+用法：
+    python benchmarks/scoped_retrieval_benchmark.py --users 10 100 1000 --docs-per-user 50
+    python benchmarks/scoped_retrieval_benchmark.py --users 10 100 --chroma
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain_core.documents import Document
+
+from app.rag.bm25_index import (
+    BM25Index, PartitionedBM25Index, PUBLIC_PARTITION, department_partition, partition_of, user_partition
+)
+
+WORDS = [
+    "报销", "请假", "考勤", "差旅", "合同", "采购", "审批", "会议", "培训", "绩效",
+    "预算", "发票", "工资", "社保", "加班", "出差", "入职", "离职", "设备", "扫地机器人",
+    "滤网", "电池", "续航", "地毯", "保修", "售后", "库存", "客户", "项目", "周报",
+]
+QUERIES = ["差旅报销发票", "请假审批流程", "扫地机器人滤网", "项目周报模板", "设备采购预算"]
+
+
+def make_documents(users: int, docs_per_user: int, public_docs: int, departments: int, seed: int = 42):
+    """
+    生成合成文档：公共文档 + 每个用户的个人文档（其中约 1/5 共享到所在部门）
+    :return: (文档列表, 用户 -> 部门)
+    """
+    rng = random.Random(seed)
+
+    def text() -> str:
+        return "，".join(rng.choice(WORDS) for _ in range(rng.randint(20, 60)))
+
+    documents = [Document(page_content=text(), metadata={"visibility": "public"}) for _ in range(public_docs)]
+    user_departments = {}
+    for index in range(users):
+        user_id = f"u{index:05d}"
+        department_id = str(index % departments)
+        user_departments[user_id] = department_id
+        for doc_index in range(docs_per_user):
+            metadata = {"visibility": "private", "user_id": user_id}
+            if doc_index % 5 == 0:
+                metadata.update(visibility="department", department_id=department_id)
+            documents.append(Document(page_content=text(), metadata=metadata))
+    return documents, user_departments
+
+
+def latency_ms(func, rounds: int) -> tuple:
+    """执行 rounds 次，返回 (p50, p95) 毫秒"""
+    samples = []
+    for i in range(rounds):
+        start = time.perf_counter()
+        func(i)
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return statistics.median(samples), samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+
+
+def bench_bm25(documents, user_departments, k: int, rounds: int) -> dict:
+    users = sorted(user_departments)
+    with tempfile.TemporaryDirectory() as directory:
+        global_index = BM25Index(os.path.join(directory, "global"))
+        global_index.rebuild(documents)
+        partitioned = PartitionedBM25Index(os.path.join(directory, "partitioned"))
+        partitioned.rebuild(documents)
+
+        def scope_of(i: int):
+            user_id = users[i % len(users)]
+            return [PUBLIC_PARTITION, user_partition(user_id), department_partition(user_departments[user_id])]
+
+        def run_global(i: int):
+            allowed = set(scope_of(i))
+            ranked = global_index.search_with_scores(QUERIES[i % len(QUERIES)], k=len(documents))
+            return [doc for doc, _ in ranked if partition_of(doc.metadata) in allowed][:k]
+
+        def run_partitioned(i: int):
+            return partitioned.search(QUERIES[i % len(QUERIES)], k=k, partitions=scope_of(i))
+
+        # 预热：加载分区、建立映射
+        for i in range(len(QUERIES)):
+            run_global(i)
+            run_partitioned(i)
+        return {"global": latency_ms(run_global, rounds), "partitioned": latency_ms(run_partitioned, rounds)}
+
+
+def bench_chroma(documents, user_departments, k: int, rounds: int, dimensions: int = 64) -> dict:
+    import chromadb
+    import numpy as np
+
+    rng = np.random.default_rng(0)
+    client = chromadb.EphemeralClient()
+    collection = client.create_collection(f"scope_bench_{len(documents)}")
+    vectors = rng.standard_normal((len(documents), dimensions)).astype(np.float32)
+    batch = 5000
+    for start in range(0, len(documents), batch):
+        collection.add(
+            ids=[str(i) for i in range(start, min(start + batch, len(documents)))],
+            embeddings=vectors[start:start + batch].tolist(),
+            metadatas=[doc.metadata for doc in documents[start:start + batch]],
+        )
+    users = sorted(user_departments)
+    queries = rng.standard_normal((rounds, dimensions)).astype(np.float32).tolist()
+
+    def run_filtered(i: int):
+        user_id = users[i % len(users)]
+        where = {"$or": [{"visibility": "public"}, {"user_id": user_id},
+                         {"department_id": user_departments[user_id]}]}
+        return collection.query(query_embeddings=[queries[i]], n_results=k, where=where)
+
+    def run_unfiltered(i: int):
+        return collection.query(query_embeddings=[queries[i]], n_results=k)
+
+    result = {"chroma-unfiltered": latency_ms(run_unfiltered, rounds), "chroma-filtered": latency_ms(run_filtered, rounds)}
+    client.delete_collection(collection.name)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="按检索范围分区的检索延迟基准测试")
+    parser.add_argument("--users", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--docs-per-user", type=int, default=50)
+    parser.add_argument("--public-docs", type=int, default=500)
+    parser.add_argument("--departments", type=int, default=10)
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--rounds", type=int, default=100)
+    parser.add_argument("--chroma", action="store_true", help="同时测试 Chroma 带过滤条件的向量检索")
+    args = parser.parse_args()
+
+    for users in args.users:
+        documents, user_departments = make_documents(users, args.docs_per_user, args.public_docs, args.departments)
+        results = bench_bm25(documents, user_departments, args.k, args.rounds)
+        if args.chroma:
+            results.update(bench_chroma(documents, user_departments, args.k, args.rounds))
+        line = " ".join(f"{name}: p50={p50:.2f}ms p95={p95:.2f}ms" for name, (p50, p95) in results.items())
+        print(f"[users={users} docs={len(documents)}] {line}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+"""
+/api/main-agent/query/stream 首字延迟（TTFT）与总耗时基准测试
+
+用模拟的流式模型（首 token 延迟 + 固定的 token 间隔）替换通义千问和知识库检索，只测流式链路本身：
+- before: 改造前的做法：等子Agent返回完整回答后逐字重放（每字一帧，sleep 20ms），
+          结束后再执行一遍主Agent获取最终响应用于保存
+- after:  get_main_agent_stream_response：模型 token 边生成边转发，按约30ms或64个字符合并成帧
+TTFT 为开始处理到第一帧回答内容的时间，总耗时为开始处理到最后一帧的时间。
+
+用法：
+    python benchmarks/stream_ttft_benchmark.py
+    python benchmarks/stream_ttft_benchmark.py --answer-chars 500 --first-token-ms 400 --token-ms 25 --requests 5
+"""
+import argparse
+import asyncio
+import importlib
+import json
+import os
+import statistics
+import sys
+import time
+from typing import Any, AsyncIterator, List, Optional
+
+os.environ.setdefault("DASHSCOPE_API_KEY", "benchmark")
+os.environ.setdefault("ALIYUN_ACCESS_KEY_SECRET", "benchmark")
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import langchain_community.chat_models
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+import app.agent.knowledge_agent as knowledge_agent_module
+import app.agent.main_agent as main_agent_module
+from app.agent.agent import get_main_agent_stream_response
+from app.agent.main_agent import MainAgent
+
+QUERY = "公司的差旅报销制度是什么"
+CHARS_PER_TOKEN = 2
+
+
+class SimulatedStreamingModel(BaseChatModel):
+    """按固定延迟逐个产出 token 的模拟模型"""
+
+    answer: str
+    first_token_s: float
+    token_s: float
+
+    @property
+    def _llm_type(self) -> str:
+        return "simulated-streaming"
+
+    def _tokens(self) -> List[str]:
+        return [self.answer[i:i + CHARS_PER_TOKEN] for i in range(0, len(self.answer), CHARS_PER_TOKEN)]
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        raise NotImplementedError("只支持异步调用")
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        await asyncio.sleep(self.first_token_s + self.token_s * (len(self._tokens()) - 1))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self.answer))])
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                       run_manager: Any = None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        for index, token in enumerate(self._tokens()):
+            await asyncio.sleep(self.first_token_s if index == 0 else self.token_s)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+
+
+class SimulatedRagService:
+    """跳过检索，只保留生成摘要的一次模型调用"""
+
+    def __init__(self, model: SimulatedStreamingModel):
+        self.model = model
+
+    async def rag_summary(self, query: str, scope: Any = None) -> str:
+        return (await self.model.ainvoke(query)).content
+
+    async def stream_documents_and_summary(self, query: str, scope: Any = None):
+        parts = []
+        async for chunk in self.model.astream(query):
+            parts.append(chunk.content)
+            yield {"type": "token", "content": chunk.content}
+        yield {"type": "result", "documents": [], "summary": "".join(parts)}
+
+
+class InMemorySessionManager:
+    async def get_history(self, session_id: str, user_id: str) -> list:
+        return []
+
+    async def add_message(self, session_id: str, user_id: str, message: str, response: str):
+        pass
+
+
+def install(model: SimulatedStreamingModel):
+    """把模型服务、知识库、会话存储和计划检查点替换为进程内的模拟实现"""
+    langchain_community.chat_models.ChatTongyi = lambda **kwargs: model
+    knowledge_agent_module.get_rag_service = lambda: SimulatedRagService(model)
+    importlib.import_module("app.services.database_session_manager").database_session_manager = InMemorySessionManager()
+
+    async def no_checkpoint(session_id, user_id):
+        return None
+
+    main_agent_module.load_plan_checkpoint = no_checkpoint
+
+
+async def run_before() -> tuple:
+    """改造前：完整回答生成后逐字重放，再执行一遍主Agent获取最终响应"""
+    input_data = {"query": QUERY, "session_id": "benchmark", "user_id": "1"}
+    start = time.perf_counter()
+    result = await MainAgent().process(input_data)
+    first_frame = None
+    for char in result["final_response"]:
+        json.dumps({"type": "response", "content": char}, ensure_ascii=False)
+        first_frame = first_frame or time.perf_counter()
+        await asyncio.sleep(0.02)
+    await MainAgent().process(input_data)
+    return first_frame - start, time.perf_counter() - start
+
+
+async def run_after() -> tuple:
+    """改造后：模型 token 边生成边转发"""
+    start = time.perf_counter()
+    first_frame = None
+    async for frame in get_main_agent_stream_response(QUERY, "benchmark", "1"):
+        payload = json.loads(frame[len("data: "):])
+        if payload.get("type") == "response" and payload.get("content"):
+            first_frame = first_frame or time.perf_counter()
+    return first_frame - start, time.perf_counter() - start
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="主Agent流式接口的首字延迟与总耗时（模拟模型）")
+    parser.add_argument("--answer-chars", type=int, default=500, help="回答的字符数")
+    parser.add_argument("--first-token-ms", type=float, default=400, help="模型首 token 延迟（毫秒）")
+    parser.add_argument("--token-ms", type=float, default=25, help="模型 token 间隔（毫秒）")
+    parser.add_argument("--requests", type=int, default=3)
+    args = parser.parse_args()
+
+    install(SimulatedStreamingModel(
+        answer=("差旅费按实际发生金额报销，需提供发票。" * args.answer_chars)[:args.answer_chars],
+        first_token_s=args.first_token_ms / 1000,
+        token_s=args.token_ms / 1000,
+    ))
+    for name, run in (("before", run_before), ("after", run_after)):
+        samples = [await run() for _ in range(args.requests)]
+        print(
+            f"[{name}] ttft_p50={statistics.median(s[0] for s in samples) * 1000:.0f}ms "
+            f"total_p50={statistics.median(s[1] for s in samples) * 1000:.0f}ms"
+        )
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,204 @@
+"""
+向量库后端基准测试：本地 HNSW（faiss，mmap 段文件）与 Chroma
+
+生成 N 个合成文档片段（带聚类结构的随机向量，元数据中带 user_id / visibility），对每个后端：
+- build:  写入全部片段的耗时
+- query:  在新进程中重新打开索引，测量无过滤 / 带检索范围过滤时的 p50、p95 延迟，
+          recall@k（与暴力精确检索的结果比较），以及打开索引并完成查询后的 RSS
+          （RssAnon 为进程私有内存，RssFile 为映射文件的页，多个 worker 之间可以通过页缓存共享）
+          HNSW 可以指定多个 --ef-search，同一个索引按不同的查询搜索宽度分别测试；
+          指定多个 --formats（存储格式[/截断维度]，如 float32 int8 int8/512）时分别建索引，比较内存与召回率
+
+用法：
+    python benchmarks/vector_backend_benchmark.py --chunks 100000 --dim 1024
+    python benchmarks/vector_backend_benchmark.py --chunks 20000 --dim 256 --backends hnsw --ef-search 64 256
+    python benchmarks/vector_backend_benchmark.py --backends hnsw --formats float32 float16 int8 int8/512
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+_BATCH_SIZE = 5000
+
+
+def make_corpus(chunks: int, dim: int, users: int, seed: int = 42):
+    """
+    生成带聚类结构的单位向量和元数据（约 1/5 为公共文档，其余分属各用户）
+    :return: (向量, 元数据列表)
+    """
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((max(chunks // 200, 1), dim)).astype(np.float32)
+    vectors = centers[rng.integers(0, len(centers), chunks)] + 0.6 * rng.standard_normal((chunks, dim)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    metadatas = []
+    for index in range(chunks):
+        if index % 5 == 0:
+            metadatas.append({"visibility": "public", "user_id": ""})
+        else:
+            metadatas.append({"visibility": "private", "user_id": f"u{index % users:04d}"})
+    return vectors, metadatas
+
+
+def make_queries(vectors: np.ndarray, rounds: int, seed: int = 7) -> np.ndarray:
+    """在语料向量附近生成查询向量"""
+    rng = np.random.default_rng(seed)
+    queries = vectors[rng.integers(0, len(vectors), rounds)] + 0.3 * rng.standard_normal(
+        (rounds, vectors.shape[1])).astype(np.float32)
+    return queries / np.linalg.norm(queries, axis=1, keepdims=True)
+
+
+def scope_filter(i: int, users: int) -> dict:
+    return {"$or": [{"visibility": "public"}, {"user_id": f"u{i % users:04d}"}]}
+
+
+def rss_mb() -> dict:
+    """读取当前进程的 RSS（仅 Linux）"""
+    result = {}
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(("RssAnon", "RssFile")):
+                    name, value = line.split(":")
+                    result[name] = int(value.split()[0]) / 1024
+    except OSError:
+        pass
+    return result
+
+
+def open_store(backend: str, directory: str, ef_search: int = 64, vector_format: str = "float32"):
+    """打开（或创建）指定后端的向量库"""
+    if backend == "hnsw":
+        from app.rag.hnsw_store import HNSWVectorStore
+        vector_dtype, _, truncate_dim = vector_format.partition("/")
+        return HNSWVectorStore(directory, embedding_function=None, ef_search=ef_search, vector_dtype=vector_dtype,
+                               truncate_dim=int(truncate_dim) if truncate_dim else None)
+    import chromadb
+    client = chromadb.PersistentClient(path=directory)
+    return client.get_or_create_collection("bench", metadata={"hnsw:space": "cosine"})
+
+
+def build(backend: str, directory: str, args) -> dict:
+    vectors, metadatas = make_corpus(args.chunks, args.dim, args.users)
+    store = open_store(backend, directory, vector_format=args.formats[0])
+    start = time.perf_counter()
+    for offset in range(0, args.chunks, _BATCH_SIZE):
+        end = min(offset + _BATCH_SIZE, args.chunks)
+        store.upsert(
+            ids=[str(i) for i in range(offset, end)],
+            embeddings=vectors[offset:end].tolist(),
+            documents=[f"chunk {i}" for i in range(offset, end)],
+            metadatas=metadatas[offset:end],
+        )
+    elapsed = time.perf_counter() - start
+    if backend == "hnsw":
+        # 合并为一个段，与 Chroma 的单个 HNSW 索引对应
+        start = time.perf_counter()
+        store.compact()
+        elapsed += time.perf_counter() - start
+    return {"build_s": elapsed}
+
+
+def search_ids(backend: str, store, query: np.ndarray, k: int, where) -> list:
+    if backend == "hnsw":
+        return [doc.id for doc in store.similarity_search_by_vector(query.tolist(), k=k, filter=where)]
+    return store.query(query_embeddings=[query.tolist()], n_results=k, where=where)["ids"][0]
+
+
+def query(backend: str, directory: str, args) -> dict:
+    vectors, metadatas = make_corpus(args.chunks, args.dim, args.users)
+    queries = make_queries(vectors, args.rounds)
+    store = open_store(backend, directory, args.ef_search[0], args.formats[0])
+
+    # 暴力精确检索的结果作为 recall 的基准
+    public = np.array([metadata["visibility"] == "public" for metadata in metadatas])
+    owners = np.array([metadata["user_id"] for metadata in metadatas])
+    truth_all, truth_scoped = [], []
+    for i, q in enumerate(queries):
+        scores = vectors @ q
+        truth_all.append(set(np.argsort(-scores)[:args.k].astype(str)))
+        scores[~(public | (owners == f"u{i % args.users:04d}"))] = -np.inf
+        truth_scoped.append(set(np.argsort(-scores)[:args.k].astype(str)))
+    del vectors
+
+    result = {}
+    for name, where_of, truth in (("unfiltered", lambda i: None, truth_all),
+                                  ("scoped", lambda i: scope_filter(i, args.users), truth_scoped)):
+        search_ids(backend, store, queries[0], args.k, where_of(0))
+        samples, hits = [], 0
+        for i, q in enumerate(queries):
+            start = time.perf_counter()
+            ids = search_ids(backend, store, q, args.k, where_of(i))
+            samples.append((time.perf_counter() - start) * 1000)
+            hits += len(truth[i] & set(ids))
+        samples.sort()
+        result[name] = {
+            "p50_ms": statistics.median(samples),
+            "p95_ms": samples[min(len(samples) - 1, int(len(samples) * 0.95))],
+            "recall": hits / (len(queries) * args.k),
+        }
+    result["rss_mb"] = rss_mb()
+    return result
+
+
+def run_phase(phase: str, backend: str, directory: str, args, ef_search: int = 64,
+              vector_format: str = "float32") -> dict:
+    """在独立的子进程中执行某个阶段，保证 RSS 只包含该阶段打开的索引"""
+    command = [sys.executable, os.path.abspath(__file__), "--phase", phase, "--backends", backend,
+               "--directory", directory, "--chunks", str(args.chunks), "--dim", str(args.dim),
+               "--users", str(args.users), "--k", str(args.k), "--rounds", str(args.rounds),
+               "--ef-search", str(ef_search), "--formats", vector_format]
+    output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="向量库后端基准测试（HNSW 与 Chroma）")
+    parser.add_argument("--chunks", type=int, default=100000)
+    parser.add_argument("--dim", type=int, default=1024)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--rounds", type=int, default=200)
+    parser.add_argument("--backends", nargs="+", default=["hnsw", "chroma"])
+    parser.add_argument("--ef-search", type=int, nargs="+", default=[64], help="HNSW 查询时的搜索宽度")
+    parser.add_argument("--formats", nargs="+", default=["float32"], help="HNSW 存储格式[/截断维度]")
+    parser.add_argument("--phase", choices=["build", "query"], help=argparse.SUPPRESS)
+    parser.add_argument("--directory", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.phase:
+        phase = build if args.phase == "build" else query
+        print(json.dumps(phase(args.backends[0], args.directory, args)))
+        return
+
+    for backend in args.backends:
+        if backend == "chroma":
+            try:
+                import chromadb  # noqa: F401
+            except ImportError:
+                print("[chroma] 未安装 chromadb，跳过")
+                continue
+        for vector_format in (args.formats if backend == "hnsw" else [None]):
+            with tempfile.TemporaryDirectory() as directory:
+                built = run_phase("build", backend, directory, args, vector_format=vector_format or "float32")
+                for ef_search in (args.ef_search if backend == "hnsw" else [None]):
+                    result = run_phase("query", backend, directory, args, ef_search or 64, vector_format or "float32")
+                    rss = " ".join(f"{name}={value:.0f}MB" for name, value in result.pop("rss_mb").items())
+                    line = " ".join(
+                        f"{name}: p50={r['p50_ms']:.2f}ms p95={r['p95_ms']:.2f}ms recall@{args.k}={r['recall']:.3f}"
+                        for name, r in result.items()
+                    )
+                    label = f"{backend} {vector_format} ef_search={ef_search}" if ef_search else backend
+                    print(f"[{label} chunks={args.chunks} dim={args.dim}] build={built['build_s']:.1f}s {line} {rss}")
+
+
+if __name__ == '__main__':
+    main()
@@ -16,6 +16,9 @@ from app.core.rate_limit import RateLimitMiddleware
 from app.core.logger_handler import logger
 
 from app.rag.reorder_service import check_and_download_reranker_model
+from app.rag.rag_service import init_rag_service, close_rag_service
+from app.rag.ingestion_jobs import init_ingestion_jobs, close_ingestion_jobs
+from app.utils.file_handler import close_pdf_executor
 
 app = FastAPI()
 
@@ -78,8 +81,26 @@ async def startup_event():
     check_and_download_reranker_model()
     logger.info("重排序模型检查完成")
 
+    # 初始化RAG服务（加载BM25索引、预热检索器）
+    await init_rag_service()
+    logger.info("RAG服务初始化完成")
+
+    # 启动后台入库任务（恢复重启前未完成的任务）
+    await init_ingestion_jobs()
+    logger.info("后台入库任务已启动")
+
 @app.on_event("shutdown")
 async def shutdown_event():
     """应用关闭时关闭Redis连接"""
+    # 先停止入库任务，未完成的任务留在Redis中等待下次启动
+    await close_ingestion_jobs()
+    logger.info("后台入库任务已停止")
+
     await close_redis()
     logger.info("Redis连接已关闭")
+
+    await close_rag_service()
+    logger.info("RAG服务已关闭")
+
+    close_pdf_executor()
+    logger.info("PDF解析进程池已关闭")
@@ -0,0 +1,5 @@
+import os
+
+# 模块导入时会创建通义千问客户端，测试中不会真正调用模型服务
+os.environ.setdefault("DASHSCOPE_API_KEY", "test")
+os.environ.setdefault("ALIYUN_ACCESS_KEY_SECRET", "test")
@@ -0,0 +1,132 @@
+import os
+import threading
+import time
+
+from langchain_core.documents import Document
+
+from app.rag.bm25_index import BM25Index, PartitionedBM25Index
+
+
+def make_documents(prefix: str, count: int) -> list:
+    return [Document(page_content=f"{prefix} 扫地机器人 滤网 清洗 第{i}条", metadata={"n": i}) for i in range(count)]
+
+
+def search_while(index, stop: threading.Event, errors: list, **kwargs):
+    while not stop.is_set():
+        try:
+            index.search("扫地机器人 滤网", k=5, **kwargs)
+        except Exception as e:  # noqa: BLE001 - 记录查询线程中的任何异常
+            errors.append(e)
+            return
+
+
+def test_search_survives_concurrent_compaction(tmp_path):
+    index = BM25Index(str(tmp_path / "index"), max_segments=2)
+    index.add_documents(make_documents("初始", 200))
+    stop = threading.Event()
+    errors = []
+    readers = [threading.Thread(target=search_while, args=(index, stop, errors)) for _ in range(4)]
+    for reader in readers:
+        reader.start()
+    try:
+        for round_ in range(30):
+            index.add_documents(make_documents(f"第{round_}轮", 50))
+            index.delete({"n": round_})
+    finally:
+        stop.set()
+        for reader in readers:
+            reader.join()
+
+    assert errors == []
+    # 被合并掉的旧段在查询结束后删除，只剩当前快照中的段
+    live = {os.path.basename(segment.path) for segment in index._snapshot[0]}
+    on_disk = {name for name in os.listdir(index.index_dir) if name.startswith("seg_")}
+    assert on_disk == live
+
+
+def test_search_survives_partition_drop(tmp_path):
+    index = PartitionedBM25Index(str(tmp_path / "bm25"))
+    stop = threading.Event()
+    errors = []
+    for round_ in range(20):
+        index.partition("user_1").add_documents(make_documents("个人", 100))
+        reader = threading.Thread(target=search_while, args=(index, stop, errors), kwargs={"partitions": ["user_1"]})
+        reader.start()
+        time.sleep(0.01)
+        index.drop("user_1")
+        stop.set()
+        reader.join()
+        stop.clear()
+
+    assert errors == []
+
+
+def test_orphan_segments_kept_during_grace_period(tmp_path):
+    index_dir = tmp_path / "index"
+    index = BM25Index(str(index_dir))
+    index.add_documents(make_documents("初始", 10))
+    index.close()
+
+    # 其他进程正在写入、尚未提交的段，以及很久以前遗留的段
+    (index_dir / "seg_900000").mkdir()
+    stale = index_dir / "seg_900001"
+    stale.mkdir()
+    old = time.time() - 7200
+    os.utime(stale, (old, old))
+
+    BM25Index(str(index_dir)).load()
+
+    assert (index_dir / "seg_900000").exists()
+    assert not stale.exists()
+
+
+def test_instances_sharing_a_directory_see_each_others_writes(tmp_path):
+    # 两个实例模拟两个 worker 进程：各自保存快照，只通过目录中的文件同步
+    first = BM25Index(str(tmp_path / "index"))
+    second = BM25Index(str(tmp_path / "index"))
+    first.load()
+    second.load()
+
+    first.add_documents(make_documents("甲", 1))
+    second.add_documents(make_documents("乙", 1))
+
+    assert BM25Index(str(tmp_path / "index")).doc_count == 2
+    assert {doc.page_content[0] for doc in first.search("扫地机器人", k=5)} == {"甲", "乙"}
+    second.delete({"n": 0})
+    assert first.search("扫地机器人", k=5) == []
+
+
+def test_concurrent_writers_in_one_directory_keep_all_documents(tmp_path):
+    writers = [BM25Index(str(tmp_path / "index"), max_segments=3) for _ in range(4)]
+    stop = threading.Event()
+    errors = []
+    reader = threading.Thread(target=search_while, args=(writers[0], stop, errors))
+    reader.start()
+
+    def write(index: BM25Index, prefix: str):
+        for round_ in range(10):
+            index.add_documents(make_documents(f"{prefix}{round_}", 5))
+
+    threads = [threading.Thread(target=write, args=(index, f"w{i}")) for i, index in enumerate(writers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    stop.set()
+    reader.join()
+
+    assert errors == []
+    assert BM25Index(str(tmp_path / "index")).doc_count == 4 * 10 * 5
+
+
+def test_partition_dropped_and_recreated_by_another_worker(tmp_path):
+    first = PartitionedBM25Index(str(tmp_path / "bm25"))
+    second = PartitionedBM25Index(str(tmp_path / "bm25"))
+    first.partition("user_1").add_documents(make_documents("旧", 3))
+    assert len(second.search("扫地机器人", k=5, partitions=["user_1"])) == 3
+
+    first.drop("user_1")
+    assert second.search("扫地机器人", k=5, partitions=["user_1"]) == []
+    first.partition("user_1").add_documents(make_documents("新", 1))
+
+    assert [doc.page_content[0] for doc in second.search("扫地机器人", k=5, partitions=["user_1"])] == ["新"]
@@ -0,0 +1,111 @@
+import asyncio
+import re
+from typing import List
+
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.runnables import RunnableLambda
+
+import app.rag.ingestion_pipeline as ingestion_pipeline_module
+from app.rag.document_summarizer import SECTION_KEY, SUMMARY_LEVEL_DOCUMENT, DocumentSummarizer
+from app.rag.ingestion_manifest import IngestionManifest
+from app.rag.ingestion_pipeline import FileTask, IngestionPipeline
+
+
+class FakeEmbeddings(Embeddings):
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [[float(len(text)), 1.0] for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return [float(len(text)), 1.0]
+
+
+class FakeBM25Index:
+    def add_documents(self, documents: List[Document]):
+        pass
+
+
+class RecordingModel:
+    """记录每次调用的提示词，返回固定格式的摘要"""
+
+    def __init__(self):
+        self.prompts = []
+
+    def __call__(self, prompt) -> str:
+        self.prompts.append(prompt.to_string())
+        return f"摘要{len(self.prompts)}"
+
+
+class SlowFirstSplitter:
+    """第一批切分最慢，并发切分时后面的批先完成"""
+
+    async def split_documents(self, documents: List[Document]) -> List[Document]:
+        if documents[0].metadata["part"] == 0:
+            await asyncio.sleep(0.05)
+        return [Document(page_content=text, metadata=dict(documents[0].metadata))
+                for text in documents[0].page_content.split("|")]
+
+
+class PartsStore:
+    """把上传内容按行拆成多批交给流水线，片段保存在内存中"""
+
+    def __init__(self, manifest: IngestionManifest):
+        self.manifest = manifest
+        self.spliter = SlowFirstSplitter()
+        self.documents = {}
+
+    async def claim_file(self, md5_hex: str, scope: str, user_id, owner=None):
+        return self.manifest.claim(md5_hex, scope, user_id, owner)
+
+    async def release_file(self, md5_hex: str, scope: str):
+        self.manifest.release(md5_hex, scope)
+
+    async def record_file(self, md5_hex: str, scope: str, user_id, chunk_ids: List[str]):
+        self.manifest.record(md5_hex, scope, user_id, chunk_ids, "fake")
+
+    async def iter_file_document(self, path: str):
+        with open(path, encoding="utf-8") as f:
+            for part, line in enumerate(f.read().splitlines()):
+                yield [Document(page_content=line, metadata={"source": path, "part": part})]
+
+    def add_embeddings(self, chunks: List[Document], vectors, chunk_ids: List[str]):
+        self.documents.update(zip(chunk_ids, chunks))
+
+    def delete_by_ids(self, ids: List[str]):
+        for doc_id in ids:
+            self.documents.pop(doc_id, None)
+
+
+def test_sections_follow_document_order_with_concurrent_splitting(tmp_path, monkeypatch):
+    monkeypatch.setattr(ingestion_pipeline_module, "bm25_index", FakeBM25Index())
+    manifest = IngestionManifest(str(tmp_path / "manifest.sqlite3"))
+    model = RecordingModel()
+    summarizer = DocumentSummarizer(RunnableLambda(model), section_max_chars=4)
+    pipeline = IngestionPipeline(PartsStore(manifest), FakeEmbeddings(), {"split_concurrency": 2}, summarizer)
+    path = tmp_path / "手册.txt"
+    path.write_text("甲一|甲二\n乙一|乙二\n丙一|丙二\n", encoding="utf-8")
+
+    stats = asyncio.run(pipeline.run([FileTask(path=str(path))], user_id="alice"))
+    manifest.close()
+
+    assert stats["ingested"] == 1
+    chunks = [doc for doc in pipeline.store.documents.values() if "doc_type" not in doc.metadata]
+    by_section = sorted((doc.metadata[SECTION_KEY], doc.page_content) for doc in chunks)
+    assert by_section == [(0, "甲一"), (0, "甲二"), (1, "乙一"), (1, "乙二"), (2, "丙一"), (2, "丙二")]
+    # 章节摘要的输入按原文顺序
+    assert [re.search(r"章节内容：(.*?)\n", prompt, re.S).group(1) for prompt in model.prompts[:3]] \
+        == ["甲一", "乙一", "丙一"]
+
+
+def test_document_summary_reduces_sections_in_bounded_groups():
+    model = RecordingModel()
+    summarizer = DocumentSummarizer(RunnableLambda(model), section_max_chars=1, reduce_group_size=4)
+    chunks = [Document(page_content=f"第{i}节", metadata={"source": "手册.txt", SECTION_KEY: i}) for i in range(20)]
+
+    summaries = asyncio.run(summarizer.summarize(chunks))
+
+    assert len(summaries) == 21 and summaries[-1].metadata["summary_level"] == SUMMARY_LEVEL_DOCUMENT
+    reduce_prompts = model.prompts[20:]
+    # 20 份章节摘要 -> 5 份 -> 2 份（4 份合并为 1 份，剩下 1 份直接保留）-> 文档摘要
+    assert len(reduce_prompts) == 5 + 1 + 1
+    assert max(prompt.count("部分：") for prompt in reduce_prompts) <= 4
@@ -0,0 +1,57 @@
+import asyncio
+import io
+import tracemalloc
+
+import app.utils.file_handler as file_handler_module
+from app.utils.file_handler import iter_file_documents, iter_txt_stream
+
+LINE = "扫地机器人的滤网建议每周清洗一次，每三个月更换一次。\n"
+
+
+def collect(stream, source: str) -> list:
+    async def run():
+        return [documents async for documents in iter_txt_stream(stream, source)]
+
+    return asyncio.run(run())
+
+
+def test_txt_stream_is_read_in_blocks_across_multibyte_boundaries(monkeypatch):
+    # 块大小不是字符长度的整数倍，多字节字符会被切到两块中
+    monkeypatch.setattr(file_handler_module, "STREAM_CHUNK_SIZE", 100)
+    text = LINE * 20 + "没有换行的结尾"
+
+    for encoding in ["utf-8", "gbk"]:
+        batches = collect(io.BytesIO(text.encode(encoding)), "说明书.txt")
+
+        assert len(batches) > 1
+        assert "".join(document.page_content for documents in batches for document in documents) == text
+        # 除最后一批外都在换行处断开
+        assert all(documents[0].page_content.endswith("\n") for documents in batches[:-1])
+
+
+def test_txt_file_peak_memory_is_bounded_by_block_size(tmp_path, monkeypatch):
+    chunk_size = 256 * 1024
+    monkeypatch.setattr(file_handler_module, "STREAM_CHUNK_SIZE", chunk_size)
+    path = tmp_path / "说明书.txt"
+    line = LINE.encode("utf-8")
+    with open(path, "wb") as f:
+        for _ in range(16 * 1024 * 1024 // len(line)):
+            f.write(line)
+    file_size = path.stat().st_size
+
+    async def run():
+        total = 0
+        async for documents in iter_file_documents(str(path)):
+            total += sum(len(document.page_content.encode("utf-8")) for document in documents)
+        return total
+
+    tracemalloc.start()
+    try:
+        total = asyncio.run(run())
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    assert total == file_size
+    # 一次读入整个文件时峰值是文件大小的数倍；分块读取时只与块大小有关
+    assert peak < 16 * chunk_size
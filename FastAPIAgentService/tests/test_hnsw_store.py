@@ -0,0 +1,90 @@
+import os
+import threading
+
+import numpy as np
+import pytest
+
+pytest.importorskip("faiss")
+
+from app.rag.hnsw_store import HNSWVectorStore
+
+DIM = 16
+
+
+def upsert_random(store: HNSWVectorStore, prefix: str, count: int, rng: np.random.Generator):
+    ids = [f"{prefix}-{i}" for i in range(count)]
+    store.upsert(ids, rng.normal(size=(count, DIM)).tolist(), [f"文档 {doc_id}" for doc_id in ids],
+                 [{"batch": prefix} for _ in ids])
+
+
+def search_while(store: HNSWVectorStore, stop: threading.Event, errors: list):
+    rng = np.random.default_rng(1)
+    while not stop.is_set():
+        try:
+            store.similarity_search_by_vector(rng.normal(size=DIM).tolist(), k=5)
+            store.get(where={"batch": "b0"})
+        except Exception as e:  # noqa: BLE001 - 记录查询线程中的任何异常
+            errors.append(e)
+            return
+
+
+@pytest.mark.parametrize("reader_is_other_worker", [False, True])
+def test_search_survives_concurrent_compaction(tmp_path, reader_is_other_worker):
+    index_dir = str(tmp_path / "hnsw")
+    writer = HNSWVectorStore(index_dir, embedding_function=None, max_segments=2, exact_search_threshold=0)
+    rng = np.random.default_rng(0)
+    upsert_random(writer, "init", 300, rng)
+    # 另一个 worker 的实例通过元数据变化重新加载快照，同样不能关闭正在查询的段
+    reader = HNSWVectorStore(index_dir, embedding_function=None, exact_search_threshold=0) \
+        if reader_is_other_worker else writer
+    stop = threading.Event()
+    errors = []
+    threads = [threading.Thread(target=search_while, args=(reader, stop, errors)) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    try:
+        for round_ in range(20):
+            upsert_random(writer, f"b{round_}", 30, rng)
+            writer.delete(where={"batch": f"b{round_ - 1}"})
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+    assert errors == []
+    live = {os.path.basename(segment.path) for segment in writer._snapshot[0]}
+    on_disk = {name for name in os.listdir(index_dir) if name.startswith("seg_")}
+    assert on_disk == live
+
+
+def chroma_batches(ids, vectors, batch_size):
+    for start in range(0, len(ids), batch_size):
+        yield {
+            "ids": ids[start:start + batch_size],
+            "embeddings": vectors[start:start + batch_size],
+            "documents": [f"文档 {doc_id}" for doc_id in ids[start:start + batch_size]],
+            "metadatas": [{"source": "chroma"} for _ in ids[start:start + batch_size]],
+        }
+
+
+def test_import_documents_writes_one_segment_once(tmp_path):
+    store = HNSWVectorStore(str(tmp_path / "hnsw"), embedding_function=None, max_segments=2)
+    rng = np.random.default_rng(0)
+    # 导入前已直接写入 hnsw 的文档以 hnsw 为准
+    store.upsert(["c-0"], rng.normal(size=(1, DIM)).tolist(), ["新版内容"], [{"source": "hnsw"}])
+    ids = [f"c-{i}" for i in range(250)]
+    vectors = rng.normal(size=(len(ids), DIM)).astype(np.float32)
+
+    assert store.import_documents(chroma_batches(ids, vectors, 100), "chroma") == 249
+    assert len(store._snapshot[0]) == 2
+    assert store.count() == 250
+    assert store.get(ids=["c-0"])["documents"] == ["新版内容"]
+
+    # 已有导入标记：不再读取 Chroma
+    def fail():
+        raise AssertionError("导入完成后不应再读取 Chroma")
+        yield
+
+    other_worker = HNSWVectorStore(str(tmp_path / "hnsw"), embedding_function=None)
+    assert other_worker.import_documents(fail(), "chroma") == 0
+    assert other_worker.count() == 250
@@ -0,0 +1,199 @@
+import asyncio
+import hashlib
+import sqlite3
+from typing import List
+
+import pytest
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+import app.rag.ingestion_pipeline as ingestion_pipeline_module
+from app.rag import ingestion_manifest as ingestion_manifest_module
+from app.rag.ingestion_manifest import IngestionManifest
+from app.rag.bm25_index import partition_of
+from app.rag.ingestion_pipeline import FileTask, IngestionPipeline
+from app.rag.text_spliter import AsyncTextSplitter
+
+CONTENT = "报销单需要部门负责人签字。发票抬头必须是公司全称。".encode("utf-8")
+
+
+class FakeEmbeddings(Embeddings):
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [[float(len(text)), 1.0] for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return [float(len(text)), 1.0]
+
+
+class FakeBM25Index:
+    def __init__(self):
+        self.documents = []
+
+    def add_documents(self, documents: List[Document]):
+        self.documents.extend(documents)
+
+    def delete(self, where, partitions=None) -> int:
+        kept = [
+            doc for doc in self.documents
+            if not (all(doc.metadata.get(key) == value for key, value in where.items())
+                    and (partitions is None or partition_of(doc.metadata) in partitions))
+        ]
+        deleted, self.documents = len(self.documents) - len(kept), kept
+        return deleted
+
+
+class InMemoryStore:
+    """入库流水线用到的 VectorStoreService 接口：向量保存在内存中，入库清单使用真实的 SQLite"""
+
+    def __init__(self, manifest: IngestionManifest, upload_path: str):
+        self.manifest = manifest
+        # 每次上传的都是同一个已落盘的文件
+        self.upload_path = upload_path
+        self.spliter = AsyncTextSplitter(chunk_size=50, chunk_overlap=0, separators=["。"])
+        self.documents = {}
+        self.fail_writes = 0
+        self.fail_records = 0
+
+    async def claim_file(self, md5_hex: str, scope: str, user_id, owner=None):
+        return self.manifest.claim(md5_hex, scope, user_id, owner)
+
+    async def discard_partial_file(self, md5_hex: str, scope: str):
+        for doc_id, doc in list(self.documents.items()):
+            if doc.metadata.get("file_hash") == md5_hex and partition_of(doc.metadata) == scope:
+                del self.documents[doc_id]
+
+    async def release_file(self, md5_hex: str, scope: str):
+        self.manifest.release(md5_hex, scope)
+
+    async def record_file(self, md5_hex: str, scope: str, user_id, chunk_ids: List[str]):
+        if self.fail_records:
+            self.fail_records -= 1
+            raise RuntimeError("入库清单写入失败")
+        self.manifest.record(md5_hex, scope, user_id, chunk_ids, "fake")
+
+    async def iter_file_document(self, path: str):
+        with open(path, "rb") as f:
+            yield [Document(page_content=f.read().decode("utf-8"), metadata={"source": path})]
+
+    def add_embeddings(self, chunks: List[Document], vectors, chunk_ids: List[str]):
+        if self.fail_writes:
+            self.fail_writes -= 1
+            raise RuntimeError("向量库写入失败")
+        self.documents.update(zip(chunk_ids, chunks))
+
+    def delete_by_ids(self, ids: List[str]):
+        for doc_id in ids:
+            self.documents.pop(doc_id, None)
+
+    def visible_to(self, user_id: str) -> List[Document]:
+        return [doc for doc in self.documents.values() if doc.metadata.get("user_id") == user_id]
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(ingestion_pipeline_module, "bm25_index", FakeBM25Index())
+    manifest = IngestionManifest(str(tmp_path / "manifest.sqlite3"))
+    upload_path = tmp_path / "报销制度.txt"
+    upload_path.write_bytes(CONTENT)
+    yield InMemoryStore(manifest, str(upload_path))
+    manifest.close()
+
+
+async def aupload(store: InMemoryStore, user_id: str, department_id: str = None, owner: str = None) -> dict:
+    pipeline = IngestionPipeline(store, FakeEmbeddings())
+    task = FileTask(path=store.upload_path, claim_owner=owner)
+    return await pipeline.run([task], user_id=user_id, department_id=department_id)
+
+
+def upload(store: InMemoryStore, user_id: str, department_id: str = None, owner: str = None) -> dict:
+    return asyncio.run(aupload(store, user_id, department_id, owner))
+
+
+def test_same_file_uploaded_by_two_users_is_ingested_for_both(store):
+    assert upload(store, "alice")["ingested"] == 1
+    stats = upload(store, "bob")
+
+    assert stats["ingested"] == 1 and stats["skipped"] == 0
+    assert store.visible_to("bob")
+    file_hash = store.manifest.list_by_user("bob")[0]["file_hash"]
+    assert {entry["scope"] for entry in store.manifest.list_by_file(file_hash)} == {"user_alice", "user_bob"}
+
+
+def test_reupload_in_same_scope_is_skipped_but_sharing_is_not(store):
+    upload(store, "alice")
+
+    assert upload(store, "alice")["skipped"] == 1
+    shared = upload(store, "alice", department_id="finance")
+    assert shared["ingested"] == 1
+    assert {entry["scope"] for entry in store.manifest.list_by_user("alice")} == {"user_alice", "dept_finance"}
+
+
+def test_concurrent_uploads_in_same_scope_ingest_once(store):
+    async def upload_twice():
+        return await asyncio.gather(aupload(store, "alice"), aupload(store, "alice"))
+
+    results = asyncio.run(upload_twice())
+
+    assert sorted((stats["ingested"], stats["skipped"]) for stats in results) == [(0, 1), (1, 0)]
+    assert len(store.manifest.list_by_user("alice")) == 1
+    assert len(store.visible_to("alice")) == len(store.manifest.list_by_user("alice")[0]["chunk_ids"])
+
+
+def test_failed_ingestion_releases_claim(store):
+    store.fail_writes = 1
+
+    assert upload(store, "alice")["failed"] == 1
+    assert store.manifest.list_by_user("alice") == []
+    assert upload(store, "alice")["ingested"] == 1
+
+
+def test_failed_record_removes_bm25_documents(store):
+    # BM25 写入成功后记录入库清单失败：重新上传时 BM25 中不会出现重复的片段
+    store.fail_records = 1
+
+    assert upload(store, "alice")["failed"] == 1
+    assert ingestion_pipeline_module.bm25_index.documents == []
+    assert upload(store, "alice")["ingested"] == 1
+    assert len(ingestion_pipeline_module.bm25_index.documents) == len(store.visible_to("alice"))
+
+
+def test_requeued_job_resumes_its_own_claim(store):
+    file_hash = hashlib.md5(CONTENT).hexdigest()
+    # 实例在入库中途退出：占用留在清单中，部分片段已写入向量库
+    assert store.manifest.claim(file_hash, "user_alice", "alice", "job-1") == "new"
+    store.documents["orphan"] = Document(page_content="半截片段", metadata={"file_hash": file_hash, "user_id": "alice"})
+
+    assert upload(store, "alice", owner="job-2")["skipped"] == 1
+    assert upload(store, "alice", owner="job-1")["ingested"] == 1
+    assert "orphan" not in store.documents
+    assert len(store.visible_to("alice")) == len(store.manifest.get(file_hash, "user_alice")["chunk_ids"])
+
+
+def test_stale_claim_can_be_taken_over(store, monkeypatch):
+    assert store.manifest.claim("h1", "public", "alice")
+    assert not store.manifest.claim("h1", "public", "bob")
+    assert not store.manifest.contains("h1", "public")
+
+    # 占用超时（进程在入库中途退出）后允许重新入库
+    monkeypatch.setattr(ingestion_manifest_module, "PENDING_CLAIM_TIMEOUT", -1)
+    assert store.manifest.claim("h1", "public", "bob")
+    store.manifest.record("h1", "public", "bob", ["c1"], "fake")
+    assert not store.manifest.claim("h1", "public", "carol")
+    assert store.manifest.get("h1", "public")["user_id"] == "bob"
+
+
+def test_legacy_manifest_is_migrated_to_scoped_keys(tmp_path):
+    db_path = str(tmp_path / "manifest.sqlite3")
+    conn = sqlite3.connect(db_path)
+    conn.execute("CREATE TABLE files (file_hash TEXT PRIMARY KEY, user_id TEXT, chunk_ids TEXT NOT NULL, "
+                 "embedding_model TEXT, ingested_at REAL NOT NULL)")
+    conn.execute("INSERT INTO files VALUES ('h1', 'alice', '[\"c1\"]', 'm', 1.0)")
+    conn.execute("INSERT INTO files VALUES ('h2', NULL, '[]', NULL, 2.0)")
+    conn.commit()
+    conn.close()
+
+    manifest = IngestionManifest(db_path)
+    assert manifest.get("h1", "user_alice")["chunk_ids"] == ["c1"]
+    assert manifest.contains("h2", "public")
+    assert not manifest.contains("h1", "user_bob")
+    manifest.close()
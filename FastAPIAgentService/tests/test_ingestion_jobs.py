@@ -0,0 +1,117 @@
+import asyncio
+import fnmatch
+import json
+from collections import defaultdict
+
+import pytest
+
+import app.rag.ingestion_jobs as ingestion_jobs_module
+from app.rag.ingestion_jobs import JOB_KEY_PREFIX, QUEUE_KEY, IngestionJobManager
+
+
+class FakeRedis:
+    """入库任务用到的 Redis 命令，数据保存在内存中（心跳不会自动过期，测试中直接删除）"""
+
+    def __init__(self):
+        self.values = {}
+        self.lists = defaultdict(list)
+        # 依次作为每次 set 的耗时，模拟较慢的写入
+        self.set_delays = []
+
+    async def set(self, key, value, ex=None):
+        await asyncio.sleep(self.set_delays.pop(0) if self.set_delays else 0)
+        self.values[key] = str(value)
+
+    async def get(self, key):
+        return self.values.get(key)
+
+    async def exists(self, key):
+        return int(key in self.values)
+
+    async def delete(self, key):
+        self.values.pop(key, None)
+
+    async def lpush(self, key, value):
+        self.lists[key].insert(0, value)
+
+    async def lmove(self, source, destination, where_from, where_to):
+        if not self.lists[source]:
+            return None
+        value = self.lists[source].pop(0 if where_from == "LEFT" else -1)
+        if where_to == "LEFT":
+            self.lists[destination].insert(0, value)
+        else:
+            self.lists[destination].append(value)
+        return value
+
+    async def blmove(self, source, destination, timeout, where_from, where_to):
+        return await self.lmove(source, destination, where_from, where_to)
+
+    async def lrem(self, key, count, value):
+        self.lists[key] = [item for item in self.lists[key] if item != value]
+
+    async def scan_iter(self, match):
+        for key in list(self.lists):
+            if self.lists[key] and fnmatch.fnmatchcase(key, match):
+                yield key
+
+
+@pytest.fixture
+def redis_client(monkeypatch):
+    client = FakeRedis()
+
+    async def connect_redis():
+        return client
+
+    monkeypatch.setattr(ingestion_jobs_module, "connect_redis", connect_redis)
+    return client
+
+
+def test_jobs_of_live_instance_are_not_requeued(redis_client, tmp_path):
+    async def scenario():
+        busy = IngestionJobManager({"spool_directory": str(tmp_path)})
+        # 实例正在执行任务：心跳有效，任务在它的处理中队列里
+        await redis_client.set(busy.heartbeat_key, 1)
+        await redis_client.lpush(busy.processing_key, "job-1")
+        other = IngestionJobManager({"spool_directory": str(tmp_path)})
+
+        assert await other.recover_expired() == 0
+        assert redis_client.lists[QUEUE_KEY] == []
+
+        # 心跳过期后两个实例同时恢复，任务只会放回队列一次
+        await redis_client.delete(busy.heartbeat_key)
+        third = IngestionJobManager({"spool_directory": str(tmp_path)})
+        recovered = await asyncio.gather(other.recover_expired(), third.recover_expired())
+        assert sum(recovered) == 1
+        assert redis_client.lists[QUEUE_KEY] == ["job-1"]
+
+    asyncio.run(scenario())
+
+
+def test_run_job_waits_for_progress_saves(redis_client, tmp_path, monkeypatch):
+    class FakeRagService:
+        async def add_documents(self, file_paths, user_id, on_file_done, department_id=None):
+            for task in file_paths:
+                task.chunk_ids = ["c1", "c2"]
+                on_file_done(task, "ingested")
+            return {"ingested": len(file_paths)}
+
+    monkeypatch.setattr(ingestion_jobs_module, "get_rag_service", lambda: FakeRagService())
+    job = {"job_id": "job-1", "user_id": "alice", "department_id": None, "status": "queued", "files": [
+        {"name": "a.txt", "path": str(tmp_path / "a.txt"), "file_hash": "h1", "status": "pending",
+         "chunks": 0, "error": ""},
+    ], "stats": {}, "error": ""}
+    redis_client.values[JOB_KEY_PREFIX + "job-1"] = json.dumps(job)
+    # 第三次写入较慢：未等待逐个文件的进度写回时，任务结束后它仍在后台执行
+    redis_client.set_delays = [0, 0, 0.2]
+
+    async def scenario():
+        manager = IngestionJobManager({"spool_directory": str(tmp_path)})
+        await manager._run_job("job-1")
+        # 逐个文件写回进度的协程已全部完成，没有遗留的后台任务
+        assert asyncio.all_tasks() == {asyncio.current_task()}
+
+    asyncio.run(scenario())
+    saved = json.loads(redis_client.values[JOB_KEY_PREFIX + "job-1"])
+    assert saved["status"] == "completed"
+    assert saved["files"][0]["status"] == "ingested" and saved["files"][0]["chunks"] == 2
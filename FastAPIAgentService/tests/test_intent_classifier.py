@@ -0,0 +1,57 @@
+import json
+
+from app.agent.intent_classifier import CHITCHAT_INTENT, IntentClassifier, get_traffic_log, traffic_log_files
+from app.utils.config import agent_config
+
+
+def make_classifier(tmp_path, **config) -> IntentClassifier:
+    return IntentClassifier({"traffic_log_path": str(tmp_path / "traffic.jsonl"), **config})
+
+
+def read_records(classifier: IntentClassifier) -> list:
+    get_traffic_log(classifier.traffic_log_path, 0, 0).close()
+    return [
+        json.loads(line)
+        for path in traffic_log_files(classifier.traffic_log_path, classifier.traffic_log_backups)
+        for line in open(path, encoding="utf-8")
+    ]
+
+
+def test_traffic_is_not_logged_by_default(tmp_path):
+    classifier = make_classifier(tmp_path)
+    classifier.log_traffic("查询我的考勤记录", "attendance", [{"task_type": "attendance"}])
+
+    assert not classifier.log_traffic_enabled
+    assert not (tmp_path / "traffic.jsonl").exists()
+
+
+def test_traffic_log_is_redacted_and_rotated(tmp_path):
+    classifier = make_classifier(tmp_path, log_traffic=True, traffic_log_max_bytes=300, traffic_log_backups=2)
+    for i in range(20):
+        classifier.log_traffic(f"把第{i}条报销单发到 zhang.san@example.com，手机 13800138000",
+                               "tool_execution", [{"task_type": "reimbursement"}])
+    records = read_records(classifier)
+
+    # 只保留当前文件和 2 个旧文件
+    assert len(traffic_log_files(classifier.traffic_log_path, 5)) == 3
+    assert 0 < len(records) < 20
+    assert records[-1] == {
+        "text": "把第19条报销单发到 <email>，手机 <number>",
+        "task_type": "tool_execution",
+        "subtask_types": ["reimbursement"],
+    }
+
+
+def test_greeting_only_input_is_chitchat(tmp_path):
+    classifier = make_classifier(tmp_path, **{**agent_config["intent_classifier"], "enabled": True})
+
+    for text in ["你好", "您好！", "谢谢你", "你真聪明", "hello~"]:
+        assert classifier.predict(text)["intent"] == CHITCHAT_INTENT, text
+
+
+def test_greeting_followed_by_a_question_is_not_chitchat(tmp_path):
+    classifier = make_classifier(tmp_path, **{**agent_config["intent_classifier"], "enabled": True})
+
+    for text in ["你好，年假有几天", "你好，我上周的加班能调休吗", "您好，请问怎么修改密码",
+                 "你好，帮我查下王五的电话", "谢谢，报销要多久到账"]:
+        assert classifier.predict(text)["intent"] != CHITCHAT_INTENT, text
@@ -0,0 +1,233 @@
+"""
+主Agent流式接口的大模型调用次数：用计数的假模型替换通义千问，验证一次请求中每个阶段只调用一次大模型
+（流式响应结束后不再重新执行主Agent）
+"""
+import asyncio
+import importlib
+import json
+from collections import Counter
+from typing import Any, Iterator, List, Optional
+
+import langchain_community.chat_models
+import pytest
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+import app.agent.knowledge_agent as knowledge_agent_module
+import app.agent.main_agent as main_agent_module
+import app.agent.tool_agent as tool_agent_module
+from app.agent.agent import get_main_agent_stream_response
+from app.agent.intent_classifier import IntentClassifier
+
+# app.services 导出了同名的变量，需要按模块名取得模块本身
+database_session_manager_module = importlib.import_module("app.services.database_session_manager")
+
+MULTI_INTENT_PLAN = {
+    "task_type": "tool_execution",
+    "subtasks": [
+        {
+            "task_id": "task_1",
+            "task_name": "查询考勤记录",
+            "task_type": "attendance",
+            "priority": 1,
+            "dependencies": [],
+            "required_params": ["who"],
+            "description": "查询我的考勤记录",
+        },
+        {
+            "task_id": "task_2",
+            "task_name": "查询报销制度",
+            "task_type": "knowledge_query",
+            "priority": 2,
+            "dependencies": [],
+            "required_params": [],
+            "description": "查询公司的报销制度",
+        },
+    ],
+}
+
+
+class CountingChatModel(BaseChatModel):
+    """按提示词识别调用阶段并计数的假模型（ainvoke / astream 最终都经过 _generate）"""
+
+    calls: List[str] = []
+    # 工具执行的流式输出在发送部分 token 后失败
+    fail_tool_stream: bool = False
+
+    @property
+    def _llm_type(self) -> str:
+        return "counting-fake"
+
+    def bind_tools(self, tools: Any, **kwargs: Any) -> "CountingChatModel":
+        return self
+
+    @staticmethod
+    def _stage(messages: List[BaseMessage]) -> str:
+        text = "\n".join(str(message.content) for message in messages)
+        if "智能任务分解专家" in text:
+            return "task_decomposer"
+        if "智能Agent路由器" in text:
+            return "agent_router"
+        if "参数抽取助手" in text:
+            return "param_extraction"
+        if "工具执行Agent" in text:
+            return "tool_agent"
+        return "rag_summary"
+
+    @staticmethod
+    def _content(stage: str) -> str:
+        return {
+            "task_decomposer": json.dumps(MULTI_INTENT_PLAN, ensure_ascii=False),
+            "agent_router": json.dumps({"selected_agent": "tool_agent", "confidence": 0.9, "reason": "test"}),
+            "param_extraction": json.dumps({"who": "requester"}),
+            "tool_agent": "任务完成：本月考勤正常",
+            "rag_summary": "差旅费按实际发生报销",
+        }[stage]
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        stage = self._stage(messages)
+        self.calls.append(stage)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self._content(stage)))])
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                run_manager: Any = None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        stage = self._stage(messages)
+        self.calls.append(stage)
+        content = self._content(stage)
+        if stage == "tool_agent" and self.fail_tool_stream:
+            yield ChatGenerationChunk(message=AIMessageChunk(content=content[:7]))
+            raise RuntimeError("模型服务连接中断")
+        yield ChatGenerationChunk(message=AIMessageChunk(content=content))
+
+
+class FakeRagService:
+    """只保留生成摘要的一次大模型调用，不访问向量库"""
+
+    def __init__(self, model: CountingChatModel):
+        self.model = model
+
+    async def rag_summary(self, query: str, scope: Any = None) -> str:
+        return (await self.model.ainvoke(query)).content
+
+    async def stream_documents_and_summary(self, query: str, scope: Any = None):
+        parts = []
+        async for chunk in self.model.astream(query):
+            parts.append(chunk.content)
+            yield {"type": "token", "content": chunk.content}
+        yield {"type": "result", "documents": [], "summary": "".join(parts)}
+
+
+class FakeSessionManager:
+    def __init__(self):
+        self.added = []
+
+    async def get_history(self, session_id: str, user_id: str) -> list:
+        return []
+
+    async def add_message(self, session_id: str, user_id: str, message: str, response: str):
+        self.added.append((message, response))
+
+
+@pytest.fixture
+def counting_model(monkeypatch):
+    model = CountingChatModel(calls=[])
+    monkeypatch.setattr(langchain_community.chat_models, "ChatTongyi", lambda **kwargs: model)
+    monkeypatch.setattr(knowledge_agent_module, "get_rag_service", lambda: FakeRagService(model))
+    monkeypatch.setattr(tool_agent_module, "_executor_cache", {})
+
+    async def no_checkpoint(session_id, user_id):
+        return None
+
+    monkeypatch.setattr(main_agent_module, "load_plan_checkpoint", no_checkpoint)
+    monkeypatch.setattr(IntentClassifier, "log_traffic", lambda self, *args, **kwargs: None)
+    return model
+
+
+@pytest.fixture
+def session_manager(monkeypatch):
+    manager = FakeSessionManager()
+    monkeypatch.setattr(database_session_manager_module, "database_session_manager", manager)
+    return manager
+
+
+def run_stream(query: str) -> list:
+    async def collect():
+        return [frame async for frame in get_main_agent_stream_response(query, "session-1", "1", "jwt")]
+
+    frames = asyncio.run(collect())
+    return [json.loads(frame[len("data: "):]) for frame in frames if frame.startswith("data: ")]
+
+
+def test_single_intent_request_calls_each_stage_once(counting_model, session_manager):
+    events = run_stream("查询我的考勤记录")
+
+    # 意图分类与查表路由不调用大模型，只有工具执行调用一次
+    assert Counter(counting_model.calls) == Counter({"tool_agent": 1})
+    assert session_manager.added == [("查询我的考勤记录", "任务完成：本月考勤正常")]
+    assert events[-1]["type"] == "done"
+
+
+def test_multi_intent_request_calls_each_stage_once(counting_model, session_manager):
+    events = run_stream("查询我的考勤记录，然后再查一下报销制度")
+
+    assert Counter(counting_model.calls) == Counter({
+        "task_decomposer": 1,
+        "param_extraction": 1,
+        "tool_agent": 1,
+        "rag_summary": 1,
+    })
+    assert session_manager.added == [
+        ("查询我的考勤记录，然后再查一下报销制度", "任务完成：本月考勤正常\n\n差旅费按实际发生报销"),
+    ]
+    streamed = "".join(event.get("content", "") for event in events if event["type"] == "response")
+    assert streamed == "任务完成：本月考勤正常\n\n差旅费按实际发生报销"
+
+
+def test_history_matches_streamed_content_when_sub_agent_fails(counting_model, session_manager):
+    counting_model.fail_tool_stream = True
+    events = run_stream("查询我的考勤记录，然后再查一下报销制度")
+
+    # 工具执行输出部分 token 后失败，整合结果只有知识库的回答；会话历史保存的是用户实际看到的内容
+    streamed = "".join(event.get("content", "") for event in events if event["type"] == "response")
+    assert streamed == "任务完成：本月\n\n差旅费按实际发生报销"
+    assert session_manager.added == [("查询我的考勤记录，然后再查一下报销制度", streamed)]
+
+
+def test_blocked_subtask_and_question_come_from_the_same_aborted_event(counting_model, monkeypatch):
+    class MissingParamsAgent:
+        """每个子任务都缺少各自的参数"""
+
+        async def process(self, input_data):
+            return {"params": {}, "missing_params": list(input_data["required_params"])}
+
+    monkeypatch.setenv("MAIN_AGENT_STRICT_REQUIRED_PARAMS", "true")
+    agent = main_agent_module.MainAgent()
+    agent.param_extraction_agent = MissingParamsAgent()
+    state = main_agent_module.AgentState()
+    state.user_input = "查询考勤并查询报销单"
+    state.task_subtasks = [
+        {"task_id": "task_1", "task_name": "查询考勤", "task_type": "attendance", "priority": 1,
+         "dependencies": [], "required_params": ["date"], "description": "查询考勤"},
+        {"task_id": "task_2", "task_name": "查询报销单", "task_type": "reimbursement", "priority": 2,
+         "dependencies": [], "required_params": ["bill_id"], "description": "查询报销单"},
+    ]
+
+    async def collect():
+        return [event async for event in agent._iter_subtasks(state)]
+
+    events = asyncio.run(collect())
+
+    # 两个子任务并发检查参数，调度器只处理第一个 aborted 事件，询问内容与被阻塞的子任务一致
+    assert events == [{"type": "aborted", "key": "task_1", "content": "我需要更多信息来完成任务：date"}]
+    assert state.blocked_task_id == "task_1"
+    assert state.final_response == "我需要更多信息来完成任务：date"
+
+
+def test_classifiers_are_shared_by_all_requests(counting_model):
+    first, second = main_agent_module.MainAgent(), main_agent_module.MainAgent()
+
+    # 意图分类器和路由分类器在进程内只建立一次，不随每个请求重新加载示例
+    assert first.intent_classifier is second.intent_classifier
+    assert first.agent_router.classifier is second.agent_router.classifier
@@ -0,0 +1,53 @@
+import asyncio
+import threading
+
+from app.rag.rerank_batcher import RerankBatcher
+
+
+def test_closed_caller_loop_does_not_stop_batcher():
+    started = threading.Event()
+    release = threading.Event()
+
+    def predict(pairs, batch_size):
+        started.set()
+        release.wait(timeout=5)
+        return [float(len(doc)) for _, doc in pairs]
+
+    batcher = RerankBatcher(predict, max_wait_ms=1)
+
+    # 请求方提交后退出，事件循环在推理完成前关闭
+    loop = asyncio.new_event_loop()
+    task = loop.create_task(batcher.submit([("q", "abandoned")]))
+    loop.run_until_complete(asyncio.sleep(0))
+    assert started.wait(timeout=5)
+    task.cancel()
+    loop.run_until_complete(asyncio.gather(task, return_exceptions=True))
+    loop.close()
+    release.set()
+
+    assert asyncio.run(batcher.submit([("q", "ab"), ("q", "abc")])) == [2.0, 3.0]
+    assert batcher._thread.is_alive()
+
+
+def test_failed_batch_delivers_error_and_keeps_running():
+    calls = []
+
+    def predict(pairs, batch_size):
+        calls.append(len(pairs))
+        # 第一次返回无法转换为分数的结果，拆分回填时出错
+        return [None] * len(pairs) if len(calls) == 1 else [1.0] * len(pairs)
+
+    batcher = RerankBatcher(predict, max_wait_ms=1)
+
+    async def run():
+        try:
+            await asyncio.wait_for(batcher.submit([("q", "a")]), timeout=5)
+        except Exception as e:  # noqa: BLE001 - 只检查收到了异常而不是一直等待
+            first = e
+        else:
+            first = None
+        return first, await batcher.submit([("q", "b")])
+
+    first, second = asyncio.run(run())
+    assert first is not None and not isinstance(first, asyncio.TimeoutError)
+    assert second == [1.0]
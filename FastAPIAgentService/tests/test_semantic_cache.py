@@ -0,0 +1,73 @@
+import asyncio
+
+import numpy as np
+
+import app.rag.rag_service as rag_service_module
+from app.cache.semantic_cache import SemanticAnswerCache
+from app.rag.ingestion_manifest import IngestionManifest
+from app.rag.retrieval_scope import RetrievalScope
+
+
+def unit(*values) -> np.ndarray:
+    vector = np.asarray(values, dtype=np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+def test_put_with_older_version_is_dropped():
+    cache = SemanticAnswerCache(embed_model=None, max_entries=4)
+    cache.put(unit(1, 0), "新问题", {"answer": "新版本"}, version=2)
+
+    # 版本 1 时开始的查询在入库完成后才写入缓存
+    cache.put(unit(0, 1), "旧问题", {"answer": "旧版本"}, version=1)
+
+    assert cache.get(unit(1, 0), version=2) == {"answer": "新版本"}
+    assert cache.get(unit(0, 1), version=2) is None
+    assert cache.stats()["version"] == 2
+    assert cache.stats()["stale_puts"] == 1
+    assert cache.stats()["invalidations"] == 0
+
+
+def test_newer_version_invalidates_cache():
+    cache = SemanticAnswerCache(embed_model=None, max_entries=4)
+    cache.put(unit(1, 0), "问题", {"answer": "旧版本"}, version=1)
+
+    assert cache.get(unit(1, 0), version=2) is None
+    cache.put(unit(1, 0), "问题", {"answer": "新版本"}, version=2)
+    assert cache.get(unit(1, 0), version=2) == {"answer": "新版本"}
+    assert cache.stats()["invalidations"] == 1
+
+
+def test_retriever_version_is_shared_across_workers(tmp_path, monkeypatch):
+    class FakeEmbeddings:
+        async def aembed_query(self, text):
+            return [1.0, 0.0]
+
+    class FakeVectorStore:
+        async def delete_file(self, file_hash, scope):
+            return True
+
+    db_path = str(tmp_path / "manifest.sqlite3")
+    scope = RetrievalScope(user_id="alice")
+    result = {"documents": ["年假制度"], "summary": "年假5天"}
+
+    def make_worker():
+        # 每个 worker 进程各自打开同一个入库清单
+        monkeypatch.setattr(rag_service_module, "ingestion_manifest", IngestionManifest(db_path))
+        service = rag_service_module.RagService(FakeVectorStore())
+        service.answer_cache = SemanticAnswerCache(FakeEmbeddings(), max_entries=4)
+        return service
+
+    async def scenario():
+        reader = make_worker()
+        _, embedding, version = await reader._lookup_answer_cache("年假有几天", scope)
+        await reader._store_answer_cache("年假有几天", embedding, result, version, scope)
+        assert (await reader._lookup_answer_cache("年假有几天", scope))[0] == result
+
+        # 另一个 worker 删除文件后，这个 worker 的缓存随之失效，生成中的旧结果也不再写入
+        _, embedding, version = await reader._lookup_answer_cache("年假有几天", scope)
+        await make_worker().delete_file("h1", "user_alice")
+        await reader._store_answer_cache("年假有几天", embedding, result, version, scope)
+        assert (await reader._lookup_answer_cache("年假有几天", scope))[0] is None
+        assert reader.answer_cache.stats()["stale_puts"] == 1
+
+    asyncio.run(scenario())
@@ -0,0 +1,77 @@
+import asyncio
+from typing import List
+
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from app.rag.text_spliter import AsyncTextSplitter
+
+
+class TopicEmbeddings(Embeddings):
+    """按片段中出现的主题词生成向量：同一主题的片段相似度为 1，不同主题为 0"""
+
+    topics = ("滤网", "电池")
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [[1.0 if topic in text else 0.0 for topic in self.topics] for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+def make_splitter(**kwargs) -> AsyncTextSplitter:
+    options = {"chunk_size": 12, "chunk_overlap": 0, "separators": ["。"],
+               "embedding_model": TopicEmbeddings(), "max_chunk_size": 40}
+    options.update(kwargs)
+    return AsyncTextSplitter(**options)
+
+
+def split(splitter: AsyncTextSplitter, *texts: str) -> List[Document]:
+    documents = [Document(page_content=text, metadata={"page": page}) for page, text in enumerate(texts)]
+    return asyncio.run(splitter.split_documents(documents))
+
+
+def test_merges_adjacent_chunks_of_the_same_topic():
+    chunks = split(make_splitter(), "滤网每两周清洗一次。滤网晾干后再装回。电池充满需要四小时。")
+
+    assert [chunk.page_content for chunk in chunks] == [
+        "滤网每两周清洗一次 。滤网晾干后再装回",
+        "。电池充满需要四小时。",
+    ]
+
+
+def test_does_not_merge_across_documents_or_past_max_size():
+    chunks = split(make_splitter(max_chunk_size=15), "滤网每两周清洗一次。滤网晾干后再装回。", "滤网要定期更换。")
+
+    assert [(chunk.page_content, chunk.metadata["page"]) for chunk in chunks] == [
+        ("滤网每两周清洗一次", 0),
+        ("。滤网晾干后再装回。", 0),
+        ("滤网要定期更换。", 1),
+    ]
+
+
+def test_without_embedding_model_no_merge():
+    chunks = split(make_splitter(embedding_model=None), "滤网每两周清洗一次。滤网晾干后再装回。")
+
+    assert len(chunks) == 2
+
+
+def test_strip_overlap_removes_splitter_overlap():
+    splitter = make_splitter(chunk_overlap=8)
+
+    assert splitter._strip_overlap("先关闭电源。滤网每两周要清洗", "滤网每两周要清洗一次") == "一次"
+
+
+def test_strip_overlap_keeps_short_coincidental_match():
+    splitter = make_splitter(chunk_overlap=8)
+
+    # 只有结尾的句号相同，不是切分时保留的重叠
+    assert splitter._strip_overlap("滤网每两周清洗一次。", "。电池充满需要四小时") == "。电池充满需要四小时"
+    assert splitter._strip_overlap("清洗一次", "次日再装回") == "次日再装回"
+
+
+def test_strip_overlap_honours_configured_minimum():
+    splitter = make_splitter(chunk_overlap=8, min_overlap=2)
+
+    assert splitter._strip_overlap("清洗一次", "一次即可") == "即可"
+    assert splitter._strip_overlap("清洗一次", "次日再装回") == "次日再装回"